@@ -8,23 +8,14 @@
 from __future__ import print_function
 
 
-import sys
 import os
 pysar_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.insert(1, pysar_path)
-sys.path.insert(1, os.path.join(pysar_path, 'defaults'))
-sys.path.insert(1, os.path.join(pysar_path, 'objects'))
-sys.path.insert(1, os.path.join(pysar_path, 'simulation'))
-sys.path.insert(1, os.path.join(pysar_path, 'utils'))
 
 from pysar.version import *
 __version__ = release_version
 
-try:
-    os.environ['PYSAR_HOME']
-except KeyError:
-    print('Using default PySAR Path: %s' % (pysar_path))
-    os.environ['PYSAR_HOME'] = pysar_path
+# default PySAR path, set silently to keep the import clean and fast
+os.environ.setdefault('PYSAR_HOME', pysar_path)
 
 
 # PySAR modules listed by relative dependecies:
@@ -47,3 +38,6 @@ except KeyError:
 # pysar.objects.insarobj
 # pysar.utils.plot
 #
+# Plotting modules (matplotlib, basemap) are imported within the functions that plot,
+# so that processing scripts start fast and run without display, check with:
+#   python -m pysar.utils.import_time
@@ -11,9 +11,6 @@ import os
 
 import h5py
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
 from scipy.linalg import pinv as pinv
 
 import pysar.utils.readfile as readfile
@@ -23,6 +20,7 @@ import pysar.utils.readfile as readfile
 def to_percent(y, position):
     # Ignore the passed in position. This has the effect of scaling the default
     # tick locations.
+    import matplotlib
     s = str(100 * y)
 
     # The percent symbol needs escaping in latex
@@ -0,0 +1,649 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+
+
+import os
+import time
+import argparse
+import h5py
+import numpy as np
+from pysar.objects import timeseries
+from pysar.utils import readfile, writefile, ptime, perf, blockwise, utils as ut
+from pysar import dem_error
+
+
+# surface types supported by the block-wise ramp removal
+RAMP_TYPES = ['plane', 'quadratic', 'plane_range', 'quadratic_range', 'plane_azimuth', 'quadratic_azimuth']
+
+
+############################################################################
+TEMPLATE = """
+## Fused Correction (optional)
+## apply LOD, tropospheric (delay file), DEM error, reference date and phase ramp corrections
+## in one pass block by block, instead of reading/writing the whole time-series once per correction.
+pysar.correction.fused        = auto  #[yes / no], auto for no
+pysar.correction.intermediate = auto  #[yes / no], auto for no, save time-series file after each correction
+
+## options of each correction are read from:
+## pysar.topographicResidual.*, pysar.residualRms.*, pysar.reference.date, pysar.deramp*
+"""
+
+EXAMPLE = """example:
+  correct_timeseries.py  timeseries.h5  -g INPUTS/geometryRadar.h5  -t pysarApp_template.txt
+  correct_timeseries.py  timeseries.h5  -g INPUTS/geometryRadar.h5  --trop-file INPUTS/ECMWF.h5  --ref-date minRMS  --deramp quadratic
+  correct_timeseries.py  timeseries.h5  -g INPUTS/geometryRadar.h5  --trop-file INPUTS/ECMWF.h5  --save-intermediate
+"""
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Correct time-series for LOD, troposphere, DEM error,\n' +
+                                                 'reference date and phase ramp in one pass block by block',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=TEMPLATE+'\n'+EXAMPLE)
+
+    parser.add_argument('timeseries_file', help='Timeseries file to be corrrected')
+    parser.add_argument('-g', '--geometry', dest='geom_file',
+                        help='geometry file including datasets:\n' +
+                             'incidence angle, slant range distance and/or 3D perpendicular baseline')
+    parser.add_argument('-t', '--template', dest='template_file',
+                        help='template file with options of each correction')
+    parser.add_argument('-o', '--outfile', help='Output file name for the final corrected time series')
+
+    parser.add_argument('--skip-lod', dest='skip_lod', action='store_true',
+                        help='Skip Local Oscilator Drift correction, which is applied for Envisat by default')
+    parser.add_argument('--trop-file', dest='trop_file',
+                        help='tropospheric delay time-series file to subtract, e.g. INPUTS/ECMWF.h5')
+    parser.add_argument('--no-dem-error', dest='dem_error', action='store_false',
+                        help='Skip DEM error correction')
+    parser.add_argument('-r', '--ref-date', dest='ref_date', default='no',
+                        help='reference date or method, default: no. e.g.\n' +
+                             '20101120\n' +
+                             'reference_date.txt - text file with date in YYYYMMDD format in it,\n' +
+                             '                     ignored and use minRMS if DEM error is corrected in this run\n' +
+                             '                     or if it is older than the input time-series file\n' +
+                             'minRMS             - choose date with min deramped residual RMS')
+    parser.add_argument('--rms-mask', dest='rms_mask_file', default='maskTempCoh.h5',
+                        help='mask file for residual RMS calculation, default: maskTempCoh.h5')
+    parser.add_argument('--rms-ramp', dest='rms_ramp_type', default='quadratic',
+                        help='ramp type to remove from residual for RMS calculation, default: quadratic')
+    parser.add_argument('--deramp', dest='ramp_type', default='no',
+                        help='type of phase ramp to remove for each epoch, default: no.\n' +
+                             '{}'.format(RAMP_TYPES))
+    parser.add_argument('--deramp-mask', dest='ramp_mask_file', default='maskTempCoh.h5',
+                        help='mask file for ramp estimation, default: maskTempCoh.h5')
+
+    parser.add_argument('--save-intermediate', dest='save_intermediate', action='store_true',
+                        help='Save time-series file after each correction, in the same name as the single step')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data (= num_date * num_row * num_col) to read per block\n' +
+                             'default: 0.1 G; adjust it according to your computer memory.')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    return inps
+
+
+def read_template2inps(template_file, inps=None):
+    """Update inps with options from template_file"""
+    if not inps:
+        inps = cmd_line_parse()
+    template = readfile.read_template(template_file)
+    template = ut.check_template_auto_value(template)
+
+    key = 'pysar.topographicResidual'
+    if key in template.keys():
+        inps.dem_error = template[key] is not False
+
+    key = 'pysar.reference.date'
+    if key in template.keys():
+        inps.ref_date = template[key]
+
+    key = 'pysar.residualRms.maskFile'
+    if key in template.keys() and template[key]:
+        inps.rms_mask_file = template[key]
+
+    key = 'pysar.residualRms.ramp'
+    if key in template.keys():
+        inps.rms_ramp_type = template[key]
+
+    key = 'pysar.deramp'
+    if key in template.keys():
+        inps.ramp_type = template[key]
+
+    key = 'pysar.deramp.maskFile'
+    if key in template.keys():
+        inps.ramp_mask_file = template[key]
+
+    key = 'pysar.correction.intermediate'
+    if key in template.keys() and template[key] is True:
+        inps.save_intermediate = True
+    return inps
+
+
+############################################################################
+def get_step_list(inps):
+    """Get the list of correction steps and their output file names, in the order of:
+    LOD --> tropospheric delay --> DEM error --> reference date --> phase ramp
+    """
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open(print_msg=False)
+    inps.metadata = dict(ts_obj.metadata)
+    inps.dateList = ts_obj.dateList
+    inps.pbase = ts_obj.pbase
+    inps.refIndex = ts_obj.refIndex
+    inps.numDate, inps.length, inps.width = ts_obj.numDate, ts_obj.length, ts_obj.width
+
+    steps = []
+    if not inps.skip_lod and inps.metadata['PLATFORM'].lower().startswith('env'):
+        steps.append('LODcor')
+
+    if inps.trop_file:
+        steps.append('trop')
+
+    if inps.dem_error:
+        steps.append('demErr')
+
+    # reference date
+    # residual time-series, written by the DEM error correction of this run or of a previous dem_error.py run
+    inps.resFile = os.path.join(os.path.dirname(inps.timeseries_file), 'timeseriesResidual.h5')
+    inps.ref_date_in_pass1 = True
+    if inps.ref_date in [None, False] or str(inps.ref_date).lower() in ['no', 'none', 'false']:
+        inps.ref_date = None
+    elif os.path.isfile(inps.ref_date):
+        # reference_date.txt is written by timeseries_rms.py from the residual of the DEM error correction,
+        # thus it is out of date if it is older than the input time-series or if the DEM error is corrected here
+        if inps.dem_error or ut.update_file(inps.ref_date, inps.timeseries_file, check_readable=False):
+            print('ignore out-of-date reference date file: {}, use minRMS instead.'.format(inps.ref_date))
+            inps.ref_date = 'minRMS'
+        else:
+            print('read reference date from file: ' + inps.ref_date)
+            inps.ref_date = ptime.read_date_list(inps.ref_date)[0]
+
+    if inps.ref_date and (inps.ref_date.lower() == 'minrms' or inps.ref_date.endswith('.txt')):
+        if inps.dem_error:
+            # reference date is known after the DEM error correction of all blocks
+            print('choose reference date based on minimum residual RMS after DEM error correction')
+            inps.ref_date_in_pass1 = False
+        else:
+            if not os.path.isfile(inps.resFile):
+                raise FileNotFoundError('residual file {} for minRMS reference date NOT found!'.format(inps.resFile))
+            print('choose reference date based on minimum residual RMS in file: {}'.format(inps.resFile))
+            rms_list, date_list = ut.get_residual_rms(inps.resFile,
+                                                      inps.rms_mask_file,
+                                                      inps.rms_ramp_type)[0:2]
+            inps.ref_date = date_list[np.argmin(rms_list)]
+    if inps.ref_date:
+        if inps.ref_date_in_pass1:
+            inps.ref_date = ptime.yyyymmdd(inps.ref_date)
+            if inps.ref_date not in inps.dateList:
+                raise ValueError('Input reference date {} was not found!'.format(inps.ref_date))
+        steps.append('refDate')
+
+    # phase ramp
+    if inps.ramp_type in [None, False] or str(inps.ramp_type).lower() in ['no', 'none', 'false']:
+        inps.ramp_type = None
+    elif inps.ramp_type not in RAMP_TYPES:
+        print('WARNING: phase ramp method {} is not supported in block-wise correction, skip it.'.format(inps.ramp_type))
+        inps.ramp_type = None
+    if inps.ramp_type:
+        steps.append('deramp')
+
+    if not steps:
+        raise ValueError('No correction step to apply.')
+
+    # output file name of each step
+    fbase = os.path.splitext(inps.timeseries_file)[0]
+    inps.stepFiles = dict()
+    for step in steps:
+        if step == 'trop':
+            fbase += '_{}'.format(os.path.splitext(os.path.basename(inps.trop_file))[0])
+        elif step == 'deramp':
+            fbase += '_{}'.format(inps.ramp_type)
+        else:
+            fbase += '_{}'.format(step)
+        inps.stepFiles[step] = fbase+'.h5'
+    if inps.outfile:
+        inps.stepFiles[steps[-1]] = inps.outfile
+    inps.outfile = inps.stepFiles[steps[-1]]
+    inps.steps = steps
+
+    print('correction steps: {}'.format(steps))
+    print('output file: {}'.format(inps.outfile))
+    return inps
+
+
+def layout_timeseries(out_file, inps, metadata=None, dates=None):
+    """Create an empty time-series file with the same date/bperp info as input file"""
+    if metadata is None:
+        metadata = dict(inps.metadata)
+    metadata['FILE_TYPE'] = 'timeseries'
+    if dates is None:
+        dates = inps.dateList
+    dsNameDict = {'date'      : (np.string_, (len(dates),), dates),
+                  'timeseries': (np.float32, (len(dates), inps.length, inps.width), None)}
+    if inps.pbase is not None and len(dates) == inps.numDate:
+        dsNameDict['bperp'] = (np.float32, (inps.numDate,), inps.pbase)
+    writefile.layout_hdf5(out_file, dsNameDict, metadata)
+    return out_file
+
+
+def write_timeseries_block(out_file, data, box):
+    block = [0, data.shape[0], box[1], box[3], box[0], box[2]]
+    writefile.write_hdf5_block(out_file, data, 'timeseries', block=block, print_msg=False)
+    return out_file
+
+
+############################################################################
+def prepare_lod(inps):
+    """Get the LOD ramp rate for Envisat (Marinkovic and Larsen, 2013) relative to the reference pixel"""
+    ref_y, ref_x = int(inps.metadata['REF_Y']), int(inps.metadata['REF_X'])
+    inps.lod_range_ref = None
+    if inps.geom_file and 'Y_FIRST' not in inps.metadata.keys():
+        ref_box = (ref_x, ref_y, ref_x+1, ref_y+1)
+        inps.lod_range_ref = readfile.read(inps.geom_file,
+                                           datasetName='slantRangeDistance',
+                                           box=ref_box,
+                                           print_msg=False)[0].flatten()[0]
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open(print_msg=False)
+    year_list = np.array(ts_obj.yearList, np.float32)
+    inps.lod_diff_year = year_list - year_list[inps.refIndex]
+    return inps
+
+
+def correct_lod_block(data, box, inps):
+    if inps.lod_range_ref is not None:
+        rg_dist = readfile.read(inps.geom_file,
+                                datasetName='slantRangeDistance',
+                                box=box,
+                                print_msg=False)[0]
+        rg_dist -= inps.lod_range_ref
+    else:
+        x = np.arange(box[0], box[2], dtype=np.float32)
+        rg_dist = float(inps.metadata['RANGE_PIXEL_SIZE']) * (x - int(inps.metadata['REF_X']))
+        rg_dist = np.tile(rg_dist, (box[3] - box[1], 1))
+    ramp_rate = np.array(rg_dist * 3.87e-7, np.float32)
+    data -= ramp_rate[np.newaxis, :, :] * inps.lod_diff_year.reshape(-1, 1, 1)
+    return data
+
+
+def prepare_trop(inps):
+    """Check the date and reference info of tropospheric delay file, as diff.py"""
+    trop_obj = timeseries(inps.trop_file)
+    trop_obj.open(print_msg=False)
+    inps.trop_date_idx = []
+    for d in inps.dateList:
+        if d not in trop_obj.dateList:
+            raise ValueError('date {} not found in tropospheric delay file: {}'.format(d, inps.trop_file))
+        inps.trop_date_idx.append(trop_obj.dateList.index(d))
+
+    # reference date / pixel difference
+    inps.trop_ref_idx = None
+    if trop_obj.metadata['REF_DATE'] != inps.metadata['REF_DATE']:
+        print('consider different reference date of tropospheric delay')
+        inps.trop_ref_idx = trop_obj.dateList.index(inps.metadata['REF_DATE'])
+    inps.trop_ref_value = None
+    ref_y, ref_x = int(inps.metadata['REF_Y']), int(inps.metadata['REF_X'])
+    if (ref_y != int(trop_obj.metadata.get('REF_Y', -1))
+            or ref_x != int(trop_obj.metadata.get('REF_X', -1))):
+        print('consider different reference pixel of tropospheric delay')
+        inps.trop_ref_value = read_trop_block(inps, (ref_x, ref_y, ref_x+1, ref_y+1), ref_pixel=False)
+    return inps
+
+
+def read_trop_block(inps, box, ref_pixel=True):
+    with h5py.File(inps.trop_file, 'r') as f:
+        delay = f['timeseries'][:, box[1]:box[3], box[0]:box[2]]
+    if inps.trop_ref_idx is not None:
+        delay -= delay[inps.trop_ref_idx]
+    delay = delay[inps.trop_date_idx]
+    if ref_pixel and inps.trop_ref_value is not None:
+        delay -= inps.trop_ref_value
+    return delay
+
+
+def correct_trop_block(data, box, inps):
+    mask = data == 0.
+    data -= read_trop_block(inps, box)
+    data[mask] = 0.            # Do not change zero phase value
+    return data
+
+
+def prepare_dem_error(inps):
+    """Prepare design matrix of deformation model for DEM error correction"""
+    dem_inps = dem_error.cmd_line_parse([inps.timeseries_file])
+    if inps.template_file:
+        dem_inps = dem_error.read_template2inps(inps.template_file, dem_inps)
+    dem_inps.geom_file = inps.geom_file
+    dem_inps = dem_error.read_geometry(dem_inps, box=(0, 0, 1, 1), print_msg=False)
+    dem_inps.A_def = dem_error.design_matrix4deformation(dem_inps)
+    dem_inps.drop_date = dem_error.read_exclude_date(dem_inps.ex_date, inps.dateList)
+    dem_inps.num_step = len(dem_inps.step_date)
+    if dem_inps.poly_order > np.sum(dem_inps.drop_date):
+        raise ValueError(("ERROR: input poly order {} > number of acquisition {}!"
+                          " Reduce it!").format(dem_inps.poly_order, np.sum(dem_inps.drop_date)))
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open(print_msg=False)
+    dem_inps.tbase = np.array(ts_obj.tbase, np.float32).reshape(-1, 1) / 365.25
+    inps.dem_inps = dem_inps
+
+    # output files
+    out_dir = os.path.dirname(inps.stepFiles['demErr'])
+    inps.demErrFile = os.path.join(out_dir, 'demErr.h5')
+    inps.resFile = os.path.join(out_dir, 'timeseriesResidual.h5')
+    inps.stepModelFile = os.path.join(out_dir, 'timeseriesStepModel.h5')
+
+    atr = dict(inps.metadata)
+    atr['FILE_TYPE'] = 'dem'
+    atr['UNIT'] = 'm'
+    atr.pop('REF_DATE', None)
+    writefile.layout_hdf5(inps.demErrFile,
+                          {'dem': (np.float32, (inps.length, inps.width), None)},
+                          metadata=atr)
+    layout_timeseries(inps.resFile, inps)
+    if dem_inps.num_step > 0:
+        atr['FILE_TYPE'] = 'timeseries'
+        atr.pop('UNIT')
+        layout_timeseries(inps.stepModelFile, inps, metadata=atr, dates=dem_inps.step_date)
+    return inps
+
+
+def correct_dem_error_block(data, box, inps):
+    """Correct DEM error of one block, write estimated DEM error / residual / step model"""
+    dem_inps = dem_error.read_geometry(inps.dem_inps, box=box, print_msg=False)
+    num_row = box[3] - box[1]
+    (delta_z,
+     ts_cor,
+     ts_res,
+     step_model) = dem_error.correct_dem_error_data(data.reshape(inps.numDate, -1),
+                                                    dem_inps.A_def,
+                                                    tbase=dem_inps.tbase,
+                                                    pbase=dem_inps.pbase,
+                                                    range_dist=dem_inps.rangeDist,
+                                                    sin_inc_angle=dem_inps.sinIncAngle,
+                                                    drop_date=dem_inps.drop_date,
+                                                    min_phase_velocity=dem_inps.min_phase_velocity,
+                                                    num_step=dem_inps.num_step,
+                                                    print_msg=False)
+
+    writefile.write_hdf5_block(inps.demErrFile, delta_z, 'dem',
+                               block=[box[1], box[3], box[0], box[2]], print_msg=False)
+    ts_res = np.array(ts_res, np.float32).reshape(inps.numDate, num_row, -1)
+    write_timeseries_block(inps.resFile, ts_res, box)
+    if dem_inps.num_step > 0:
+        write_timeseries_block(inps.stepModelFile,
+                               np.array(step_model, np.float32).reshape(dem_inps.num_step, num_row, -1),
+                               box)
+
+    # accumulate residual statistics for reference date selection
+    if not inps.ref_date_in_pass1:
+        accumulate_ramp_stats(ts_res, box, inps.rms_stats, inps.rms_mask, inps, rms=True)
+    return np.array(ts_cor, np.float32).reshape(inps.numDate, num_row, -1)
+
+
+def correct_ref_date_block(data, ref_idx):
+    data -= data[ref_idx]
+    return data
+
+
+############################################################################
+def read_mask_file(mask_file):
+    """Read mask file, return None to use the whole area"""
+    if mask_file and os.path.isfile(mask_file):
+        print('read mask from file: {}'.format(mask_file))
+        return readfile.read(mask_file)[0] != 0
+    print('use mask of the whole area')
+    return None
+
+
+def get_ramp_design_matrix(box, inps, ramp_type):
+    """Design matrix of ramp for pixels in box, with normalized coordinates.
+    Same columns as deramp.remove_data_surface(); the normalization scales the columns only,
+    thus the fitted ramp is the same, with better numerical stability of the normal equation.
+    """
+    yy, xx = np.mgrid[box[1]:box[3], box[0]:box[2]]
+    yy = yy.flatten() / inps.length
+    xx = xx.flatten() / inps.width
+    ones = np.ones(yy.shape)
+    if ramp_type == 'quadratic':
+        G = [yy**2, xx**2, yy, xx, yy*xx, ones]
+    elif ramp_type == 'plane':
+        G = [yy, xx, ones]
+    elif ramp_type == 'quadratic_range':
+        G = [xx**2, xx, ones]
+    elif ramp_type == 'quadratic_azimuth':
+        G = [yy**2, yy, ones]
+    elif ramp_type == 'plane_range':
+        G = [xx, ones]
+    elif ramp_type == 'plane_azimuth':
+        G = [yy, ones]
+    else:
+        raise ValueError('un-recognized ramp type: {}'.format(ramp_type))
+    return np.array(G, np.float64).T
+
+
+def init_ramp_stats(inps, ramp_type):
+    if ramp_type in [None, False, 'no']:
+        ramp_type = 'no'
+        num_param = 0
+    else:
+        num_param = get_ramp_design_matrix((0, 0, 1, 1), inps, ramp_type).shape[1]
+    stats = {'ramp_type': ramp_type,
+             'GtG' : np.zeros((inps.numDate, num_param, num_param)),
+             'Gtd' : np.zeros((inps.numDate, num_param)),
+             'GtG0': np.zeros((inps.numDate, num_param, num_param)),
+             'dtd' : np.zeros(inps.numDate),
+             'num' : np.zeros(inps.numDate)}
+    return stats
+
+
+def accumulate_ramp_stats(data, box, stats, mask, inps, rms=False):
+    """Accumulate the normal equation of ramp estimation for each epoch of the data block
+    Parameters: data  : 3D np.array in size of (num_date, num_row, width)
+                box   : tuple of 4 int, (x0, y0, x1, y1)
+                stats : dict, from init_ramp_stats()
+                mask  : 2D np.array of bool in size of (length, width), or None for the whole area
+                rms   : bool, accumulate the sum of squares for the residual RMS
+    """
+    d = data.reshape(data.shape[0], -1)
+    m = np.ones(d.shape[1], np.bool_)
+    if mask is not None:
+        m = mask[box[1]:box[3], box[0]:box[2]].flatten()
+    d = d[:, m]
+
+    # pixels with NaN value are excluded from the estimation
+    valid = ~np.isnan(d)
+    d = np.where(valid, d, 0.).astype(np.float64)
+    if rms:
+        stats['dtd'] += np.sum(d**2, axis=1)
+        stats['num'] += np.sum(valid, axis=1)
+    if stats['ramp_type'] == 'no':
+        return stats
+
+    G = get_ramp_design_matrix(box, inps, stats['ramp_type'])[m, :]
+    num_param = G.shape[1]
+    if np.all(valid):
+        stats['GtG'] += np.dot(G.T, G)[np.newaxis, :, :]
+    else:
+        GG = (G[:, :, np.newaxis] * G[:, np.newaxis, :]).reshape(-1, num_param**2)
+        stats['GtG'] += np.dot(valid.astype(np.float64), GG).reshape(-1, num_param, num_param)
+    stats['Gtd'] += np.dot(d, G)
+
+    if rms:
+        # deramped value of zero pixels is reset to zero, as deramp.remove_data_surface()
+        zero = valid * (d == 0.)
+        flag = np.any(zero, axis=0)
+        if np.any(flag):
+            GG = (G[flag, :, np.newaxis] * G[flag, np.newaxis, :]).reshape(-1, num_param**2)
+            stats['GtG0'] += np.dot(zero[:, flag].astype(np.float64), GG).reshape(-1, num_param, num_param)
+    return stats
+
+
+def estimate_ramp_coeff(stats):
+    """Solve the accumulated normal equation for ramp coefficients of each epoch"""
+    coeff = np.zeros(stats['Gtd'].shape)
+    for i in range(coeff.shape[0]):
+        coeff[i] = np.dot(np.linalg.pinv(stats['GtG'][i]), stats['Gtd'][i])
+    return coeff
+
+
+def get_residual_rms(stats):
+    """Root Mean Square of deramped residual for each epoch from accumulated statistics,
+    same as ut.get_residual_rms() without writing the deramped residual file."""
+    if stats['ramp_type'] == 'no':
+        ssr = stats['dtd']
+    else:
+        c = estimate_ramp_coeff(stats)
+        ssr = (stats['dtd']
+               - 2 * np.sum(c * stats['Gtd'], axis=1)
+               + np.einsum('ti,tij,tj->t', c, stats['GtG'] - stats['GtG0'], c))
+    rms = np.sqrt(np.maximum(ssr, 0.) / np.maximum(stats['num'], 1))
+    return rms
+
+
+def deramp_block(data, box, coeff, inps):
+    G = get_ramp_design_matrix(box, inps, inps.ramp_type)
+    ramp = np.dot(coeff, G.T).reshape(data.shape)
+    data_n = data - ramp
+    data_n[data == 0.] = 0.       # Do not change zero phase value
+    return np.array(data_n, np.float32)
+
+
+############################################################################
+def correct_timeseries(inps):
+    """Apply all correction steps block by block.
+    Pass 1: LOD, tropospheric delay, DEM error and reference date (if known) for all epochs of each block,
+            accumulate normal equations for the residual RMS and phase ramp of each epoch.
+    Pass 2: reference date (if chosen with min residual RMS) and phase ramp, in place of the output file.
+    """
+    inps = get_step_list(inps)
+    box_list = blockwise.split2boxes(inps.length, inps.width, num_slice=inps.numDate,
+                                     chunk_size=inps.chunk_size, print_msg=True)
+
+    # prepare each step
+    if 'LODcor' in inps.steps:
+        inps = prepare_lod(inps)
+    if 'trop' in inps.steps:
+        inps = prepare_trop(inps)
+    if not inps.ref_date_in_pass1:
+        inps.rms_mask = read_mask_file(inps.rms_mask_file)
+        inps.rms_stats = init_ramp_stats(inps, inps.rms_ramp_type)
+    if 'demErr' in inps.steps:
+        inps = prepare_dem_error(inps)
+    if inps.ramp_type:
+        inps.ramp_mask = read_mask_file(inps.ramp_mask_file)
+        inps.ramp_stats = init_ramp_stats(inps, inps.ramp_type)
+
+    # layout output files
+    pass1_steps = [i for i in inps.steps if i not in ['deramp'] and (i != 'refDate' or inps.ref_date_in_pass1)]
+    pass2_steps = [i for i in inps.steps if i not in pass1_steps]
+    for step in inps.steps:
+        if inps.save_intermediate or step == inps.steps[-1]:
+            metadata = dict(inps.metadata)
+            if step in ['refDate', 'deramp'] and inps.ref_date:
+                metadata['REF_DATE'] = inps.ref_date
+            layout_timeseries(inps.stepFiles[step], inps, metadata=metadata)
+
+    ##------------------------------- Pass 1 -------------------------------##
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open(print_msg=False)
+    print('-'*50)
+    print('pass 1: {}'.format(pass1_steps))
+    prog_bar = ptime.progressBar(maxValue=len(box_list))
+    for i, box in enumerate(box_list):
+        with perf.phase('read'):
+            data = ts_obj.read(box=box, print_msg=False).reshape(inps.numDate, box[3]-box[1], box[2]-box[0])
+
+        with perf.phase('compute'):
+            for step in pass1_steps:
+                if step == 'LODcor':
+                    data = correct_lod_block(data, box, inps)
+                elif step == 'trop':
+                    data = correct_trop_block(data, box, inps)
+                elif step == 'demErr':
+                    data = correct_dem_error_block(data, box, inps)
+                elif step == 'refDate':
+                    data = correct_ref_date_block(data, inps.dateList.index(inps.ref_date))
+
+                if inps.save_intermediate and step != inps.steps[-1]:
+                    write_timeseries_block(inps.stepFiles[step], data, box)
+
+            if inps.ramp_type:
+                accumulate_ramp_stats(data, box, inps.ramp_stats, inps.ramp_mask, inps)
+
+        with perf.phase('write'):
+            write_timeseries_block(inps.outfile, data, box)
+        prog_bar.update(i+1, suffix='{}/{}'.format(i+1, len(box_list)))
+    prog_bar.close()
+
+    if not pass2_steps:
+        return inps.outfile
+
+    ##------------------------------- Pass 2 -------------------------------##
+    ref_idx = None
+    if not inps.ref_date_in_pass1:
+        rms = get_residual_rms(inps.rms_stats)
+        ref_idx = np.argmin(rms)
+        inps.ref_date = inps.dateList[ref_idx]
+        print('date with minimum residual RMS: {} - {:.4f}'.format(inps.ref_date, rms[ref_idx]))
+        for step in ['refDate', 'deramp']:
+            fname = inps.stepFiles.get(step, None)
+            if fname and os.path.isfile(fname):
+                with h5py.File(fname, 'r+') as f:
+                    f.attrs['REF_DATE'] = inps.ref_date
+
+    if inps.ramp_type:
+        coeff = estimate_ramp_coeff(inps.ramp_stats)
+        # ramp is linear to the data, thus the ramp of referenced data = ramp - ramp on reference date
+        if ref_idx is not None:
+            coeff -= coeff[ref_idx]
+
+    print('-'*50)
+    print('pass 2: {}'.format(pass2_steps))
+    prog_bar = ptime.progressBar(maxValue=len(box_list))
+    for i, box in enumerate(box_list):
+        with perf.phase('read'):
+            data = timeseries(inps.outfile).read(box=box, print_msg=False)
+            data = data.reshape(inps.numDate, box[3]-box[1], box[2]-box[0])
+
+        with perf.phase('compute'):
+            for step in pass2_steps:
+                if step == 'refDate':
+                    data = correct_ref_date_block(data, ref_idx)
+                elif step == 'deramp':
+                    data = deramp_block(data, box, coeff, inps)
+
+                if inps.save_intermediate and step != inps.steps[-1]:
+                    write_timeseries_block(inps.stepFiles[step], data, box)
+
+        with perf.phase('write'):
+            write_timeseries_block(inps.outfile, data, box)
+        prog_bar.update(i+1, suffix='{}/{}'.format(i+1, len(box_list)))
+    prog_bar.close()
+    return inps.outfile
+
+
+############################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    if inps.template_file:
+        inps = read_template2inps(inps.template_file, inps)
+
+    start_time = time.time()
+    inps.outfile = correct_timeseries(inps)
+
+    m, s = divmod(time.time()-start_time, 60)
+    print('\ntime used: {:02.0f} mins {:02.1f} secs\nDone.'.format(m, s))
+    return inps.outfile
+
+
+############################################################################
+if __name__ == '__main__':
+    main()
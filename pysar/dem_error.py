@@ -12,7 +12,7 @@ import time
 import argparse
 import numpy as np
 from scipy.special import gamma
-from pysar.utils import ptime, readfile, writefile, utils as ut
+from pysar.utils import ptime, readfile, writefile, perf, blockwise, utils as ut
 from pysar.objects import timeseries, geometry
 
 
@@ -35,6 +35,9 @@ EXAMPLE = """example:
   # correct DEM error with mean geometry parameters
   dem_error.py  timeseries_ECMWF.h5
 
+  # process blocks of 50e6 elements in 4 processes
+  dem_error.py  timeseries_ECMWF.h5 -g INPUTS/geometryRadar.h5 --chunk-size 50e6 --num-worker 4
+
   # get time-series of estimated deformation model
   diff.py timeseries_ECMWF_demErr.h5 timeseriesResidual.h5 -o timeseriesDefModel.h5
 """
@@ -72,6 +75,12 @@ def create_parser():
                         help='Use phase velocity instead of phase for inversion constrain.')
     parser.add_argument('-p', '--poly-order', dest='poly_order', type=int, default=2,
                         help='polynomial order number of temporal deformation model, default = 2')
+
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to process per block, default: 100e6\n' +
+                             'memory usage is ~1.6GB per block per worker.')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of blocks to process in parallel, default: 1.')
     return parser
 
 
@@ -165,7 +174,7 @@ def design_matrix4deformation(inps):
     msg = 'ordinal least squares (OLS) inversion with L2-norm minimization on: phase'
     if inps.min_phase_velocity:
         msg += ' velocity'
-    if inps.rangeDist.size != 1:
+    if inps.geom_file:
         msg += ' (pixel-wisely)'
     print(msg)
 
@@ -190,30 +199,41 @@ def design_matrix4deformation(inps):
     return A_def
 
 
-def read_geometry(inps):
+def read_geometry(inps, box=None, print_msg=True):
+    """Read geometry info for DEM error estimation
+    Parameters: inps : Namespace, with timeseries_file and geom_file
+                box  : tuple of 4 int, (x0, y0, x1, y1), read the whole area if None
+    Returns:    inps : Namespace, with incAngle, rangeDist, sinIncAngle and pbase
+    """
     ts_obj = timeseries(inps.timeseries_file)
     ts_obj.open(print_msg=False)
     # 2D / 3D geometry
     if inps.geom_file:
         geom_obj = geometry(inps.geom_file)
-        geom_obj.open()
-        print(('read 2D incidenceAngle,slantRangeDistance from {} file:'
-               ' {}').format(geom_obj.name, os.path.basename(geom_obj.file)))
-        inps.incAngle = geom_obj.read(datasetName='incidenceAngle', print_msg=False).flatten()
-        inps.rangeDist = geom_obj.read(datasetName='slantRangeDistance', print_msg=False).flatten()
+        geom_obj.open(print_msg=print_msg)
+        if box is None:
+            box = (0, 0, geom_obj.width, geom_obj.length)
+        if print_msg:
+            print(('read 2D incidenceAngle,slantRangeDistance from {} file:'
+                   ' {}').format(geom_obj.name, os.path.basename(geom_obj.file)))
+        inps.incAngle = geom_obj.read(datasetName='incidenceAngle', box=box, print_msg=False).flatten()
+        inps.rangeDist = geom_obj.read(datasetName='slantRangeDistance', box=box, print_msg=False).flatten()
         if 'bperp' in geom_obj.datasetNames:
-            print('read 3D bperp from {} file: {} ...'.format(geom_obj.name, os.path.basename(geom_obj.file)))
-            inps.pbase = geom_obj.read(datasetName='bperp', print_msg=False).reshape((geom_obj.numDate, -1))
+            if print_msg:
+                print('read 3D bperp from {} file: {} ...'.format(geom_obj.name, os.path.basename(geom_obj.file)))
+            inps.pbase = geom_obj.read(datasetName='bperp', box=box, print_msg=False).reshape((geom_obj.numDate, -1))
             inps.pbase -= inps.pbase[ts_obj.refIndex]
         else:
-            print('read mean bperp from {} file'.format(ts_obj.name))
+            if print_msg:
+                print('read mean bperp from {} file'.format(ts_obj.name))
             inps.pbase = ts_obj.pbase.reshape((-1, 1))
 
     # 0D geometry
     else:
-        print('read mean incidenceAngle,slantRangeDistance,bperp value from {} file'.format(ts_obj.name))
-        inps.incAngle = ut.incidence_angle(ts_obj.metadata, dimension=0)
-        inps.rangeDist = ut.range_distance(ts_obj.metadata, dimension=0)
+        if print_msg:
+            print('read mean incidenceAngle,slantRangeDistance,bperp value from {} file'.format(ts_obj.name))
+        inps.incAngle = ut.incidence_angle(ts_obj.metadata, dimension=0, print_msg=print_msg)
+        inps.rangeDist = ut.range_distance(ts_obj.metadata, dimension=0, print_msg=print_msg)
         inps.pbase = ts_obj.pbase.reshape((-1, 1))
 
     inps.sinIncAngle = np.sin(inps.incAngle * np.pi / 180.)
@@ -278,29 +298,90 @@ def estimate_dem_error(ts0, A0, tbase, drop_date=None, min_phase_velocity=False,
     return delta_z, ts_cor, ts_res, step_def
 
 
-def correct_dem_error(inps, A_def):
-    """Correct DEM error of input timeseries file"""
-    # Read Date Info
-    ts_obj = timeseries(inps.timeseries_file)
-    ts_obj.open()
-    num_date = ts_obj.numDate
-    num_pixel = ts_obj.numPixel
-    tbase = np.array(ts_obj.tbase, np.float32) / 365.25
+def estimate_dem_error_batch(ts0, A_geom0, A_def0, tbase, drop_date=None, min_phase_velocity=False, num_step=0):
+    """Estimate DEM error with least square optimization for pixels with different geometry.
+    The design matrix A = [A_geom, A_def] of each pixel differs in the first column only, thus
+    the inversion is split using the Schur complement of A_def, which is shared by all pixels:
+        delta_z = (g.T * P * d) / (g.T * P * g), with P = I - A_def * pinv(A_def)
+        X_def   = pinv(A_def) * (d - g * delta_z)
+    which is equivalent to X = np.linalg.pinv(A).dot(d) in estimate_dem_error() pixel by pixel.
+    Parameters: ts0     : 2D np.array in size of (numDate, numPixel), original time series displacement
+                A_geom0 : 2D np.array in size of (numDate, numPixel), design matrix of DEM error of each pixel
+                A_def0  : 2D np.array in size of (numDate, model_num), design matrix of deformation model
+                tbase : 2D np.array in size of (numDate, 1), temporal baseline
+                drop_date : 1D np.array in bool data type, mark the date used in the estimation
+                min_phase_velocity : bool, use phase history or phase velocity for minimization
+    Returns:    delta_z: 1D np.array in size of (numPixel,) estimated DEM residual
+                ts_cor : 2D np.array in size of (numDate, numPixel),
+                            corrected timeseries = tsOrig - delta_z_phase
+                ts_res : 2D np.array in size of (numDate, numPixel),
+                            residual timeseries = tsOrig - delta_z_phase - defModel
+                step_def : 2D np.array in size of (num_step, numPixel) or None
+    Example:    delta_z, ts_cor, ts_res = estimate_dem_error_batch(ts, A_geom, A_def, tbase, drop_date)[0:3]
+    """
+    if drop_date is None:
+        drop_date = np.ones(ts0.shape[0], np.bool_)
 
-    num_step = len(inps.step_date)
-    drop_date = read_exclude_date(inps.ex_date, ts_obj.dateList)
-    if inps.poly_order > np.sum(drop_date):
-        raise ValueError(("ERROR: input poly order {} > number of acquisition {}!"
-                          " Reduce it!").format(inps.poly_order, np.sum(drop_date)))
+    # Prepare Design matrix A and observations ts for inversion
+    A_geom = A_geom0[drop_date, :]
+    A_def = A_def0[drop_date, :]
+    ts = ts0[drop_date, :]
+    if min_phase_velocity:
+        tbase_diff = np.diff(tbase[drop_date, :], axis=0)
+        ts = np.diff(ts, axis=0) / tbase_diff
+        A_geom = np.diff(A_geom, axis=0) / tbase_diff
+        A_def = np.diff(A_def, axis=0) / tbase_diff
+
+    # Project A_geom and ts onto the orthogonal complement of the deformation model
+    A_def_inv = np.linalg.pinv(A_def)
+    X_ts = np.dot(A_def_inv, ts)
+    X_geom = np.dot(A_def_inv, A_geom)
+    A_geom_res = A_geom - np.dot(A_def, X_geom)
+
+    # DEM error, set to zero where geometry is not separable from the deformation model
+    num = np.sum(A_geom_res * ts, axis=0)
+    den = np.sum(A_geom_res * A_geom_res, axis=0)
+    flag = den > 1e-12 * np.sum(A_geom * A_geom, axis=0)
+    delta_z = np.zeros(ts0.shape[1], np.float64)
+    delta_z[flag] = num[flag] / den[flag]
+    X_def = X_ts - X_geom * delta_z
 
-    # Read time-series Data
-    print('reading time-series data ...')
-    ts_data = ts_obj.read().reshape((num_date, -1))
+    # Prepare Outputs
+    ts_cor = ts0 - A_geom0 * delta_z
+    ts_res = ts_cor - np.dot(A_def0, X_def)
 
-    ##-------------------------------- Loop for L2-norm inversion  --------------------------------##
-    print('inverting DEM error ...')
-    if inps.rangeDist.size == 1:
-        A_geom = inps.pbase / (inps.rangeDist * inps.sinIncAngle)
+    step_def = None
+    if num_step > 0:
+        step_def = X_def[-1*num_step:, :].reshape(num_step, -1)
+    return delta_z, ts_cor, ts_res, step_def
+
+
+def correct_dem_error_data(ts_data, A_def, tbase, pbase, range_dist, sin_inc_angle, drop_date=None,
+                           min_phase_velocity=False, num_step=0, chunk_size=50e6, print_msg=True):
+    """Correct DEM error of input time series matrix
+    Parameters: ts_data : 2D np.array in size of (numDate, numPixel), original time series displacement
+                A_def   : 2D np.array in size of (numDate, model_num), design matrix of deformation model
+                tbase   : 2D np.array in size of (numDate, 1), temporal baseline in years
+                pbase   : 2D np.array in size of (numDate, 1) or (numDate, numPixel), perpendicular baseline
+                range_dist    : float or 1D np.array in size of (numPixel,), slant range distance
+                sin_inc_angle : float or 1D np.array in size of (numPixel,), sin of incidence angle
+                drop_date : 1D np.array in bool data type, mark the date used in the estimation
+                min_phase_velocity : bool, use phase history or phase velocity for minimization
+                num_step : int, number of step functions in A_def
+                chunk_size : float, max number of data elements of pixels inverted at once,
+                             for pixels with different geometry
+    Returns:    delta_z    : 1D np.array in size of (numPixel,), estimated DEM residual
+                ts_cor     : 2D np.array in size of (numDate, numPixel), corrected timeseries
+                ts_res     : 2D np.array in size of (numDate, numPixel), residual timeseries
+                step_model : 2D np.array in size of (num_step, numPixel), estimated step model
+    """
+    num_date, num_pixel = ts_data.shape
+    step_model = None
+    range_dist = np.array(range_dist)
+    sin_inc_angle = np.array(sin_inc_angle)
+
+    if range_dist.size == 1 and pbase.shape[1] == 1:
+        A_geom = pbase / (range_dist * sin_inc_angle)
         A = np.hstack((A_geom, A_def))
         (delta_z,
          ts_cor,
@@ -309,107 +390,199 @@ def correct_dem_error(inps, A_def):
                                           A,
                                           tbase=tbase,
                                           drop_date=drop_date,
-                                          min_phase_velocity=inps.min_phase_velocity,
+                                          min_phase_velocity=min_phase_velocity,
                                           num_step=num_step)
 
     else:
         ts_cor = np.zeros((num_date, num_pixel), dtype=np.float32)
         ts_res = np.zeros((num_date, num_pixel), dtype=np.float32)
         delta_z = np.zeros(num_pixel, dtype=np.float32)
-        #constC = np.zeros(num_pixel, dtype=np.float32)
         if num_step > 0:
             step_model = np.zeros((num_step, num_pixel), dtype=np.float32)
 
         # mask
-        print('skip pixels with zero/nan value in geometry: incidence angle or range distance')
-        mask = np.multiply(inps.sinIncAngle != 0., inps.rangeDist != 0.)
-        print('skip pixels with zero value in all acquisitions')
+        mask = np.multiply(sin_inc_angle != 0., range_dist != 0.)
         ts_mean = np.nanmean(ts_data, axis=0)
         mask *= ts_mean != 0.
         del ts_mean
 
         num_pixel2inv = np.sum(mask)
         idx_pixel2inv = np.where(mask)[0]
-        print(('number of pixels to invert: {} out of {}'
-               ' ({:.1f}%)').format(num_pixel2inv,
-                                    num_pixel,
-                                    num_pixel2inv/num_pixel*100))
+        if print_msg:
+            print('skip pixels with zero/nan value in geometry: incidence angle or range distance')
+            print('skip pixels with zero value in all acquisitions')
+            print(('number of pixels to invert: {} out of {}'
+                   ' ({:.1f}%)').format(num_pixel2inv,
+                                        num_pixel,
+                                        num_pixel2inv/max(num_pixel, 1)*100))
 
         # update data matrix to save memory and IO
         ts_data = ts_data[:, mask]
-        inps.rangeDist = inps.rangeDist[mask]
-        inps.sinIncAngle = inps.sinIncAngle[mask]
-        if inps.pbase.shape[1] != 1:
-            inps.pbase = inps.pbase[:, mask]
-
-        # loop pixel by pixel
-        prog_bar = ptime.progressBar(maxValue=num_pixel2inv)
-        for i in range(num_pixel2inv):
-            prog_bar.update(i+1, every=1000, suffix='{}/{}'.format(i+1, num_pixel2inv))
-            idx = idx_pixel2inv[i]
-
-            # design matrix
-            if inps.pbase.shape[1] == 1:
-                pbase = inps.pbase
-            else:
-                pbase = inps.pbase[:, i].reshape(-1, 1)
-            A_geom = pbase / (inps.rangeDist[i] * inps.sinIncAngle[i])
-            A = np.hstack((A_geom, A_def))
-
-            (delta_z_i,
-             ts_cor_i,
-             ts_res_i,
-             step_model_i) = estimate_dem_error(ts_data[:, i],
-                                                A,
-                                                tbase=tbase,
-                                                drop_date=drop_date,
-                                                min_phase_velocity=inps.min_phase_velocity,
-                                                num_step=num_step)
-            delta_z[idx:idx+1] = delta_z_i
-            ts_cor[:, idx:idx+1] = ts_cor_i
-            ts_res[:, idx:idx+1] = ts_res_i
+        range_dist = range_dist[mask] if range_dist.size > 1 else range_dist
+        sin_inc_angle = sin_inc_angle[mask] if sin_inc_angle.size > 1 else sin_inc_angle
+        if pbase.shape[1] != 1:
+            pbase = pbase[:, mask]
+
+        # invert pixels in chunks, to limit the memory of temporary matrices
+        step = max(1, int(chunk_size / num_date))
+        num_chunk = int(np.ceil(num_pixel2inv / step))
+        if print_msg and num_chunk > 1:
+            prog_bar = ptime.progressBar(maxValue=num_chunk)
+        for i in range(num_chunk):
+            i0, i1 = i * step, min((i + 1) * step, num_pixel2inv)
+            idx = idx_pixel2inv[i0:i1]
+
+            # design matrix of DEM error for each pixel
+            pbase_i = pbase if pbase.shape[1] == 1 else pbase[:, i0:i1]
+            range_dist_i = range_dist if range_dist.size == 1 else range_dist[i0:i1]
+            sin_inc_angle_i = sin_inc_angle if sin_inc_angle.size == 1 else sin_inc_angle[i0:i1]
+            A_geom = pbase_i / (range_dist_i * sin_inc_angle_i)
+            if A_geom.shape[1] != i1 - i0:
+                A_geom = np.tile(A_geom, (1, i1 - i0))
+
+            (delta_z[idx],
+             ts_cor[:, idx],
+             ts_res[:, idx],
+             step_model_i) = estimate_dem_error_batch(ts_data[:, i0:i1],
+                                                      A_geom,
+                                                      A_def,
+                                                      tbase=tbase,
+                                                      drop_date=drop_date,
+                                                      min_phase_velocity=min_phase_velocity,
+                                                      num_step=num_step)
             if num_step > 0:
-                step_model[:, idx:idx+1] = step_model_i
-        prog_bar.close()
-    del ts_data
-
-    ##---------------------------------------- Output  -----------------------------------------##
-    # prepare for output
-    ts_cor = ts_cor.reshape((num_date, ts_obj.length, ts_obj.width))
-    ts_res = ts_res.reshape((num_date, ts_obj.length, ts_obj.width))
-    delta_z = delta_z.reshape((ts_obj.length, ts_obj.width))
-    if num_step > 0:
-        step_model = step_model.reshape((num_step, ts_obj.length, ts_obj.width))
-    atr = dict(ts_obj.metadata)
+                step_model[:, idx] = step_model_i
+            if print_msg and num_chunk > 1:
+                prog_bar.update(i+1, suffix='{}/{}'.format(i1, num_pixel2inv))
+        if print_msg and num_chunk > 1:
+            prog_bar.close()
+    return delta_z, ts_cor, ts_res, step_model
+
+
+def layout_output_files(inps, ts_obj):
+    """Create output files with empty datasets, to be written block by block"""
+    shape2d = (ts_obj.length, ts_obj.width)
+    ts_dsNameDict = {'date'      : (np.string_, (ts_obj.numDate,), ts_obj.dateList),
+                     'bperp'     : (np.float32, (ts_obj.numDate,), ts_obj.pbase),
+                     'timeseries': (np.float32, (ts_obj.numDate,)+shape2d, None)}
 
     # 1. Estimated DEM error
-    outfile = 'demErr.h5'
+    atr = dict(ts_obj.metadata)
     atr['FILE_TYPE'] = 'dem'
     atr['UNIT'] = 'm'
-    writefile.write(delta_z, out_file=outfile, metadata=atr)
+    writefile.layout_hdf5(inps.demErrFile, {'dem': (np.float32, shape2d, None)}, metadata=atr)
 
     # 2. Time-series corrected for DEM error
-    if not inps.outfile:
-        inps.outfile = '{}_demErr.h5'.format(os.path.splitext(inps.timeseries_file)[0])
-    ts_cor_obj = timeseries(inps.outfile)
-    ts_cor_obj.write2hdf5(data=ts_cor, refFile=ts_obj.file)
-
     # 3. Time-series of inversion residual
-    ts_res_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesResidual.h5'))
-    ts_res_obj.write2hdf5(data=ts_res, refFile=ts_obj.file)
+    atr = dict(ts_obj.metadata)
+    atr['FILE_TYPE'] = 'timeseries'
+    writefile.layout_hdf5(inps.outfile, ts_dsNameDict, metadata=atr)
+    writefile.layout_hdf5(inps.resFile, ts_dsNameDict, metadata=atr)
 
     # 4. Time-series of estimated Step Model
+    num_step = len(inps.step_date)
     if num_step > 0:
-        atr['FILE_TYPE'] = 'timeseries'
-        atr.pop('REF_DATE')
-        step_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesStepModel.h5'))
-        step_obj.write2hdf5(data=step_model, metadata=atr, dates=inps.step_date)
+        atr.pop('REF_DATE', None)
+        atr['UNIT'] = 'm'
+        step_dsNameDict = {'date'      : (np.string_, (num_step,), inps.step_date),
+                           'timeseries': (np.float32, (num_step,)+shape2d, None)}
+        writefile.layout_hdf5(inps.stepModelFile, step_dsNameDict, metadata=atr)
+    return inps
 
-    ## 5. Time-series of estimated Deformation Model = poly model + step model
-    #ts_def_obj = timeseries(os.path.join(os.path.dirname(inps.outfile), 'timeseriesDefModel.h5'))
-    #ts_def_obj.write2hdf5(data=ts_cor - ts_res, refFile=ts_obj.file)
-    #del ts_cor, ts_res
 
+def correct_dem_error_patch(inps, A_def, tbase, drop_date, box):
+    """Correct DEM error of one block
+    Parameters: inps  : Namespace, with timeseries_file, geom_file, min_phase_velocity and step_date
+                A_def : 2D np.array in size of (numDate, model_num), design matrix of deformation model
+                tbase : 2D np.array in size of (numDate, 1), temporal baseline in years
+                drop_date : 1D np.array in bool data type, mark the date used in the estimation
+                box   : tuple of 4 int, (x0, y0, x1, y1)
+    Returns:    box, delta_z, ts_cor, ts_res, step_model in 2D/3D np.array of float32
+    """
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open(print_msg=False)
+    num_row = box[3] - box[1]
+    num_col = box[2] - box[0]
+    num_step = len(inps.step_date)
+
+    with perf.phase('read'):
+        ts_data = ts_obj.read(box=box, print_msg=False).reshape((ts_obj.numDate, -1))
+        inps = read_geometry(inps, box=box, print_msg=False)
+
+    with perf.phase('compute'):
+        (delta_z,
+         ts_cor,
+         ts_res,
+         step_model) = correct_dem_error_data(ts_data,
+                                              A_def,
+                                              tbase=tbase,
+                                              pbase=inps.pbase,
+                                              range_dist=inps.rangeDist,
+                                              sin_inc_angle=inps.sinIncAngle,
+                                              drop_date=drop_date,
+                                              min_phase_velocity=inps.min_phase_velocity,
+                                              num_step=num_step,
+                                              print_msg=False)
+
+    delta_z = np.array(delta_z, np.float32).reshape(num_row, num_col)
+    ts_cor = np.array(ts_cor, np.float32).reshape(ts_obj.numDate, num_row, num_col)
+    ts_res = np.array(ts_res, np.float32).reshape(ts_obj.numDate, num_row, num_col)
+    if num_step > 0:
+        step_model = np.array(step_model, np.float32).reshape(num_step, num_row, num_col)
+    return box, delta_z, ts_cor, ts_res, step_model
+
+
+def write_patch(inps, box, delta_z, ts_cor, ts_res, step_model):
+    """Write the result of one block into output files"""
+    with perf.phase('write'):
+        block2d = [box[1], box[3], box[0], box[2]]
+        writefile.write_hdf5_block(inps.demErrFile, delta_z, 'dem', block=block2d, print_msg=False)
+        for fname, data in [(inps.outfile, ts_cor),
+                            (inps.resFile, ts_res),
+                            (inps.stepModelFile, step_model)]:
+            if data is not None:
+                writefile.write_hdf5_block(fname, data, 'timeseries',
+                                           block=[0, data.shape[0]]+block2d,
+                                           print_msg=False)
+    return
+
+
+def correct_dem_error(inps, A_def):
+    """Correct DEM error of input timeseries file block by block,
+    with results written into output files incrementally."""
+    # Read Date Info
+    ts_obj = timeseries(inps.timeseries_file)
+    ts_obj.open()
+    tbase = np.array(ts_obj.tbase, np.float32).reshape(-1, 1) / 365.25
+
+    drop_date = read_exclude_date(inps.ex_date, ts_obj.dateList)
+    if inps.poly_order > np.sum(drop_date):
+        raise ValueError(("ERROR: input poly order {} > number of acquisition {}!"
+                          " Reduce it!").format(inps.poly_order, np.sum(drop_date)))
+
+    # Output files
+    if not inps.outfile:
+        inps.outfile = '{}_demErr.h5'.format(os.path.splitext(inps.timeseries_file)[0])
+    out_dir = os.path.dirname(inps.outfile)
+    inps.demErrFile = 'demErr.h5'
+    inps.resFile = os.path.join(out_dir, 'timeseriesResidual.h5')
+    inps.stepModelFile = os.path.join(out_dir, 'timeseriesStepModel.h5')
+    inps = layout_output_files(inps, ts_obj)
+
+    ##-------------------------------- Loop for L2-norm inversion  --------------------------------##
+    # memory usage is ~ 4 * 4 * chunk_size bytes (ts_data, ts_cor, ts_res)
+    box_list = blockwise.split2boxes(ts_obj.length, ts_obj.width, num_slice=ts_obj.numDate,
+                                     chunk_size=inps.chunk_size, print_msg=True)
+    task_list = [(inps, A_def, tbase, drop_date, box) for box in box_list]
+    print('inverting DEM error ...')
+    blockwise.run_tasks(correct_dem_error_patch, task_list,
+                        write_func=lambda task, result: write_patch(inps, *result),
+                        num_worker=inps.numWorker,
+                        suffix=lambda task: '{}/{} lines'.format(task[-1][3], ts_obj.length))
+
+    ## 5. Time-series of estimated Deformation Model = poly model + step model
+    #diff.py timeseries_ECMWF_demErr.h5 timeseriesResidual.h5 -o timeseriesDefModel.h5
+    print('finished writing to {}, {} and {}'.format(inps.outfile, inps.resFile, inps.demErrFile))
     return inps
 
 
@@ -420,7 +593,8 @@ def main(iargs=None):
         inps = read_template2inps(inps.template_file, inps)
 
     start_time = time.time()
-    inps = read_geometry(inps)
+    # geometry of the 1st pixel, to check the dimension of geometry
+    inps = read_geometry(inps, box=(0, 0, 1, 1))
     A_def = design_matrix4deformation(inps)
     inps = correct_dem_error(inps, A_def)
 
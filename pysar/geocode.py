@@ -12,9 +12,10 @@ import time
 import argparse
 import warnings
 import multiprocessing
+import h5py
 import numpy as np
 from pysar.objects.resample import resample
-from pysar.utils import readfile, writefile, utils as ut
+from pysar.utils import readfile, writefile, perf, utils as ut
 
 
 ######################################################################################
@@ -31,6 +32,7 @@ EXAMPLE = """example:
   geocode.py velocity.h5
   geocode.py velocity.h5 -b -0.5 -0.25 -91.3 -91.1
   geocode.py velocity.h5 timeseries.h5 -t pysarApp_template.txt -o ./GEOCODE --update
+  geocode.py timeseries.h5 --chunk-size 20e6
 
   geocode.py geo_velocity.h5 --geo2radar
 """
@@ -68,6 +70,14 @@ def create_parser():
     parser.add_argument('--fill', dest='fillValue', type=float, default=np.nan,
                         help='Value used for points outside of the interpolation domain.\n' +
                              'Default: np.nan')
+    parser.add_argument('--index-file', dest='indexFile', default='auto',
+                        help='HDF5 file of the resampling index, i.e. neighbours of the output pixels,\n' +
+                             'to skip the neighbour search if it matches the lookup table and output grid.\n' +
+                             'Default: resampleIndex.h5 in the same directory as the lookup file\n' +
+                             'Set to "no" to search the neighbours without saving them.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to resample at once, for HDF5 files.\n' +
+                             'Memory usage is ~ 3 * 4 * chunk_size bytes. Default: 100e6')
 
     parser.add_argument('--update', dest='updateMode', action='store_true',
                         help='skip resampling if output file exists and newer than input file')
@@ -108,6 +118,11 @@ def _check_inps(inps):
     if inps.SNWE:
         inps.SNWE = tuple(inps.SNWE)
 
+    if inps.indexFile == 'auto':
+        inps.indexFile = os.path.join(os.path.dirname(os.path.abspath(inps.lookupFile)), 'resampleIndex.h5')
+    elif inps.indexFile.lower() in ['no', 'none', 'false']:
+        inps.indexFile = None
+
     inps.laloStep = [inps.latStep, inps.lonStep]
     if None in inps.laloStep:
         inps.laloStep = None
@@ -201,20 +216,88 @@ def metadata_geo2radar(atr_in, res_obj, print_msg=True):
     return atr
 
 
-def resample_data(data, inps, res_obj):
-    """resample 2D/3D data"""
+def resample_data(data, inps, res_obj, block_index=None):
+    """resample 2D/3D data, of the whole source grid or of the footprint of block_index"""
     if len(data.shape) == 3:
         data = np.moveaxis(data, 0, -1)
 
     # resample source data into target data
     geo_data = res_obj.resample(src_data=data, interp_method=inps.interpMethod, fill_value=inps.fillValue,
-                                nprocs=inps.nprocs, print_msg=False)
+                                nprocs=inps.nprocs, block_index=block_index, print_msg=False)
 
     if len(geo_data.shape) == 3:
         geo_data = np.moveaxis(geo_data, -1, 0)
     return geo_data
 
 
+def layout_output_file(infile, outfile, dsNames, atr, res_obj, inps, ref_file=None):
+    """Create output HDF5 file with empty datasets to be resampled,
+    and the auxiliary datasets, e.g. date and bperp, copied from ref_file."""
+    dsNameDict = dict()
+    with h5py.File(infile, 'r') as f:
+        for dsName in dsNames:
+            ds = f[dsName]
+            dsNameDict[dsName] = (res_obj.get_dest_dtype(ds.dtype, inps.fillValue),
+                                  ds.shape[:-2] + (res_obj.length, res_obj.width),
+                                  None)
+    if ref_file:
+        with h5py.File(ref_file, 'r') as f:
+            for dsName in f.keys():
+                ds = f[dsName]
+                if dsName not in dsNames and isinstance(ds, h5py.Dataset):
+                    dsNameDict[dsName] = (ds.dtype, ds.shape, ds[:])
+    writefile.layout_hdf5(outfile, dsNameDict, metadata=atr)
+    return outfile
+
+
+def resample_dataset_block(infile, outfile, dsName, inps, res_obj):
+    """Resample one 2D/3D dataset of HDF5 file block by block,
+    in blocks of the output grid and groups of slices, and write each block into outfile."""
+    with h5py.File(infile, 'r') as f:
+        ds_shape = f[dsName].shape
+    num_slice = ds_shape[0] if len(ds_shape) == 3 else 1
+
+    for dest_box in res_obj.get_dest_boxes(chunk_size=inps.chunk_size, print_msg=False):
+        # input footprint of the output block
+        block_index = res_obj.get_block_index(dest_box)
+        x0, y0, x1, y1 = block_index['src_box']
+        num_pixel = (x1 - x0) * (y1 - y0) + (dest_box[2] - dest_box[0]) * (dest_box[3] - dest_box[1])
+        z_step = int(max(1, inps.chunk_size / num_pixel))
+
+        for z0 in range(0, num_slice, z_step):
+            z1 = min(num_slice, z0 + z_step)
+            with perf.phase('read'):
+                with h5py.File(infile, 'r') as f:
+                    if len(ds_shape) == 3:
+                        data = f[dsName][z0:z1, y0:y1, x0:x1]
+                    else:
+                        data = f[dsName][y0:y1, x0:x1]
+
+            with perf.phase('compute'):
+                res_data = resample_data(data, inps, res_obj, block_index=block_index)
+
+            with perf.phase('write'):
+                block = [dest_box[1], dest_box[3], dest_box[0], dest_box[2]]
+                if len(ds_shape) == 3:
+                    block = [z0, z1] + block
+                writefile.write_hdf5_block(outfile, res_data, dsName, block=block, print_msg=False)
+    return outfile
+
+
+def is_block_readable(infile, dsNames):
+    """Whether all datasets could be read block by block directly, i.e. 2D/3D datasets in the root
+    of HDF5 file, with the last two dimensions in (length, width)"""
+    if os.path.splitext(infile)[1].lower() not in ['.h5', '.he5']:
+        return False
+    with h5py.File(infile, 'r') as f:
+        for dsName in dsNames:
+            if dsName not in f.keys() or not isinstance(f[dsName], h5py.Dataset):
+                return False
+            if len(f[dsName].shape) not in [2, 3]:
+                return False
+    return True
+
+
 def auto_output_filename(infile, inps):
     if len(inps.file) == 1 and inps.outfile:
         return inps.outfile
@@ -243,7 +326,9 @@ def run_resample(inps):
                        SNWE=inps.SNWE, laloStep=inps.laloStep)
     res_obj.get_geometry_definition()
 
+    # Search neighbours once for all datasets of all files
     inps.nprocs = multiprocessing.cpu_count()
+    res_obj.get_resample_index(interp_method=inps.interpMethod, nprocs=inps.nprocs, index_file=inps.indexFile)
 
     # resample input files one by one
     for infile in inps.file:
@@ -251,30 +336,39 @@ def run_resample(inps):
         outfile = auto_output_filename(infile, inps)
         if inps.updateMode and not ut.update_file(outfile, [infile, inps.lookupFile]):
             print('update mode is ON, skip geocoding.')
-            return outfile
-
-        # read source data and resample
-        dsNames = readfile.get_dataset_list(infile, datasetName=inps.dset)
-        maxDigit = max([len(i) for i in dsNames])
-        dsResDict = dict()
-        for dsName in dsNames:
-            print('resampling {d:<{w}} from {f} using {n} processor cores ...'.format(
-                d=dsName, w=maxDigit, f=os.path.basename(infile), n=inps.nprocs))
-            data = readfile.read(infile, datasetName=dsName, print_msg=False)[0]
-            res_data = resample_data(data, inps, res_obj)
-            dsResDict[dsName] = res_data
+            continue
 
         # update metadata
+        dsNames = readfile.get_dataset_list(infile, datasetName=inps.dset)
         atr = readfile.read_attribute(infile, datasetName=inps.dset)
         if inps.radar2geo:
             atr = metadata_radar2geo(atr, res_obj)
         else:
             atr = metadata_geo2radar(atr, res_obj)
-        if len(dsNames) == 1 and dsName not in ['timeseries']:
+        ref_file = infile
+        if len(dsNames) == 1 and dsNames[0] not in ['timeseries']:
             atr['FILE_TYPE'] = dsNames[0]
-            infile = None
+            ref_file = None
+
+        # HDF5 file: resample block by block and write directly into the output file
+        maxDigit = max([len(i) for i in dsNames])
+        if is_block_readable(infile, dsNames):
+            layout_output_file(infile, outfile, dsNames, atr, res_obj, inps, ref_file=ref_file)
+            for dsName in dsNames:
+                print('resampling {d:<{w}} from {f} ...'.format(d=dsName, w=maxDigit, f=os.path.basename(infile)))
+                resample_dataset_block(infile, outfile, dsName, inps, res_obj)
+            print('finished writing to {}'.format(outfile))
+            continue
+
+        # read source data and resample
+        dsResDict = dict()
+        for dsName in dsNames:
+            print('resampling {d:<{w}} from {f} ...'.format(d=dsName, w=maxDigit, f=os.path.basename(infile)))
+            data = readfile.read(infile, datasetName=dsName, print_msg=False)[0]
+            res_data = resample_data(data, inps, res_obj)
+            dsResDict[dsName] = res_data
 
-        writefile.write(dsResDict, out_file=outfile, metadata=atr, ref_file=infile)
+        writefile.write(dsResDict, out_file=outfile, metadata=atr, ref_file=ref_file)
 
     m, s = divmod(time.time()-start_time, 60)
     print('\ntime used: {:02.0f} mins {:02.1f} secs\nDone.'.format(m, s))
@@ -1,52 +1,177 @@
 #!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+
 
-import os
-import sys
+import argparse
 import h5py
-import pysar.utils.utils as ut
+import numpy as np
+from pysar.objects import ifgramStack
+from pysar.utils import ptime, perf, writefile, network as pnet
 
 
 ############################################################
-USAGE = """
-usage: ifgram_closure.py  ifgram_file  [output_file]
-
-Generate closure file for interferograms.
+DESCRIPTION = """
+  Closure phase statistics of the network of interferograms for quality control,
+  calculated block by block from the sparse closure matrix C of triangles (ab + bc - ac) and
+  the unwrapped phase referenced to REF_Y/X, without storing the closure phase of each triangle:
+    meanAbsClosurePhase   : mean of absolute closure phase of valid triangles, in radian
+    numNonzeroClosure     : number of triangles with non-zero integer ambiguity, i.e. |closure| > pi
+    numTriangle           : number of valid triangles, i.e. with non-zero phase in all 3 interferograms
+    unwrapErrorLikelihood : numNonzeroClosure / numTriangle, likelihood of unwrapping errors
+"""
 
-example:
+EXAMPLE = """example:
   ifgram_closure.py  INPUTS/ifgramStack.h5
-  ifgram_closure.py  INPUTS/ifgramStack.h5  curls.h5
+  ifgram_closure.py  INPUTS/ifgramStack.h5  -o closurePhaseStat.h5  --chunk-size 50e6
+  ifgram_closure.py  INPUTS/ifgramStack.h5  --closure-file curls.h5
 """
 
+STAT_DATASET_NAMES = ['meanAbsClosurePhase',
+                      'numNonzeroClosure',
+                      'numTriangle',
+                      'unwrapErrorLikelihood']
 
-def usage():
-    print(USAGE)
-    return
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Closure phase statistics of interferograms.'+DESCRIPTION,
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+    parser.add_argument('ifgram_file', help='interferograms stack file, i.e. ifgramStack.h5')
+    parser.add_argument('-o', '--outfile', default='closurePhaseStat.h5',
+                        help='output file of closure phase statistics, default: closurePhaseStat.h5')
+    parser.add_argument('--closure-file', dest='closure_file',
+                        help='write closure phase of all triangles into this file, e.g. curls.h5')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to process per block, default: 100e6')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    return inps
 
 
 ############################################################
-def main(argv):
-    try:
-        file = argv[0]
-    except:
-        usage()
-        sys.exit(1)
-
-    h5file = h5py.File(file)
-    curls, Triangles, C = ut.get_triangles(h5file)
-
-    try:
-        curlfile = argv[1]
-    except:
-        curlfile = 'curls.h5'
-
-    if not os.path.isfile(curlfile):
-        ut.generate_curls(curlfile, h5file, Triangles, curls)
+def closure_phase_stat(closure_pha, valid):
+    """Statistics of closure phase of a group of pixels
+    Parameters: closure_pha : 2D np.array in size of (num_triangle, num_pixel), closure phase in radian
+                valid       : 2D np.array of bool in size of (num_triangle, num_pixel), valid triangles
+    Returns:    stat : dict of 1D np.array in size of (num_pixel,), with key in STAT_DATASET_NAMES
+    """
+    abs_pha = np.abs(closure_pha) * valid
+    num_tri = np.sum(valid, axis=0)
+    num_nonzero = np.sum(abs_pha > np.pi, axis=0)
+
+    stat = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat['meanAbsClosurePhase'] = np.sum(abs_pha, axis=0) / num_tri
+        stat['unwrapErrorLikelihood'] = num_nonzero / num_tri
+    stat['numNonzeroClosure'] = num_nonzero
+    stat['numTriangle'] = num_tri
+    return stat
+
+
+def write_closure_phase_stat(ifgram_file, out_file='closurePhaseStat.h5', closure_file=None, chunk_size=100e6):
+    """Calculate closure phase statistics in a single pass over ifgramStack file, block by block.
+    Parameters: ifgram_file  : str, path of ifgramStack file
+                out_file     : str, path of output closure phase statistics file
+                closure_file : str, optional, path of output closure phase file of all triangles
+                chunk_size   : float, max number of data elements to process per block
+    Returns:    out_file
+    """
+    stack_obj = ifgramStack(ifgram_file)
+    stack_obj.open(print_msg=False)
+    length, width = stack_obj.length, stack_obj.width
+    dropIfgram = stack_obj.dropIfgram
+    date12_list = stack_obj.get_date12_list(dropIfgram=True)
+    C, triangles = pnet.read_closure_matrix(ifgram_file, dropIfgram=True)
+    num_tri, num_ifgram = C.shape
+    if num_tri == 0:
+        raise ValueError('No triangle found in the network of interferograms!')
+    C_abs = abs(C)
+
+    # reference pixel, as the constant phase offset of each interferogram biases the closure phase
+    ref_phase = np.zeros((num_ifgram, 1), np.float32)
+    if 'REF_Y' in stack_obj.metadata.keys():
+        ref_y, ref_x = int(stack_obj.metadata['REF_Y']), int(stack_obj.metadata['REF_X'])
+        print('reference pixel in y/x: {}'.format((ref_y, ref_x)))
+        with h5py.File(ifgram_file, 'r') as f:
+            ref_phase = f['unwrapPhase'][:, ref_y, ref_x][dropIfgram].reshape(-1, 1)
     else:
-        print(curlfile + " already exists!")
+        print('WARNING: No REF_X/Y found, use unwrapped phase without referencing in space.')
+
+    # Output
+    meta = dict(stack_obj.metadata)
+    meta['FILE_TYPE'] = 'closurePhaseStat'
+    meta['NUM_TRIANGLE'] = str(num_tri)
+    for key in ['REF_Y', 'REF_X', 'REF_LAT', 'REF_LON', 'REF_DATE']:
+        meta.pop(key, None)
+    dsNameDict = {'meanAbsClosurePhase'   : (np.float32, (length, width), None),
+                  'numNonzeroClosure'     : (np.int32,   (length, width), None),
+                  'numTriangle'           : (np.int32,   (length, width), None),
+                  'unwrapErrorLikelihood' : (np.float32, (length, width), None)}
+    writefile.layout_hdf5(out_file, dsNameDict, metadata=meta)
+
+    if closure_file:
+        # date of triangles in a, b, c
+        tri_dates = [date12_list[i[0]].split('_') + [date12_list[i[1]].split('_')[1]] for i in triangles]
+        meta['FILE_TYPE'] = 'closurePhase'
+        meta['UNIT'] = 'radian'
+        dsNameDict = {'date'         : (np.string_, (num_tri, 3), np.array(tri_dates, np.string_)),
+                      'closurePhase' : (np.float32, (num_tri, length, width), None)}
+        writefile.layout_hdf5(closure_file, dsNameDict, metadata=meta)
+
+    # split in rows, with memory of phase, closure phase and valid flag
+    r_step = max(int(chunk_size / ((num_ifgram + num_tri * 2) * width)), 1)
+    with h5py.File(ifgram_file, 'r') as f:
+        ds = f['unwrapPhase']
+        prog_bar = ptime.progressBar(maxValue=length)
+        for r0 in range(0, length, r_step):
+            r1 = min(r0 + r_step, length)
+            with perf.phase('read'):
+                data = ds[:, r0:r1, :][dropIfgram].reshape(num_ifgram, -1)
 
-    return curlfile
+            with perf.phase('compute'):
+                # triangles with zero/nan value in any interferogram are invalid
+                invalid = np.logical_or(data == 0., np.isnan(data)).astype(np.float32)
+                valid = C_abs.dot(invalid) == 0
+                data -= ref_phase
+                data[invalid != 0] = 0.
+                closure_pha = C.dot(data)
+                stat = closure_phase_stat(closure_pha, valid)
+
+            with perf.phase('write'):
+                for dsName in STAT_DATASET_NAMES:
+                    writefile.write_hdf5_block(out_file, stat[dsName].reshape(r1-r0, width),
+                                               datasetName=dsName,
+                                               block=[r0, r1, 0, width],
+                                               print_msg=False)
+                if closure_file:
+                    writefile.write_hdf5_block(closure_file, closure_pha.reshape(num_tri, r1-r0, width),
+                                               datasetName='closurePhase',
+                                               block=[0, num_tri, r0, r1, 0, width],
+                                               print_msg=False)
+            prog_bar.update(r1, suffix='line {}'.format(r1))
+        prog_bar.close()
+    print('finished writing to file: {}'.format(out_file))
+    return out_file
+
+
+############################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    write_closure_phase_stat(inps.ifgram_file,
+                             out_file=inps.outfile,
+                             closure_file=inps.closure_file,
+                             chunk_size=inps.chunk_size)
+    return inps.outfile
 
 
 ############################################################
 if __name__ == '__main__':
-    main(sys.argv[1:])
+    main()
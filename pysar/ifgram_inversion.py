@@ -17,7 +17,7 @@ import h5py
 import numpy as np
 from scipy.special import gamma
 from pysar.objects import ifgramStack, timeseries
-from pysar.utils import readfile, writefile, ptime, utils as ut
+from pysar.utils import readfile, writefile, ptime, perf, utils as ut
 
 key_prefix = 'pysar.networkInversion.'
 
@@ -764,16 +764,17 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, weight_func='f
     num_inv_ifgram = np.zeros(num_pixel, np.int16)
 
     # Read/Mask unwrapPhase
-    pha_data = read_unwrap_phase(stack_obj,
-                                 box,
-                                 ref_phase,
-                                 skip_zero_phase=skip_zero_phase)
-
-    pha_data = mask_unwrap_phase(pha_data,
-                                 stack_obj,
-                                 box,
-                                 mask_ds_name=mask_dataset_name,
-                                 mask_threshold=mask_threshold)
+    with perf.phase('read'):
+        pha_data = read_unwrap_phase(stack_obj,
+                                     box,
+                                     ref_phase,
+                                     skip_zero_phase=skip_zero_phase)
+
+        pha_data = mask_unwrap_phase(pha_data,
+                                     stack_obj,
+                                     box,
+                                     mask_ds_name=mask_dataset_name,
+                                     mask_threshold=mask_threshold)
 
     # Mask for pixels to invert
     mask = np.ones(num_pixel, np.bool_)
@@ -784,9 +785,10 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, weight_func='f
         dsNames = readfile.get_dataset_list(water_mask_file)
         dsName = [i for i in dsNames
                   if i in ['waterMask', 'mask']][0]
-        waterMask = readfile.read(water_mask_file,
-                                  datasetName=dsName,
-                                  box=box)[0].flatten()
+        with perf.phase('read'):
+            waterMask = readfile.read(water_mask_file,
+                                      datasetName=dsName,
+                                      box=box)[0].flatten()
         mask *= np.array(waterMask, np.bool_)
         del waterMask
 
@@ -866,7 +868,8 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, weight_func='f
 
     # Inversion - WLS
     else:
-        weight = read_coherence2weight(stack_obj, box=box, weight_func=weight_func)
+        with perf.phase('read'):
+            weight = read_coherence2weight(stack_obj, box=box, weight_func=weight_func)
 
         # Converting to 32 bit floats leads to 2X speedup
         # (comment it out as we now convert it beforehand)
@@ -902,7 +905,8 @@ def ifgram_inversion_patch(ifgram_file, box=None, ref_phase=None, weight_func='f
         metadata = dict(stack_obj.metadata)
         metadata[key_prefix+'weightFunc'] = weight_func
         suffix = re.findall('_\d{3}', ifgram_file)[0]
-        write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std, num_inv_ifgram, suffix)
+        with perf.phase('write'):
+            write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std, num_inv_ifgram, suffix)
         return
     else:
         return ts, temp_coh, ts_std, num_inv_ifgram
@@ -992,7 +996,8 @@ def ifgram_inversion(ifgram_file='ifgramStack.h5', inps=None):
         # metadata
         metadata = dict(stack_obj.metadata)
         metadata[key_prefix+'weightFunc'] = inps.weightFunc
-        write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std, num_inv_ifgram, suffix='')
+        with perf.phase('write'):
+            write2hdf5_file(ifgram_file, metadata, ts, temp_coh, ts_std, num_inv_ifgram, suffix='')
 
     m, s = divmod(time.time()-start_time, 60)
     print('\ntime used: {:02.0f} mins {:02.1f} secs\nDone.'.format(m, s))
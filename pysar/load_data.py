@@ -16,7 +16,7 @@ import time
 from pysar.defaults import auto_path
 from pysar.objects import ifgramDatasetNames, geometryDatasetNames, ifgramStack, geometry, sensor
 from pysar.objects.insarobj import ifgramDict, ifgramStackDict, geometryDict
-from pysar.utils import readfile, ptime, utils as ut
+from pysar.utils import readfile, ptime, h5compress, utils as ut
 from pysar import subset
 
 
@@ -51,6 +51,7 @@ TEMPLATE = """template:
 ## load_data.py -H to check more details and example inputs.
 pysar.load.processor      = auto  #[isce,roipac,gamma,], auto for isce
 pysar.load.updateMode     = auto  #[yes / no], auto for yes, skip re-loading if HDF5 files are complete
+pysar.load.compression    = auto  #[gzip / lzf / auto_size / auto_speed / no], auto for no.
 ##---------interferogram datasets:
 pysar.load.unwFile        = auto  #[path2unw_file]
 pysar.load.corFile        = auto  #[path2cor_file]
@@ -102,8 +103,11 @@ def create_parser():
                         help='InSAR processor/software of the file', default='isce')
     parser.add_argument('--enforce', '-f', dest='updateMode', action='store_false',
                         help='Disable the update mode, or skip checking dataset already loaded.')
-    parser.add_argument('--compression', choices={'gzip', 'lzf', None}, default=None,
-                        help='compress loaded geometry while writing HDF5 file, default: None.')
+    parser.add_argument('--compression', choices=h5compress.COMPRESSION_CHOICES, default=None,
+                        help='compress loaded geometry while writing HDF5 file, default: None,\n'
+                             'or the value of environment variable $PYSAR_COMPRESSION if set.\n'
+                             'auto_size   - benchmark filters and use the one with min file size\n'
+                             'auto_speed  - benchmark filters and use the one with max read speed')
 
     parser.add_argument('-o', '--output', type=str, nargs=3, dest='outfile',
                         default=['./INPUTS/ifgramStack.h5',
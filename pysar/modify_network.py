@@ -11,8 +11,7 @@ import sys
 import argparse
 import h5py
 import numpy as np
-from matplotlib import pyplot as plt, dates as mdates
-from pysar.utils import readfile, ptime, utils as ut, network as pnet, plot as pp
+from pysar.utils import readfile, ptime, utils as ut, network as pnet
 from pysar.objects import ifgramStack
 import pysar.subset as subset
 
@@ -233,6 +232,8 @@ def manual_select_pairs_to_remove(stackFile):
     print('2) repeat until you select all pairs you would like to remove')
     print('3) close the figure to continue the program ...')
     print('-------------------------------------------------------------\n')
+    from matplotlib import pyplot as plt, dates as mdates
+    from pysar.utils import plot as pp
     obj = ifgramStack(stackFile)
     obj.open()
     date12ListAll = obj.date12List
@@ -11,14 +11,24 @@ import sys
 import re
 import argparse
 import warnings
+import h5py
 import numpy as np
-from pysar.utils import readfile, writefile, ptime, utils as ut
+from pysar.utils import readfile, writefile, perf, blockwise, utils as ut
 
 
 ##################################################################################################
+# wrapped phase, averaged coherently in complex domain
+WRAP_PHASE_DATASET_NAMES = ['wrapPhase']
+WRAP_PHASE_FILE_EXTS = ['.int', '.flat']
+
+# datasets weighted by coherence with --method weighted
+WEIGHT_DATASET_NAMES = ['unwrapPhase', 'wrapPhase']
+
 EXAMPLE = """example:
   multilook.py  velocity.h5  15 15
   multilook.py  srtm30m.dem  10 10  -o srtm30m_300m.dem
+  multilook.py  ifgramStack.h5  10 10  --num-worker 4
+  multilook.py  ifgramStack.h5  10 10  --method weighted
 
   To interpolate input file into larger size file:
   multilook.py  bperp.rdr  -10 -2 -o bperp_full.rdr
@@ -37,8 +47,18 @@ def create_parser():
                         help='number of multilooking in range  /x direction')
     parser.add_argument('-o', '--outfile',
                         help='Output file name. Disabled when more than 1 input files')
+    parser.add_argument('--method', dest='method', choices=['mean', 'weighted'], default='mean',
+                        help='multilook method, default: mean\n' +
+                             'mean     : nan-mean\n' +
+                             'weighted : coherence-weighted mean for {} of ifgramStack file\n'.format(WEIGHT_DATASET_NAMES) +
+                             'Wrapped phase is always averaged coherently in complex domain.\n' +
+                             'Integer / bool data, e.g. connectComponent and mask, use the center sample of each look.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to read per block, default: 100e6')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of blocks to process in parallel, default: 1.')
     parser.add_argument('--no-parallel', dest='parallel', action='store_false', default=True,
-                        help='Disable parallel processing. Diabled auto for 1 input file.')
+                        help='Disable parallel processing, same as --num-worker 1.')
     return parser
 
 
@@ -46,6 +66,8 @@ def cmd_line_parse(iargs=None):
     parser = create_parser()
     inps = parser.parse_args(args=iargs)
     inps.file = ut.get_file_list(inps.file)
+    if not inps.parallel:
+        inps.numWorker = 1
     return inps
 
 
@@ -80,32 +102,51 @@ def multilook_matrix(matrix, lks_y, lks_x):
     return matrix_mli
 
 
-def multilook_data(data, lksY, lksX):
+def multilook_data(data, lksY, lksX, method='mean', weight=None):
     """Modified from Praveen on StackOverflow:
     https://stackoverflow.com/questions/34689519/how-to-coarser-the-2-d-array-data-resolution
-    Parameters: data : 2D / 3D np.array
-                lksY : int, number of multilook in y/azimuth direction
-                lksX : int, number of multilook in x/range direction
+    Parameters: data   : 2D / 3D np.array
+                lksY   : int, number of multilook in y/azimuth direction
+                lksX   : int, number of multilook in x/range direction
+                method : str, mean     - nan-mean
+                              complex  - coherent average for wrapped phase in radian (or complex data),
+                                         i.e. phase of the (weighted) mean of exp(1j*phase)
+                              weighted - weighted nan-mean
+                              nearest  - center sample of each look, keeping the data type, for labels / masks
+                weight : np.array in the same shape as data, e.g. coherence, for complex / weighted method
     Returns:    coarseData : 2D / 3D np.array after multilooking in last two dimension
     """
-    shape = np.array(data.shape, dtype=float)
-    if len(shape) == 2:
-        newShape = np.floor(shape / (lksY, lksX)).astype(int) * (lksY, lksX)
-        cropData = data[:newShape[0], :newShape[1]]
-        temp = cropData.reshape((newShape[0] // lksY, lksY,
-                                 newShape[1] // lksX, lksX))
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            coarseData = np.nanmean(temp, axis=(1, 3))
-    elif len(shape) == 3:
-        newShape = np.floor(shape / (1, lksY, lksX)).astype(int) * (1, lksY, lksX)
-        cropData = data[:newShape[0], :newShape[1], :newShape[2]]
-        temp = cropData.reshape((newShape[0],
-                                 newShape[1] // lksY, lksY,
-                                 newShape[2] // lksX, lksX))
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore", category=RuntimeWarning)
-            coarseData = np.nanmean(temp, axis=(2, 4))
+    shape = np.array(data.shape, dtype=int)
+    newShape = shape[-2:] // (lksY, lksX)
+    cropShape = tuple(shape[:-2]) + tuple(newShape * (lksY, lksX))
+    slices = tuple(slice(0, i) for i in cropShape)
+    lookShape = tuple(shape[:-2]) + (newShape[0], lksY, newShape[1], lksX)
+    axis = (-3, -1)
+
+    temp = data[slices].reshape(lookShape)
+    if weight is not None:
+        weight = weight[slices].reshape(lookShape)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        if method == 'nearest':
+            coarseData = temp[..., lksY // 2, :, lksX // 2]
+
+        elif method == 'complex':
+            cpx = temp if np.iscomplexobj(temp) else np.exp(1j * temp)
+            if weight is not None:
+                cpx = cpx * weight
+            coarseData = np.nanmean(cpx, axis=axis)
+            if not np.iscomplexobj(data):
+                coarseData = np.angle(coarseData).astype(data.dtype)
+
+        elif method == 'weighted' and weight is not None:
+            weight = weight * ~np.isnan(temp)
+            coarseData = np.nansum(temp * weight, axis=axis) / np.nansum(weight, axis=axis)
+            coarseData = coarseData.astype(data.dtype)
+
+        else:
+            coarseData = np.nanmean(temp, axis=axis)
     return coarseData
 
 
@@ -161,7 +202,102 @@ def multilook_attribute(atr_dict, lks_y, lks_x, print_msg=True):
     return atr
 
 
-def multilook_file(infile, lks_y, lks_x, outfile=None):
+def get_multilook_method(dsName, method='mean', ext=None, dtype=None):
+    """Multilook method and weight dataset name of the input dataset"""
+    if dtype is not None and np.dtype(dtype).kind in ['b', 'i', 'u']:
+        # integer labels / bool masks, e.g. connectComponent, are not averaged
+        return 'nearest', None
+    if dsName in WRAP_PHASE_DATASET_NAMES or ext in WRAP_PHASE_FILE_EXTS:
+        ml_method = 'complex'
+    else:
+        ml_method = method
+    weight_dsName = 'coherence' if method == 'weighted' and dsName in WEIGHT_DATASET_NAMES else None
+    return ml_method, weight_dsName
+
+
+def multilook_block(infile, dsName, block, lks_y, lks_x, method='mean', weight_dsName=None):
+    """Read and multilook one block of dataset from HDF5 file
+    Parameters: block : list of 4 int, [z0, z1, y0, y1], z0/z1 is None for 2D dataset
+    Returns:    data  : 2D/3D np.array, multilooked data
+                block : list of 4 int, input block
+    """
+    z0, z1, y0, y1 = block
+    with h5py.File(infile, 'r') as f:
+        ds = f[dsName]
+        x1 = ds.shape[-1] - ds.shape[-1] % lks_x
+        if ds.ndim == 3:
+            slices = (slice(z0, z1), slice(y0, y1), slice(0, x1))
+        else:
+            slices = (slice(y0, y1), slice(0, x1))
+        with perf.phase('read'):
+            data = ds[slices]
+            weight = f[weight_dsName][slices] if weight_dsName else None
+    with perf.phase('compute'):
+        data = multilook_data(data, lks_y, lks_x, method=method, weight=weight)
+    return data, block
+
+
+def multilook_hdf5_file(infile, lks_y, lks_x, outfile, method='mean', chunk_size=100e6, num_worker=1):
+    """Multilook HDF5 file with datasets in the root level, block by block
+    Parameters: infile/outfile : str, input / output HDF5 file
+                lks_y/x        : int, number of looks in y / x direction
+                method         : str, mean or weighted (by coherence)
+                chunk_size     : float, max number of data elements to read per block
+                num_worker     : int, number of blocks to process in parallel
+    Returns:    outfile
+    """
+    atr = readfile.read_attribute(infile)
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    length_mli, width_mli = length // lks_y, width // lks_x
+    dsNames = readfile.get_dataset_list(infile)
+
+    # layout output file: multilook 2D/3D datasets, copy the others, e.g. date, bperp
+    dsNameDict = dict()
+    ds_shape_dict = dict()
+    ds_dtype_dict = dict()
+    with h5py.File(infile, 'r') as f:
+        for key in f.keys():
+            ds = f[key]
+            if not isinstance(ds, h5py.Dataset):
+                continue
+            if key in dsNames:
+                ds_shape_dict[key] = ds.shape
+                ds_dtype_dict[key] = ds.dtype
+                dsNameDict[key] = (ds.dtype, ds.shape[:-2] + (length_mli, width_mli), None)
+            else:
+                dsNameDict[key] = (ds.dtype, ds.shape, ds[:])
+        weight_exists = 'coherence' in f.keys() and atr['FILE_TYPE'] == 'ifgramStack'
+    atr = multilook_attribute(atr, lks_y, lks_x)
+    writefile.layout_hdf5(outfile, dsNameDict, metadata=atr)
+
+    # list of tasks: dataset and block
+    task_list = []
+    for dsName in dsNames:
+        ml_method, weight_dsName = get_multilook_method(dsName, method, dtype=ds_dtype_dict[dsName])
+        if weight_dsName and not weight_exists:
+            weight_dsName = None
+        num_ds = 2 if weight_dsName else 1
+        ds_shape = ds_shape_dict[dsName]
+        ds_shape = ds_shape[:-2] + (ds_shape[-2] - ds_shape[-2] % lks_y, ds_shape[-1])
+        for block in blockwise.split2blocks(ds_shape, chunk_size=chunk_size, num_copy=num_ds, multiple=lks_y):
+            task_list.append((infile, dsName, block, lks_y, lks_x, ml_method, weight_dsName))
+    print('multilooking {} datasets in {} blocks ...'.format(len(dsNames), len(task_list)))
+
+    def write_block(task, result):
+        data, (z0, z1, y0, y1) = result
+        out_block = [y0 // lks_y, y1 // lks_y, 0, width_mli]
+        if z0 is not None:
+            out_block = [z0, z1] + out_block
+        with perf.phase('write'):
+            writefile.write_hdf5_block(outfile, data, datasetName=task[1], block=out_block, print_msg=False)
+
+    blockwise.run_tasks(multilook_block, task_list, write_block, num_worker=num_worker,
+                        suffix=lambda task: task[1])
+    print('finished writing to file: {}'.format(outfile))
+    return outfile
+
+
+def multilook_file(infile, lks_y, lks_x, outfile=None, method='mean', chunk_size=100e6, num_worker=1):
     lks_y = int(lks_y)
     lks_x = int(lks_x)
 
@@ -171,6 +307,7 @@ def multilook_file(infile, lks_y, lks_x, outfile=None):
     print('multilooking {} {} file: {}'.format(atr['PROCESSOR'], k, infile))
     print('number of looks in y / azimuth direction: %d' % lks_y)
     print('number of looks in x / range   direction: %d' % lks_x)
+    print('multilook method: {}'.format(method))
 
     # output file name
     if not outfile:
@@ -181,7 +318,15 @@ def multilook_file(infile, lks_y, lks_x, outfile=None):
             outfile = os.path.basename(infile)
     #print('writing >>> '+outfile)
 
+    # HDF5 file: block by block
+    if readfile.is_root_hdf5_file(infile):
+        return multilook_hdf5_file(infile, lks_y, lks_x, outfile,
+                                   method=method,
+                                   chunk_size=chunk_size,
+                                   num_worker=num_worker)
+
     # read source data and multilooking
+    ext = os.path.splitext(infile)[1].lower()
     dsNames = readfile.get_dataset_list(infile)
     maxDigit = max([len(i) for i in dsNames])
     dsDict = dict()
@@ -189,7 +334,8 @@ def multilook_file(infile, lks_y, lks_x, outfile=None):
         print('multilooking {d:<{w}} from {f} ...'.format(
             d=dsName, w=maxDigit, f=os.path.basename(infile)))
         data = readfile.read(infile, datasetName=dsName, print_msg=False)[0]
-        data = multilook_data(data, lks_y, lks_x)
+        ml_method = get_multilook_method(dsName, method, ext, dtype=data.dtype)[0]
+        data = multilook_data(data, lks_y, lks_x, method=ml_method)
         dsDict[dsName] = data
     atr = multilook_attribute(atr, lks_y, lks_x)
     writefile.write(dsDict, out_file=outfile, metadata=atr, ref_file=infile)
@@ -201,7 +347,11 @@ def main(iargs=None):
     inps = cmd_line_parse(iargs)
 
     for infile in inps.file:
-        multilook_file(infile, inps.lks_y, inps.lks_x)
+        multilook_file(infile, inps.lks_y, inps.lks_x,
+                       outfile=inps.outfile if len(inps.file) == 1 else None,
+                       method=inps.method,
+                       chunk_size=inps.chunk_size,
+                       num_worker=inps.numWorker)
 
     print('Done.')
     return
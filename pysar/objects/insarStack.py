@@ -3,7 +3,6 @@
 import os
 import sys
 import h5py
-import insarPair as insarPair
 from numpy import median, float32, complex64, vstack
 
 chunk_shape = (128, 128)
@@ -159,7 +158,7 @@ class insarStack:
 
     def addDatasets(self, platTrack, fileList, nameList, bands):
         # appends a list of 2D or 3D datsets to the geometry group. Can be lat.rdr, lon.rdr, z.rdr, los.rdr, a mask file, etc
-        import reader
+        from pysar.objects import reader
         if fileList is not None:
             self.h5file = h5py.File(self.output, 'a')
 
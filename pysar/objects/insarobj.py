@@ -14,7 +14,7 @@ import warnings
 import h5py
 import numpy as np
 from skimage.transform import resize
-from pysar.utils import readfile, ptime, utils as ut
+from pysar.utils import readfile, ptime, h5compress, utils as ut
 from pysar.objects import ifgramDatasetNames, geometryDatasetNames, dataTypeDict
 
 BOOL_ZERO = np.bool_(0)
@@ -95,9 +95,11 @@ class ifgramStackDict:
         Parameters: outputFile : str, Name of the HDF5 file for the InSAR stack
                     access_mode : str, access mode of output File, e.g. w, r+
                     box : tuple, subset range in (x0, y0, x1, y1)
+                    compression : str, None, lzf, gzip, auto_size, auto_speed
                     extra_metadata : dict, extra metadata to be added into output file
         Returns:    outputFile
         '''
+        compression = h5compress.check_compression(compression)
 
         self.outputFile = outputFile
         f = h5py.File(self.outputFile, access_mode)
@@ -120,18 +122,26 @@ class ifgramStackDict:
             dsDataType = dataType
             if dsName in ['connectComponent']:
                 dsDataType = np.bool_
+
+            # benchmark compression filters on the 1st interferogram for auto options
+            sample = None
+            if compression and compression.startswith('auto'):
+                ifgramObj = self.pairsDict[self.pairs[0]]
+                sample = np.array(ifgramObj.read(dsName, box=box)[0], dtype=dsDataType)
+            kwargs = h5compress.get_compression_kwargs(compression, sample)
+
             print(('create dataset /{d:<{w}} of {t:<25} in size of {s}'
                    ' with compression = {c}').format(d=dsName,
                                                      w=maxDigit,
                                                      t=str(dsDataType),
                                                      s=dsShape,
-                                                     c=str(compression)))
+                                                     c=h5compress.filter2str(kwargs)))
             ds = f.create_dataset(dsName,
                                   shape=dsShape,
                                   maxshape=(None, dsShape[1], dsShape[2]),
                                   dtype=dsDataType,
                                   chunks=True,
-                                  compression=compression)
+                                  **kwargs)
 
             #dMin = 0
             #dMax = 0
@@ -416,6 +426,7 @@ class geometryDict:
         if len(self.datasetDict) == 0:
             print('No dataset file path in the object, skip HDF5 file writing.')
             return None
+        compression = h5compress.check_compression(compression)
 
         self.outputFile = outputFile
         f = h5py.File(self.outputFile, access_mode)
@@ -437,18 +448,28 @@ class geometryDict:
                 dsDataType = dataType
                 self.numDate = len(self.dateList)
                 dsShape = (self.numDate, length, width)
+
+                # benchmark compression filters on the 1st date for auto options
+                sample = None
+                if compression and compression.startswith('auto'):
+                    fname = self.datasetDict[dsName][self.dateList[0]]
+                    sample = np.array(read_isce_bperp_file(fname=fname,
+                                                           out_shape=(self.length, self.width),
+                                                           box=box), dtype=dsDataType)
+                kwargs = h5compress.get_compression_kwargs(compression, sample)
+
                 ds = f.create_dataset(dsName,
                                       shape=dsShape,
                                       maxshape=(None, dsShape[1], dsShape[2]),
                                       dtype=dsDataType,
                                       chunks=True,
-                                      compression=compression)
+                                      **kwargs)
                 print(('create dataset /{d:<{w}} of {t:<25} in size of {s}'
                        ' with compression = {c}').format(d=dsName,
                                                          w=maxDigit,
                                                          t=str(dsDataType),
                                                          s=dsShape,
-                                                         c=str(compression)))
+                                                         c=h5compress.filter2str(kwargs)))
 
                 print('read coarse grid baseline files and linear interpolate into full resolution ...')
                 prog_bar = ptime.progressBar(maxValue=self.numDate)
@@ -479,17 +500,18 @@ class geometryDict:
                 if dsName.lower().endswith('mask'):
                     dsDataType = np.bool_
                 dsShape = (length, width)
+                data = np.array(self.read(family=dsName, box=box)[0], dtype=dsDataType)
+                kwargs = h5compress.get_compression_kwargs(compression, data)
                 print(('create dataset /{d:<{w}} of {t:<25} in size of {s}'
                        ' with compression = {c}').format(d=dsName,
                                                          w=maxDigit,
                                                          t=str(dsDataType),
                                                          s=dsShape,
-                                                         c=str(compression)))
-                data = np.array(self.read(family=dsName, box=box)[0], dtype=dsDataType)
+                                                         c=h5compress.filter2str(kwargs)))
                 ds = f.create_dataset(dsName,
                                       data=data,
                                       chunks=True,
-                                      compression=compression)
+                                      **kwargs)
 
         ###############################
         # Generate Dataset if not existed in binary file: incidenceAngle, slantRangeDistance
@@ -506,17 +528,18 @@ class geometryDict:
             if data is not None:
                 dsShape = data.shape
                 dsDataType = dataType
+                kwargs = h5compress.get_compression_kwargs(compression, data)
                 print(('create dataset /{d:<{w}} of {t:<25} in size of {s}'
                        ' with compression = {c}').format(d=dsName,
                                                          w=maxDigit,
                                                          t=str(dsDataType),
                                                          s=dsShape,
-                                                         c=str(compression)))
+                                                         c=h5compress.filter2str(kwargs)))
                 ds = f.create_dataset(dsName,
                                       data=data,
                                       dtype=dataType,
                                       chunks=True,
-                                      compression=compression)
+                                      **kwargs)
 
         ###############################
         # Attributes
@@ -9,8 +9,8 @@ import argparse
 import configparser
 import datetime
 import time
-from insarPair import insarPair
-from insarStack import insarStack
+from pysar.objects.insarPair import insarPair
+from pysar.objects.insarStack import insarStack
 
 
 #################################################################
@@ -15,6 +15,12 @@ import time
 from datetime import datetime as dt
 import h5py
 import numpy as np
+from pysar.utils import h5compress
+
+# cache of design matrices, shared by all steps running within the same Python process, e.g. pysarApp.py
+# key: (tuple of date12, reference date), value: (A, B)
+design_matrix_cache = {}
+DESIGN_MATRIX_CACHE_SIZE = 8
 
 BOOL_ZERO = np.bool_(0)
 INT_ZERO = np.int16(0)
@@ -64,6 +70,13 @@ ifgramDatasetNames = ['unwrapPhase',
                       'azimuthOffset',
                       'refPhase']
 
+# reference value of each slice, subtracted on the fly while reading, see reference_point.py --virtual
+refValueDatasetName = 'refValue'
+
+# closure triangles of the network of interferograms, cached in closureTriangle.h5 next to ifgramStack.h5,
+# see pysar.utils.network.read_closure_matrix()
+closureDatasetName = 'closureTriangle'
+
 datasetUnitDict = {'unwrapPhase'        :'radian',
                    'coherence'          :'1',
                    'connectComponent'   :'1',
@@ -113,6 +126,8 @@ Attributes       Dictionary for metadata
 /timeseries      3D array of float32 in size of (n, l, w) in meter.
 /date            1D array of string  in size of (n,     ) in YYYYMMDD format
 /bperp           1D array of float32 in size of (n,     ) in meter. (optional)
+/refValue        1D array of float32 in size of (n,     ) in meter, value of the reference pixel,
+                 subtracted from timeseries while reading. (optional)
 """
 
 class timeseries:
@@ -223,10 +238,15 @@ class timeseries:
                 box = [0, 0, self.width, self.length]
 
             data = ds[dateFlag, box[1]:box[3], box[0]:box[2]]
+
+            # virtual referencing
+            if refValueDatasetName in f.keys():
+                data -= f[refValueDatasetName][:][dateFlag].reshape(-1, 1, 1)
             data = np.squeeze(data)
         return data
 
-    def write2hdf5(self, data, outFile=None, dates=None, bperp=None, metadata=None, refFile=None):
+    def write2hdf5(self, data, outFile=None, dates=None, bperp=None, metadata=None, refFile=None,
+                   compression=None):
         """
         Parameters: data  : 3D array of float32
                     dates : 1D array/list of string in YYYYMMDD format
@@ -234,6 +254,7 @@ class timeseries:
                     metadata : dict
                     outFile : string
                     refFile : string
+                    compression : string, None, lzf, gzip, auto_size, auto_speed
         Returns: outFile : string
         Examples:
             from pysar.objects import timeseries
@@ -266,8 +287,10 @@ class timeseries:
         # 3D dataset - timeseries
         print('create timeseries HDF5 file: {} with w mode'.format(outFile))
         f = h5py.File(outFile, 'w')
-        print('create dataset /timeseries of {:<10} in size of {}'.format(str(data.dtype), data.shape))
-        dset = f.create_dataset('timeseries', data=data, chunks=True)
+        kwargs = h5compress.get_compression_kwargs(compression, data)
+        print('create dataset /timeseries of {:<10} in size of {} with compression = {}'.format(
+            str(data.dtype), data.shape, h5compress.filter2str(kwargs)))
+        dset = f.create_dataset('timeseries', data=data, chunks=True, **kwargs)
 
         # 1D dataset - date / bperp
         print('create dataset /dates      of {:<10} in size of {}'.format(str(dates.dtype), dates.shape))
@@ -499,6 +522,8 @@ Attributes         Dictionary for metadata
 /wrapPhase         3D array of float32 in size of (m, l, w) in radian. (optional)
 /rangeOffset       3D array of float32 in size of (m, l, w).           (optional)
 /azimuthOffset     3D array of float32 in size of (m, l, w).           (optional)
+/refValue          1D array of float32 in size of (m,     ) in radian, unwrapPhase of the reference pixel,
+                   subtracted from unwrapPhase while reading.          (optional)
 """
 
 class ifgramStack:
@@ -627,6 +652,10 @@ class ifgramStack:
                 box = (0, 0, self.width, self.length)
 
             data = ds[dateFlag, box[1]:box[3], box[0]:box[2]]
+
+            # virtual referencing
+            if familyName == 'unwrapPhase' and refValueDatasetName in f.keys():
+                data -= f[refValueDatasetName][:][dateFlag].reshape(-1, 1, 1)
             data = np.squeeze(data)
         return data
 
@@ -771,6 +800,15 @@ class ifgramStack:
         mDates = [i.split('_')[0] for i in date12List]
         sDates = [i.split('_')[1] for i in date12List]
         dateList = sorted(list(set(mDates + sDates)))
+        if not refDate:
+            refDate = dateList[0]
+
+        # use cached design matrix of the same network
+        cache_key = (tuple(date12List), refDate)
+        if cache_key in design_matrix_cache.keys():
+            A, B = design_matrix_cache[cache_key]
+            return np.array(A), np.array(B)
+
         dates = [dt(*time.strptime(i, "%Y%m%d")[0:5]) for i in dateList]
         tbase = np.array([(i - dates[0]).days for i in dates], np.float32) / 365.25
         numIfgram = len(date12List)
@@ -786,12 +824,14 @@ class ifgramStack:
             B[i, m_idx:s_idx] = tbase[m_idx+1:s_idx+1] - tbase[m_idx:s_idx]
 
         # Remove reference date as it can not be resolved
-        if not refDate:
-            refDate = dateList[0]
         refIndex = dateList.index(refDate)
         A = np.hstack((A[:, 0:refIndex], A[:, (refIndex+1):]))
         B = B[:, :-1]
-        return A, B
+
+        if len(design_matrix_cache) >= DESIGN_MATRIX_CACHE_SIZE:
+            design_matrix_cache.pop(next(iter(design_matrix_cache)))
+        design_matrix_cache[cache_key] = (A, B)
+        return np.array(A), np.array(B)
 
     def get_perp_baseline_timeseries(self, dropIfgram=True):
         """Get spatial perpendicular baseline in timeseries from ifgramStack, ignoring dropped ifgrams"""
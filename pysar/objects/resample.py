@@ -7,7 +7,9 @@
 #     from pysar.objects.resample import resample
 
 
+import os
 import sys
+import h5py
 import numpy as np
 import multiprocessing
 try:
@@ -24,6 +26,13 @@ class resample:
     Example:
         resObj = resample(lookupFile='./INPUTS/geometryRadar.h5')
         resObj = resample(lookupFile='./INPUTS/geometryGeo.h5', dataFile='velocity.h5')
+
+    The neighbour search is done once and saved as the resampling index, which is applied to all
+    2D slices of all files with the same source grid by fancy indexing, and could be saved into /
+    read from HDF5 file to skip the search for later products of the same stack:
+        resObj.get_geometry_definition()
+        resObj.get_resample_index(interp_method='nearest', index_file='./INPUTS/resampleIndex.h5')
+        dest_data = resObj.resample(src_data)
     """
 
     def __init__(self, lookupFile, dataFile=None, SNWE=None, laloStep=None):
@@ -31,6 +40,8 @@ class resample:
         self.dataFile = dataFile
         self.SNWE = SNWE
         self.laloStep = laloStep
+        self.index = None
+        self.lut_yx = None
 
     def get_geometry_definition(self):
         self.lut_metadata = readfile.read_attribute(self.file)
@@ -41,7 +52,8 @@ class resample:
             self.get_geometry_definition4geo_lookup_table()
         else:
             self.get_geometry_definition4radar_lookup_table()
-        self.length, self.width = self.dest_def.lats.shape
+            self.src_shape = tuple(self.src_def.shape)
+            self.length, self.width = self.dest_def.lats.shape
 
     def get_geometry_definition4radar_lookup_table(self):
         """Get src_def and dest_def for lookup table from ISCE, DORIS"""
@@ -125,17 +137,11 @@ class resample:
         self.dest_def = pr.geometry.GridDefinition(lons=dest_lon, lats=dest_lat)
 
     def get_geometry_definition4geo_lookup_table(self):
-        """Get src_def and dest_def for lookup table from Gamma and ROI_PAC."""
-        def project_yx2lalo(yy, xx, SNWE, laloStep=None):
-            """scale/project coordinates in pixel number into lat/lon based on bbox and step"""
-
-            lats = SNWE[1] + yy * laloStep[0]
-            lons = SNWE[2] + xx * laloStep[1]
-            lats[np.isnan(lats)] = 90.
-            lats[np.isnan(lons)] = 90.
-            lons[lats == 90.] = 0
-            return lats, lons
+        """Get the output grid for lookup table from Gamma and ROI_PAC.
 
+        The lookup table gives the radar coordinates of each pixel in geo coordinates,
+        thus the resampling index is calculated from it directly, without neighbour search.
+        """
         # radar2geo
         if 'Y_FIRST' not in self.src_metadata.keys():
             lat0 = float(self.lut_metadata['Y_FIRST'])
@@ -158,43 +164,41 @@ class resample:
                              lat0,
                              lon0,
                              lon0 + lon_step * lon_num)
-                dest_box = None
-            else:
-                dest_box = ((self.SNWE[2] - lon0) / lon_step, (self.SNWE[1] - lat0) / lat_step,
-                            (self.SNWE[3] - lon0) / lon_step, (self.SNWE[0] - lat0) / lat_step,)
             print('output area extent in (S N W E) in degree: {}'.format(self.SNWE))
-
-            # src_y/x
-            length = int(self.src_metadata['LENGTH'])
-            width = int(self.src_metadata['WIDTH'])
-            src_y, src_x = np.mgrid[0:length-1:length*1j, 0:width-1:width*1j]
-
-            # dest_y/x
-            dest_y = readfile.read(self.file, datasetName='azimuthCoord', box=dest_box)[0]
-            dest_x = readfile.read(self.file, datasetName='rangeCoord', box=dest_box)[0]
+            self.length = int(np.rint((self.SNWE[0] - self.SNWE[1]) / self.laloStep[0]))
+            self.width = int(np.rint((self.SNWE[3] - self.SNWE[2]) / self.laloStep[1]))
+
+            # row/col of output pixels in the lookup table, nearest
+            lut_rows = np.rint((self.SNWE[1] + np.arange(self.length) * self.laloStep[0] - lat0) / lat_step)
+            lut_cols = np.rint((self.SNWE[2] + np.arange(self.width) * self.laloStep[1] - lon0) / lon_step)
+            lut_rows = lut_rows.astype(np.int64)
+            lut_cols = lut_cols.astype(np.int64)
+            row_flag = np.multiply(lut_rows >= 0, lut_rows < lat_num)
+            col_flag = np.multiply(lut_cols >= 0, lut_cols < lon_num)
+
+            # read the covered part of the lookup table only
+            dest_y = np.zeros((self.length, self.width), dtype=np.float32)
+            dest_x = np.zeros((self.length, self.width), dtype=np.float32)
+            if np.any(row_flag) and np.any(col_flag):
+                r0, r1 = np.min(lut_rows[row_flag]), np.max(lut_rows[row_flag]) + 1
+                c0, c1 = np.min(lut_cols[col_flag]), np.max(lut_cols[col_flag]) + 1
+                box = (c0, r0, c1, r1)
+                idx = np.ix_(lut_rows[row_flag] - r0, lut_cols[col_flag] - c0)
+                out_idx = np.ix_(row_flag, col_flag)
+                dest_y[out_idx] = readfile.read(self.file, datasetName='azimuthCoord', box=box)[0][idx]
+                dest_x[out_idx] = readfile.read(self.file, datasetName='rangeCoord', box=box)[0][idx]
+
+            # zero for pixels without radar coverage
+            flag = np.multiply(dest_y != 0., dest_x != 0.)
             if 'SUBSET_XMIN' in self.src_metadata.keys():
                 print('input data file was cropped before.')
-                dest_y[dest_y != 0.] -= float(self.src_metadata['SUBSET_YMIN'])
-                dest_x[dest_x != 0.] -= float(self.src_metadata['SUBSET_XMIN'])
-
-            # Convert y/x to lat/lon to be able to use pyresample.geometryDefinition
-            idx_row, idx_col = np.where(np.multiply(np.multiply(dest_y > 0, dest_y < length+1),
-                                                    np.multiply(dest_x > 0, dest_x < width+1)))
-            SNWEcomm = (np.max(idx_row) * lat_step + lat0,
-                        np.min(idx_row) * lat_step + lat0,
-                        np.min(idx_col) * lon_step + lon0,
-                        np.max(idx_col) * lon_step + lon0)
-            laloStep = [(SNWEcomm[0] - SNWEcomm[1]) / length,
-                        (SNWEcomm[3] - SNWEcomm[2]) / width]
-            # print('converting az/rgCoord to lat/lon based on common SNWE: {}'.format(SNWEcomm))
-            src_lat, src_lon = project_yx2lalo(src_y, src_x, SNWEcomm, laloStep)
-            dest_y[dest_y == 0.] = np.nan
-            dest_x[dest_x == 0.] = np.nan
-            dest_lat, dest_lon = project_yx2lalo(dest_y, dest_x, SNWEcomm, laloStep)
-
-            # src_def and dest_def
-            self.src_def = pr.geometry.SwathDefinition(lons=src_lon, lats=src_lat)
-            self.dest_def = pr.geometry.SwathDefinition(lons=dest_lon, lats=dest_lat)
+                dest_y[flag] -= float(self.src_metadata['SUBSET_YMIN'])
+                dest_x[flag] -= float(self.src_metadata['SUBSET_XMIN'])
+            dest_y[~flag] = np.nan
+            dest_x[~flag] = np.nan
+
+            self.src_shape = (int(self.src_metadata['LENGTH']), int(self.src_metadata['WIDTH']))
+            self.lut_yx = (dest_y, dest_x)
 
         # geo2radar
         else:
@@ -202,37 +206,324 @@ class resample:
             print('Not implemented yet for GAMMA and ROIPAC products')
             sys.exit(-1)
 
-    def resample(self, src_data, interp_method='nearest', fill_value=np.nan, nprocs=None, radius=None, print_msg=True):
+    def get_lookup_table_index(self, interp_method='nearest'):
+        """Resampling index from the radar coordinates of the output pixels in the lookup table,
+        as nearest gathering or bilinear interpolation, same as
+        scipy.ndimage.map_coordinates(order=0/1, mode='nearest') within the source grid.
+        """
+        dest_y, dest_x = self.lut_yx
+        length, width = self.src_shape
+        with np.errstate(invalid='ignore'):
+            flag = np.multiply(np.multiply(dest_y >= -0.5, dest_y <= length - 0.5),
+                               np.multiply(dest_x >= -0.5, dest_x <= width - 0.5)).flatten()
+        dest_y = dest_y.flatten()[flag]
+        dest_x = dest_x.flatten()[flag]
+
+        index = {'dest_idx': np.flatnonzero(flag), 'weight': None, 'distance': None}
+        if interp_method == 'nearest':
+            y = np.clip(np.rint(dest_y), 0, length - 1).astype(np.int64)
+            x = np.clip(np.rint(dest_x), 0, width - 1).astype(np.int64)
+            index['src_idx'] = (y * width + x).reshape(-1, 1)
+
+        else:
+            dest_y = np.clip(dest_y, 0, length - 1)
+            dest_x = np.clip(dest_x, 0, width - 1)
+            y0 = np.floor(dest_y).astype(np.int64)
+            x0 = np.floor(dest_x).astype(np.int64)
+            y1 = np.minimum(y0 + 1, length - 1)
+            x1 = np.minimum(x0 + 1, width - 1)
+            dy = (dest_y - y0).astype(np.float32)
+            dx = (dest_x - x0).astype(np.float32)
+            index['src_idx'] = np.hstack([(y0 * width + x0).reshape(-1, 1),
+                                          (y0 * width + x1).reshape(-1, 1),
+                                          (y1 * width + x0).reshape(-1, 1),
+                                          (y1 * width + x1).reshape(-1, 1)])
+            index['weight'] = np.hstack([((1 - dy) * (1 - dx)).reshape(-1, 1),
+                                         ((1 - dy) * dx).reshape(-1, 1),
+                                         (dy * (1 - dx)).reshape(-1, 1),
+                                         (dy * dx).reshape(-1, 1)])
+        return index
+
+    def get_radius(self):
+        """Default radius of influence in meters"""
+        if 'Y_FIRST' in self.src_metadata.keys():
+            radius = 100e3     # geo2radar
+        else:
+            radius = 200       # radar2geo
+        return radius
+
+    def get_index_key(self, interp_method, radius):
+        """Metadata identifying the resampling index, for its reuse from file"""
+        st = os.stat(self.file)
+        key = {'LOOKUP_FILE'   : os.path.abspath(self.file),
+               'LOOKUP_SIZE'   : st.st_size,
+               'LOOKUP_MTIME'  : st.st_mtime,
+               'INTERP_METHOD' : interp_method,
+               'RADIUS'        : radius,
+               'SRC_SHAPE'     : self.src_shape,
+               'DEST_SHAPE'    : (self.length, self.width),
+               'SNWE'          : self.SNWE,
+               'LALO_STEP'     : self.laloStep}
+        for i in ['Y_FIRST', 'X_FIRST', 'Y_STEP', 'X_STEP', 'SUBSET_YMIN', 'SUBSET_XMIN']:
+            if i in self.src_metadata.keys():
+                key['SRC_'+i] = self.src_metadata[i]
+        return dict((k, str(v)) for k, v in key.items())
+
+    def search_neighbour_index(self, interp_method, radius, nprocs):
+        """Resampling index from the neighbour search with pyresample, for radar-coded lookup table"""
+        num_dest = self.length * self.width
+        index = {'weight': None, 'distance': None}
+        if interp_method == 'nearest':
+            (valid_in, valid_out,
+             idx_arr, dist_arr) = pr.kd_tree.get_neighbour_info(self.src_def, self.dest_def, radius,
+                                                                neighbours=1, epsilon=0, nprocs=nprocs)
+            in_idx = np.flatnonzero(valid_in)
+            out_idx = np.flatnonzero(valid_out)
+            flag = idx_arr < in_idx.size
+            index['src_idx'] = in_idx[idx_arr[flag]].reshape(-1, 1)
+            index['dest_idx'] = out_idx[flag]
+            index['distance'] = np.array(dist_arr[flag], dtype=np.float32)
+
+        else:
+            t, s, valid_in, idx_arr = pr.bilinear.get_bil_info(self.src_def, self.dest_def, radius=radius,
+                                                               neighbours=32, nprocs=nprocs, epsilon=0)
+            t = np.array(t).flatten()
+            s = np.array(s).flatten()
+            idx_arr = np.array(idx_arr).reshape(num_dest, 4)
+            valid_in = np.array(valid_in)
+            in_idx = np.flatnonzero(valid_in) if valid_in.dtype == np.bool_ else valid_in.flatten()
+            flag = np.multiply(np.isfinite(t), np.isfinite(s))
+            flag *= np.all(np.multiply(idx_arr >= 0, idx_arr < in_idx.size), axis=1)
+            t, s = t[flag], s[flag]
+            index['src_idx'] = in_idx[idx_arr[flag, :]]
+            index['dest_idx'] = np.flatnonzero(flag)
+            index['weight'] = np.hstack([((1 - s) * (1 - t)).reshape(-1, 1),
+                                         (s * (1 - t)).reshape(-1, 1),
+                                         ((1 - s) * t).reshape(-1, 1),
+                                         (s * t).reshape(-1, 1)]).astype(np.float32)
+        return index
+
+    def get_resample_index(self, interp_method='nearest', radius=None, nprocs=None, index_file=None,
+                           print_msg=True):
+        """Get the neighbours of destination pixels in the source grid once, from the lookup table directly
+        for geo-coded lookup table, or from the neighbour search for radar-coded lookup table
+        Parameters: interp_method : str, nearest or bilinear
+                    radius        : float, radius of influence in meters
+                    nprocs        : int, number of processor cores for the neighbour search
+                    index_file    : str, HDF5 file to read the index from if it matches,
+                                    or to write the index into after the search
+        Returns:    self.index    : dict with
+                        src_idx   : 2D np.array in size of (num_valid, num_neighbour), in int,
+                                    flattened index of source pixels
+                        dest_idx  : 1D np.array in size of (num_valid,), in int,
+                                    flattened index of destination pixels with valid neighbour(s)
+                        weight    : 2D np.array in size of (num_valid, 4), in float32, bilinear weights,
+                                    None for nearest
+                        distance  : 1D np.array in size of (num_valid,), in float32, distance in meters
+                                    to the nearest neighbour, None for bilinear
+        """
+        interp_method = 'nearest' if interp_method.startswith('near') else 'bilinear'
+        if not radius:
+            radius = self.get_radius()
+        if not nprocs:
+            nprocs = multiprocessing.cpu_count()
+
+        key = self.get_index_key(interp_method, radius)
+        if self.index is not None and self.index['key'] == key:
+            return self.index
+
+        num_dest = self.length * self.width
+        if self.lut_yx is not None:
+            # geo lookup table: calculate directly, no need to save
+            if print_msg:
+                print('calculate {} resampling index from lookup table ...'.format(interp_method))
+            self.index = self.get_lookup_table_index(interp_method)
+            index_file = None
+
+        elif index_file and self.read_index(index_file, key, print_msg=print_msg):
+            return self.index
+
+        else:
+            if print_msg:
+                print('search {} neighbours using {} processor cores ...'.format(interp_method, nprocs))
+            self.index = self.search_neighbour_index(interp_method, radius, nprocs)
+        self.index['key'] = key
+
+        # save memory for the index of up to 2 billion pixels
+        idx_type = np.int32 if max(num_dest, np.prod(self.src_shape)) < 2**31 else np.int64
+        for i in ['src_idx', 'dest_idx']:
+            self.index[i] = self.index[i].astype(idx_type)
+        if print_msg:
+            print('number of destination pixels with valid neighbour: {} out of {}'.format(
+                self.index['dest_idx'].size, num_dest))
+
+        if index_file:
+            self.write_index(index_file, print_msg=print_msg)
+        return self.index
+
+    def write_index(self, index_file, print_msg=True):
+        """Write resampling index into HDF5 file, via a temporary file renamed atomically,
+        so that concurrent runs sharing the same index file never see a partially written one.
+        """
+        if print_msg:
+            print('write resampling index to file: {}'.format(index_file))
+        tmp_file = '{}.{}.tmp'.format(index_file, os.getpid())
+        try:
+            with h5py.File(tmp_file, 'w') as f:
+                for key, value in self.index['key'].items():
+                    f.attrs[key] = value
+                for dsName in ['src_idx', 'dest_idx', 'weight', 'distance']:
+                    if self.index[dsName] is not None:
+                        f.create_dataset(dsName, data=self.index[dsName])
+            os.replace(tmp_file, index_file)
+        except (OSError, ValueError) as e:
+            print('WARNING: failed to write resampling index to file {}: {}'.format(index_file, e))
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+            return None
+        return index_file
+
+    def read_index(self, index_file, key, print_msg=True):
+        """Read resampling index from HDF5 file if it matches key
+        Returns: True if the index is read, False otherwise
+        """
+        if not os.path.isfile(index_file):
+            return False
+        try:
+            with h5py.File(index_file, 'r') as f:
+                key_file = dict((k, v.decode() if isinstance(v, bytes) else str(v))
+                                for k, v in f.attrs.items())
+                if key_file != key:
+                    if print_msg:
+                        print('resampling index in file {} does not match, re-calculate it.'.format(index_file))
+                    return False
+                index = {'key': key}
+                for dsName in ['src_idx', 'dest_idx', 'weight', 'distance']:
+                    index[dsName] = f[dsName][:] if dsName in f.keys() else None
+        except (OSError, KeyError, ValueError) as e:
+            # corrupted or partially written file, e.g. from an interrupted run
+            print('WARNING: failed to read resampling index from file {}: {}, re-calculate it.'.format(index_file, e))
+            return False
+        self.index = index
+        if print_msg:
+            print('read resampling index from file: {}'.format(index_file))
+        return True
+
+    def get_dest_dtype(self, src_dtype, fill_value=np.nan):
+        """Data type of the resampled data"""
+        dtype = np.dtype(src_dtype)
+        if self.index['weight'] is not None:
+            dtype = np.result_type(dtype, np.float32)
+        if not np.issubdtype(dtype, np.inexact) and not float(fill_value).is_integer():
+            dtype = np.dtype(np.float32)
+        return dtype
+
+    def get_dest_boxes(self, chunk_size=100e6, print_msg=True):
+        """Split the output grid into blocks in rows, to resample block by block with limited memory
+        Parameters: chunk_size : float, max number of pixels of each output block and its input footprint
+        Returns:    box_list   : list of tuple of 4 int, (x0, y0, x1, y1)
+        """
+        r_step = int(max(1, chunk_size / 2 / self.width))
+        box_list = []
+        for r0 in range(0, self.length, r_step):
+            box_list.append((0, r0, self.width, min(self.length, r0 + r_step)))
+        if print_msg and len(box_list) > 1:
+            print('split {} lines into {} blocks for resampling, with each block up to {} lines'.format(
+                self.length, len(box_list), r_step))
+        return box_list
+
+    def get_block_index(self, dest_box=None):
+        """Resampling index of one block of the output grid, with pixel indices local to the block
+        and to its footprint in the source grid, i.e. the bounding box of all its neighbours
+        Parameters: dest_box    : tuple of 4 int, (x0, y0, x1, y1) of the output grid, None for all
+        Returns:    block_index : dict with src_idx, dest_idx and weight, same as self.index, and
+                        src_box  : tuple of 4 int, (x0, y0, x1, y1) of the source data to read
+                        dest_box : tuple of 4 int, (x0, y0, x1, y1) of the output data
+        """
+        src_length, src_width = self.src_shape
+        if dest_box is None:
+            dest_box = (0, 0, self.width, self.length)
+        x0, y0, x1, y1 = dest_box
+
+        # dest_idx is sorted, select the rows first, then the columns
+        i0, i1 = np.searchsorted(self.index['dest_idx'], [y0 * self.width, y1 * self.width])
+        dest_y, dest_x = np.divmod(self.index['dest_idx'][i0:i1], self.width)
+        flag = np.multiply(dest_x >= x0, dest_x < x1)
+        dest_y, dest_x = dest_y[flag], dest_x[flag]
+        src_y, src_x = np.divmod(self.index['src_idx'][i0:i1][flag], src_width)
+
+        if src_y.size > 0:
+            src_box = (int(np.min(src_x)), int(np.min(src_y)), int(np.max(src_x)) + 1, int(np.max(src_y)) + 1)
+        else:
+            # no valid neighbour, read one pixel as dummy
+            src_box = (0, 0, 1, 1)
+
+        block_index = {'src_box': src_box, 'dest_box': tuple(dest_box), 'weight': None}
+        block_index['src_idx'] = (src_y - src_box[1]) * (src_box[2] - src_box[0]) + (src_x - src_box[0])
+        block_index['dest_idx'] = (dest_y - y0) * (x1 - x0) + (dest_x - x0)
+        if self.index['weight'] is not None:
+            block_index['weight'] = self.index['weight'][i0:i1][flag]
+        return block_index
+
+    def apply_resample_index(self, src_data, fill_value=np.nan, block_index=None):
+        """Resample 2D/3D src_data with the resampling index
+        Parameters: src_data    : 2D / 3D np.array in size of (src_length, src_width, [num_slice]),
+                                  of the whole source grid, or of block_index['src_box']
+                    fill_value  : number, value of destination pixels without valid neighbour
+                    block_index : dict, resampling index of one output block from get_block_index()
+        Returns:    dest_data   : 2D / 3D np.array in size of (length, width, [num_slice]),
+                                  of the whole output grid, or of block_index['dest_box']
+        """
+        if block_index is None:
+            src_shape = self.src_shape
+            dest_shape = (self.length, self.width)
+            index = self.index
+        else:
+            x0, y0, x1, y1 = block_index['src_box']
+            src_shape = (y1 - y0, x1 - x0)
+            x0, y0, x1, y1 = block_index['dest_box']
+            dest_shape = (y1 - y0, x1 - x0)
+            index = block_index
+
+        if src_data.shape[:2] != src_shape:
+            raise ValueError('input data shape {} does not match the source grid {}'.format(
+                src_data.shape[:2], src_shape))
+        num_slice = int(np.prod(src_data.shape[2:]))
+        data = src_data.reshape(src_shape[0] * src_shape[1], num_slice)
+        src_idx = index['src_idx']
+        weight = index['weight']
+
+        if weight is None:
+            dest_value = data[src_idx[:, 0], :]
+        else:
+            dest_value = weight[:, 0:1] * data[src_idx[:, 0], :]
+            for i in range(1, weight.shape[1]):
+                dest_value += weight[:, i:i+1] * data[src_idx[:, i], :]
+
+        dtype = self.get_dest_dtype(src_data.dtype, fill_value)
+        dest_data = np.full((dest_shape[0] * dest_shape[1], num_slice), fill_value, dtype=dtype)
+        dest_data[index['dest_idx'], :] = dest_value
+        return dest_data.reshape(dest_shape + src_data.shape[2:])
+
+    def resample(self, src_data, interp_method='nearest', fill_value=np.nan, nprocs=None, radius=None,
+                 block_index=None, print_msg=True):
         """
         Resample input src_data into dest_data
-        Parameters: src_data : 2D np.array
+        Parameters: src_data : 2D / 3D np.array, with the slice dimension at the end
                     interp_method : str,
                     fill_value : number
                     nprocs : int
+                    block_index : dict, resampling index of one output block, for src_data of its footprint
                     print_msg : bool
         Returns:    dest_data
-        Example:    dest_data = reObj.resample(src_data, src_def, dest_def, interp_method=inps.interpMethod,\
+        Example:    dest_data = reObj.resample(src_data, interp_method=inps.interpMethod,\
                                                fill_value=np.fillValue, nprocs=4)
         """
-        if not radius:
-            if 'Y_FIRST' in self.src_metadata.keys():
-                radius = 100e3     # geo2radar
-            else:
-                radius = 200       # radar2geo
-
-        if not nprocs:
-            nprocs = multiprocessing.cpu_count()
-
-        if interp_method.startswith('near'):
-            if print_msg:
-                print('nearest resampling using {} processor cores ...'.format(nprocs))
-            dest_data = pr.kd_tree.resample_nearest(self.src_def, src_data, self.dest_def, nprocs=nprocs,
-                                                    fill_value=fill_value, radius_of_influence=radius, epsilon=0)
-        elif interp_method.endswith('linear'):
-            if print_msg:
-                print('bilinear resampling using {} processor cores ...'.format(nprocs))
-            dest_data = pr.bilinear.resample_bilinear(src_data, self.src_def, self.dest_def, nprocs=nprocs,
-                                                      fill_value=fill_value, radius=radius, neighbours=32, epsilon=0)
+        # neighbour search, if not done yet for the same interp_method and radius
+        self.get_resample_index(interp_method=interp_method, radius=radius, nprocs=nprocs, print_msg=print_msg)
+        if print_msg:
+            print('{} resampling with pre-computed index ...'.format(self.index['key']['INTERP_METHOD']))
+        dest_data = self.apply_resample_index(src_data, fill_value=fill_value, block_index=block_index)
 
         # for debug
         debug_mode = False
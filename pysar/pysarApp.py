@@ -10,18 +10,21 @@
 
 import os
 import sys
-import glob
 import time
 import argparse
 import warnings
 import shutil
-import subprocess
+import shlex
+import importlib.util
+import traceback
 
 import h5py
 import numpy as np
 
-import version
-from pysar.utils import readfile, writefile, utils as ut
+from pysar import version
+from pysar.utils import readfile, writefile, perf, utils as ut
+from pysar.utils.scheduler import stepGraph
+from pysar.correct_timeseries import RAMP_TYPES
 from pysar.objects import ifgramStack
 from pysar.defaults.auto_path import autoPath
 from pysar import subset, save_hdfeos5 as hdfeos5
@@ -35,7 +38,7 @@ TEMPLATE = """# vim: set filetype=cfg:
 ## load_data.py -H to check more details and example inputs.
 pysar.load.processor      = auto  #[isce,roipac,gamma,], auto for isce
 pysar.load.updateMode     = auto  #[yes / no], auto for yes, skip re-loading if HDF5 files are complete
-pysar.load.compression    = auto  #[gzip / lzf / no], auto for no [recommended].
+pysar.load.compression    = auto  #[gzip / lzf / auto_size / auto_speed / no], auto for no [recommended].
 ##---------interferogram datasets:
 pysar.load.unwFile        = auto  #[path2unw_file]
 pysar.load.corFile        = auto  #[path2cor_file]
@@ -136,6 +139,8 @@ pysar.troposphericDelay.weatherDir   = auto  #[path2directory], auto for "./../W
 pysar.troposphericDelay.polyOrder    = auto  #[1 / 2 / 3], auto for 1, for height_correlation method
 pysar.troposphericDelay.looks        = auto  #[1-inf], auto for 8, for height_correlation, number of looks applied to
                                              #interferogram for empirical estimation of topography correlated atmosphere.
+pysar.troposphericDelay.windowSize   = auto  #[0-inf], auto for 0, for height_correlation, window size in pixels for
+                                             #spatially varying phase/elevation ratio, 0 for one ratio for the whole image.
 
 
 ########## 4. Topographic Residual (DEM Error) Correction (optional and recommended)
@@ -172,11 +177,21 @@ pysar.deramp          = auto  #[no / plane / quadratic], auto for no - no ramp w
 pysar.deramp.maskFile = auto  #[filename / no], auto for maskTempCoh.h5, mask file for ramp estimation
 
 
+## 5.1 Fused Correction (optional)
+## apply LOD, tropospheric delay (pyaps), DEM error, reference date and phase ramp corrections
+## in one pass block by block with correct_timeseries.py, instead of one time-series file per correction.
+pysar.correction.fused        = auto  #[yes / no], auto for no
+pysar.correction.intermediate = auto  #[yes / no], auto for no, save time-series file after each correction
+
+
 ########## 6. Velocity Inversion
 ## estimate linear velocity from timeseries, and from tropospheric delay file if exists.
 pysar.velocity.excludeDate = auto   #[exclude_date.txt / 20080520,20090817 / no], auto for exclude_date.txt
 pysar.velocity.startDate   = auto   #[20070101 / no], auto for no
 pysar.velocity.endDate     = auto   #[20101230 / no], auto for no
+pysar.velocity.polynomial  = auto   #[1 / 2 / 3], auto for 1 - linear velocity, 2 for acceleration
+pysar.velocity.periodic    = auto   #[1.0,0.5 / no], auto for no, period(s) in years of sinusoid functions
+pysar.velocity.stepDate    = auto   #[20110311,20120928 / no], auto for no, date(s) of step functions
 
 
 ########## 7. Post-processing (geocode, output to Google Earth, HDF-EOS5, etc.)
@@ -250,6 +265,18 @@ def create_parser():
     parser.add_argument('-H', dest='print_example_template', action='store_true',
                         help='Print/Show the example template file for routine processing.')
     parser.add_argument('--version', action='store_true', help='print version number')
+    parser.add_argument('--subprocess', dest='subproc', action='store_true',
+                        help='Run each step in a separated Python interpreter (for debugging),\n' +
+                             'instead of calling main() of each module within the current process.')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='Number of steps to run in parallel, default: 1.\n' +
+                             'Steps with all dependencies done are run in separated processes if > 1.')
+    parser.add_argument('--perf-report', dest='perfFile', default='pysarApp_perf.json',
+                        help='Performance report file of steps run, i.e. wall/CPU time, peak memory and\n' +
+                             'bytes read/written, in JSON and CSV format, default: pysarApp_perf.json/csv.\n' +
+                             'Set to no to disable.')
+    parser.add_argument('--perf-compare', dest='perfRefFile',
+                        help='Performance report of a previous run to compare with, to spot regressions.')
 
     parser.add_argument('--reset', action='store_true',
                         help='Reset files attributes to re-run pysarApp.py after loading data by:\n' +
@@ -373,6 +400,50 @@ def read_template(inps):
     return inps, template, templateCustom
 
 
+def run_cmd(cmd, inps):
+    """Run one processing step and return its exit status.
+    PySAR scripts (*.py) are run within the current Python process by calling main() of the module,
+    so that imported modules and cached design matrices are shared among all steps,
+    while cached file metadata is cleared after each step;
+    other commands or inps.subproc = True are run with subprocess.
+    Parameters: cmd  : str, command line, e.g. 'generate_mask.py temporalCoherence.h5 -m 0.7 -o maskTempCoh.h5'
+                inps : Namespace, with subproc and workDir
+    Returns:    status : int, 0 for success
+    """
+    args = shlex.split(cmd)
+    script = os.path.basename(args[0])
+    mod_name = os.path.splitext(script)[0]
+    if (inps.subproc
+            or not script.endswith('.py')
+            or importlib.util.find_spec('pysar.{}'.format(mod_name)) is None):
+        return perf.call(cmd)
+
+    status = 0
+    try:
+        mod = importlib.import_module('pysar.{}'.format(mod_name))
+        mod.main(args[1:])
+    except SystemExit as e:
+        # same exit status as running the script with python
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code)
+            status = 1
+    except Exception:
+        traceback.print_exc()
+        status = 1
+    finally:
+        # reset state changed by the step
+        # cached metadata may be stale after in-place attribute edits on coarse mtime file systems
+        os.chdir(inps.workDir)
+        readfile.metadata_cache.clear()
+        if 'matplotlib.pyplot' in sys.modules:
+            sys.modules['matplotlib.pyplot'].close('all')
+    return status
+
+
 ##########################################################################
 def main(iargs=None):
     start_time = time.time()
@@ -416,7 +487,7 @@ def main(iargs=None):
     if inps.projectName:
         loadCmd += ' --project {}'.format(inps.projectName)
     print(loadCmd)
-    status = subprocess.Popen(loadCmd, shell=True).wait()
+    run_cmd(loadCmd, inps)
     os.chdir(inps.workDir)
 
     print('-'*50)
@@ -437,43 +508,55 @@ def main(iargs=None):
         # Reset reference pixel
         refPointCmd = 'reference_point.py {} --reset'.format(inps.stackFile)
         print(refPointCmd)
-        status = subprocess.Popen(refPointCmd, shell=True).wait()
+        run_cmd(refPointCmd, inps)
         # Reset network modification
         networkCmd = 'modify_network.py {} --reset'.format(inps.stackFile)
         print(networkCmd)
-        status = subprocess.Popen(networkCmd, shell=True).wait()
+        run_cmd(networkCmd, inps)
 
     #########################################
     # Generating Aux files
     #########################################
     print('\n**********  Generate Auxiliary Files  **********')
+    # Steps below are added into a dependency graph and run when needed only,
+    # i.e. for changed input files / template options or missing / changed output files.
+    perfFile = None
+    if inps.perfFile.lower() not in ['no', 'none']:
+        perfFile = os.path.join(inps.workDir, inps.perfFile)
+    dag = stepGraph(state_file=os.path.join(inps.workDir, 'pysarApp_state.json'),
+                    template=template,
+                    run_func=lambda cmd: run_cmd(cmd, inps),
+                    num_worker=inps.numWorker,
+                    work_dir=inps.workDir,
+                    perf_file=perfFile)
+
     # Initial mask (pixels with valid unwrapPhase or connectComponent in ALL interferograms)
     inps.maskFile = 'mask.h5'
-    if ut.update_file(inps.maskFile, inps.stackFile):
-        maskCmd = 'generate_mask.py {} --nonzero -o {}'.format(inps.stackFile,
-                                                               inps.maskFile)
-        print(maskCmd)
-        status = subprocess.Popen(maskCmd, shell=True).wait()
+    maskCmd = 'generate_mask.py {} --nonzero -o {}'.format(inps.stackFile,
+                                                           inps.maskFile)
+    dag.add_step('mask', maskCmd,
+                 inputs=[inps.stackFile],
+                 outputs=[inps.maskFile])
 
     # Average spatial coherence
     inps.avgSpatialCohFile = 'avgSpatialCoherence.h5'
-    if ut.update_file(inps.avgSpatialCohFile, inps.stackFile):
-        avgCmd = 'temporal_average.py {} --dataset coherence -o {}'.format(inps.stackFile,
-                                                                           inps.avgSpatialCohFile)
-        print(avgCmd)
-        status = subprocess.Popen(avgCmd, shell=True).wait()
+    avgCmd = 'temporal_average.py {} --dataset coherence -o {}'.format(inps.stackFile,
+                                                                       inps.avgSpatialCohFile)
+    dag.add_step('avgSpatialCoherence', avgCmd,
+                 inputs=[inps.stackFile],
+                 outputs=[inps.avgSpatialCohFile])
 
     #########################################
     # Referencing Interferograms in Space
     #########################################
-    print('\n**********  Select Reference Point  **********')
     refPointCmd = 'reference_point.py {} -t {} -c {}'.format(inps.stackFile,
                                                              inps.templateFile,
                                                              inps.avgSpatialCohFile)
-    print(refPointCmd)
-    status = subprocess.Popen(refPointCmd, shell=True).wait()
-    if status is not 0:
-        raise Exception('Error while finding reference pixel in space.\n')
+    dag.add_step('reference_point', refPointCmd,
+                 inputs=[inps.stackFile, inps.avgSpatialCohFile, inps.maskFile],
+                 outputs=[inps.stackFile],
+                 template_keys=['pysar.reference.*'],
+                 error_msg='Error while finding reference pixel in space.')
 
     ############################################
     # Unwrapping Error Correction (Optional)
@@ -481,71 +564,68 @@ def main(iargs=None):
     #    of interferograms
     ############################################
     if template['pysar.unwrapError.method']:
-        print('\n**********  Unwrapping Error Correction  **********')
         outName = '{}_unwCor.h5'.format(os.path.splitext(inps.stackFile)[0])
         unwCmd = 'unwrap_error.py {} --mask {} --template {}'.format(inps.stackFile,
                                                                      inps.maskFile,
                                                                      inps.templateFile)
-        print(unwCmd)
-        if ut.update_file(outName, inps.stackFile):
-            print('This might take a while depending on the size of your data set!')
-            status = subprocess.Popen(unwCmd, shell=True).wait()
-            if status is not 0:
-                raise Exception('Error while correcting phase unwrapping errors.\n')
+        dag.add_step('unwrap_error', unwCmd,
+                     inputs=[inps.stackFile, inps.maskFile],
+                     outputs=[outName],
+                     template_keys=['pysar.unwrapError.*'],
+                     error_msg='Error while correcting phase unwrapping errors.')
         inps.stackFile = outName
 
     #########################################
     # Network Modification (Optional)
     #########################################
-    print('\n**********  Modify Network  **********')
     networkCmd = 'modify_network.py {} -t {}'.format(inps.stackFile,
                                                      inps.templateFile)
-    print(networkCmd)
-    status = subprocess.Popen(networkCmd, shell=True).wait()
-    if status is not 0:
-        raise Exception('Error while modifying the network of interferograms.\n')
+    dag.add_step('modify_network', networkCmd,
+                 inputs=[inps.stackFile, inps.maskFile],
+                 outputs=[inps.stackFile],
+                 template_keys=['pysar.network.*'],
+                 error_msg='Error while modifying the network of interferograms.')
 
     # Plot network colored in spatial coherence
-    print('--------------------------------------------------')
     plotCmd = 'plot_network.py {} --template {} --nodisplay'.format(inps.stackFile,
                                                                     inps.templateFile)
-    print(plotCmd)
     inps.cohSpatialAvgFile = '{}_coherence_spatialAverage.txt'.format(
         os.path.splitext(os.path.basename(inps.stackFile))[0])
-    if ut.update_file('Network.pdf', check_readable=False, inFile=[inps.stackFile,
-                                                                   inps.cohSpatialAvgFile,
-                                                                   inps.templateFile]):
-        status = subprocess.Popen(plotCmd, shell=True).wait()
+    dag.add_step('plot_network', plotCmd,
+                 inputs=[inps.stackFile],
+                 outputs=['Network.pdf', inps.cohSpatialAvgFile],
+                 template_keys=['pysar.network.*'])
 
     if inps.modify_network:
+        dag.run()
         raise SystemExit('Exit as planned after network modification.')
 
     #########################################
     # Inversion of Interferograms
     ########################################
-    print('\n**********  Invert Network of Interferograms into Time-series  **********')
     invCmd = 'ifgram_inversion.py {} --template {}'.format(inps.stackFile,
                                                            inps.templateFile)
-    print(invCmd)
     inps.timeseriesFile = 'timeseries.h5'
     inps.tempCohFile = 'temporalCoherence.h5'
-    if ut.update_file(inps.timeseriesFile, inps.stackFile):
-        status = subprocess.Popen(invCmd, shell=True).wait()
-        if status is not 0:
-            raise Exception('Error while inverting network interferograms into timeseries')
+    dag.add_step('ifgram_inversion', invCmd,
+                 inputs=[inps.stackFile, inps.maskFile],
+                 outputs=[inps.timeseriesFile, inps.tempCohFile],
+                 template_keys=['pysar.networkInversion.*'],
+                 error_msg='Error while inverting network interferograms into timeseries')
 
-    print('\n--------------------------------------------')
-    print('Update Mask based on Temporal Coherence ...')
+    # Update Mask based on Temporal Coherence
     inps.maskFile = 'maskTempCoh.h5'
     inps.minTempCoh = template['pysar.networkInversion.minTempCoh']
     maskCmd = 'generate_mask.py {} -m {} -o {}'.format(inps.tempCohFile,
                                                        inps.minTempCoh,
                                                        inps.maskFile)
-    print(maskCmd)
-    if ut.update_file(inps.maskFile, inps.tempCohFile):
-        status = subprocess.Popen(maskCmd, shell=True).wait()
-        if status is not 0:
-            raise Exception('Error while generating mask file from temporal coherence.')
+    dag.add_step('maskTempCoh', maskCmd,
+                 inputs=[inps.tempCohFile],
+                 outputs=[inps.maskFile],
+                 error_msg='Error while generating mask file from temporal coherence.')
+
+    print('\n**********  Run Steps from Reference Point to Network Inversion  **********')
+    dag.run()
 
     if inps.invert_network:
         raise SystemExit('Exit as planned after network inversion.')
@@ -564,21 +644,28 @@ def main(iargs=None):
     del msk
 
 
+    # Fused correction (optional): LOD, tropospheric delay from weather models, DEM error,
+    # reference date and phase ramp are applied in one step with correct_timeseries.py block by block.
+    # Height correlation is estimated from the whole area of each epoch, thus the steps before it are not fused.
+    inps.fused = template['pysar.correction.fused'] is True
+    inps.fusedLodTrop = inps.fused and template['pysar.troposphericDelay.method'] != 'height_correlation'
+    inps.fusedInFile = inps.timeseriesFile
+    inps.fusedTropFile = None
+
     ##############################################
     # LOD (Local Oscillator Drift) Correction
     #   for Envisat data in radar coord only
     ##############################################
     if atr['PLATFORM'].lower().startswith('env'):
-        print('\n**********  Local Oscillator Drift Correction for Envisat  **********')
         outName = os.path.splitext(inps.timeseriesFile)[0]+'_LODcor.h5'
         lodCmd = 'local_oscilator_drift.py {} {} -o {}'.format(inps.timeseriesFile,
                                                                inps.geomFile,
                                                                outName)
-        print(lodCmd)
-        if ut.update_file(outName, [inps.timeseriesFile, inps.geomFile]):
-            status = subprocess.Popen(lodCmd, shell=True).wait()
-            if status is not 0:
-                raise Exception('Error while correcting Local Oscillator Drift.\n')
+        if not inps.fusedLodTrop:
+            dag.add_step('local_oscilator_drift', lodCmd,
+                         inputs=[inps.timeseriesFile, inps.geomFile],
+                         outputs=[outName],
+                         error_msg='Error while correcting Local Oscillator Drift.')
         inps.timeseriesFile = outName
 
     ##############################################
@@ -610,18 +697,21 @@ def main(iargs=None):
         if inps.tropMethod == 'height_correlation':
             outName = '{}_tropHgt.h5'.format(fbase)
             print('tropospheric delay correction with height-correlation approach')
-            tropCmd = ('tropcor_phase_elevation.py {t} -d {d} -p {p}'
+            tropCmd = ('tropcor_phase_elevation.py {t} -d {d} -p {p} -l {l} -w {w}'
                        ' -m {m} -o {o}').format(t=inps.timeseriesFile,
                                                 d=inps.geomFile,
                                                 p=inps.tropPolyOrder,
+                                                l=template['pysar.troposphericDelay.looks'],
+                                                w=template['pysar.troposphericDelay.windowSize'],
                                                 m=inps.maskFile,
                                                 o=outName)
-            print(tropCmd)
-            if ut.update_file(outName, inps.timeseriesFile):
-                status = subprocess.Popen(tropCmd, shell=True).wait()
-                if status is not 0:
-                    raise Exception('Error while correcting tropospheric delay.\n')
+            dag.add_step('tropcor_phase_elevation', tropCmd,
+                         inputs=[inps.timeseriesFile, inps.geomFile, inps.maskFile],
+                         outputs=[outName],
+                         template_keys=['pysar.troposphericDelay.*'],
+                         error_msg='Error while correcting tropospheric delay.')
             inps.timeseriesFile = outName
+            inps.fusedInFile = outName
 
         elif inps.tropMethod == 'pyaps':
             inps.weatherDir = template['pysar.troposphericDelay.weatherDir']
@@ -635,35 +725,39 @@ def main(iargs=None):
                                                 d=inps.geomFile,
                                                 i=inps.geomFile,
                                                 w=inps.weatherDir)
-            print(tropCmd)
-            if ut.update_file(outName, inps.timeseriesFile):
-                if inps.tropFile:
-                    tropCmd = 'diff.py {} {} -o {}'.format(inps.timeseriesFile,
-                                                           inps.tropFile,
-                                                           outName)
-                    print('--------------------------------------------')
-                    print('Use existed tropospheric delay file: {}'.format(inps.tropFile))
-                    print(tropCmd)
-                status = subprocess.Popen(tropCmd, shell=True).wait()
-                if status is not 0:
-                    print('\nError while correcting tropospheric delay, try the following:')
-                    print('1) Check the installation of PyAPS')
-                    print('   http://earthdef.caltech.edu/projects/pyaps/wiki/Main')
-                    print('   Try in command line: python -c "import pyaps"')
-                    print('2) Use other tropospheric correction method, height-correlation, for example')
-                    print('3) or turn off the option by setting pysar.troposphericDelay.method = no.\n')
-                    raise RuntimeError()
+            tropOutputs = [outName]
+            if inps.fusedLodTrop:
+                # calculate delay only, correct it with the fused correction
+                tropCmd = tropCmd.replace('-f {}'.format(inps.timeseriesFile),
+                                          '-f {} --delay-only'.format(inps.fusedInFile))
+                tropOutputs = []
+            if inps.tropFile:
+                tropCmd = 'diff.py {} {} -o {}'.format(inps.timeseriesFile,
+                                                       inps.tropFile,
+                                                       outName)
+                print('Use existed tropospheric delay file: {}'.format(inps.tropFile))
+            else:
+                inps.tropFile = os.path.join(inps.workDir, 'INPUTS/{}.h5'.format(inps.tropModel))
+                tropOutputs.append(inps.tropFile)
+            msg = 'Error while correcting tropospheric delay, try the following:\n'
+            msg += '1) Check the installation of PyAPS\n'
+            msg += '   http://earthdef.caltech.edu/projects/pyaps/wiki/Main\n'
+            msg += '   Try in command line: python -c "import pyaps"\n'
+            msg += '2) Use other tropospheric correction method, height-correlation, for example\n'
+            msg += '3) or turn off the option by setting pysar.troposphericDelay.method = no.\n'
+            if inps.fusedLodTrop:
+                inps.fusedTropFile = inps.tropFile
+            if tropOutputs:
+                dag.add_step('tropcor_pyaps', tropCmd,
+                             inputs=[inps.fusedInFile if inps.fusedLodTrop else inps.timeseriesFile,
+                                     inps.geomFile],
+                             outputs=tropOutputs,
+                             template_keys=['pysar.troposphericDelay.*'],
+                             error_msg=msg)
             inps.timeseriesFile = outName
         else:
             print('No atmospheric delay correction.')
 
-    # Grab tropospheric delay file
-    try:
-        fileList = [os.path.join(inps.workDir, 'INPUTS/{}.h5'.format(inps.tropModel))]
-        inps.tropFile = ut.get_file_list(fileList)[0]
-    except:
-        inps.tropFile = None
-
     ##############################################
     # Topographic (DEM) Residuals Correction (Optional)
     ##############################################
@@ -673,15 +767,16 @@ def main(iargs=None):
                                                          inps.geomFile,
                                                          inps.templateFile,
                                                          outName)
-    print(topoCmd)
     inps.timeseriesResFile = None
     if template['pysar.topographicResidual']:
-        if ut.update_file(outName, inps.timeseriesFile):
-            status = subprocess.Popen(topoCmd, shell=True).wait()
-            if status is not 0:
-                raise Exception('Error while correcting topographic phase residual.\n')
-        inps.timeseriesFile = outName
         inps.timeseriesResFile = 'timeseriesResidual.h5'
+        if not inps.fused:
+            dag.add_step('dem_error', topoCmd,
+                         inputs=[inps.timeseriesFile, inps.geomFile],
+                         outputs=[outName, inps.timeseriesResFile],
+                         template_keys=['pysar.topographicResidual*'],
+                         error_msg='Error while correcting topographic phase residual.')
+        inps.timeseriesFile = outName
     else:
         print('No correction for topographic residuals.')
 
@@ -692,10 +787,13 @@ def main(iargs=None):
     if inps.timeseriesResFile:
         rmsCmd = 'timeseries_rms.py {} -t {}'.format(inps.timeseriesResFile,
                                                      inps.templateFile)
-        print(rmsCmd)
-        status = subprocess.Popen(rmsCmd, shell=True).wait()
-        if status is not 0:
-            raise Exception('Error while calculating RMS of time series phase residual.\n')
+        rmsKwargs = dict(inputs=[inps.timeseriesResFile, inps.maskFile],
+                         outputs=['reference_date.txt', 'exclude_date.txt'],
+                         template_keys=['pysar.residualRms.*'],
+                         error_msg='Error while calculating RMS of time series phase residual.')
+        # run after the residual file is generated by the fused correction
+        if not inps.fused:
+            dag.add_step('timeseries_rms', rmsCmd, **rmsKwargs)
     else:
         print('No timeseries residual file found! Skip residual RMS analysis.')
 
@@ -708,15 +806,49 @@ def main(iargs=None):
         refCmd = 'reference_date.py {} -t {} -o {}'.format(inps.timeseriesFile,
                                                            inps.templateFile,
                                                            outName)
-        print(refCmd)
-        if ut.update_file(outName, inps.timeseriesFile):
-            status = subprocess.Popen(refCmd, shell=True).wait()
-            if status is not 0:
-                raise Exception('Error while changing reference date.\n')
+        if not inps.fused:
+            dag.add_step('reference_date', refCmd,
+                         inputs=[inps.timeseriesFile, 'reference_date.txt'],
+                         outputs=[outName],
+                         template_keys=['pysar.reference.date', 'pysar.residualRms.*'],
+                         error_msg='Error while changing reference date.')
         inps.timeseriesFile = outName
     else:
         print('No reference change in time.')
 
+    ##############################################
+    # Fused Correction (Optional)
+    ##############################################
+    if inps.fused:
+        print('\n**********  Fused Correction  **********')
+        outName = inps.timeseriesFile
+        if template['pysar.deramp'] in RAMP_TYPES:
+            outName = '{}_{}.h5'.format(os.path.splitext(inps.timeseriesFile)[0], template['pysar.deramp'])
+        fusedCmd = 'correct_timeseries.py {} -g {} -t {} -o {}'.format(inps.fusedInFile,
+                                                                      inps.geomFile,
+                                                                      inps.templateFile,
+                                                                      outName)
+        if not inps.fusedLodTrop:
+            fusedCmd += ' --skip-lod'
+        if inps.fusedTropFile:
+            fusedCmd += ' --trop-file {}'.format(inps.fusedTropFile)
+        fusedOutputs = [outName]
+        if inps.timeseriesResFile:
+            fusedOutputs += [inps.timeseriesResFile, 'demErr.h5']
+        dag.add_step('correct_timeseries', fusedCmd,
+                     inputs=[inps.fusedInFile, inps.geomFile, inps.fusedTropFile,
+                             inps.maskFile, template['pysar.deramp.maskFile']],
+                     outputs=fusedOutputs,
+                     template_keys=['pysar.topographicResidual*',
+                                    'pysar.residualRms.*',
+                                    'pysar.reference.date',
+                                    'pysar.deramp*',
+                                    'pysar.correction.*'],
+                     error_msg='Error while correcting time-series.')
+
+        if inps.timeseriesResFile:
+            dag.add_step('timeseries_rms', rmsCmd, **rmsKwargs)
+
     ##############################################
     # Phase Ramp Correction (Optional)
     ##############################################
@@ -732,14 +864,15 @@ def main(iargs=None):
 
         # Get executable command and output name
         derampCmd = None
+        derampInputs = [inps.timeseriesFile, inps.maskFile]
         fbase = os.path.splitext(inps.timeseriesFile)[0]
-        if inps.derampMethod in ['plane', 'quadratic', 'plane_range', 'quadratic_range',
-                                 'plane_azimuth', 'quadratic_azimuth']:
+        if inps.derampMethod in RAMP_TYPES:
             outName = '{}_{}.h5'.format(fbase, inps.derampMethod)
             derampCmd = 'remove_ramp.py {} -s {} -m {} -o {}'.format(inps.timeseriesFile,
                                                                      inps.derampMethod,
                                                                      inps.derampMaskFile,
                                                                      outName)
+            derampInputs = [inps.timeseriesFile, inps.derampMaskFile]
 
         elif inps.derampMethod == 'baseline_cor':
             outName = '{}_baselineCor.h5'.format(fbase)
@@ -755,16 +888,20 @@ def main(iargs=None):
                                                           d=inps.geomFile,
                                                           p=inps.tropPolyOrder,
                                                           m=inps.maskFile)
+            derampInputs.append(inps.geomFile)
         else:
             warnings.warn('Unrecognized phase ramp method: {}'.format(template['pysar.deramp']))
 
-        # Execute command
+        # Add step
         if derampCmd:
-            print(derampCmd)
-            if ut.update_file(outName, inps.timeseriesFile):
-                status = subprocess.Popen(derampCmd, shell=True).wait()
-                if status is not 0:
-                    raise Exception('Error while removing phase ramp for time-series.\n')
+            if inps.fused and inps.derampMethod in RAMP_TYPES:
+                print('phase ramp is removed with the fused correction.')
+            else:
+                dag.add_step('deramp', derampCmd,
+                             inputs=derampInputs,
+                             outputs=[outName],
+                             template_keys=['pysar.deramp*'],
+                             error_msg='Error while removing phase ramp for time-series.')
             inps.timeseriesFile = outName
     else:
         print('No phase ramp removal.')
@@ -772,16 +909,15 @@ def main(iargs=None):
     #############################################
     # Velocity and rmse maps
     #############################################
-    print('\n**********  Estimate Velocity  **********')
     inps.velFile = 'velocity.h5'
     velCmd = 'timeseries2velocity.py {} -t {} -o {}'.format(inps.timeseriesFile,
                                                             inps.templateFile,
                                                             inps.velFile)
-    print(velCmd)
-    if ut.update_file(inps.velFile, [inps.timeseriesFile, inps.templateFile]):
-        status = subprocess.Popen(velCmd, shell=True).wait()
-        if status is not 0:
-            raise Exception('Error while estimating linear velocity from time-series.\n')
+    dag.add_step('velocity', velCmd,
+                 inputs=[inps.timeseriesFile, 'exclude_date.txt'],
+                 outputs=[inps.velFile],
+                 template_keys=['pysar.velocity.*'],
+                 error_msg='Error while estimating linear velocity from time-series.')
 
     # Velocity from Tropospheric delay
     if inps.tropFile:
@@ -790,9 +926,10 @@ def main(iargs=None):
         velCmd = 'timeseries2velocity.py {} -t {} -o {}'.format(inps.tropFile,
                                                                 inps.templateFile,
                                                                 inps.tropVelFile)
-        print(velCmd)
-        if ut.update_file(inps.tropVelFile, [inps.tropFile, inps.templateFile]):
-            status = subprocess.Popen(velCmd, shell=True).wait()
+        dag.add_step('velocity_trop', velCmd,
+                     inputs=[inps.tropFile, 'exclude_date.txt'],
+                     outputs=[inps.tropVelFile],
+                     template_keys=['pysar.velocity.*'])
 
     ############################################
     # Post-processing
@@ -806,39 +943,38 @@ def main(iargs=None):
     # Geocoding
     if not inps.geocoded:
         if template['pysar.geocode'] is True:
-            print('\n--------------------------------------------')
             geo_dir = os.path.abspath('./GEOCODE')
             if not os.path.isdir(geo_dir):
                 os.makedirs(geo_dir)
                 print('create directory: {}'.format(geo_dir))
-            geoCmd = ('geocode.py {v} {c} {t} {g} -l {l} -t {e}'
-                      ' --outdir {d} --update').format(v=inps.velFile,
-                                                       c=inps.tempCohFile,
-                                                       t=inps.timeseriesFile,
-                                                       g=inps.geomFile,
+
+            # one step for all files, to share the resampling index, i.e. INPUTS/resampleIndex.h5
+            geoKeys = ['velFile', 'tempCohFile', 'timeseriesFile', 'geomFile']
+            inFiles = [vars(inps)[key] for key in geoKeys]
+            geoFiles = dict((key, os.path.join(geo_dir, 'geo_'+os.path.basename(vars(inps)[key])))
+                            for key in geoKeys)
+            geoCmd = ('geocode.py {f} -l {l} -t {e}'
+                      ' --outdir {d} --update').format(f=' '.join(inFiles),
                                                        l=inps.lookupFile,
                                                        e=inps.templateFile,
                                                        d=geo_dir)
-            print(geoCmd)
-            status = subprocess.Popen(geoCmd, shell=True).wait()
-            if status is not 0:
-                raise Exception('Error while geocoding.\n')
-            else:
-                inps.velFile        = os.path.join(geo_dir, 'geo_'+os.path.basename(inps.velFile))
-                inps.tempCohFile    = os.path.join(geo_dir, 'geo_'+os.path.basename(inps.tempCohFile))
-                inps.timeseriesFile = os.path.join(geo_dir, 'geo_'+os.path.basename(inps.timeseriesFile))
-                inps.geomFile       = os.path.join(geo_dir, 'geo_'+os.path.basename(inps.geomFile))
-                inps.geocoded = True
+            dag.add_step('geocode', geoCmd,
+                         inputs=inFiles + [inps.lookupFile],
+                         outputs=[geoFiles[key] for key in geoKeys],
+                         template_keys=['pysar.geocode*'],
+                         error_msg='Error while geocoding.')
+            for key, value in geoFiles.items():
+                setattr(inps, key, value)
+            inps.geocoded = True
 
             # generate mask based on geocoded temporal coherence
-            print('\n--------------------------------------------')
             outName = os.path.join(geo_dir, 'geo_maskTempCoh.h5')
             genCmd = 'generate_mask.py {} -m {} -o {}'.format(inps.tempCohFile,
                                                               inps.minTempCoh,
                                                               outName)
-            print(genCmd)
-            if ut.update_file(outName, inps.tempCohFile):
-                status = subprocess.Popen(genCmd, shell=True).wait()
+            dag.add_step('geo_maskTempCoh', genCmd,
+                         inputs=[inps.tempCohFile],
+                         outputs=[outName])
             inps.maskFile = outName
 
     # mask velocity file
@@ -847,25 +983,23 @@ def main(iargs=None):
         maskCmd = 'mask.py {} -m {} -o {}'.format(inps.velFile,
                                                   inps.maskFile,
                                                   outName)
-        print(maskCmd)
-        if ut.update_file(outName, [inps.velFile, inps.maskFile]):
-            status = subprocess.Popen(maskCmd, shell=True).wait()
-        try:
-            inps.velFile = glob.glob(outName)[0]
-        except:
-            inps.velFile = None
+        dag.add_step('mask_velocity', maskCmd,
+                     inputs=[inps.velFile, inps.maskFile],
+                     outputs=[outName],
+                     error_msg='Error while masking velocity file.')
+        inps.velFile = outName
 
     # Save to Google Earth KML file
     if inps.geocoded and inps.velFile and template['pysar.save.kml'] is True:
-        print('\n--------------------------------------------')
-        print('creating Google Earth KMZ file for geocoded velocity file: ...')
         outName = '{}.kmz'.format(os.path.splitext(os.path.basename(inps.velFile))[0])
         kmlCmd = 'save_kml.py {} -o {}'.format(inps.velFile, outName)
-        print(kmlCmd)
-        if ut.update_file(outName, inps.velFile, check_readable=False):
-            status = subprocess.Popen(kmlCmd, shell=True).wait()
-            if status is not 0:
-                raise Exception('Error while generating Google Earth KMZ file.')
+        dag.add_step('save_kml', kmlCmd,
+                     inputs=[inps.velFile],
+                     outputs=[outName],
+                     error_msg='Error while generating Google Earth KMZ file.')
+
+    print('\n**********  Run Steps from Tropospheric Correction to Post-processing  **********')
+    dag.run()
 
     #############################################
     # Save Timeseries to HDF-EOS5 format
@@ -880,26 +1014,24 @@ def main(iargs=None):
                 ut.add_attribute(inps.timeseriesFile, templateCustom)
 
             # Save to HDF-EOS5 format
-            print('--------------------------------------------')
             hdfeos5Cmd = ('save_hdfeos5.py {t} -c {c} -m {m} -g {g}'
                           ' -t {e}').format(t=inps.timeseriesFile,
                                             c=inps.tempCohFile,
                                             m=inps.maskFile,
                                             g=inps.geomFile,
                                             e=inps.templateFile)
-            print(hdfeos5Cmd)
-            SAT = hdfeos5.get_mission_name(atr)
-            try:
-                inps.hdfeos5File = ut.get_file_list('{}_*.he5'.format(SAT))[0]
-            except:
-                inps.hdfeos5File = None
-            if ut.update_file(inps.hdfeos5File, [inps.timeseriesFile,
-                                                 inps.tempCohFile,
-                                                 inps.maskFile,
-                                                 inps.geomFile]):
-                status = subprocess.Popen(hdfeos5Cmd, shell=True).wait()
-                if status is not 0:
-                    raise Exception('Error while generating HDF-EOS5 time-series file.\n')
+            # output file name from the time-series metadata, e.g. S1_IW12_128_0593_0597_20141213_20180619.he5
+            outFiles = []
+            if os.path.isfile(inps.timeseriesFile):
+                outFiles = [hdfeos5.get_output_file(shlex.split(hdfeos5Cmd)[1:])]
+            dag.add_step('save_hdfeos5', hdfeos5Cmd,
+                         inputs=[inps.timeseriesFile,
+                                 inps.tempCohFile,
+                                 inps.maskFile,
+                                 inps.geomFile],
+                         outputs=outFiles,
+                         template_keys=['pysar.save.hdfEos5*'],
+                         error_msg='Error while generating HDF-EOS5 time-series file.')
 
     #############################################
     # Plot Figures
@@ -915,14 +1047,25 @@ def main(iargs=None):
             shutil.copy2(inps.plotShellFile, inps.workDir)
 
     if inps.plot and os.path.isfile(plotCmd):
-        print(plotCmd)
-        status = subprocess.Popen(plotCmd, shell=True).wait()
+        dag.add_step('plot', plotCmd,
+                     inputs=[plotCmd,
+                             inps.velFile,
+                             inps.tempCohFile,
+                             inps.timeseriesFile,
+                             inps.maskFile,
+                             inps.geomFile],
+                     template_keys=['pysar.plot'],
+                     error_msg='Error while plotting data files using {}'.format(plotCmd))
+    dag.run()
+
+    if inps.plot and os.path.isfile(plotCmd):
         print('\n'+'-'*50)
         print('For better figures:')
         print('  1) Edit parameters in plot_pysarApp.sh and re-run this script.')
         print('  2) Play with view.py, tsview.py and save_kml.py for more advanced/customized figures.')
-        if status is not 0:
-            raise Exception('Error while plotting data files using {}'.format(plotCmd))
+
+    if dag.monitor is not None and inps.perfRefFile:
+        dag.monitor.compare(inps.perfRefFile)
 
     #############################################
     # Time                                      #
@@ -10,7 +10,6 @@ import sys
 import os
 import numpy as np
 import h5py
-import matplotlib.pyplot as plt
 from scipy.ndimage.filters import laplace
 from pysar.utils import ptime
 
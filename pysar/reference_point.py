@@ -12,7 +12,7 @@ import argparse
 import h5py
 import numpy as np
 import random
-from pysar.objects import ifgramStack, timeseries
+from pysar.objects import ifgramStack, timeseries, refValueDatasetName
 from pysar.utils import readfile, writefile, ptime, utils as ut
 
 
@@ -47,6 +47,7 @@ EXAMPLE = """example:
 
   reference_point.py timeseries.h5     -r Seeded_velocity.h5
   reference_point.py 091120_100407.unw -y 257    -x 151      -m Mask.h5 --write-data
+  reference_point.py timeseries.h5     -y 257    -x 151      --virtual
   reference_point.py geo_velocity.h5   -l 34.45  -L -116.23  -m Mask.h5
   reference_point.py unwrapIfgram.h5   -l 34.45  -L -116.23  --lookup geomap_4rlks.trans
   
@@ -70,6 +71,10 @@ def create_parser():
                         help='output file name, disabled when more than 1 input files.')
     parser.add_argument('--write-data', dest='write_data', action='store_true',
                         help='write referenced data value into file, in addition to update metadata.')
+    parser.add_argument('--virtual', action='store_true',
+                        help='save the value of reference pixel of each slice in /{} dataset, in addition to\n'
+                             'update metadata, instead of rewriting the whole data (for timeseries and\n'
+                             'ifgramStack file only). It is subtracted on the fly while reading.'.format(refValueDatasetName))
     parser.add_argument('--reset', action='store_true',
                         help='remove reference pixel information from attributes in the file')
     parser.add_argument('--force', action='store_true',
@@ -196,7 +201,11 @@ def reference_file(inps):
 
     # Seeding file with reference y/x
     atrNew = reference_point_attribute(atr, y=inps.ref_y, x=inps.ref_x)
-    if not inps.write_data:
+    if inps.virtual and atr['FILE_TYPE'] in ['timeseries', 'ifgramStack']:
+        write_reference_value(inps.file, inps.ref_y, inps.ref_x, atrNew)
+        inps.outfile = inps.file
+
+    elif not inps.write_data:
         print('Add/update ref_x/y attribute to file: '+inps.file)
         print(atrNew)
         inps.outfile = ut.add_attribute(inps.file, atrNew)
@@ -211,10 +220,13 @@ def reference_file(inps):
         # For ifgramStack file, update data value directly, do not write to new file
         if k == 'ifgramStack':
             f = h5py.File(inps.file, 'r+')
-            ds = f[k].get('unwrapPhase')
+            ds = f['unwrapPhase']
             for i in range(ds.shape[0]):
                 ds[i, :, :] -= ds[i, inps.ref_y, inps.ref_x]
-            f[k].attrs.update(atrNew)
+            # data is referenced physically, drop the virtual reference
+            if refValueDatasetName in f.keys():
+                del f[refValueDatasetName]
+            f.attrs.update(atrNew)
             f.close()
             inps.outfile = inps.file
 
@@ -236,6 +248,28 @@ def reference_file(inps):
     return inps.outfile
 
 
+def write_reference_value(fname, ref_y, ref_x, atrNew):
+    """Virtual referencing: save value of the reference pixel of each slice into /refValue dataset,
+    which is subtracted on the fly by the read() of timeseries / ifgramStack object,
+    so that re-referencing costs O(num_slice) instead of rewriting the whole file.
+    Parameters: fname  : str, path of timeseries / ifgramStack HDF5 file
+                ref_y/x: int, row / column number of the reference pixel
+                atrNew : dict, metadata of the reference pixel
+    """
+    k = readfile.read_attribute(fname)['FILE_TYPE']
+    dsName = {'timeseries': 'timeseries', 'ifgramStack': 'unwrapPhase'}[k]
+    print('write value of reference pixel to dataset /{} in file: {}'.format(refValueDatasetName, fname))
+    with h5py.File(fname, 'r+') as f:
+        # reference value is always relative to the raw data
+        ref_value = np.array(f[dsName][:, ref_y, ref_x], dtype=np.float32)
+        if refValueDatasetName in f.keys():
+            del f[refValueDatasetName]
+        f.create_dataset(refValueDatasetName, data=ref_value)
+        f.attrs.update(atrNew)
+    print(atrNew)
+    return fname
+
+
 ###############################################################
 def reference_point_attribute(atr, y, x):
     atrNew = dict()
@@ -426,6 +460,13 @@ def remove_reference_pixel(File):
     for i in ['REF_X', 'REF_Y', 'REF_LAT', 'REF_LON']:
         atrDrop[i] = 'None'
     File = ut.add_attribute(File, atrDrop)
+
+    # remove virtual reference value
+    if os.path.splitext(File)[1] in ['.h5', '.he5']:
+        with h5py.File(File, 'r+') as f:
+            if refValueDatasetName in f.keys():
+                print('remove dataset /{} from file: {}'.format(refValueDatasetName, File))
+                del f[refValueDatasetName]
     return File
 
 
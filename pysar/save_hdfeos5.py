@@ -16,7 +16,7 @@ import datetime as dt
 import h5py
 import numpy as np
 from pysar.objects import timeseries, geometry, HDFEOS
-from pysar.utils import readfile
+from pysar.utils import readfile, h5compress
 from pysar import info
 
 
@@ -61,6 +61,9 @@ def create_parser():
                         help='Enable update mode, a.k.a. put XXXXXXXX as endDate in filename if endDate < 1 year')
     parser.add_argument('--subset', action='store_true',
                         help='Enable subset mode, a.k.a. put suffix _N31700_N32100_E130500_E131100')
+    parser.add_argument('--compression', choices=h5compress.COMPRESSION_CHOICES, default=compression,
+                        help='compression while writing HDF5 file, default: {}.\n'.format(compression) +
+                             'auto_size/auto_speed - benchmark filters for min size/max read speed')
     return parser
 
 
@@ -342,7 +345,7 @@ def read_template2inps(template_file, inps=None):
     return inps
 
 
-def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
+def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata, compression=compression):
     """Write HDF5 file in HDF-EOS5 format"""
     ts_obj = timeseries(ts_file)
     ts_obj.open(print_msg=False)
@@ -360,18 +363,19 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
 
     dsName = 'displacement'
     data = ts_obj.read(print_msg=False)
+    kwargs = h5compress.get_compression_kwargs(compression, data)
     print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
            ' with compression={c}').format(g=gName,
                                            d=dsName,
                                            w=maxDigit,
                                            t=str(data.dtype),
                                            s=data.shape,
-                                           c=compression))
+                                           c=h5compress.filter2str(kwargs)))
     dset = group.create_dataset(dsName,
                                 data=data,
                                 dtype=np.float32,
                                 chunks=True,
-                                compression=compression)
+                                **kwargs)
     dset.attrs['Title'] = dsName
     dset.attrs['MissingValue'] = FLOAT_ZERO
     dset.attrs['_FillValue'] = FLOAT_ZERO
@@ -403,17 +407,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     ## 1 - temporalCoherence
     dsName = 'temporalCoherence'
     data = readfile.read(coh_file)[0]
+    kwargs = h5compress.get_compression_kwargs(compression, data)
     print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
            ' with compression={c}').format(g=gName,
                                            d=dsName,
                                            w=maxDigit,
                                            t=str(data.dtype),
                                            s=data.shape,
-                                           c=compression))
+                                           c=h5compress.filter2str(kwargs)))
     dset = group.create_dataset(dsName,
                                 data=data,
                                 chunks=True,
-                                compression=compression)
+                                **kwargs)
     dset.attrs['Title'] = dsName
     dset.attrs['MissingValue'] = FLOAT_ZERO
     dset.attrs['_FillValue'] = FLOAT_ZERO
@@ -422,17 +427,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     ## 2 - mask
     dsName = 'mask'
     data = readfile.read(mask_file, datasetName='mask')[0]
+    kwargs = h5compress.get_compression_kwargs(compression, data)
     print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
            ' with compression={c}').format(g=gName,
                                            d=dsName,
                                            w=maxDigit,
                                            t=str(data.dtype),
                                            s=data.shape,
-                                           c=compression))
+                                           c=h5compress.filter2str(kwargs)))
     dset = group.create_dataset(dsName,
                                 data=data,
                                 chunks=True,
-                                compression=compression)
+                                **kwargs)
     dset.attrs['Title'] = dsName
     dset.attrs['MissingValue'] = BOOL_ZERO
     dset.attrs['_FillValue'] = BOOL_ZERO
@@ -449,17 +455,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     geom_obj.open(print_msg=False)
     for dsName in geom_obj.datasetNames:
         data = geom_obj.read(datasetName=dsName, print_msg=False)
+        kwargs = h5compress.get_compression_kwargs(compression, data)
         print(('create dataset /{g}/{d:<{w}} of {t:<10} in size of {s}'
                ' with compression={c}').format(g=gName,
                                                d=dsName,
                                                w=maxDigit,
                                                t=str(data.dtype),
                                                s=data.shape,
-                                               c=compression))
+                                               c=h5compress.filter2str(kwargs)))
         dset = group.create_dataset(dsName,
                                     data=data,
                                     chunks=True,
-                                    compression=compression)
+                                    **kwargs)
 
         dset.attrs['Title'] = dsName
         if dsName in ['height',
@@ -497,6 +504,18 @@ def write2hdf5(out_file, ts_file, coh_file, mask_file, geom_file, metadata):
     return out_file
 
 
+def get_output_file(iargs=None):
+    """Output file name of the input command line arguments, without writing it,
+    e.g. to declare the output of the save_hdfeos5 step in pysarApp.py"""
+    inps = cmd_line_parse(iargs)
+    if inps.template_file:
+        inps = read_template2inps(inps.template_file, inps)
+    meta_dict = prep_metadata(ts_file=inps.timeseries_file, print_msg=False)
+    return get_output_filename(metadata=meta_dict,
+                               update_mode=inps.update,
+                               subset_mode=inps.subset)
+
+
 ################################################################
 def main(iargs=None):
     inps = cmd_line_parse(iargs)
@@ -517,7 +536,8 @@ def main(iargs=None):
                coh_file=inps.coherence_file,
                mask_file=inps.mask_file,
                geom_file=inps.geom_file,
-               metadata=meta_dict)
+               metadata=meta_dict,
+               compression=inps.compression)
     return outName
 
 
@@ -12,11 +12,10 @@ import glob
 import argparse
 import datetime
 import inspect
-import matplotlib.pyplot as plt
 import numpy as np
 from pysar.defaults.auto_path import autoPath
 from pysar.objects import sensor, ifgramStack
-from pysar.utils import readfile, ptime, network as pnet, plot as pp, utils as ut
+from pysar.utils import readfile, ptime, network as pnet, utils as ut
 
 sar_sensor_list = ['Ers', 'Env', 'Jers', 'Alos', 'Alos2',
                    'Tsx', 'Csk', 'Rsat', 'Rsat2', 'Sen', 'Kmps5', 'G3']
@@ -461,6 +460,8 @@ def write_ifgram_list(inps):
 
 
 def plot_network_info(inps):
+    import matplotlib.pyplot as plt
+    from pysar.utils import plot as pp
     if not inps.disp_fig:
         plt.switch_backend('Agg')
 
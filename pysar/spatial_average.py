@@ -8,9 +8,8 @@
 
 import sys
 import argparse
-import matplotlib.pyplot as plt
 from pysar.objects import ifgramDatasetNames
-from pysar.utils import readfile, ptime, utils as ut, plot as pp
+from pysar.utils import readfile, ptime, utils as ut
 
 
 #################################  Usage  ####################################
@@ -51,6 +50,8 @@ def main(iargs=None):
     atr = readfile.read_attribute(inps.file)
     k = atr['FILE_TYPE']
     if inps.disp_fig and k == 'timeseries':
+        import matplotlib.pyplot as plt
+        from pysar.utils import plot as pp
         dates, datevector = ptime.date_list2vector(date_list)
         # plot
         fig = plt.figure()
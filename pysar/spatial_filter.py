@@ -19,18 +19,27 @@ except ImportError:
     print('See: http://scikit-image.org/')
     print('++++++++++++++++++++++++++++++++++++++++++++')
 
+import h5py
 import numpy as np
-from scipy import ndimage
-from pysar.utils import readfile, writefile
+from scipy import ndimage, signal
+from pysar.objects import refValueDatasetName
+from pysar.utils import readfile, writefile, perf, blockwise
 
 
 ################################################################################################
+# linear filters, via NaN-aware normalized convolution, block by block
+LINEAR_FILTER_TYPES = ['lowpass_gaussian', 'highpass_gaussian', 'lowpass_avg', 'highpass_avg']
+
+# kernel size above which convolution is done in frequency domain with overlap-add FFT
+FFT_KERNEL_SIZE = 15 * 15
+
 EXAMPLE = """example:
   spatial_filter.py  velocity.h5
   spatial_filter.py  timeseries.h5  lowpass_avg        5
   spatial_filter.py  velocity.h5    lowpass_avg        5
   spatial_filter.py  velocity.h5    highpass_gaussian  3
   spatial_filter.py  velocity.h5    sobel
+  spatial_filter.py  timeseries.h5  lowpass_gaussian   50  --num-worker 4
 """
 
 
@@ -52,6 +61,10 @@ def create_parser():
                              'Sigma       for low/high pass gaussian filter, default: 3.0\n' +
                              'Kernel Size for low/high pass average filter, default: 5')
     parser.add_argument('-o', '--outfile', help='Output file name.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to process per block, default: 100e6')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='number of blocks / slices to process in parallel, default: 1.')
     return parser
 
 
@@ -63,6 +76,54 @@ def cmd_line_parse(iargs=None):
 
 
 ################################################################################################
+def get_kernel(filter_type, filter_par):
+    """Convolution kernel of low/high pass filter, normalized to sum of 1
+    Parameters: filter_type : str, low/highpass_avg or low/highpass_gaussian
+                filter_par  : kernel size in int for avg filter, sigma in float for gaussian filter
+    Returns:    kernel : 2D np.array of float32
+    """
+    if filter_type.endswith('avg'):
+        p = int(filter_par)
+        kernel = np.ones((p, p), np.float32)
+    else:
+        # truncate at 4 sigma, as ndimage / skimage
+        r = int(4.0 * filter_par + 0.5)
+        x = np.arange(-r, r+1, dtype=np.float32)
+        g = np.exp(-0.5 * x**2 / filter_par**2)
+        kernel = np.outer(g, g)
+    kernel /= np.sum(kernel)
+    return kernel
+
+
+def convolve_data(data, kernel):
+    """Convolution in the same size, in frequency domain with overlap-add FFT for large kernel,
+    and in spatial domain for small kernel, with zero padding outside of data."""
+    if kernel.size > FFT_KERNEL_SIZE:
+        # oaconvolve is available since scipy 1.4
+        convolve = getattr(signal, 'oaconvolve', signal.fftconvolve)
+        y0, x0 = kernel.shape[0] // 2, kernel.shape[1] // 2
+        data_conv = convolve(data, kernel, mode='full')
+        data_conv = data_conv[y0:y0+data.shape[0], x0:x0+data.shape[1]]
+    else:
+        data_conv = ndimage.convolve(data, kernel, mode='constant', cval=0.)
+    return data_conv
+
+
+def convolve_nan(data, kernel):
+    """NaN-aware normalized convolution: weighted average of valid pixels within the kernel
+    Parameters: data   : 2D np.array, with NaN for no-data pixels
+                kernel : 2D np.array, normalized convolution kernel
+    Returns:    data_conv : 2D np.array of float32, NaN for no-data pixels
+    """
+    valid = ~np.isnan(data)
+    data_conv = convolve_data(np.where(valid, data, 0.).astype(np.float32), kernel)
+    weight = convolve_data(valid.astype(np.float32), kernel)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data_conv /= weight
+    data_conv[np.logical_or(~valid, weight < 1e-6)] = np.nan
+    return data_conv.astype(np.float32)
+
+
 def filter_data(data, filter_type, filter_par=None):
     """Filter 2D matrix with selected filter
     Inputs:
@@ -82,21 +143,10 @@ def filter_data(data, filter_type, filter_par=None):
     elif filter_type == "canny":
         data_filt = feature.canny(data)
 
-    elif filter_type == "lowpass_avg":
-        p = int(filter_par)
-        kernel = np.ones((p, p), np.float32)/(p*p)
-        data_filt = ndimage.convolve(data, kernel)
-    elif filter_type == "highpass_avg":
-        p = int(filter_par)
-        kernel = np.ones((p, p), np.float32)/(p*p)
-        lp_data = ndimage.convolve(data, kernel)
-        data_filt = data - lp_data
-
-    elif filter_type == "lowpass_gaussian":
-        data_filt = filters.gaussian(data, sigma=filter_par)
-    elif filter_type == "highpass_gaussian":
-        lp_data = filters.gaussian(data, sigma=filter_par)
-        data_filt = data - lp_data
+    elif filter_type in LINEAR_FILTER_TYPES:
+        data_filt = convolve_nan(np.array(data, np.float32), get_kernel(filter_type, filter_par))
+        if filter_type.startswith('highpass'):
+            data_filt = data - data_filt
 
     else:
         raise Exception('Un-recognized filter type: '+filter_type)
@@ -105,7 +155,79 @@ def filter_data(data, filter_type, filter_par=None):
 
 
 ############################################################
-def filter_file(fname, filter_type, filter_par=None, fname_out=None):
+def filter_block(fname, dsName, block, filter_type, filter_par, halo):
+    """Read and filter one block of rows with halo
+    Parameters: block : list of [z0, z1, y0, y1] of one slice, z0/z1 is None for 2D dataset
+    Returns:    data  : 2D np.array of float32 in size of (y1-y0, width)
+                block : list of [z0, z1, y0, y1], input block
+    """
+    z0, z1, y0, y1 = block
+    with h5py.File(fname, 'r') as f:
+        ds = f[dsName]
+        y0h, y1h = max(y0 - halo, 0), min(y1 + halo, ds.shape[-2])
+        with perf.phase('read'):
+            if z0 is None:
+                data = ds[y0h:y1h, :]
+            else:
+                data = ds[z0, y0h:y1h, :]
+    with perf.phase('compute'):
+        data = filter_data(np.array(data, np.float32), filter_type, filter_par)
+    return data[y0-y0h:y1-y0h, :], block
+
+
+def filter_hdf5_file(fname, filter_type, filter_par, fname_out, chunk_size=100e6, num_worker=1):
+    """Filter HDF5 file with datasets in the root level with linear filter,
+    block by block with halo and slice by slice in parallel.
+    Non-spatial datasets, e.g. date and bperp, are copied."""
+    atr = readfile.read_attribute(fname)
+    dsNames = readfile.get_dataset_list(fname)
+    kernel = get_kernel(filter_type, filter_par)
+    halo = kernel.shape[0] // 2
+    if kernel.size > FFT_KERNEL_SIZE:
+        print('convolution via overlap-add FFT with kernel size of {}'.format(kernel.shape))
+
+    # layout output file
+    dsNameDict = dict()
+    ds_shape_dict = dict()
+    with h5py.File(fname, 'r') as f:
+        for key in f.keys():
+            ds = f[key]
+            if not isinstance(ds, h5py.Dataset):
+                continue
+            if key in dsNames:
+                ds_shape_dict[key] = ds.shape
+                dsNameDict[key] = (np.float32, ds.shape, None)
+            elif key == refValueDatasetName and filter_type.startswith('highpass'):
+                # high pass filtered data is independent of the reference value
+                continue
+            else:
+                dsNameDict[key] = (ds.dtype, ds.shape, ds[:])
+    writefile.layout_hdf5(fname_out, dsNameDict, metadata=atr)
+
+    # list of tasks: dataset, slice and block
+    task_list = []
+    for dsName in dsNames:
+        # memory of data, weight and their FFT in complex
+        block_list = blockwise.split2blocks(ds_shape_dict[dsName], chunk_size=chunk_size, num_copy=6,
+                                            halo=halo, slice_step=1)
+        for block in block_list:
+            task_list.append((fname, dsName, block, filter_type, filter_par, halo))
+
+    def write_block(task, result):
+        data, (z0, z1, y0, y1) = result
+        out_block = [y0, y1, 0, data.shape[-1]]
+        if z0 is not None:
+            out_block = [z0, z1] + out_block
+        with perf.phase('write'):
+            writefile.write_hdf5_block(fname_out, data, datasetName=task[1], block=out_block, print_msg=False)
+
+    blockwise.run_tasks(filter_block, task_list, write_block, num_worker=num_worker,
+                        suffix=lambda task: task[1])
+    print('finished writing to file: {}'.format(fname_out))
+    return fname_out
+
+
+def filter_file(fname, filter_type, filter_par=None, fname_out=None, chunk_size=100e6, num_worker=1):
     """Filter 2D matrix with selected filter
     Inputs:
         fname       : string, name/path of file to be filtered
@@ -113,6 +235,8 @@ def filter_file(fname, filter_type, filter_par=None, fname_out=None):
         filter_par  : string, optional, parameter for low/high pass filter
                       for low/highpass_avg, it's kernel size in int
                       for low/highpass_gaussain, it's sigma in float
+        chunk_size  : float, max number of data elements to process per block
+        num_worker  : int, number of blocks / slices to process in parallel
     Output:
         fname_out   : string, optional, output file name/path
     """
@@ -136,6 +260,12 @@ def filter_file(fname, filter_type, filter_par=None, fname_out=None):
         fname_out = '{}_{}{}'.format(os.path.splitext(fname)[0], filter_type,
                                      os.path.splitext(fname)[1])
 
+    # HDF5 file with linear filter: block by block
+    if filter_type in LINEAR_FILTER_TYPES and readfile.is_root_hdf5_file(fname):
+        return filter_hdf5_file(fname, filter_type, filter_par, fname_out,
+                                chunk_size=chunk_size,
+                                num_worker=num_worker)
+
     # filtering file
     dsNames = readfile.get_dataset_list(fname)
     maxDigit = max([len(i) for i in dsNames])
@@ -162,7 +292,10 @@ def filter_file(fname, filter_type, filter_par=None, fname_out=None):
 def main(iargs=None):
     inps = cmd_line_parse(iargs)
 
-    inps.outfile = filter_file(inps.file, inps.filter_type, inps.filter_par)
+    inps.outfile = filter_file(inps.file, inps.filter_type, inps.filter_par,
+                               fname_out=inps.outfile,
+                               chunk_size=inps.chunk_size,
+                               num_worker=inps.numWorker)
     print('Done.')
     return inps.outfile
 
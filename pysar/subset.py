@@ -214,8 +214,8 @@ def bbox_geo2radar(geo_box, atr_rdr=dict(), lookup_file=None, print_msg=False):
                                            atr_rdr,
                                            print_msg=print_msg)
         buf = 2*(np.max(np.abs([x_res, y_res])))
-        pix_box = (np.min(x)-buf, np.min(y)-buf,
-                   np.max(x)+buf, np.max(y)+buf)
+        pix_box = (np.nanmin(x)-buf, np.nanmin(y)-buf,
+                   np.nanmax(x)+buf, np.nanmax(y)+buf)
     return pix_box
 
 
@@ -240,8 +240,8 @@ def bbox_radar2geo(pix_box, atr_rdr=dict(), lookup_file=None, print_msg=False):
                                                    atr_rdr,
                                                    print_msg=print_msg)
         buf = 2*(np.max(np.abs([lat_res, lon_res])))
-        geo_box = (np.min(lon)-buf, np.max(lat)+buf,
-                   np.max(lon)+buf, np.min(lat)-buf)
+        geo_box = (np.nanmin(lon)-buf, np.nanmax(lat)+buf,
+                   np.nanmax(lon)+buf, np.nanmin(lat)-buf)
     return geo_box
 
 
@@ -10,18 +10,24 @@ import os
 import argparse
 import numpy as np
 from pysar.objects import timeseries
-from pysar.utils import ptime
+from pysar.utils import ptime, perf, writefile, blockwise
 
 
 ############################################################
+KERNEL_SUFFIX = {'gaussian'   : 'tempGaussian',
+                 'triangular' : 'tempTriangular',
+                 'robust'     : 'tempRobust'}
+
 EXAMPLE = """example:
  temporal_filter.py timeseries_ECMWF_demErr_refDate.h5
  temporal_filter.py timeseries_ECMWF_demErr_refDate.h5 -t 0.3
+ temporal_filter.py timeseries_ECMWF_demErr_refDate.h5 -t 0.3 --kernel robust
+ temporal_filter.py timeseries_ECMWF_demErr_refDate.h5 -t 0.5 --kernel triangular --chunk-size 50e6
 """
 
 
 def create_parser():
-    parser = argparse.ArgumentParser(description='Smoothing timeseries in time using moving Gaussian window\n' +
+    parser = argparse.ArgumentParser(description='Smoothing timeseries in time using moving window\n' +
                                      '  https://en.wikipedia.org/wiki/Gaussian_blur',
                                      formatter_class=argparse.RawTextHelpFormatter,
                                      epilog=EXAMPLE)
@@ -29,7 +35,20 @@ def create_parser():
     parser.add_argument('timeseries_file',
                         help='timeseries file to be smoothed.')
     parser.add_argument('-t', '--time-win', dest='time_win', type=float, default=0.3,
-                        help='time window in years (Sigma of the assmued Gaussian distribution.)')
+                        help='time window in years, default: 0.3\n' +
+                             'Sigma of the assmued Gaussian distribution for gaussian and robust kernel\n' +
+                             'Half width of the window for triangular kernel')
+    parser.add_argument('-k', '--kernel', dest='kernel', choices=list(KERNEL_SUFFIX.keys()), default='gaussian',
+                        help='filter kernel in time, default: gaussian\n' +
+                             'gaussian   : Gaussian weighted average\n' +
+                             'triangular : triangular weighted average\n' +
+                             'robust     : median-like robust smoother, Gaussian weighted average with\n' +
+                             '             bisquare weights from the median absolute deviation of residuals\n' +
+                             '             down-weighting outliers, e.g. unwrapping errors (Cleveland, 1979)')
+    parser.add_argument('--robust-iter', dest='robust_iter', type=int, default=2,
+                        help='number of robustness iterations for robust kernel, default: 2')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to process per block, default: 100e6')
     parser.add_argument('-o', '--outfile', help='Output file name.')
     return parser
 
@@ -41,41 +60,111 @@ def cmd_line_parse(iargs=None):
 
 
 ############################################################
-def main(iargs=None):
-    inps = cmd_line_parse(iargs)
-
-    # read timeseries info / data
-    obj = timeseries(inps.timeseries_file)
+def get_weight_matrix(tbase, time_win, kernel='gaussian'):
+    """Weight matrix of the moving window in time, with each row normalized to 1,
+    so that the filtered time-series = W * time-series
+    Parameters: tbase    : 1D np.array, time in years
+                time_win : float, time window in years
+                kernel   : str, gaussian / triangular / robust
+    Returns:    W : 2D np.array of float32 in size of (num_date, num_date)
+    """
+    tbase = np.array(tbase, np.float32).flatten()
+    tbase_diff = tbase.reshape(-1, 1) - tbase.reshape(1, -1)
+    if kernel == 'triangular':
+        W = np.maximum(1. - np.abs(tbase_diff) / time_win, 0.)
+    else:
+        W = np.exp(-0.5 * (tbase_diff**2) / (time_win**2))
+    W /= np.sum(W, axis=1, keepdims=True)
+    return W.astype(np.float32)
+
+
+def filter_data(ts_data, W, kernel='gaussian', robust_iter=2):
+    """Filter time-series of a group of pixels in time
+    Parameters: ts_data : 2D np.array in size of (num_date, num_pixel)
+                W       : 2D np.array in size of (num_date, num_date), weight matrix
+                kernel  : str, gaussian / triangular / robust
+                robust_iter : int, number of robustness iterations for robust kernel
+    Returns:    ts_filt : 2D np.array in size of (num_date, num_pixel)
+    """
+    ts_filt = np.dot(W, ts_data)
+    if kernel != 'robust':
+        return ts_filt
+
+    for i in range(robust_iter):
+        # bisquare robustness weight of each acquisition of each pixel
+        res = np.abs(ts_data - ts_filt)
+        mad = np.median(res, axis=0)
+        mad[mad == 0.] = np.finfo(np.float32).eps
+        rob_weight = np.square(np.maximum(1. - np.square(res / (6. * mad)), 0.))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ts_rob = np.dot(W, rob_weight * ts_data) / np.dot(W, rob_weight)
+        # keep the non-robust result for pixels with all acquisitions as outlier
+        ts_filt = np.where(np.isnan(ts_rob), ts_filt, ts_rob)
+    return ts_filt
+
+
+def filter_file(ts_file, time_win=0.3, kernel='gaussian', robust_iter=2, out_file=None, chunk_size=100e6):
+    """Filter time-series file in time block by block, with results written into output file incrementally.
+    Parameters: ts_file  : str, path of time-series file
+                time_win : float, time window in years
+                kernel   : str, gaussian / triangular / robust
+                robust_iter : int, number of robustness iterations for robust kernel
+                out_file : str, path of output time-series file
+                chunk_size : float, max number of data elements to process per block
+    Returns:    out_file
+    """
+    # read timeseries info
+    obj = timeseries(ts_file)
     obj.open()
 
-    tbase = np.array(obj.yearList, np.float32).reshape(-1, 1)
+    tbase = np.array(obj.yearList, np.float32)
     tbase -= tbase[obj.refIndex]
-
-    ts_data = obj.read().reshape(obj.numDate, -1)
-
-    # Smooth acquisitions / moving window in time one by one
+    W = get_weight_matrix(tbase, time_win, kernel=kernel)
+
+    # output file
+    if not out_file:
+        out_file = '{}_{}.h5'.format(os.path.splitext(ts_file)[0], KERNEL_SUFFIX[kernel])
+    dsNameDict = {'date'       : (np.string_, (obj.numDate,), obj.dateList),
+                  'timeseries' : (np.float32, (obj.numDate, obj.length, obj.width), None)}
+    if obj.pbase is not None:
+        dsNameDict['bperp'] = (np.float32, (obj.numDate,), obj.pbase)
+    atr = dict(obj.metadata)
+    atr['FILE_TYPE'] = 'timeseries'
+    writefile.layout_hdf5(out_file, dsNameDict, metadata=atr)
+
+    # Smooth acquisitions / moving window in time block by block
     print('-'*50)
-    print('filtering in time Gaussian window with size of {:.1f} years'.format(inps.time_win))
-    ts_data_filt = np.zeros(ts_data.shape, np.float32)
-    prog_bar = ptime.progressBar(maxValue=obj.numDate)
-    for i in range(obj.numDate):
-        # Weight from Gaussian (normal) distribution in time
-        tbase_diff = tbase[i] - tbase
-        weight = np.exp(-0.5 * (tbase_diff**2) / (inps.time_win**2))
-        weight /= np.sum(weight)
-        # Smooth the current acquisition
-        ts_data_filt[i, :] = np.sum(ts_data * weight, axis=0)
-        prog_bar.update(i+1, suffix=obj.dateList[i])
+    print('filtering in time {} window with size of {:.1f} years'.format(kernel, time_win))
+    num_copy = 5 if kernel == 'robust' else 2
+    box_list = blockwise.split2boxes(obj.length, obj.width, num_slice=obj.numDate,
+                                     chunk_size=chunk_size, num_copy=num_copy)
+    prog_bar = ptime.progressBar(maxValue=obj.length)
+    for box in box_list:
+        with perf.phase('read'):
+            ts_data = obj.read(box=box, print_msg=False).reshape(obj.numDate, -1)
+
+        with perf.phase('compute'):
+            ts_data = filter_data(ts_data, W, kernel=kernel, robust_iter=robust_iter)
+            ts_data -= ts_data[obj.refIndex, :]
+
+        with perf.phase('write'):
+            block = [0, obj.numDate, box[1], box[3], box[0], box[2]]
+            writefile.write_hdf5_block(out_file, ts_data, 'timeseries', block=block, print_msg=False)
+        prog_bar.update(box[3], suffix='{}/{} lines'.format(box[3], obj.length))
     prog_bar.close()
-    del ts_data
-    ts_data_filt -= ts_data_filt[obj.refIndex, :]
-    ts_data_filt = np.reshape(ts_data_filt, (obj.numDate, obj.length, obj.width))
-
-    # write filtered timeseries file
-    if not inps.outfile:
-        inps.outfile = '{}_tempGaussian.h5'.format(os.path.splitext(inps.timeseries_file)[0])
-    obj_out = timeseries(inps.outfile)
-    obj_out.write2hdf5(ts_data_filt, refFile=inps.timeseries_file)
+    print('finished writing to file: {}'.format(out_file))
+    return out_file
+
+
+############################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    inps.outfile = filter_file(inps.timeseries_file,
+                               time_win=inps.time_win,
+                               kernel=inps.kernel,
+                               robust_iter=inps.robust_iter,
+                               out_file=inps.outfile,
+                               chunk_size=inps.chunk_size)
     return inps.outfile
 
 
@@ -7,10 +7,11 @@
 
 
 import os
+import math
 import argparse
 import numpy as np
 from pysar.objects import timeseries
-from pysar.utils import readfile, writefile, ptime, utils as ut
+from pysar.utils import readfile, writefile, ptime, perf, blockwise, utils as ut
 
 dataType = np.float32
 
@@ -23,6 +24,9 @@ EXAMPLE = """example:
   timeseries2velocity.py  timeseries.h5  --start-date 20080201  --end-date 20100508
   timeseries2velocity.py  timeseries.h5  --exclude-date 20040502 20060708 20090103
   timeseries2velocity.py  timeseries.h5  --exclude-date exclude_date.txt
+
+  # temporal deformation model: acceleration, annual and semi-annual sinusoids and a co-seismic step
+  timeseries2velocity.py  timeseries.h5  --polynomial 2  --periodic 1.0 0.5  --step 20110311
 """
 
 TEMPLATE = """
@@ -30,6 +34,10 @@ TEMPLATE = """
 pysar.velocity.excludeDate = auto   #[exclude_date.txt / 20080520,20090817 / no], auto for exclude_date.txt
 pysar.velocity.startDate   = auto   #[20070101 / no], auto for no
 pysar.velocity.endDate     = auto   #[20101230 / no], auto for no
+## temporal deformation model, estimated in one pass with the same design matrix for all pixels
+pysar.velocity.polynomial  = auto   #[1 / 2 / 3], auto for 1 - linear velocity, 2 for acceleration
+pysar.velocity.periodic    = auto   #[1.0,0.5 / no], auto for no, period(s) in years of sinusoid functions
+pysar.velocity.stepDate    = auto   #[20110311,20120928 / no], auto for no, date(s) of step functions
 """
 
 DROP_DATE_TXT = """exclude_date.txt:
@@ -58,6 +66,20 @@ def create_parser():
                         help='template file with the following items:'+TEMPLATE)
     parser.add_argument('-o', '--output', dest='outfile',
                         help='output file name')
+
+    model = parser.add_argument_group('deformation model', 'temporal deformation model to estimate')
+    model.add_argument('--polynomial', '--poly-order', dest='polynomial', type=int, default=1,
+                       help='polynomial order in time, default: 1 - linear velocity\n' +
+                            '2 for acceleration, 3 for acceleration rate')
+    model.add_argument('--periodic', '--period', dest='periodic', type=float, nargs='+', default=[],
+                       help='period(s) in years of sinusoid functions, i.e.:\n' +
+                            '--periodic 1.0 0.5 for annual and semi-annual variation')
+    model.add_argument('--step', dest='step_date', nargs='+', default=[],
+                       help='date(s) of step functions, e.g. earthquakes, i.e.:\n' +
+                            '--step 20110311')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to read/process per block, default: 100e6\n' +
+                             'memory usage is ~ 3 * 4 * chunk_size bytes')
     return parser
 
 
@@ -176,38 +198,143 @@ def read_template2inps(template_file, inps=None):
         if value not in ['auto', 'no']:
             inps.max_date = ptime.yyyymmdd(value)
 
-    return inps
+    key = prefix+'polynomial'
+    if key in template.keys():
+        value = template[key]
+        if value not in ['auto', 'no']:
+            inps.polynomial = int(value)
 
+    key = prefix+'periodic'
+    if key in template.keys():
+        value = template[key]
+        if value not in ['auto', 'no']:
+            inps.periodic = [float(i) for i in value.replace(',', ' ').split()]
 
-def design_matrix(years):
-    """design matrix/function model of linear velocity estimation
-    Parameters: years : 1D array of float in size of (numDate,),
-                    date in years, e.g. 2015.1830937713896
-    Returns:    A : 2D array of int in size of (numDate, 2)
-    """
-    A = np.ones([len(years), 2], dtype=dataType)
-    A[:, 0] = years
-    #A_inv = np.dot(np.linalg.inv(np.dot(A.T,A)), A.T)
-    #A_inv = np.array(A_inv, dataType)
-    return A
+    key = prefix+'stepDate'
+    if key in template.keys():
+        value = template[key]
+        if value not in ['auto', 'no']:
+            inps.step_date = ptime.yyyymmdd(value.replace(',', ' ').split())
 
+    return inps
 
-def estimate_linear_velocity(inps):
-    A = design_matrix(inps.years)
-    A_inv = np.array(np.linalg.pinv(A), dataType)
-    # A_inv = np.array(np.linalg.inv(A.T.dot(A)).dot(A.T), dataType)  #Give wrong and different result, find reason.
 
+def get_model_names(polynomial=1, periodic=[], step_date=[]):
+    """Names of the parameters of the temporal deformation model, in the column order
+    of the design matrix, excluding the constant offset.
+    Returns: names : list of str, e.g. ['velocity', 'annualCosine', 'annualSine', 'step20110311']
+    """
+    poly_names = ['velocity', 'acceleration', 'accelerationRate']
+    names = []
+    for i in range(1, polynomial+1):
+        names.append(poly_names[i-1] if i <= len(poly_names) else 'poly{}'.format(i))
+    for period in periodic:
+        name = get_period_name(period)
+        names += [name+'Cosine', name+'Sine']
+    for date in step_date:
+        names.append('step{}'.format(date))
+    return names
+
+
+def get_period_name(period):
+    if period == 1.:
+        return 'annual'
+    elif period == 0.5:
+        return 'semiAnnual'
+    return 'period{:g}Year'.format(period).replace('.', 'p')
+
+
+def design_matrix(years, polynomial=1, periodic=[], step_years=[]):
+    """design matrix/function model of the temporal deformation:
+        d(t) = c0 + sum_i(c_i * (t-t0)^i / i!)                          polynomial
+                  + sum_j(a_j * cos(2*pi*t/T_j) + b_j * sin(2*pi*t/T_j))   periodic
+                  + sum_k(s_k * H(t-t_k))                               step
+    Parameters: years      : 1D array of float in size of (numDate,),
+                             date in years, e.g. 2015.1830937713896
+                polynomial : int, polynomial order, 1 for linear velocity
+                periodic   : list of float, period(s) in years of sinusoid functions
+                step_years : list of float, date(s) in years of step functions
+    Returns:    A : 2D array of float64 in size of (numDate, numParam), with the column of the
+                    constant offset last, in the order of get_model_names()
+    """
+    years = np.array(years, dtype=np.float64)
+    # relative to the first date, for numerical stability of high order terms
+    t = years - years[0]
+    A = []
+    for i in range(1, polynomial+1):
+        A.append(t**i / math.factorial(i))
+    for period in periodic:
+        A.append(np.cos(2. * np.pi * years / period))
+        A.append(np.sin(2. * np.pi * years / period))
+    for step_year in step_years:
+        A.append(np.array(years > step_year, dtype=np.float64))
+    A.append(np.ones(len(years), dtype=np.float64))
+    return np.vstack(A).T
+
+
+def estimate_time_func_data(ts_data, A, A_inv, Q, period_idx=[]):
+    """Estimate the temporal deformation model for a block of pixels.
+    Parameters: ts_data : 2D array of float32 in size of (numDate, numPixel)
+                A       : 2D array of float32 in size of (numDate, numParam), design matrix
+                A_inv   : 2D array of float32 in size of (numParam, numDate), pseudo-inverse of A
+                Q       : 2D array of float64 in size of (numParam, numParam), cofactor matrix inv(A'A)
+                period_idx : list of int, column index of the cosine term of each periodic function,
+                             followed by its sine term
+    Returns:    X       : 2D array of float32 in size of (numParam, numPixel), estimated parameters
+                X_std   : 2D array of float32 in size of (numParam, numPixel), formal STD
+                amp     : 2D array of float32 in size of (numPeriod, numPixel), amplitude of sinusoids
+                amp_std : 2D array of float32 in size of (numPeriod, numPixel), formal STD of amplitude
+    """
+    num_date, num_param = A.shape
+    X = np.dot(A_inv, ts_data)
+
+    # variance of unit weight from the residual
+    ts_res = ts_data - np.dot(A, X)
+    sigma2 = np.sum(ts_res**2, axis=0) / (num_date - num_param)
+    del ts_res
+    X_std = np.sqrt(np.outer(np.diag(Q), sigma2)).astype(np.float32)
+
+    # amplitude of sinusoid: sqrt(a^2 + b^2), with its STD propagated from the covariance of (a, b)
+    amp = np.zeros((len(period_idx), X.shape[1]), dtype=np.float32)
+    amp_std = np.zeros((len(period_idx), X.shape[1]), dtype=np.float32)
+    for i, j in enumerate(period_idx):
+        a, b = X[j, :], X[j+1, :]
+        amp[i, :] = np.hypot(a, b)
+        amp_var = sigma2 * (a**2 * Q[j, j] + 2 * a * b * Q[j, j+1] + b**2 * Q[j+1, j+1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            amp_std[i, :] = np.sqrt(amp_var) / amp[i, :]
+    return X, X_std, amp, amp_std
+
+
+def estimate_time_func(inps):
+    """Estimate the temporal deformation model from time-series block by block, and
+    write each parameter and its formal STD into datasets of the output file."""
     tsobj = timeseries(inps.timeseries_file)
-    tsData = tsobj.read()[inps.dropDate, :, :].reshape(inps.numDate, -1)
-    dsShape = (tsobj.length, tsobj.width)
-
-    X = np.dot(A_inv, tsData)
-    V = np.reshape(X[0, :], dsShape)
-
-    tsResidual = tsData - np.dot(A, X)
-    timeStd = np.sqrt(np.sum((inps.years - np.mean(inps.years))**2))
-    Vstd = np.sqrt(np.sum(tsResidual**2, axis=0) / (inps.numDate-2)) / timeStd
-    Vstd = Vstd.reshape(dsShape)
+    tsobj.open(print_msg=False)
+
+    # step function date(s) within the time span
+    inps.step_date = [i for i in ptime.yyyymmdd(list(inps.step_date))
+                      if inps.dateList[0] <= i < inps.dateList[-1]]
+    step_years = ptime.yyyymmdd2years(inps.step_date)
+
+    # design matrix and its pseudo-inverse, the same for all pixels
+    A = design_matrix(inps.years,
+                      polynomial=inps.polynomial,
+                      periodic=inps.periodic,
+                      step_years=step_years)
+    num_param = A.shape[1]
+    if inps.numDate <= num_param:
+        raise ValueError('number of dates ({}) <= number of parameters ({}) to estimate!'.format(
+            inps.numDate, num_param))
+    A_inv = np.linalg.pinv(A)
+    Q = np.dot(A_inv, A_inv.T)
+    A = np.array(A, dataType)
+    A_inv = np.array(A_inv, dataType)
+
+    names = get_model_names(inps.polynomial, inps.periodic, inps.step_date)
+    period_idx = [names.index(get_period_name(i)+'Cosine') for i in inps.periodic]
+    amp_names = [get_period_name(i)+'Amplitude' for i in inps.periodic]
+    print('estimate deformation model with {} parameters: {}'.format(len(names), names))
 
     # Write h5 file
     if not inps.outfile:
@@ -215,17 +342,46 @@ def estimate_linear_velocity(inps):
             inps.outfile = 'velocityEx.h5'
         else:
             inps.outfile = 'velocity.h5'
-    # outfileStd = '{}Std{}'.format(os.path.splitext(inps.outfile)[0],
-    #                               os.path.splitext(inps.outfile)[1])
 
     atr = tsobj.metadata.copy()
     atr['FILE_TYPE'] = 'velocity'
     atr['UNIT'] = 'm/year'
-
-    dsDict = dict()
-    dsDict['velocity'] = V
-    dsDict['velocityStd'] = Vstd
-    writefile.write(dsDict, out_file=inps.outfile, metadata=atr)
+    shape2d = (tsobj.length, tsobj.width)
+    dsNameDict = dict()
+    for name in names + amp_names:
+        dsNameDict[name] = (dataType, shape2d, None)
+        dsNameDict[name+'Std'] = (dataType, shape2d, None)
+    writefile.layout_hdf5(inps.outfile, dsNameDict, metadata=atr)
+
+    box_list = blockwise.split2boxes(tsobj.length, tsobj.width, num_slice=tsobj.numDate,
+                                     chunk_size=inps.chunk_size, print_msg=True)
+    for i, box in enumerate(box_list):
+        if len(box_list) > 1:
+            print('\n------- processing patch {} out of {} --------------'.format(i+1, len(box_list)))
+        block = [box[1], box[3], box[0], box[2]]
+        box_shape = (box[3] - box[1], box[2] - box[0])
+
+        with perf.phase('read'):
+            ts_data = tsobj.read(datasetName=inps.dateList, box=box, print_msg=False)
+            ts_data = ts_data.reshape(inps.numDate, -1)
+
+        with perf.phase('compute'):
+            X, X_std, amp, amp_std = estimate_time_func_data(ts_data, A, A_inv, Q, period_idx=period_idx)
+            del ts_data
+
+        with perf.phase('write'):
+            for j, name in enumerate(names):
+                writefile.write_hdf5_block(inps.outfile, X[j, :].reshape(box_shape), name,
+                                           block=block, print_msg=False)
+                writefile.write_hdf5_block(inps.outfile, X_std[j, :].reshape(box_shape), name+'Std',
+                                           block=block, print_msg=False)
+            for j, name in enumerate(amp_names):
+                writefile.write_hdf5_block(inps.outfile, amp[j, :].reshape(box_shape), name,
+                                           block=block, print_msg=False)
+                writefile.write_hdf5_block(inps.outfile, amp_std[j, :].reshape(box_shape), name+'Std',
+                                           block=block, print_msg=False)
+
+    print('finished writing to {}'.format(inps.outfile))
     return inps.outfile
 
 
@@ -233,7 +389,7 @@ def estimate_linear_velocity(inps):
 def main(iargs=None):
     inps = cmd_line_parse(iargs)
     inps = read_date_info(inps)
-    inps.outfile = estimate_linear_velocity(inps)
+    inps.outfile = estimate_time_func(inps)
     print('Done.')
     return inps.outfile
 
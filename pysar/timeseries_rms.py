@@ -10,10 +10,7 @@ import os
 import sys
 import argparse
 import numpy as np
-import matplotlib as mpl
-mpl.use('Agg')
-import matplotlib.pyplot as plt
-from pysar.utils import readfile, ptime, utils as ut, plot as pp
+from pysar.utils import readfile, ptime, utils as ut
 
 
 ######################################################################################################
@@ -121,6 +118,10 @@ def save_date2txt_file(inps):
 
 
 def plot_bar4date_rms(inps):
+    import matplotlib as mpl
+    mpl.use('Agg')
+    import matplotlib.pyplot as plt
+    from pysar.utils import plot as pp
     inps.figName = os.path.splitext(inps.rmsFile)[0]+'.pdf'
     if ut.update_file(inps.figName, [inps.exDateFile, inps.refDateFile, inps.template_file], check_readable=False):
         if inps.fig_size:
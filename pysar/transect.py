@@ -58,6 +58,9 @@ def create_parser():
                           '>\n'
                           '131.1663    33.1157\n'
                           '131.2621    33.0860')
+    end.add_argument('-l', '--lookup', dest='lookup_file',
+                     help='lookup table file to convert lat/lon for file in radar coord.\n'
+                          'Default: auto search in ./INPUTS')
 
     # DEM
     dem = parser.add_argument_group('DEM', 'display topography in the bottom')
@@ -214,11 +217,24 @@ def transect_yx(z, atr, start_yx, end_yx, interpolation='nearest'):
     return transect
 
 
-def transect_lalo(z, atr, start_lalo, end_lalo, interpolation='nearest'):
+def lalo2yx(start_lalo, end_lalo, atr, lookup_file=None):
+    """Convert start/end point from lat/lon into y/x, for file in geo coord,
+    or in radar coord with lookup table, in sub-pixel precision."""
+    lat = [start_lalo[0], end_lalo[0]]
+    lon = [start_lalo[1], end_lalo[1]]
+    if 'Y_FIRST' in atr.keys():
+        y = ut.coord_geo2radar(lat, atr, 'lat')
+        x = ut.coord_geo2radar(lon, atr, 'lon')
+    else:
+        y, x = ut.glob2radar(np.array(lat), np.array(lon), lookup_file, atr,
+                             print_msg=False, subpixel=True)[0:2]
+    return [y[0], x[0]], [y[1], x[1]]
+
+
+def transect_lalo(z, atr, start_lalo, end_lalo, interpolation='nearest', lookup_file=None):
     """Extract 2D matrix (z) value along the line [start_lalo, end_lalo]"""
-    [y0, y1] = ut.coord_geo2radar([start_lalo[0], end_lalo[0]], atr, 'lat')
-    [x0, x1] = ut.coord_geo2radar([start_lalo[1], end_lalo[1]], atr, 'lon')
-    transect = transect_yx(z, atr, [y0, x0], [y1, x1], interpolation)
+    start_yx, end_yx = lalo2yx(start_lalo, end_lalo, atr, lookup_file)
+    transect = transect_yx(z, atr, start_yx, end_yx, interpolation)
     return transect
 
 
@@ -243,7 +259,8 @@ def transect_list(fileList, inps):
         if inps.start_lalo and inps.end_lalo:
             transect = transect_lalo(data, atr,
                                      inps.start_lalo, inps.end_lalo,
-                                     inps.interpolation)
+                                     inps.interpolation,
+                                     lookup_file=inps.lookup_file)
         else:
             transect = transect_yx(data, atr,
                                    inps.start_yx, inps.end_yx,
@@ -280,10 +297,7 @@ def plot_transect_location(ax, inps):
     ax.imshow(data0)
 
     if inps.start_lalo and inps.end_lalo:
-        [y0, y1] = ut.coord_geo2radar([inps.start_lalo[0], inps.end_lalo[0]], atr0, 'lat')
-        [x0, x1] = ut.coord_geo2radar([inps.start_lalo[1], inps.end_lalo[1]], atr0, 'lon')
-        inps.start_yx = [y0, x0]
-        inps.end_yx = [y1, x1]
+        inps.start_yx, inps.end_yx = lalo2yx(inps.start_lalo, inps.end_lalo, atr0, inps.lookup_file)
 
     ax.plot([inps.start_yx[1], inps.end_yx[1]],
             [inps.start_yx[0], inps.end_yx[0]], 'ro-')
@@ -1,4 +1,4 @@
-#! /usr/bin/env python2
+#!/usr/bin/env python3
 ############################################################
 # Program is part of PySAR                                 #
 # Copyright(c) 2018, Bhuvan Varugu, Zhang Yunjun           #
@@ -7,295 +7,389 @@
 
 
 import os
+import argparse
+from concurrent import futures
 import numpy as np
-import sys
-import pyaps as pa
-import scipy as sc
 from scipy.interpolate import RegularGridInterpolator as RGI
 from scipy.interpolate import griddata
-import pyaps as pa
-import matplotlib.pyplot as plt
-import pysar._pysar_utilities as ut
-import pysar._readfile as readfile
-import pysar._writefile as writefile
-import h5py
-import pysar._datetime as ptime
-import argparse
+from pysar.objects import timeseries, ifgramStack
+from pysar.utils import readfile, writefile, ptime, perf, blockwise, utils as ut
 
 
-##########################################################
-def read_params(filename):
-    fil=open(filename+'.rsc','r')
-    line= fil.readline()
-    rscdict = {}
-    while line:
-        llist = line.split()
-        if len(llist)>0:
-            rscdict[llist[0]] = llist[1]
-        line = fil.readline()
-    fil.close()
-    nx=np.int(rscdict['WIDTH']);ny=np.int(rscdict['FILE_LENGTH'])
-    lat=np.zeros((4,1));lon=np.zeros((4,1));
-    lat[0]=np.float(rscdict['Y_FIRST']);lat[1]=np.float(rscdict['Y_FIRST'])
-    lat[2]=np.float(rscdict['Y_FIRST'])+(ny-1)*np.float(rscdict['Y_STEP']);
-    lat[3]=np.float(rscdict['Y_FIRST'])+(ny-1)*np.float(rscdict['Y_STEP'])
-    lon[0]=np.float(rscdict['X_FIRST']);lon[1]=np.float(rscdict['X_FIRST'])+(nx-1)*np.float(rscdict['X_STEP']);
-    lon[2]=np.float(rscdict['X_FIRST']);lon[3]=np.float(rscdict['X_FIRST'])+(nx-1)*np.float(rscdict['X_STEP']);
-    return lat,lon,nx,ny
-
-
-def get_delay(delay_file,atr,lookup_file,cinc):
-    [lat,lon,nx,ny]= read_params(delay_file)
-    date1=np.fromfile(delay_file, dtype=np.float32, sep=(""))
-    data=date1.reshape(ny,nx)
-    lats,step=np.linspace(lat[2],lat[0],num=ny,endpoint=True,retstep=True);lats=np.asarray(lats)
-    lons,step=np.linspace(lon[0],lon[1],num=nx,endpoint=True,retstep=True);lons=np.asarray(lons)
-    pts_old=tuple((lats,lons));del step
-    RGI_func=RGI(pts_old,data,method='linear',bounds_error=False)
-    latd=np.zeros((4,1));lond=np.zeros((4,1));
-    rx=np.int(atr['ref_x']);ry=np.int(atr['ref_y'])
-    if 'X_FIRST' in list(atr.keys()):
-        nxd=np.int(atr['WIDTH']);nyd=np.int(atr['FILE_LENGTH'])
-        latd[0]=np.float(atr['Y_FIRST']);latd[2]=np.float(atr['Y_FIRST'])+(nyd-1)*np.float(atr['Y_STEP']);
-        lond[0]=np.float(atr['X_FIRST']);lond[1]=np.float(atr['X_FIRST'])+(nxd-1)*np.float(atr['X_STEP']);
-        xarr,step = np.linspace(lond[0],lond[1],num=nxd,endpoint=True,retstep=True);
-        yarr,step = np.linspace(latd[2],latd[0],num=nyd,endpoint=True,retstep=True);
-        lons3=np.tile(xarr,nyd);lats3=np.repeat(yarr,nxd);
-        pts_new = np.hstack((lats3.reshape(-1,1), lons3.reshape(-1,1)));
-        delay_geo=RGI_func(pts_new)
-        delay_geo=delay_geo.reshape(1858,1820);
-        rlat=np.float(atr['ref_lat']);rlon=np.float(atr['ref_lon'])
-        delay_geo=delay_geo-delay_geo[ry,rx]
-        delay_geo=delay_geo/cinc;
-        delay=delay_geo; del delay_geo, pts_new
-        
-    else:
-        if atr['processor']=='isce':
-            print('interferogram processor is isce')
-            len_rdr = int(atr['FILE_LENGTH']);wid_rdr = int(atr['WIDTH']);
-            lons=np.tile(lons,ny);lats=np.repeat(lats,nx);
-            pts_old=np.hstack((lats.reshape(-1,1), lons.reshape(-1,1)));
-            atr_lut = readfile.read_attribute(lookup_file)
-            lon_lut = readfile.read(lookup_file, epoch='longitude')[0]
-            lat_lut = readfile.read(lookup_file, epoch='latitude')[0]
-            pts_new=np.hstack((lat_lut.reshape(-1,1), lon_lut.reshape(-1,1)));
-            delay_rdr=griddata(pts_old, data.flatten(), pts_new, method='linear')
-            delay_rdr=delay_rdr.reshape(len_rdr,wid_rdr)
-            delay_rdr=delay_rdr-delay_rdr[ry,rx];
-            delay_rdr=delay_rdr/cinc;
-            delay=delay_rdr; del delay_rdr, pts_new
-            
-        else:
-            print('interferogram processor is roi_pac')
-            [latd,lond,nxd,nyd] = read_params(lookup_file); 
-            xarr,step = np.linspace(lond[0],lond[1],num=nxd,endpoint=True,retstep=True);
-            yarr,step = np.linspace(latd[2],latd[0],num=nyd,endpoint=True,retstep=True);
-            lons3=np.tile(xarr,nyd);lats3=np.repeat(yarr,nxd);
-            pts_new = np.hstack((lats3.reshape(-1,1), lons3.reshape(-1,1)));
-            delay_geo=RGI_func(pts_new)
-            delay_geo=delay_geo.reshape(nyd,nxd)
-            len_rdr = int(atr['FILE_LENGTH']);wid_rdr = int(atr['WIDTH']);
-            yy, xx = np.mgrid[0:len_rdr:len_rdr*1j, 0:wid_rdr:wid_rdr*1j]
-            yx_rdr = np.hstack((yy.reshape(-1,1), xx.reshape(-1,1)))
-            atr_lut = readfile.read_attribute(lookup_file)
-            rg = readfile.read(lookup_file, epoch='range')[0]
-            az = readfile.read(lookup_file, epoch='azimuth')[0]
-            idx = (az>0.0)*(az<=len_rdr)*(rg>0.0)*(rg<=wid_rdr)
-            pts_new2 = np.hstack((az[idx].reshape(-1,1), rg[idx].reshape(-1,1)))
-            delay_geo=delay_geo[idx]
-            delay_rdr=griddata(pts_new2, delay_geo, yx_rdr, method='linear')
-            delay_rdr=delay_rdr.reshape(len_rdr,wid_rdr)
-            delay_rdr=delay_rdr-delay_rdr[ry,rx];
-            delay_rdr=delay_rdr/cinc;
-            delay=delay_rdr; del delay_rdr, pts_new, pts_new2
-        
-    return delay
+###############################################################
+EXAMPLE = """example:
+  tropcor_GACOS.py timeseries.h5 -l geometryRadar.h5 -i geometryRadar.h5
+  tropcor_GACOS.py timeseries.h5 -l geometryGeo.h5   -i geometryRadar.h5   --GACOS-dir ./../WEATHER/GACOS
+  tropcor_GACOS.py geo_timeseries.h5 -i geo_geometryRadar.h5 --num-worker 8
+"""
 
+TEMPLATE = """
+pysar.troposphericDelay.method        = GACOS   #[pyaps, height-correlation,GACOS]
+"""
 
-###############################################################
-EXAMPLE='''example:
-  tropcor_GACOS.py timeseries.h5 -l geomap_*rlks.trans -i incidenceAngle.h5
-  tropcor_pyaps.py timeseries.h5 -l geometryRadar.h5   -i geometryRadar.h5   --weather-dir /famelung/data/WEATHER
-  tropcor_pyaps.py geo_timeseries.h5 -l geometryGeo.h5
-'''
-TEMPLATE='''
-pysar.troposphericDelay.method        = GACOS   #[pyaps, height-correlation,GACOS] 
-'''
-
-def cmdLineParse():
-    parser = argparse.ArgumentParser(description='Tropospheric correction using GACOS delays\n',\
-                                     formatter_class=argparse.RawTextHelpFormatter,\
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Tropospheric correction using GACOS delays\n',
+                                     formatter_class=argparse.RawTextHelpFormatter,
                                      epilog=EXAMPLE)
 
-    parser.add_argument(dest='timeseries_file', nargs='?', help='timeseries HDF5 file, i.e. timeseries.h5')
-    parser.add_argument('-i', dest='inc_angle',\
+    parser.add_argument('timeseries_file', help='timeseries HDF5 file, i.e. timeseries.h5')
+    parser.add_argument('-i', dest='inc_angle', default='30.0',
                         help='a file containing all incidence angles, or a number representing for the whole image.')
-    parser.add_argument('-l', dest='lookup_file',\
-                        help='a file containing all information to tranfer from radar to geo coordinates.')
-    parser.add_argument('--GACOS-dir', dest='GACOS_dir', \
-                        help='directory to downloaded GACOS delays data, i.e. ./../WEATHER/GACOS\n'+\
+    parser.add_argument('-l', dest='lookup_file',
+                        help='a file containing all information to tranfer from radar to geo coordinates.\n' +
+                             'i.e. geometryRadar.h5 with latitude/longitude for ISCE, or\n' +
+                             '     geometryGeo.h5 with rangeCoord/azimuthCoord for ROI_PAC/GAMMA')
+    parser.add_argument('--GACOS-dir', dest='GACOS_dir',
+                        help='directory to downloaded GACOS delays data, i.e. ./../WEATHER/GACOS\n' +
                              'use directory of input timeseries_file if not specified.')
-    parser.add_argument('--date-list', dest='date_list_file',\
-                        help='Read the first column of text file as list of date to download data\n'+\
+    parser.add_argument('--date-list', dest='date_list_file',
+                        help='Read the first column of text file as list of date to calculate delay\n' +
                              'in YYYYMMDD or YYMMDD format')
     parser.add_argument('--ref-yx', dest='ref_yx', type=int, nargs=2, help='reference pixel in y/x')
-    parser.add_argument('--template', dest='template_file',\
+    parser.add_argument('--template', dest='template_file',
                         help='template file with input options below:\n'+TEMPLATE)
     parser.add_argument('-o', dest='out_file', help='Output file name for trospheric corrected timeseries.')
 
-    inps = parser.parse_args()
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='Number of processes to resample the delay of dates in parallel, default: 1.')
+    parser.add_argument('--cache', dest='cache_file',
+                        help='HDF5 file to cache the delay of each date, to skip the resampling of existing\n' +
+                             'dates in re-runs, default: GACOS_delayCache.h5 in the directory of time-series.\n' +
+                             'Zenith delay of one date is re-used only if the ztd file and lookup table are the same,\n' +
+                             'thus, it is valid for any reference pixel and incidence angle. Set to "no" to disable.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to read/process per block, default: 100e6')
+    return parser
 
-    # Correcting TIMESERIES or DOWNLOAD DATA ONLY, required one of them
-    if not inps.timeseries_file and not inps.download:
-        parser.print_help()
-        sys.exit(1)
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
     return inps
 
-def main(argv):
-    inps = cmdLineParse()
-    
-    if inps.timeseries_file:
-        inps.timeseries_file=ut.get_file_list([inps.timeseries_file])[0]
-        atr=readfile.read_attribute(inps.timeseries_file)
-        k = atr['FILE_TYPE']
-        if 'ref_y' not in list(atr.keys()) and inps.ref_yx:
-            print('No reference info found in input file, use input ref_yx: '+str(inps.ref_yx))
-            atr['ref_y'] = inps.ref_yx[0]
-            atr['ref_x'] = inps.ref_yx[1]
-
-    #****reading incidence angle file***/
-    if os.path.isfile(inps.inc_angle):
-        inps.inc_angle=readfile.read(inps.inc_angle, epoch='incidenceAngle')[0]
-        inps.inc_angle=np.nan_to_num(inps.inc_angle)
-    else:
-        inps.inps.inc_angle = float(inps.inc_angle)
-        print('incidence angle: '+str(inps.inc_angle))
-    cinc=np.cos(inps.inc_angle*np.pi/180.0);
 
-    #****look up file****/
-    if inps.lookup_file:
-        inps.lookup_file = ut.get_file_list([inps.lookup_file])[0] #'geomap_32rlks_tight.trans'
+##########################################################
+def read_ztd_grid(delay_file):
+    """Read GACOS zenith total delay in geo-coordinates
+    Returns: data : 2D np.array in size of (length, width), ZTD in meters
+             lats : 1D np.array in size of (length,), latitude in ascending order
+             lons : 1D np.array in size of (width,),  longitude in ascending order
+    """
+    atr = readfile.read_roipac_rsc(delay_file+'.rsc')
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    data = np.fromfile(delay_file, dtype=np.float32).reshape(length, width)
+
+    lats = float(atr['Y_FIRST']) + np.arange(length) * float(atr['Y_STEP'])
+    lons = float(atr['X_FIRST']) + np.arange(width) * float(atr['X_STEP'])
+    if lats[0] > lats[-1]:
+        lats = lats[::-1]
+        data = data[::-1, :]
+    return data, lats, lons
+
+
+def get_geo_coord(atr):
+    """Latitude / longitude of each pixel of the geocoded file
+    Returns: lats, lons : 2D np.array in size of (length, width)
+    """
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    lat = float(atr['Y_FIRST']) + np.arange(length) * float(atr['Y_STEP'])
+    lon = float(atr['X_FIRST']) + np.arange(width) * float(atr['X_STEP'])
+    lons, lats = np.meshgrid(lon, lat)
+    return lats, lons
+
+
+def get_delay(delay_file, atr, lookup_file):
+    """Resample the GACOS zenith delay of one date onto the grid of the time-series.
+    Parameters: delay_file  : str, GACOS ztd file
+                atr         : dict, attributes of the time-series file
+                lookup_file : str, lookup table file, for time-series in radar coordinates
+    Returns:    delay       : 2D np.array of float32 in size of (length, width), zenith delay in meters
+    """
+    data, lats, lons = read_ztd_grid(delay_file)
+    RGI_func = RGI((lats, lons), data, method='linear', bounds_error=False)
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+
+    if 'Y_FIRST' in atr.keys():
+        # geocoded time-series
+        lat, lon = get_geo_coord(atr)
+        delay = RGI_func((lat, lon))
+
+    elif 'latitude' in readfile.get_dataset_list(lookup_file):
+        # lookup table in radar coordinates, i.e. ISCE
+        # interpolate the regular GACOS grid at lat/lon of each radar pixel
+        lat = readfile.read(lookup_file, datasetName='latitude', print_msg=False)[0]
+        lon = readfile.read(lookup_file, datasetName='longitude', print_msg=False)[0]
+        delay = RGI_func((lat, lon))
 
-    #****GACOS****/
-    delay_source = 'GACOS'
-    # Get weather directory
-    if not inps.GACOS_dir:
-        if inps.timeseries_file:
-            inps.GACOS_dir = os.path.dirname(os.path.abspath(inps.timeseries_file))+'/../WEATHER/GACOS'
-        elif inps.lookup_file:
-            inps.GACOS_dir = os.path.dirname(os.path.abspath(inps.lookup_file))+'/../WEATHER/GACOS'
-        else:
-            inps.GACOS_dir = os.path.abspath(os.getcwd())
-    
-    print('Store weather data into directory: '+inps.GACOS_dir)
-        
-    #source_dir=os.path.dirname(os.path.abspath('timeseries_file'))+'/Agung/GACOS/data';print source_dir
-    #os.makedirs(GACOS_dir)  -----------------------------------------------add part to copy/download weather data------#
-    #----get date list-----#
-    if not inps.date_list_file:
-        print('read date list info from: '+inps.timeseries_file)
-        h5=h5py.File(inps.timeseries_file,'r')
-        if 'timeseries' in list(h5.keys()):
-            date_list=sorted(h5[k].keys())
-        elif k in ['interferograms','coherence','wrapped']:
-            ifgram_list = sorted(h5[k].keys())
-            date12_list = ptime.list_ifgram2date12(ifgram_list)
-            m_dates = [i.split('-')[0] for i in date12_list]
-            s_dates = [i.split('-')[1] for i in date12_list]
-            date_list = ptime.yyyymmdd(sorted(list(set(m_dates + s_dates))))
-        else:
-            raise ValueError('Un-support input file type:'+k)
-        h5.close()
     else:
-        date_list = ptime.yyyymmdd(np.loadtxt(inps.date_list_file, dtype=str, usecols=(0,)).tolist())
-        print('read date list info from: '+inps.date_list_file)
+        # lookup table in geo coordinates, i.e. ROI_PAC / GAMMA
+        # interpolate onto the geo grid of the lookup table, then onto the radar grid
+        atr_lut = readfile.read_attribute(lookup_file)
+        lat, lon = get_geo_coord(atr_lut)
+        delay_geo = RGI_func((lat, lon))
+        rg = readfile.read(lookup_file, datasetName='rangeCoord', print_msg=False)[0]
+        az = readfile.read(lookup_file, datasetName='azimuthCoord', print_msg=False)[0]
+        idx = (az > 0.0) * (az <= length) * (rg > 0.0) * (rg <= width)
+        pts_geo = np.hstack((az[idx].reshape(-1, 1), rg[idx].reshape(-1, 1)))
+        yy, xx = np.mgrid[0:length, 0:width]
+        pts_rdr = np.hstack((yy.reshape(-1, 1), xx.reshape(-1, 1)))
+        delay = griddata(pts_geo, delay_geo[idx], pts_rdr, method='linear').reshape(length, width)
 
-    #****cheacking availability of delays****/
-    print('checking availability of delays')
-    delay_file_list=[]
-    for d in date_list:
-        if   delay_source == 'GACOS':  delay_file = inps.GACOS_dir+'/'+d+'.ztd';
-        delay_file_list.append(delay_file)
-    delay_file_existed = ut.get_file_list(delay_file_list)
-
-    if len(delay_file_existed)==len(date_list):
-        print('no missing files')
+    return np.array(delay, np.float32)
+
+
+def get_los_delay(delay, atr, cos_inc):
+    """Project zenith delay into LOS direction relative to the reference pixel
+    Parameters: delay   : 2D np.array in size of (length, width), zenith delay in meters
+                atr     : dict, attributes of the time-series file, with REF_Y/X
+                cos_inc : float or 2D np.array, cosine of the incidence angle
+    Returns:    delay   : 2D np.array in size of (length, width), LOS delay in meters
+    """
+    delay = np.array(delay, np.float32)
+    delay -= delay[int(atr['REF_Y']), int(atr['REF_X'])]
+    delay /= cos_inc
+    return delay
+
+
+def get_delay_cache_key(inps, atr):
+    """Attributes of the delay cache file, delays in the cache are valid only if all of them match.
+    The zenith delay is cached, thus, it does not depend on the reference pixel and incidence angle."""
+    key = {'DELAY_SOURCE'  : 'GACOS',
+           'DELAY_TYPE'    : 'zenith',
+           'LENGTH'        : str(atr['LENGTH']),
+           'WIDTH'         : str(atr['WIDTH']),
+           'LOOKUP_HASH'   : ut.get_file_hash(inps.lookup_file) if inps.lookup_file else 'no'}
+    if 'Y_FIRST' in atr.keys():
+        for k in ['Y_FIRST', 'X_FIRST', 'Y_STEP', 'X_STEP']:
+            key[k] = str(atr[k])
+    return key
+
+
+def calc_delay_iter(date_list, delay_file_list, inps, atr):
+    """Resample zenith delay of dates in date_list, in parallel with inps.numWorker processes.
+    Yields: (date, delay), date and its zenith delay as 2D np.array, in the order of completion
+    """
+    num_worker = min(inps.numWorker, len(date_list))
+    if num_worker <= 1:
+        for date, delay_file in zip(date_list, delay_file_list):
+            print('calculating delay for date {} from file {}'.format(date, os.path.basename(delay_file)))
+            yield date, get_delay(delay_file, atr, inps.lookup_file)
     else:
-        print('no. of date files found:', len(delay_file_existed));
-        print('no. of dates:', len(date_list))
+        print('calculating delay with {} processes in parallel'.format(num_worker))
+        with futures.ProcessPoolExecutor(max_workers=num_worker) as executor:
+            future2date = {executor.submit(get_delay, delay_file, atr, inps.lookup_file): (date, delay_file)
+                           for date, delay_file in zip(date_list, delay_file_list)}
+            for future in futures.as_completed(future2date):
+                date, delay_file = future2date[future]
+                print('finished delay for date {} from file {}'.format(date, os.path.basename(delay_file)))
+                yield date, future.result()
+
+
+def get_delay_timeseries(inps, atr):
+    """Calculate delay of each date and write it into inps.trop_file date by date.
+    Delay of each date is relative to the reference pixel, not to the reference date yet.
+    Delay of the reference date is saved in inps.ref_delay, calculated from its own GACOS file
+    if it is not in the date list.
+    """
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    date_num = len(inps.date_list)
 
-    #*****Calculating delays***/
-    print('calculating delays')
+    ds_name_dict = {'date'      : (np.string_, (date_num,), inps.date_list),
+                    'timeseries': (np.float32, (date_num, length, width), None)}
+    trop_atr = dict(atr)
+    trop_atr['FILE_TYPE'] = 'timeseries'
+    trop_atr['UNIT'] = 'm'
+    if inps.ref_date not in inps.date_list:
+        trop_atr.pop('REF_DATE', None)
+    writefile.layout_hdf5(inps.trop_file, ds_name_dict, metadata=trop_atr)
 
-    length=int(atr['FILE_LENGTH'])
-    width=int(atr['WIDTH'])
-    #initialise delay files
-    date_num=len(date_list)
-    trop_ts=np.zeros((date_num, length, width), np.float32)
+    date_list = list(inps.date_list)
+    delay_file_list = list(inps.delay_file_list)
+    if inps.ref_date not in date_list:
+        date_list.append(inps.ref_date)
+        delay_file_list.append(inps.ref_delay_file)
 
-    #reading wrf files for each epoch and getting delay
-    for i in range(date_num):
-        delay_file=delay_file_existed[i]
-        date=date_list[i]
-        print('calculating delay for date',date)
-        trop_ts[i] =get_delay(delay_file,atr,inps.lookup_file,cinc)  
+    def write_delay(date, delay):
+        delay = get_los_delay(delay, atr, inps.cos_inc)
+        if date in inps.date_list:
+            i = inps.date_list.index(date)
+            writefile.write_hdf5_block(inps.trop_file, delay, 'timeseries',
+                                       block=[i, i+1, 0, length, 0, width],
+                                       print_msg=False)
+        if date == inps.ref_date:
+            inps.ref_delay = delay
 
+    # read delay from cache file
+    file_hash_dict, cache_key, delay_dict = dict(), None, dict()
+    if inps.cache_file:
+        file_hash_dict = {d: ut.get_file_hash(f) for d, f in zip(date_list, delay_file_list)}
+        cache_key = get_delay_cache_key(inps, atr)
+        delay_dict = ut.read_delay_cache(inps.cache_file, cache_key, file_hash_dict)
 
+    dates2calc, files2calc = [], []
+    for date, delay_file in zip(date_list, delay_file_list):
+        if date in delay_dict.keys():
+            write_delay(date, delay_dict.pop(date))
+        else:
+            dates2calc.append(date)
+            files2calc.append(delay_file)
+    print('number of dates to calculate delay: {} out of {}'.format(len(dates2calc), len(date_list)))
+
+    # calculate delay for dates not in cache
+    for date, delay in calc_delay_iter(dates2calc, files2calc, inps, atr):
+        write_delay(date, delay)
+        if inps.cache_file:
+            ut.write_delay_cache(inps.cache_file, cache_key, date, file_hash_dict[date], delay)
     print('Delays Calculated')
-    # Convert relative phase delay on reference date
-    try:    ref_date = atr['ref_date']
-    except: ref_date = date_list[0]
-    print('convert to relative phase delay with reference date: '+ref_date)
-    ref_idx = date_list.index(ref_date)
-    trop_ts -= np.tile(trop_ts[ref_idx,:,:], (date_num, 1, 1))
-
-    ## Write tropospheric delay to HDF5
-    tropFile = 'GACOSdelays'+'.h5'
-    print('writing >>> %s' % (tropFile))
-    h5trop = h5py.File(tropFile, 'w')
-    group_trop = h5trop.create_group('timeseries')
-    print('number of acquisitions: '+str(date_num))
-    prog_bar = ptime.progress_bar(maxValue=date_num)
-    for i in range(date_num):
-        date = date_list[i]
-        group_trop.create_dataset(date, data=trop_ts[i], compression='gzip')
-        prog_bar.update(i+1, suffix=date)
-    prog_bar.close()
-
-    # Write Attributes
-    for key,value in atr.items():
-        group_trop.attrs[key] = value
-    h5trop.close()
-
-    ## Write corrected Time series to HDF5
-    if k == 'timeseries':
+    return inps.trop_file
+
+
+def correct_delay(inps, atr):
+    """Convert delay into relative delay on the reference date, and correct the time-series with it,
+    block by block."""
+    length, width = int(atr['LENGTH']), int(atr['WIDTH'])
+    date_num = len(inps.date_list)
+    print('convert to relative phase delay with reference date: '+inps.ref_date)
+
+    ts_obj = None
+    if atr['FILE_TYPE'] == 'timeseries':
         if not inps.out_file:
-            inps.out_file = os.path.splitext(inps.timeseries_file)[0]+'_'+'GACOS'+'.h5'
-        print('writing trop corrected timeseries file %s' % (inps.out_file))
-        h5ts = h5py.File(inps.timeseries_file, 'r')
-        h5tsCor = h5py.File(inps.out_file, 'w')
-        group_tsCor = h5tsCor.create_group('timeseries')
-        print('number of acquisitions: '+str(date_num))
-        prog_bar = ptime.progress_bar(maxValue=date_num)
-        for i in range(date_num):
-            date = date_list[i];print(date)
-            ts = h5ts['timeseries'].get(date)[:]
-            group_tsCor.create_dataset(date, data=ts-trop_ts[i], compression='gzip')
-            prog_bar.update(i+1, suffix=date)
-        prog_bar.close()
-        h5ts.close()
-        # Write Attributes
-        for key,value in atr.items():
-            group_tsCor.attrs[key] = value
-        h5tsCor.close()
-        print('delays written to %s' % (inps.out_file))
+            inps.out_file = os.path.splitext(inps.timeseries_file)[0]+'_GACOS.h5'
+        ts_obj = timeseries(inps.timeseries_file)
+        ts_obj.open(print_msg=False)
+        # output time-series of dates in the date list only
+        ds_name_dict = {'date'      : (np.string_, (date_num,), inps.date_list),
+                        'timeseries': (np.float32, (date_num, length, width), None)}
+        if ts_obj.pbase is not None:
+            date_idx = [ts_obj.dateList.index(d) for d in inps.date_list]
+            ds_name_dict['bperp'] = (np.float32, (date_num,), np.array(ts_obj.pbase)[date_idx])
+        metadata = dict(ts_obj.metadata)
+        if inps.ref_date not in inps.date_list:
+            # still relative to the reference date, which is not in the output date list
+            metadata.pop('REF_DATE', None)
+        writefile.layout_hdf5(inps.out_file, ds_name_dict, metadata=metadata)
+        print('writing trop corrected timeseries file {}'.format(inps.out_file))
 
-    print('finished')
+    trop_obj = timeseries(inps.trop_file)
+    for box in blockwise.split2boxes(length, width, num_slice=date_num, chunk_size=inps.chunk_size):
+        block = [0, date_num, box[1], box[3], box[0], box[2]]
+        with perf.phase('read'):
+            trop_data = trop_obj.read(box=box, print_msg=False).reshape(date_num, box[3]-box[1], -1)
+        with perf.phase('compute'):
+            trop_data -= inps.ref_delay[box[1]:box[3], box[0]:box[2]]
+        with perf.phase('write'):
+            writefile.write_hdf5_block(inps.trop_file, trop_data, 'timeseries', block=block, print_msg=False)
+
+        if ts_obj is not None:
+            with perf.phase('read'):
+                ts_data = ts_obj.read(datasetName=inps.date_list, box=box, print_msg=False)
+                ts_data = ts_data.reshape(date_num, box[3]-box[1], -1)
+            with perf.phase('compute'):
+                mask = ts_data == 0.
+                ts_data -= trop_data
+                ts_data[mask] = 0.
+            with perf.phase('write'):
+                writefile.write_hdf5_block(inps.out_file, ts_data, 'timeseries', block=block, print_msg=False)
+
+    if ts_obj is not None:
+        print('delays written to {}'.format(inps.out_file))
     return inps.out_file
-    
+
+
 ###############################################################
-if __name__ == '__main__':
-    main(sys.argv[1:])
+def read_date_list(inps, atr):
+    k = atr['FILE_TYPE']
+    if inps.date_list_file:
+        print('read date list info from: '+inps.date_list_file)
+        date_list = ptime.yyyymmdd(np.loadtxt(inps.date_list_file, dtype=bytes,
+                                              usecols=(0,)).astype(str).tolist())
+    elif k == 'timeseries':
+        print('read date list info from: '+inps.timeseries_file)
+        obj = timeseries(inps.timeseries_file)
+        obj.open(print_msg=False)
+        date_list = obj.dateList
+    elif k == 'ifgramStack':
+        print('read date list info from: '+inps.timeseries_file)
+        obj = ifgramStack(inps.timeseries_file)
+        obj.open(print_msg=False)
+        date_list = obj.get_date_list(dropIfgram=False)
+    else:
+        raise ValueError('Un-support input file type:'+k)
+    return date_list
+
 
+def check_inputs(inps):
+    atr = readfile.read_attribute(inps.timeseries_file)
+    if 'REF_Y' not in atr.keys():
+        if not inps.ref_yx:
+            raise ValueError('No reference info found in input file, use --ref-yx to specify it.')
+        print('No reference info found in input file, use input ref_yx: '+str(inps.ref_yx))
+        atr['REF_Y'], atr['REF_X'] = inps.ref_yx
 
+    # incidence angle
+    if os.path.isfile(inps.inc_angle):
+        inc_angle = readfile.read(inps.inc_angle, datasetName='incidenceAngle', print_msg=False)[0]
+        inc_angle = np.nan_to_num(inc_angle)
+    else:
+        inc_angle = float(inps.inc_angle)
+        print('incidence angle: '+str(inc_angle))
+    inps.cos_inc = np.cos(inc_angle*np.pi/180.0)
 
+    # lookup table
+    if 'Y_FIRST' not in atr.keys():
+        if not inps.lookup_file:
+            raise ValueError('Input file is in radar coordinates, lookup table (-l) is required.')
+        inps.lookup_file = ut.get_file_list([inps.lookup_file])[0]
+
+    # GACOS directory
+    if not inps.GACOS_dir:
+        inps.GACOS_dir = os.path.dirname(os.path.abspath(inps.timeseries_file))+'/../WEATHER/GACOS'
+    print('GACOS data directory: '+inps.GACOS_dir)
+
+    # date list and delay file list
+    inps.date_list = read_date_list(inps, atr)
+    if atr['FILE_TYPE'] == 'timeseries':
+        ts_date_list = timeseries(inps.timeseries_file).get_date_list()
+        date_extra = sorted(set(inps.date_list) - set(ts_date_list))
+        if date_extra:
+            raise ValueError('date(s) not found in {}: {}'.format(inps.timeseries_file, date_extra))
+    inps.delay_file_list = [os.path.join(inps.GACOS_dir, d+'.ztd') for d in inps.date_list]
+
+    # reference date, whose delay is read from its own GACOS file if it is not in the date list
+    inps.ref_date = atr.get('REF_DATE', inps.date_list[0])
+    inps.ref_delay_file = os.path.join(inps.GACOS_dir, inps.ref_date+'.ztd')
+    print('checking availability of delays')
+    date_missed = [d for d, f in zip(inps.date_list + [inps.ref_date],
+                                     inps.delay_file_list + [inps.ref_delay_file]) if not os.path.isfile(f)]
+    date_missed = sorted(set(date_missed))
+    if date_missed:
+        raise FileNotFoundError('GACOS delay files of {} date(s) are missing in {}: {}'.format(
+            len(date_missed), inps.GACOS_dir, date_missed))
+    print('no missing files')
+
+    # output files
+    out_dir = os.path.dirname(os.path.abspath(inps.timeseries_file))
+    inps.trop_file = os.path.join(out_dir, 'GACOS.h5')
+    if inps.cache_file == 'no':
+        inps.cache_file = None
+    elif not inps.cache_file:
+        inps.cache_file = os.path.join(out_dir, 'GACOS_delayCache.h5')
+    return inps, atr
+
+
+###############################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    inps, atr = check_inputs(inps)
+
+    get_delay_timeseries(inps, atr)
+    correct_delay(inps, atr)
+
+    print('finished')
+    return inps.out_file
+
+
+###############################################################
+if __name__ == '__main__':
+    main()
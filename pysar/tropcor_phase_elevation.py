@@ -7,15 +7,10 @@
 
 
 import os
-import sys
-import time
-import datetime
 import argparse
-import h5py
 import numpy as np
-import matplotlib.pyplot as plt
 from pysar.objects import timeseries
-from pysar.utils import readfile, ptime, utils as ut
+from pysar.utils import readfile, writefile, perf, blockwise
 from pysar.multilook import multilook_data
 from pysar.mask import mask_matrix
 
@@ -24,6 +19,7 @@ from pysar.mask import mask_matrix
 EXAMPLE = """example:
   tropcor_phase_elevation.py  timeseries_demErr.h5      -d INPUTS/geometryRadar.h5  -m maskTempCoh.h5    
   tropcor_phase_elevation.py  geo_timeseries_demErr.h5  -d geo_geometryRadar.h5     -m geo_maskTempCoh.h5
+  tropcor_phase_elevation.py  timeseries_demErr.h5      -d INPUTS/geometryRadar.h5  -m maskTempCoh.h5  --window 400
 """
 
 REFERENCE = """reference:
@@ -40,7 +36,7 @@ def create_parser():
 
     parser.add_argument('timeseries_file',
                         help='time-series file to be corrected')
-    parser.add_argument('-g', '--geometry', dest='geom_file', required=True,
+    parser.add_argument('-g', '-d', '--geometry', dest='geom_file', required=True,
                         help='DEM file used for correlation calculation.')
     parser.add_argument('-m', '--mask', dest='mask_file', required=True,
                         help='mask file for pixels used for correlation calculation')
@@ -54,6 +50,12 @@ def create_parser():
 
     parser.add_argument('--poly-order', '-p', dest='poly_order', type=int, default=1, choices=[1, 2, 3],
                         help='polynomial order of phase-height correlation. Default: 1')
+    parser.add_argument('-w', '--window', dest='window_size', type=int, default=0,
+                        help='window size in pixels for spatially varying phase/elevation ratio, i.e. 400\n' +
+                             'ratios are estimated in each window and interpolated bilinearly in between.\n' +
+                             'default: 0 - one ratio for the whole image.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                        help='max number of data elements to read/process per block, default: 100e6')
     parser.add_argument('-o', '--outfile',
                         help='output corrected timeseries file name')
     return parser
@@ -83,7 +85,7 @@ def design_matrix(dem, poly_order=1):
     return A
 
 
-def read_topographic_data(geom_file, metadata):
+def read_topographic_data(geom_file):
     print('read DEM from file: '+geom_file)
     dem = readfile.read(geom_file,
                         datasetName='height',
@@ -95,141 +97,242 @@ def read_topographic_data(geom_file, metadata):
                               print_msg=False)[0]
     dem *= 1.0/np.cos(inc_angle*np.pi/180.0)
 
-    ref_y = int(metadata['REF_Y'])
-    ref_x = int(metadata['REF_X'])
-    dem -= dem[ref_y, ref_x]
-
-    # Design matrix for elevation v.s. phase
-    # dem = dem.flatten()
+    # use absolute elevation: delay is proportional to the absolute elevation for spatially varying ratio,
+    # and the delay is referenced to the reference pixel after the estimation.
     return dem
 
 
+def read_multilooked_data(ts_obj, dem, mask, inps):
+    """Read masked and multilooked time-series block by block, for empirical estimation.
+    Parameters: ts_obj : timeseries object
+                dem    : 2D array in size of (length, width)
+                mask   : 2D array of bool in size of (length, width)
+                inps   : Namespace
+    Returns:    dem_mli : 2D array in size of (          length_mli, width_mli)
+                ts_mli  : 3D array in size of (num_date, length_mli, width_mli)
+    """
+    lks = inps.num_multilook
+    if lks > 1:
+        print('number of multilook: {} (multilook data for estimation only)'.format(lks))
+    dem_mli = multilook_data(mask_matrix(np.array(dem, np.float32), mask), lks, lks)
+    ts_mli = np.zeros((ts_obj.numDate,) + dem_mli.shape, np.float32)
+    box_list = blockwise.split2boxes(ts_obj.length, ts_obj.width, num_slice=ts_obj.numDate,
+                                     chunk_size=inps.chunk_size, multiple=lks, print_msg=True)
+    for box in box_list:
+        y0, y1 = box[1] // lks, box[3] // lks
+        if y1 <= y0:
+            continue
+        ts_data = ts_obj.read(box=box, print_msg=False).reshape(ts_obj.numDate, box[3]-box[1], -1)
+        ts_data = mask_matrix(ts_data, mask[box[1]:box[3], :])
+        ts_mli[:, y0:y1, :] = multilook_data(ts_data, lks, lks)
+    return dem_mli, ts_mli
+
+
+def calc_correlation(dem, ts_data):
+    """Correlation coefficient of DEM with each acquisition, in one matrix product.
+    Parameters: dem     : 1D array in size of (num_pixel,)
+                ts_data : 2D array in size of (num_date, num_pixel)
+    Returns:    corr    : 1D array in size of (num_date,), 0 for acquisitions without signal
+    """
+    dem_c = dem - np.mean(dem)
+    ts_c = ts_data - np.mean(ts_data, axis=1, keepdims=True)
+    norm = np.sqrt(np.sum(ts_c**2, axis=1) * np.sum(dem_c**2))
+    corr = np.zeros(ts_data.shape[0], np.float32)
+    flag = norm > 0.
+    corr[flag] = np.dot(ts_c[flag, :], dem_c) / norm[flag]
+    return corr
+
+
 def estimate_phase_elevation_ratio(dem, ts_data, inps):
     """Estimate phase/elevation ratio for each acquisition of timeseries
-    Parameters: dem     : 2D array in size of (          length, width)
-                ts_data : 3D array in size of (num_date, length, width)
+    Parameters: dem     : 2D array in size of (          length, width), multilooked and masked with NaN
+                ts_data : 3D array in size of (num_date, length, width), multilooked and masked with NaN
                 inps    : Namespace
-    Returns:    X       : 2D array in size of (poly_num+1, num_date)
+    Returns:    X       : 4D array in size of (poly_num+1, num_date, num_win_y, num_win_x),
+                          with num_win_y/x = 1 for one ratio for the whole image
     """
     num_date = ts_data.shape[0]
-
-    # prepare phase and elevation data
-    print('reading mask from file: '+inps.mask_file)
-    mask = readfile.read(inps.mask_file, datasetName='mask')[0]
-    dem = mask_matrix(np.array(dem), mask)
-    ts_data = mask_matrix(np.array(ts_data), mask)
-
-    # display
-    # 1. effect of multilooking --> narrow phase range --> better ratio estimation
-    debug_mode = False
-    if debug_mode:
-        import matplotlib.pyplot as plt
-        #d_index = np.argmax(topo_trop_corr)
-        d_index = 47
-        data = ts_data[d_index, :, :]
-        title = inps.date_list[d_index]
-        fig = plt.figure()
-        plt.plot(dem[~np.isnan(dem)],
-                 data[~np.isnan(dem)],
-                 '.', label='Number of Looks = 1')
-        mli_dem = multilook_data(dem, 8, 8)
-        mli_data = multilook_data(data, 8, 8)
-        plt.plot(mli_dem[~np.isnan(mli_dem)],
-                 mli_data[~np.isnan(mli_dem)],
-                 '.', label='Number of Looks = 8')
-        plt.legend()
-        plt.xlabel('Elevation (m)')
-        plt.ylabel('Range Change (m)')
-        plt.title(title)
-        out_file = 'phase_elevation_ratio_{}.png'.format(title)
-        plt.savefig(out_file, bbox_inches='tight', transparent=True, dpi=300)
-        print('save to {}'.format(out_file))
-        #plt.show()
-        #sys.exit(0)
-
     print('----------------------------------------------------------')
     print('Empirical tropospheric delay correction based on phase/elevation ratio (Doin et al., 2009)')
     print('polynomial order: {}'.format(inps.poly_order))
 
-    if inps.num_multilook > 1:
-        print('number of multilook: {} (multilook data for estimation only)'.format(inps.num_multilook))
-        mask = multilook_data(mask, inps.num_multilook, inps.num_multilook)
-        dem = multilook_data(dem, inps.num_multilook, inps.num_multilook)
-        ts_data = multilook_data(ts_data, inps.num_multilook, inps.num_multilook)
-
-    mask_nan = ~np.isnan(dem)
-    dem = dem[mask_nan]
-    ts_data = ts_data[:, mask_nan]
+    mask_nan = ~np.isnan(dem) & ~np.any(np.isnan(ts_data), axis=0)
+    dem_1d = dem[mask_nan]
+    ts_1d = ts_data[:, mask_nan]
 
     # calculate correlation coefficient
     print('----------------------------------------------------------')
     print('calculate correlation of DEM with each acquisition')
-    topo_trop_corr = np.zeros(num_date, np.float32)
+    topo_trop_corr = calc_correlation(dem_1d, ts_1d)
     for i in range(num_date):
-        phase = ts_data[i, :]
-        cc = 0.
-        if np.count_nonzero(phase) > 0:
-            comp_data = np.vstack((dem, phase))
-            cc = np.corrcoef(comp_data)[0, 1]
-            topo_trop_corr[i] = cc
-        print('{}: {:>5.2f}'.format(inps.date_list[i], cc))
+        print('{}: {:>5.2f}'.format(inps.date_list[i], topo_trop_corr[i]))
     topo_trop_corr = np.abs(topo_trop_corr)
     print('average correlation magnitude: {:>5.2f}'.format(np.nanmean(topo_trop_corr)))
 
     # estimate ratio parameter
     print('----------------------------------------------------------')
     print('estimate phase/elevation ratio')
-    A = design_matrix(dem=dem, poly_order=inps.poly_order)
+    A = design_matrix(dem=dem_1d, poly_order=inps.poly_order)
     A_inv = np.linalg.pinv(A)
-    X = np.array(np.dot(A_inv, ts_data.T), np.float32)
+    X = np.array(np.dot(A_inv, ts_1d.T), np.float32)
+    X = X[:, :, np.newaxis, np.newaxis]
+
+    if inps.window_size > 0:
+        X = estimate_windowed_ratio(dem, ts_data, mask_nan, X, inps)
     X[:, topo_trop_corr < inps.threshold] = 0.
     return X
 
 
-def estimate_tropospheric_delay(dem, X, metadata):
-    poly_order = X.shape[0]-1
-    num_date = X.shape[1]
-    length, width = dem.shape
+def estimate_windowed_ratio(dem, ts_data, mask, X_global, inps, min_num_pixel=20):
+    """Estimate phase/elevation ratio in windows, for all windows and acquisitions at once
+    via the normal equation of each window.
+    Parameters: dem      : 2D array in size of (          length, width), multilooked
+                ts_data  : 3D array in size of (num_date, length, width), multilooked
+                mask     : 2D array of bool in size of (length, width), valid pixels
+                X_global : 4D array in size of (poly_num+1, num_date, 1, 1), ratio of the whole image,
+                           used for windows with less than min_num_pixel valid pixels
+    Returns:    X        : 4D array in size of (poly_num+1, num_date, num_win_y, num_win_x)
+    """
+    num_date, length, width = ts_data.shape
+    win = max(1, inps.window_size // inps.num_multilook)
+    num_win_y = int(np.ceil(length / win))
+    num_win_x = int(np.ceil(width / win))
+    num_param = inps.poly_order + 1
+    print('estimate phase/elevation ratio in {} x {} windows of {} pixels'.format(num_win_y, num_win_x,
+                                                                                  win * inps.num_multilook))
+
+    # pad to multiple of window size, and reshape into (num_win, num_pixel_per_win, ...)
+    pad = ((0, num_win_y * win - length), (0, num_win_x * win - width))
+    mask = np.pad(mask, pad, mode='constant', constant_values=False)
+    dem = np.pad(np.nan_to_num(dem), pad, mode='constant') * mask
+    ts_data = np.pad(np.nan_to_num(ts_data), ((0, 0),) + pad, mode='constant') * mask
+
+    def to_win(data):
+        data = data.reshape(-1, num_win_y, win, num_win_x, win)
+        return data.transpose(1, 3, 2, 4, 0).reshape(num_win_y * num_win_x, win * win, -1)
+
+    G = to_win(design_matrix(dem, poly_order=inps.poly_order).T.reshape(num_param, *dem.shape)
+               * mask)                                         # (num_win, num_pixel, num_param)
+    Y = to_win(ts_data)                                        # (num_win, num_pixel, num_date)
+    GtG = np.matmul(G.transpose(0, 2, 1), G)
+    GtY = np.matmul(G.transpose(0, 2, 1), Y)
+    X = np.matmul(np.linalg.pinv(GtG), GtY)                    # (num_win, num_param, num_date)
+
+    # windows with few valid pixels or little relief use the global ratio:
+    # the ratio error of the window, noise_std / sqrt(sum((dem - dem_mean)^2)), times the DEM std
+    # of the whole image should be smaller than the noise level, to not amplify noise by interpolation
+    num_pixel = np.sum(to_win(mask[np.newaxis, :, :]), axis=(1, 2))
+    dem_win = to_win(dem[np.newaxis, :, :])[:, :, 0]
+    dem_mean = np.sum(dem_win, axis=1) / np.maximum(num_pixel, 1)
+    dem_ss = np.sum(dem_win**2, axis=1) - num_pixel * dem_mean**2
+    flag = (num_pixel < max(min_num_pixel, num_param * 2)) | (dem_ss < np.var(dem[mask]))
+    X[flag] = X_global[:, :, 0, 0]
+    print('number of windows with few valid pixels or little relief, using the global ratio: {} out of {}'.format(
+        np.sum(flag), flag.size))
+    return np.array(X.transpose(1, 2, 0).reshape(num_param, num_date, num_win_y, num_win_x), np.float32)
+
+
+def get_interp_weight(coord, num):
+    """Weight matrix for linear interpolation of a regular grid of num nodes at coordinates,
+    with nearest extrapolation outside of the grid.
+    Parameters: coord : 1D array in size of (n,), coordinates in unit of grid spacing
+                num   : int, number of grid nodes
+    Returns:    W     : 2D array in size of (n, num)
+    """
+    coord = np.clip(coord, 0, num - 1)
+    i0 = np.minimum(np.floor(coord).astype(int), max(num - 2, 0))
+    w1 = coord - i0
+    W = np.zeros((coord.size, num), np.float32)
+    W[np.arange(coord.size), i0] = 1. - w1
+    if num > 1:
+        W[np.arange(coord.size), i0 + 1] += w1
+    return W
+
+
+def estimate_tropospheric_delay(dem, X, box, inps, ref_value=None):
+    """Stratified tropospheric delay of a block, relative to the reference pixel.
+    Parameters: dem : 2D array in size of (box_length, box_width)
+                X   : 4D array in size of (poly_num+1, num_date, num_win_y, num_win_x)
+                box : tuple of 4 int, (x0, y0, x1, y1) of the block
+                inps: Namespace
+                ref_value : 1D array in size of (num_date,), delay of the reference pixel
+    Returns:    trop_data : 3D array in size of (num_date, box_length, box_width)
+    """
+    num_param, num_date, num_win_y, num_win_x = X.shape
+    # ratio of each pixel, interpolated bilinearly between window centers
+    lks = inps.num_multilook
+    win = max(1, inps.window_size // lks) * lks
+    c0 = (win - 1) / 2.
+    Wy = get_interp_weight((np.arange(box[1], box[3]) - c0) / win, num_win_y)
+    Wx = get_interp_weight((np.arange(box[0], box[2]) - c0) / win, num_win_x)
+
+    # constant term is skipped, it is removed after referencing anyway
+    trop_data = np.zeros((num_date, box[3]-box[1], box[2]-box[0]), np.float32)
+    for i in range(1, num_param):
+        ratio = np.matmul(np.matmul(Wy, X[i]), Wx.T)
+        trop_data += ratio * np.array(dem**i, np.float32)
+
+    if ref_value is not None:
+        trop_data -= ref_value.reshape(-1, 1, 1)
+    return trop_data
 
-    print('estimate the stratified tropospheric delay')
-    B = design_matrix(dem=dem, poly_order=poly_order)
-    trop_data = np.dot(B, X).T
 
-    ref_index = int(metadata['REF_Y']) * width + int(metadata['REF_X'])
-    ref_value = trop_data[:, ref_index].reshape(-1, 1)
-    trop_data -= np.tile(ref_value, (1, length*width))
+def correct_tropospheric_delay(ts_obj, dem, X, inps):
+    """Correct the stratified tropospheric delay block by block, and write to the output file."""
+    # delay of the reference pixel
+    ref_y, ref_x = int(ts_obj.metadata['REF_Y']), int(ts_obj.metadata['REF_X'])
+    ref_box = (ref_x, ref_y, ref_x+1, ref_y+1)
+    ref_value = estimate_tropospheric_delay(dem[ref_y:ref_y+1, ref_x:ref_x+1], X, ref_box, inps).flatten()
 
-    trop_data = np.reshape(trop_data, (num_date, length, width))
-    return trop_data
+    ds_name_dict = {'date'      : (np.string_, (ts_obj.numDate,), ts_obj.dateList),
+                    'timeseries': (np.float32, (ts_obj.numDate, ts_obj.length, ts_obj.width), None)}
+    if ts_obj.pbase is not None:
+        ds_name_dict['bperp'] = (np.float32, (ts_obj.numDate,), ts_obj.pbase)
+    writefile.layout_hdf5(inps.outfile, ds_name_dict, metadata=ts_obj.metadata)
+
+    print('----------------------------------------------------------')
+    print('correct the stratified tropospheric delay block by block')
+    box_list = blockwise.split2boxes(ts_obj.length, ts_obj.width, num_slice=ts_obj.numDate,
+                                     chunk_size=inps.chunk_size, print_msg=True)
+    for box in box_list:
+        with perf.phase('read'):
+            ts_data = ts_obj.read(box=box, print_msg=False).reshape(ts_obj.numDate, box[3]-box[1], -1)
+        with perf.phase('compute'):
+            mask = ts_data == 0.
+            ts_data -= estimate_tropospheric_delay(dem[box[1]:box[3], box[0]:box[2]], X, box, inps,
+                                                   ref_value=ref_value)
+            ts_data[mask] = 0.
+        with perf.phase('write'):
+            writefile.write_hdf5_block(inps.outfile, ts_data, 'timeseries',
+                                       block=[0, ts_obj.numDate, box[1], box[3], box[0], box[2]],
+                                       print_msg=False)
+    print('finished writing to file: {}'.format(inps.outfile))
+    return inps.outfile
 
 
 ############################################################################
 def main(iargs=None):
     inps = cmd_line_parse(iargs)
 
-    # read timeseries data
+    # read topographic data (DEM) and mask
     obj = timeseries(inps.timeseries_file)
     obj.open()
-    ts_data = obj.read()
     inps.date_list = list(obj.dateList)
+    dem = read_topographic_data(inps.geom_file)
+    print('reading mask from file: '+inps.mask_file)
+    mask = readfile.read(inps.mask_file, datasetName='mask')[0]
 
-    # read topographic data (DEM)
-    dem = read_topographic_data(inps.geom_file, obj.metadata)
-
-    # estimate phase/elevation ratio parameters
-    X = estimate_phase_elevation_ratio(dem, ts_data, inps)
+    # estimate phase/elevation ratio parameters on multilooked data
+    with perf.phase('read'):
+        dem_mli, ts_mli = read_multilooked_data(obj, dem, mask, inps)
+    with perf.phase('compute'):
+        X = estimate_phase_elevation_ratio(dem_mli, ts_mli, inps)
+    del ts_mli
 
     # correct trop delay in timeseries
-    trop_data = estimate_tropospheric_delay(dem, X, obj.metadata)
-    mask = ts_data == 0.
-    ts_data -= trop_data
-    ts_data[mask] = 0.
-
-    # write time-series file
     if not inps.outfile:
         inps.outfile = '{}_tropHgt.h5'.format(os.path.splitext(inps.timeseries_file)[0])
-    obj_out = timeseries(inps.outfile)
-    obj_out.write2hdf5(ts_data, refFile=inps.timeseries_file)
+    correct_tropospheric_delay(obj, dem, X, inps)
     return inps.outfile
 
 
@@ -9,6 +9,9 @@
 import os
 import sys
 import re
+import json
+import hashlib
+from concurrent import futures
 
 try:
     import pyaps as pa
@@ -32,6 +35,7 @@ EXAMPLE = """example:
   tropcor_pyaps.py -d date_list.txt     --hour 12 -m MERRA
   tropcor_pyaps.py -d 20151002 20151003 --hour 12 -m ECMWF --dem geometryRadar.h5 --ref-yx 30 40 -i geometryRadar.h5
   tropcor_pyaps.py -m ECMWF --dem geometryRadar.h5 -i geometryRadar.h5 -f timeseries.h5
+  tropcor_pyaps.py -m ECMWF --dem geometryRadar.h5 -i geometryRadar.h5 -f timeseries.h5 --num-worker 8
 """
 
 REFERENCE = """reference:
@@ -78,6 +82,9 @@ def create_parser():
     parser.add_argument('-w', '--dir', '--weather-dir', dest='weather_dir',
                         help='directory to put downloaded weather data, i.e. ./../WEATHER\n' +
                              'use directory of input timeseries_file if not specified.')
+    parser.add_argument('--rescan', dest='rescan_weather', action='store_true',
+                        help='check size and modification time of all weather files in the inventory,\n' +
+                             'instead of new/removed files only, i.e. after files are modified in place.')
 
     # For delay calculation
     parser.add_argument('--dem', dest='dem_file',
@@ -89,12 +96,22 @@ def create_parser():
                         nargs=2, help='reference pixel in y/x')
     parser.add_argument('--delay', dest='delay_type', default='comb', choices={'comb', 'dry', 'wet'},
                         help='Delay type to calculate, comb contains both wet and dry delays')
+    parser.add_argument('--num-worker', dest='numWorker', type=int, default=1,
+                        help='Number of processes to calculate the delay of dates in parallel, default: 1.')
+    parser.add_argument('--cache', dest='cache_file',
+                        help='HDF5 file to cache the delay of each date, to skip the calculation of existing\n' +
+                             'dates in re-runs, default: {trop_model}_delayCache.h5 in the directory of DEM.\n' +
+                             'Delay of one date is re-used only if the grib file, DEM, incidence angle,\n' +
+                             'reference pixel and delay type are the same. Set to "no" to disable.')
 
     # For delay correction
     parser.add_argument('-f', '--file', dest='timeseries_file',
                         help='timeseries HDF5 file, i.e. timeseries.h5')
     parser.add_argument('-o', dest='outfile',
                         help='Output file name for trospheric corrected timeseries.')
+    parser.add_argument('--delay-only', dest='delay_only', action='store_true',
+                        help='Calculate the tropospheric delay file only, skip correcting the input timeseries file,\n' +
+                             'e.g. for the block-wise correction with correct_timeseries.py')
     return parser
 
 
@@ -190,6 +207,11 @@ def check_inputs(inps):
 
     # Prepare DEM file in ROI_PAC format for PyAPS to read
     if inps.dem_file:
+        if inps.cache_file == 'no':
+            inps.cache_file = None
+        elif not inps.cache_file:
+            inps.cache_file = os.path.join(os.path.dirname(os.path.abspath(inps.dem_file)),
+                                           '{}_delayCache.h5'.format(inps.trop_model))
         inps.dem_file = prepare_roipac_dem(inps.dem_file, inps.geocoded)
 
     return inps, atr
@@ -209,13 +231,113 @@ def date_list2grib_file(date_list, hour, trop_model, grib_dir):
     return grib_file_list
 
 
-def dload_grib_pyaps(date_list, hour, trop_model='ECMWF', weather_dir='./'):
+GRIB_INVENTORY_FILE = 'grib_inventory.json'
+
+
+def get_grib_file_info(grib_file):
+    """Date and hour of the weather file from its name, None for un-recognized file"""
+    m = re.search(r'(\d{8})[_-](\d{2})', os.path.basename(grib_file))
+    if not m:
+        return None, None
+    return m.group(1), m.group(2)
+
+
+def read_grib_inventory(grib_dir):
+    """Read the inventory of weather files in grib_dir.
+    Returns: inventory : dict, with key = file name and value = dict of date, hour, model, size,
+                         mtime, md5 (None until the file is used) and valid, e.g.:
+                         {'ERA-Int_20151002_12.grb': {'date': '20151002', 'hour': '12', 'model': 'ECMWF',
+                                                      'size': 31838400, 'mtime': 1517450213.4,
+                                                      'md5': 'a2c0...', 'valid': True}, ...}
+    """
+    inv_file = os.path.join(grib_dir, GRIB_INVENTORY_FILE)
+    if not os.path.isfile(inv_file):
+        return dict()
+    try:
+        with open(inv_file, 'r') as f:
+            return json.load(f)
+    except ValueError:
+        print('WARNING: can not read inventory file: {}, re-build it.'.format(inv_file))
+        return dict()
+
+
+def write_grib_inventory(grib_dir, inventory):
+    """Write inventory into file, atomically for the weather directory shared by multiple projects"""
+    inv_file = os.path.join(grib_dir, GRIB_INVENTORY_FILE)
+    tmp_file = '{}.{}.tmp'.format(inv_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(inventory, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, inv_file)
+    return inv_file
+
+
+def check_grib_validity(inventory):
+    """Mark weather files with size different from the most common one as invalid/corrupted,
+    by comparing the number of digits and the first two digits of the file size."""
+    sizes = [str(i['size']) for i in inventory.values()]
+    if not sizes:
+        return inventory
+    size_digit = ut.most_common([len(i) for i in sizes])
+    size_max2 = ut.most_common([i[0:2] for i in sizes])
+    for info in inventory.values():
+        size = str(info['size'])
+        info['valid'] = len(size) == size_digit and size[0:2] == size_max2
+    print('file size mode: %se%d bytes' % (size_max2, size_digit-2))
+    return inventory
+
+
+def update_grib_inventory(grib_dir, trop_model, rescan=False):
+    """Update the inventory of weather files in grib_dir incrementally.
+    Only new files are stat-ed, files removed from the directory are dropped.
+    The md5 hash is computed in get_delay_timeseries() for the files of requested dates only.
+    Parameters: grib_dir   : str, directory of weather files of one model
+                trop_model : str, weather model name
+                rescan     : bool, re-check size and modification time of existing files in inventory
+    Returns:    inventory  : dict, see read_grib_inventory()
+    """
+    inventory = read_grib_inventory(grib_dir)
+    fnames = [i for i in os.listdir(grib_dir)
+              if get_grib_file_info(i)[0] and not i.startswith(GRIB_INVENTORY_FILE)]
+    num_old = len(inventory)
+
+    # files removed or modified
+    for fname in list(inventory.keys()):
+        if fname not in fnames:
+            inventory.pop(fname)
+        elif rescan:
+            st = os.stat(os.path.join(grib_dir, fname))
+            if st.st_size != inventory[fname]['size'] or st.st_mtime != inventory[fname]['mtime']:
+                inventory.pop(fname)
+
+    # files new or modified
+    fnames_new = [i for i in fnames if i not in inventory.keys()]
+    for fname in fnames_new:
+        grib_file = os.path.join(grib_dir, fname)
+        st = os.stat(grib_file)
+        date, hour = get_grib_file_info(fname)
+        inventory[fname] = {'date': date,
+                            'hour': hour,
+                            'model': trop_model,
+                            'size': st.st_size,
+                            'mtime': st.st_mtime,
+                            'md5': None,
+                            'valid': True}
+
+    if fnames_new or len(inventory) != num_old or not os.path.isfile(os.path.join(grib_dir, GRIB_INVENTORY_FILE)):
+        inventory = check_grib_validity(inventory)
+        write_grib_inventory(grib_dir, inventory)
+    print('number of weather files in inventory: {} ({} new)'.format(len(inventory), len(fnames_new)))
+    return inventory
+
+
+def dload_grib_pyaps(date_list, hour, trop_model='ECMWF', weather_dir='./', rescan=False):
     """Download weather re-analysis grib files using PyAPS
     Inputs:
         date_list   : list of string in YYYYMMDD format
         hour        : string in HH:MM or HH format
         trop_model : string, 
         weather_dir : string,
+        rescan      : bool, re-check all weather files in the inventory
     Output:
         grib_file_list : list of string
     """
@@ -230,36 +352,33 @@ def dload_grib_pyaps(date_list, hour, trop_model='ECMWF', weather_dir='./'):
     grib_file_list = date_list2grib_file(date_list, hour, trop_model, grib_dir)
 
     # Get date list to download (skip already downloaded files)
-    grib_file_existed = ut.get_file_list(grib_file_list)
-    if grib_file_existed:
-        grib_filesize_digit = ut.most_common([len(str(os.path.getsize(i))) for i in grib_file_existed])
-        grib_filesize_max2 = ut.most_common([str(os.path.getsize(i))[0:2] for i in grib_file_existed])
-        grib_file_corrupted = [i for i in grib_file_existed
-                               if (len(str(os.path.getsize(i))) != grib_filesize_digit
-                                   or str(os.path.getsize(i))[0:2] != grib_filesize_max2)]
-        print('file size mode: %se%d bytes' % (grib_filesize_max2, grib_filesize_digit-2))
-        print('number of grib files existed    : %d' % len(grib_file_existed))
-        if grib_file_corrupted:
-            print('------------------------------------------------------------------------------')
-            print('corrupted grib files detected! Delete them and re-download...')
-            print('number of grib files corrupted  : %d' % len(grib_file_corrupted))
-            for i in grib_file_corrupted:
-                rmCmd = 'rm '+i
-                print(rmCmd)
-                os.system(rmCmd)
-                grib_file_existed.remove(i)
-            print('------------------------------------------------------------------------------')
+    inventory = update_grib_inventory(grib_dir, trop_model, rescan=rescan)
+    grib_file_existed = [i for i in grib_file_list if os.path.basename(i) in inventory.keys()]
+    grib_file_corrupted = [i for i in grib_file_existed if not inventory[os.path.basename(i)]['valid']]
+    print('number of grib files existed    : %d' % len(grib_file_existed))
+    if grib_file_corrupted:
+        print('------------------------------------------------------------------------------')
+        print('corrupted grib files detected! Delete them and re-download...')
+        print('number of grib files corrupted  : %d' % len(grib_file_corrupted))
+        for i in grib_file_corrupted:
+            print('rm '+i)
+            os.remove(i)
+            grib_file_existed.remove(i)
+        print('------------------------------------------------------------------------------')
     grib_file2download = sorted(list(set(grib_file_list) - set(grib_file_existed)))
     date_list2download = [str(re.findall('\d{8}', i)[0]) for i in grib_file2download]
     print('number of grib files to download: %d' % len(date_list2download))
     print('------------------------------------------------------------------------------\n')
 
     # Download grib file using PyAPS
-    if   trop_model == 'ECMWF' :  pa.ECMWFdload( date_list2download, hour, grib_dir)
-    elif trop_model == 'MERRA' :  pa.MERRAdload( date_list2download, hour, grib_dir)
-    elif trop_model == 'NARR'  :  pa.NARRdload(  date_list2download, hour, grib_dir)
-    elif trop_model == 'ERA'   :  pa.ERAdload(   date_list2download, hour, grib_dir)
-    elif trop_model == 'MERRA1':  pa.MERRA1dload(date_list2download, hour, grib_dir)
+    if date_list2download:
+        if   trop_model == 'ECMWF' :  pa.ECMWFdload( date_list2download, hour, grib_dir)
+        elif trop_model == 'MERRA' :  pa.MERRAdload( date_list2download, hour, grib_dir)
+        elif trop_model == 'NARR'  :  pa.NARRdload(  date_list2download, hour, grib_dir)
+        elif trop_model == 'ERA'   :  pa.ERAdload(   date_list2download, hour, grib_dir)
+        elif trop_model == 'MERRA1':  pa.MERRA1dload(date_list2download, hour, grib_dir)
+    if date_list2download or grib_file_corrupted:
+        update_grib_inventory(grib_dir, trop_model)
     return grib_file_list
 
 
@@ -304,8 +423,44 @@ def get_delay(grib_file, inps):
     return phs
 
 
+def get_delay_cache_key(inps):
+    """Attributes of the delay cache file, delays in the cache are valid only if all of them match."""
+    inc_angle = np.array(inps.inc_angle, dtype=np.float32)
+    key = {'TROP_MODEL' : inps.trop_model,
+           'DELAY_TYPE' : inps.delay_type,
+           'DEM_HASH'   : ut.get_file_hash(inps.dem_file),
+           'INC_ANGLE_HASH': hashlib.md5(inc_angle.tobytes()).hexdigest(),
+           'REF_Y'      : str(inps.ref_yx[0]),
+           'REF_X'      : str(inps.ref_yx[1])}
+    return key
+
+
+def calc_delay_iter(idx_list, inps):
+    """Calculate delay of dates in idx_list, in parallel with inps.numWorker processes.
+    Yields: (i, delay), index of date and its delay as 2D np.array, in the order of completion
+    """
+    num_worker = min(inps.numWorker, len(idx_list))
+    if num_worker <= 1:
+        for i in idx_list:
+            print('calculate phase delay on %s from file %s' %
+                  (inps.date_list[i], os.path.basename(inps.grib_file_list[i])))
+            yield i, get_delay(inps.grib_file_list[i], inps)
+    else:
+        print('calculate phase delay with {} processes in parallel'.format(num_worker))
+        with futures.ProcessPoolExecutor(max_workers=num_worker) as executor:
+            future2idx = {executor.submit(get_delay, inps.grib_file_list[i], inps): i for i in idx_list}
+            for future in futures.as_completed(future2idx):
+                i = future2idx[future]
+                print('finished phase delay on %s from file %s' %
+                      (inps.date_list[i], os.path.basename(inps.grib_file_list[i])))
+                yield i, future.result()
+
+
 def get_delay_timeseries(inps, atr):
-    """Calculate delay time-series and write it to HDF5 file."""
+    """Calculate delay time-series and write it to HDF5 file.
+    Delay of each date is calculated in parallel with inps.numWorker processes, and cached in
+    inps.cache_file, so that only new or changed dates are calculated in re-runs.
+    """
     print('*'*50+'\nCalcualting delay for each epoch using PyAPS ...')
     if any(i is None for i in [inps.dem_file, inps.inc_angle, inps.ref_yx]):
         print('No DEM / incidenceAngle / ref_yx found, exit.')
@@ -315,12 +470,46 @@ def get_delay_timeseries(inps, atr):
     width = int(atr['WIDTH'])
     date_num = len(inps.date_list)
     drop_data = np.zeros((date_num, length, width), np.float32)
-    for i in range(date_num):
-        grib_file = inps.grib_file_list[i]
+
+    # read delay from cache file
+    grib_hash_dict, cache_key, delay_dict = dict(), None, dict()
+    if inps.cache_file:
+        # grib file hash from the inventory of weather files, if file is not modified since indexed
+        grib_dir = os.path.dirname(inps.grib_file_list[0])
+        inventory = read_grib_inventory(grib_dir)
+        inventory_updated = False
+        for d, g in zip(inps.date_list, inps.grib_file_list):
+            if not os.path.isfile(g):
+                # missing file, not in cache
+                continue
+            info = inventory.get(os.path.basename(g), None)
+            st = os.stat(g)
+            if info and info['size'] == st.st_size and info['mtime'] == st.st_mtime:
+                if not info.get('md5', None):
+                    info['md5'] = ut.get_file_hash(g)
+                    inventory_updated = True
+                grib_hash_dict[d] = info['md5']
+            else:
+                grib_hash_dict[d] = ut.get_file_hash(g)
+        if inventory_updated:
+            write_grib_inventory(grib_dir, inventory)
+        cache_key = get_delay_cache_key(inps)
+        delay_dict = ut.read_delay_cache(inps.cache_file, cache_key, grib_hash_dict)
+    idx2calc = []
+    for i, date in enumerate(inps.date_list):
+        if date in delay_dict.keys():
+            drop_data[i] = delay_dict.pop(date)
+        else:
+            idx2calc.append(i)
+
+    # calculate delay for dates not in cache
+    print('number of dates to calculate delay: {} out of {}'.format(len(idx2calc), date_num))
+
+    for i, delay in calc_delay_iter(idx2calc, inps):
+        drop_data[i] = delay
         date = inps.date_list[i]
-        print('calculate phase delay on %s from file %s' %
-              (date, os.path.basename(grib_file)))
-        drop_data[i] = get_delay(grib_file, inps)
+        if inps.cache_file and date in grib_hash_dict.keys():
+            ut.write_delay_cache(inps.cache_file, cache_key, date, grib_hash_dict[date], delay)
 
     # Convert relative phase delay on reference date
     try:
@@ -369,11 +558,12 @@ def main(iargs=None):
     inps.grib_file_list = dload_grib_pyaps(inps.date_list,
                                            inps.hour,
                                            inps.trop_model,
-                                           inps.weather_dir)
+                                           inps.weather_dir,
+                                           rescan=inps.rescan_weather)
 
     drop_data = get_delay_timeseries(inps, atr)
 
-    if atr['FILE_TYPE'] == 'timeseries':
+    if atr['FILE_TYPE'] == 'timeseries' and not inps.delay_only:
         inps.outfile = correct_delay(inps.timeseries_file, drop_data, inps.outfile)
 
     return inps.outfile
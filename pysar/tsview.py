@@ -15,7 +15,7 @@ import numpy as np
 import scipy.stats as stats
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider, Button
-from pysar.objects import timeseries
+from pysar.objects import timeseries, refValueDatasetName
 from pysar.utils import readfile, ptime, utils as ut, plot as pp
 from pysar.mask import mask_matrix
 
@@ -66,6 +66,9 @@ def create_parser():
                        help='change reference pixel to input location')
     pixel.add_argument('--ref-lalo', dest='ref_lalo', type=float, metavar=('LAT','LON'), nargs=2,\
                        help='change reference pixel to input location')
+    pixel.add_argument('-l','--lookup', dest='lookup_file',\
+                       help='lookup table file to convert lat/lon for file in radar coord.\n'+\
+                            'Default: auto search in ./INPUTS')
 
     output = parser.add_argument_group('Output Setting')
     output.add_argument('-o','--output', dest='fig_base', help='Figure base name for output files')
@@ -272,7 +275,7 @@ def save_output():
     Reads basic information about timeseries file being viewed
 '''
 def read_timeseries_info():
-    global atr, k, h5, dateList, tims, date_num, inps
+    global atr, k, h5, dateList, tims, date_num
 
     atr = readfile.read_attribute(inps.timeseries_file)
     k = atr['FILE_TYPE']
@@ -372,6 +375,19 @@ def set_inital_pixel_coords():
         y, x = set_yx_coords(inps.ref_lalo[0], inps.ref_lalo[1])
         inps.ref_yx = [y, x]
 
+    # radar coord: convert all lat/lon with the lookup table at once
+    if 'Y_FIRST' not in list(atr.keys()) and (inps.lalo or inps.ref_lalo):
+        lalo_list = [i for i in [inps.lalo, inps.ref_lalo] if i]
+        coord = ut.glob2radar(np.array([i[0] for i in lalo_list]), np.array([i[1] for i in lalo_list]),
+                              inps.lookup_file, atr, print_msg=False)
+        if coord is not None:
+            yx_list = [[int(y), int(x)] if np.isfinite(y) and np.isfinite(x) else None
+                       for y, x in zip(coord[0], coord[1])]
+            if inps.lalo:
+                inps.yx = yx_list.pop(0)
+            if inps.ref_lalo:
+                inps.ref_yx = yx_list.pop(0)
+
     # Display Unit
     if inps.disp_unit == 'cm': inps.unit_fac = 100.0
     elif inps.disp_unit == 'm': inps.unit_fac = 1.0
@@ -464,7 +480,7 @@ def set_mask():
     Sets the initial map plot
 '''
 def set_initial_map():
-    global d_v, h5, k, dateList, inps, data_lim
+    global d_v, data_lim
 
     d_v = h5['timeseries'][inps.epoch_num][:] * inps.unit_fac
     # Initial Map
@@ -625,11 +641,14 @@ def configure_plot():
 ################### PLOTTING HELPER FUNCTIONS #######################
 def time_slider_update(val):
     '''Update Displacement Map using Slider'''
-    global tims, tslider, ax_v, d_v, inps, img, fig_v, h5, k, dateList
+    global d_v
     timein = tslider.val
     idx_nearest = np.argmin(np.abs(np.array(tims) - timein))
     ax_v.set_title('N = %d, Time = %s' % (idx_nearest, inps.dates[idx_nearest].strftime('%Y-%m-%d')))
-    d_v = h5[k][idx_nearest][:] * inps.unit_fac
+    d_v = h5[k][idx_nearest][:]
+    if refValueDatasetName in h5.keys():
+        d_v -= h5[refValueDatasetName][idx_nearest]
+    d_v *= inps.unit_fac
     if inps.ref_date:
         d_v -= inps.ref_d_v
     if mask is not None:
@@ -721,7 +740,7 @@ def update_timeseries(y, x, plot_number, data_only=False):
         Outputs:
             d_ts        : [float], timeseries data at x, y point
     '''
-    global fig_ts, ax_ts, second_plot_axis, inps, dateList, h5, k, inps, tims, fig_v, date_num, d_ts
+    global d_ts
 
     set_scatter_coords(plot_number, x, y)
 
@@ -730,12 +749,13 @@ def update_timeseries(y, x, plot_number, data_only=False):
     else:
         axis = second_plot_axis
 
-    d_ts = []
-    for i, date in enumerate(dateList):
-        d = h5['timeseries'][i][y, x]
-        if inps.ref_yx:
-            d -= h5['timeseries'][i][inps.ref_yx[0], inps.ref_yx[1]]
-        d_ts.append(d * inps.unit_fac)
+    # read point time-series only, instead of the whole slice of each date
+    d_ts = h5['timeseries'][:, y, x]
+    if inps.ref_yx:
+        d_ts -= h5['timeseries'][:, inps.ref_yx[0], inps.ref_yx[1]]
+    elif refValueDatasetName in h5.keys():
+        d_ts -= h5[refValueDatasetName][:]
+    d_ts *= inps.unit_fac
 
     if inps.zero_first:
         d_ts -= d_ts[inps.zero_idx]
@@ -812,6 +832,13 @@ def xy_to_lat_lon(x, y):
     '''
     global ullat, ullon, lat_step, lon_step
 
+    # radar coord: lookup table, with cached spatial index for repeated hovering
+    if 'Y_FIRST' not in atr.keys():
+        coord = ut.radar2glob(np.array(y), np.array(x), inps.lookup_file, atr, print_msg=False)
+        if coord is None:
+            return np.nan, np.nan
+        return coord[0], coord[1]
+
     latitude = ullat + y * lat_step
     longitude = ullon + x * lon_step
 
@@ -8,11 +8,12 @@
 
 import os
 import sys
+import shutil
 import argparse
 import h5py
 import numpy as np
-from scipy.linalg import pinv
-from pysar.utils import readfile, writefile, ptime, utils as ut, deramp
+from pysar.objects import ifgramStack
+from pysar.utils import readfile, writefile, ptime, perf, network as pnet, deramp
 
 
 ##########################################################################################
@@ -41,142 +42,135 @@ def bridging_data(data, mask, x, y):
     return data
 
 
-def unwrap_error_correction_phase_closure(ifgram_file, mask_file, ifgram_cor_file=None):
-    """Correct unwrapping errors in network of interferograms using phase closure.
-    Inputs:
-        ifgram_file     - string, name/path of interferograms file
-        mask_file       - string, name/path of mask file to mask the pixels to be corrected
-        ifgram_cor_file - string, optional, name/path of corrected interferograms file
-    Output:
-        ifgram_cor_file
-    Example:
-        'unwrapIfgram_unwCor.h5' = unwrap_error_correction_phase_closure('Seeded_unwrapIfgram.h5','mask.h5')
-    """
-    print('read mask from file: '+mask_file)
-    mask = readfile.read(mask_file, datasetName='mask')[0].flatten(1)
+def estimate_unwrap_error(pha_data, C, thres=0.5, reg_factor=0.25):
+    """Estimate integer ambiguity of unwrapped phase based on phase closure, for a group of pixels.
 
-    atr = readfile.read_attribute(ifgram_file)
-    length = int(atr['LENGTH'])
-    width = int(atr['WIDTH'])
-    k = atr['FILE_TYPE']
-    pixel_num = length*width
+    For each pixel, interferograms in closing triangles (|closure| < thres) only are constrained to
+    zero ambiguity, then the integer ambiguity U is estimated with Tikhonov regularization as:
+        [-2*pi*C; D; reg_factor*I] * U = [C * pha; 0; 0]
+    Since only the constraint matrix D varies, pixels sharing the same set of constrained interferograms
+    are solved together with one normal equation. Pixels with all triangles closed are not changed.
+
+    Parameters: pha_data : 2D np.array in size of (num_ifgram, num_pixel), referenced unwrapped phase
+                C        : 2D scipy.sparse matrix in size of (num_triangle, num_ifgram), closure matrix
+                thres    : float, threshold of absolute closure phase in radian for non-closing triangle
+                reg_factor : float, Tikhonov regularization factor
+    Returns:    num_cycle : 2D np.array of int16 in size of (num_ifgram, num_pixel), integer ambiguity,
+                            i.e. phase to be added in number of 2*pi
+    """
+    num_ifgram, num_pixel = pha_data.shape
+    num_cycle = np.zeros((num_ifgram, num_pixel), np.int16)
+
+    # closure phase and non-closing triangles of pixels with unwrapping errors
+    closure_pha = C.dot(pha_data)
+    non_close = np.abs(closure_pha) >= thres
+    pix_idx = np.where(np.any(non_close, axis=0))[0]
+    if pix_idx.size == 0:
+        return num_cycle
+    closure_pha = closure_pha[:, pix_idx]
+    non_close = non_close[:, pix_idx].astype(np.float32)
+
+    # constrained ifgrams: in closing triangles but not in any non-closing triangle
+    C_abs = abs(C).T.tocsr()
+    num_non_close = C_abs.dot(non_close)
+    num_close = C_abs.dot(1. - non_close)
+    constrain = np.logical_and(num_close > 0, num_non_close == 0)
+
+    # group pixels by the set of constrained ifgrams
+    flags, group_idx = np.unique(np.packbits(constrain.T, axis=1), axis=0, return_inverse=True)
+    group_idx = group_idx.flatten()
+
+    # normal equation: (4*pi^2*C'C + D'D + reg^2*I) * U = -2*pi*C' * closure
+    CtC = 4. * np.pi**2 * C.T.dot(C).toarray()
+    Ct_closure = -2. * np.pi * C.T.dot(closure_pha)
+    # sort pixels by group once, then slice each group
+    order = np.argsort(group_idx, kind='stable')
+    starts = np.unique(group_idx[order], return_index=True)[1]
+    ends = np.append(starts[1:], order.size)
+    for i0, i1 in zip(starts, ends):
+        idx = order[i0:i1]
+        diag = constrain[:, idx[0]] + reg_factor**2
+        U = np.linalg.solve(CtC + np.diag(diag), Ct_closure[:, idx])
+        num_cycle[:, pix_idx[idx]] = np.round(U)
+    return num_cycle
+
+
+def unwrap_error_correction_phase_closure(ifgram_file, mask_file=None, ifgram_cor_file=None,
+                                          chunk_size=100e6, thres=0.5):
+    """Correct unwrapping errors in network of interferograms using phase closure, block by block.
+    Parameters: ifgram_file     : str, path of ifgramStack file
+                mask_file       : str, path of mask file to mask the pixels to be corrected
+                ifgram_cor_file : str, optional, path of corrected ifgramStack file
+                chunk_size      : float, max number of data elements to process per block
+                thres           : float, threshold of absolute closure phase for non-closing triangle
+    Returns:    ifgram_cor_file
+    Example:    unwrap_error_correction_phase_closure('ifgramStack.h5', 'maskConnComp.h5')
+    """
+    stack_obj = ifgramStack(ifgram_file)
+    stack_obj.open(print_msg=False)
+    length, width = stack_obj.length, stack_obj.width
+    dropIfgram = stack_obj.dropIfgram
+    date12_list = stack_obj.get_date12_list(dropIfgram=True)
+    num_ifgram = len(date12_list)
 
     # Check reference pixel
     try:
-        ref_y = int(atr['REF_Y'])
-        ref_x = int(atr['REF_X'])
+        ref_y = int(stack_obj.metadata['REF_Y'])
+        ref_x = int(stack_obj.metadata['REF_X'])
         print('reference pixel in y/x: %d/%d' % (ref_y, ref_x))
     except:
         sys.exit('ERROR: Can not find ref_y/x value, input file is not referenced in space!')
 
-    h5 = h5py.File(ifgram_file, 'r')
-    ifgram_list = sorted(h5[k].keys())
-    ifgram_num = len(ifgram_list)
-
-    # Prepare curls
-    curls, Triangles, C = ut.get_triangles(h5)
-    curl_num = np.shape(curls)[0]
-    print('Number of      triangles: ' + str(curl_num))
-
-    curl_file = 'curls.h5'
-    if not os.path.isfile(curl_file):
-        print('writing >>> '+curl_file)
-        ut.generate_curls(curl_file, h5, Triangles, curls)
-
-    thr = 0.50
-    curls = np.array(curls)
-    n1 = curls[:, 0]
-    n2 = curls[:, 1]
-    n3 = curls[:, 2]
-
-    print('reading interferograms...')
-    print('Number of interferograms: ' + str(ifgram_num))
-    data = np.zeros((ifgram_num, pixel_num), np.float32)
-    prog_bar = ptime.progressBar(maxValue=ifgram_num)
-    for ni in range(ifgram_num):
-        ifgram = ifgram_list[ni]
-        d = h5[k][ifgram].get(ifgram)[:].flatten(1)
-        data[ni, :] = d
-        prog_bar.update(ni+1)
-    prog_bar.close()
-
-    print('reading curls ...')
-    print('number of culrs: '+str(curl_num))
-    h5curl = h5py.File(curl_file, 'r')
-    curl_list = sorted(h5curl[k].keys())
-    curl_data = np.zeros((curl_num, pixel_num), np.float32)
-    prog_bar = ptime.progressBar(maxValue=curl_num)
-    for ni in range(curl_num):
-        d = h5curl[k][curl_list[ni]].get(curl_list[ni])[:].flatten(1)
-        curl_data[ni, :] = d.flatten(1)
-        prog_bar.update(ni+1)
-    prog_bar.close()
-    h5curl.close()
-
-    print('estimating unwrapping error pixel by pixel ...')
-    EstUnwrap = np.zeros((ifgram_num, pixel_num), np.float32)
-    prog_bar = ptime.progressBar(maxValue=pixel_num)
-    for ni in range(pixel_num):
-        if mask[ni] == 1:
-            dU = data[:, ni]
-            unwCurl = np.array(curl_data[:, ni])
-
-            ind = np.abs(unwCurl) >= thr
-            N1 = n1[ind]
-            N2 = n2[ind]
-            N3 = n3[ind]
-            indC = np.abs(unwCurl) < thr
-            Nc1 = n1[indC]
-            Nc2 = n2[indC]
-            Nc3 = n3[indC]
-
-            N = np.hstack([N1, N2, N3])
-            UniN = np.unique(N)
-            Nc = np.hstack([Nc1, Nc2, Nc3])
-            UniNc = np.unique(Nc)
-
-            inter = list(set(UniNc) & set(UniN))  # intersetion
-            UniNc = list(UniNc)
-            for x in inter:
-                UniNc.remove(x)
-
-            D = np.zeros([len(UniNc), ifgram_num])
-            for i in range(len(UniNc)):
-                D[i, UniNc[i]] = 1
-
-            AAA = np.vstack([-2*np.pi*C, D])
-            AAAA = np.vstack([AAA, 0.25*np.eye(ifgram_num)])
-
-            ##########
-            # with Tikhonov regularization:
-            LLL = list(np.dot(C, dU)) + list(np.zeros(np.shape(UniNc)[0])) + list(np.zeros(ifgram_num))
-            ind = np.isnan(AAAA)
-            M1 = pinv(AAAA)
-            M = np.dot(M1, LLL)
-            EstUnwrap[:, ni] = np.round(M[0:ifgram_num])*2.0*np.pi
-        prog_bar.update(ni+1, suffix='%s/%d' % (ni, pixel_num))
-    prog_bar.close()
-
-    dataCor = data + EstUnwrap
-
-    # Output
+    # Prepare closure matrix
+    C = pnet.read_closure_matrix(ifgram_file, dropIfgram=True)[0]
+    num_tri = C.shape[0]
+    if num_tri == 0:
+        raise ValueError('No triangle found in the network of interferograms!')
+
+    mask = np.ones((length, width), np.bool_)
+    if mask_file:
+        print('read mask from file: '+mask_file)
+        mask = readfile.read(mask_file, datasetName='mask')[0] != 0
+
+    # Output: copy the input file and update unwrapPhase block by block
     if not ifgram_cor_file:
         ifgram_cor_file = os.path.splitext(ifgram_file)[0]+'_unwCor.h5'
-    print('writing >>> '+ifgram_cor_file)
-    h5unwCor = h5py.File(ifgram_cor_file, 'w')
-    gg = h5unwCor.create_group(k)
-
-    prog_bar = ptime.progressBar(maxValue=ifgram_num)
-    for i in range(ifgram_num):
-        ifgram = ifgram_list[i]
-        group = gg.create_group(ifgram)
-        dset = group.create_dataset(ifgram, data=np.reshape(dataCor[i, :], [width, length]).T)
-        for key, value in h5[k][ifgram].attrs.items():
-            group.attrs[key] = value
-        prog_bar.update(i+1)
-    prog_bar.close()
-    h5unwCor.close()
-    h5.close()
+    print('copy {} to {}'.format(ifgram_file, ifgram_cor_file))
+    shutil.copy2(ifgram_file, ifgram_cor_file)
+
+    with h5py.File(ifgram_file, 'r') as f:
+        ds = f['unwrapPhase']
+        ref_phase = ds[:, ref_y, ref_x][dropIfgram]
+
+        # split in rows, with memory of phase, closure phase and ambiguity
+        r_step = max(int(chunk_size / ((num_ifgram * 2 + num_tri * 2) * width)), 1)
+        box_list = [(0, r0, width, min(r0+r_step, length)) for r0 in range(0, length, r_step)]
+        num_cor_pixel = 0
+        for i, box in enumerate(box_list):
+            if len(box_list) > 1:
+                print('\n------- processing patch {} out of {} --------------'.format(i+1, len(box_list)))
+            with perf.phase('read'):
+                data = ds[:, box[1]:box[3], box[0]:box[2]]
+
+            with perf.phase('compute'):
+                pha_data = data[dropIfgram].reshape(num_ifgram, -1) - ref_phase.reshape(-1, 1)
+                # skip pixels with zero/nan value in any interferogram
+                mask_box = mask[box[1]:box[3], box[0]:box[2]].flatten()
+                mask_box *= np.all(data[dropIfgram].reshape(num_ifgram, -1) != 0., axis=0)
+                mask_box *= ~np.any(np.isnan(pha_data), axis=0)
+                print('estimating unwrapping error for {} pixels ...'.format(np.sum(mask_box)))
+
+                num_cycle = estimate_unwrap_error(pha_data[:, mask_box], C, thres=thres)
+                cor_data = np.zeros(pha_data.shape, np.float32)
+                cor_data[:, mask_box] = num_cycle * 2. * np.pi
+                num_cor_pixel += np.sum(np.any(num_cycle != 0, axis=0))
+                data[dropIfgram] += cor_data.reshape(num_ifgram, box[3]-box[1], box[2]-box[0])
+
+            with perf.phase('write'):
+                block = [0, data.shape[0], box[1], box[3], box[0], box[2]]
+                writefile.write_hdf5_block(ifgram_cor_file, data, datasetName='unwrapPhase', block=block,
+                                           print_msg=False)
+    print('number of pixels with unwrapping error corrected: {}'.format(num_cor_pixel))
     return ifgram_cor_file
 
 
@@ -380,7 +374,8 @@ def read_template2inps(template_file, inps=None):
 ####################################################################################################
 EXAMPLE = """example:
 Phase Closure:
-  unwrap_error.py  Seeded_unwrapIfgram.h5  --mask mask.h5
+  unwrap_error.py  ifgramStack.h5  --mask maskConnComp.h5
+  unwrap_error.py  ifgramStack.h5  --mask maskConnComp.h5  --chunk-size 50e6
 Bridging:
   unwrap_error.py  unwrapIfgram.h5    -t ShikokuT417F650_690AlosA.template
   unwrap_error.py  unwrapIfgram.h5    --mask mask.h5     -x 283 305 -y 1177 1247
@@ -453,6 +448,10 @@ def create_parser():
     parser.add_argument('-o', '--outfile',
                         help="output file name. Default is to add suffix '_unwCor.h5'")
 
+    closure = parser.add_argument_group('Phase Closure')
+    closure.add_argument('--chunk-size', dest='chunk_size', type=float, default=100e6,
+                         help='max number of data elements to process per block, default: 100e6')
+
     bridging = parser.add_argument_group('Bridging')
     bridging.add_argument('-y', type=int, nargs='*',
                           help='Y coordinates of bridge bonding points from reference patch to to-be-corrected patch.\n' +
@@ -505,7 +504,8 @@ def main(iargs=None):
     if inps.method == 'phase_closure':
         inps.outfile = unwrap_error_correction_phase_closure(inps.ifgram_file,
                                                              inps.mask_file,
-                                                             inps.outfile)
+                                                             inps.outfile,
+                                                             chunk_size=inps.chunk_size)
 
     elif inps.method == 'bridging':
         inps.outfile = unwrap_error_correction_bridging(inps.ifgram_file,
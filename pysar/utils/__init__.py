@@ -5,6 +5,10 @@
 # readfile
 # writefile
 # sensor
+# h5compress
+# perf
+# import_time
+# blockwise
 #
 # Dependent utility scripts:
 # network, deramp
@@ -0,0 +1,114 @@
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+# Utilities for block-wise processing of large 2D/3D datasets with bounded memory
+# Recommend import:
+#   from pysar.utils import blockwise
+
+
+from concurrent import futures
+from pysar.utils import ptime
+
+
+def get_row_step(width, num_slice=1, chunk_size=100e6, num_copy=1, multiple=1, halo=0):
+    """Number of rows per block
+    Parameters: width      : int, number of columns
+                num_slice  : int, number of slices, e.g. dates / interferograms, read per block
+                chunk_size : float, max number of data elements per block
+                num_copy   : int, number of data-sized arrays in memory per block
+                multiple   : int, number of rows in multiple of, e.g. the number of looks
+                halo       : int, number of rows overlapping on each side, counted into chunk_size
+    Returns:    r_step     : int, number of rows per block, at least multiple
+    """
+    r_step = int(chunk_size / (num_slice * width * num_copy)) - 2 * halo
+    return max(r_step // multiple, 1) * multiple
+
+
+def split2boxes(length, width, num_slice=1, chunk_size=100e6, num_copy=1, multiple=1, print_msg=False):
+    """Split data in size of (num_slice, length, width) into blocks of rows to reduce memory usage
+    Parameters: see get_row_step()
+    Returns:    box_list : list of tuple of 4 int, (x0, y0, x1, y1)
+    Examples:   box_list = blockwise.split2boxes(ts_obj.length, ts_obj.width, num_slice=ts_obj.numDate)
+    """
+    r_step = get_row_step(width, num_slice=num_slice, chunk_size=chunk_size, num_copy=num_copy,
+                          multiple=multiple)
+    box_list = [(0, r0, width, min(length, r0 + r_step)) for r0 in range(0, length, r_step)]
+    if print_msg:
+        print('split {} lines into {} blocks for processing, with each block up to {} lines'.format(
+            length, len(box_list), r_step))
+    return box_list
+
+
+def split2blocks(ds_shape, chunk_size=100e6, num_copy=1, multiple=1, halo=0, slice_step=None):
+    """Split 2D/3D dataset into blocks of rows, and of slices for 3D dataset
+    Parameters: ds_shape   : tuple of int, shape of 2D/3D dataset
+                slice_step : int, number of slices per block,
+                             None for all slices, or for as many slices as chunk_size allows
+                             if one block of all slices is too large
+                others     : see get_row_step()
+    Returns:    block_list : list of [z0, z1, y0, y1], z0/z1 is None for 2D dataset
+    Examples:   block_list = blockwise.split2blocks((num_date, length, width), chunk_size=50e6)
+                block_list = blockwise.split2blocks(ds.shape, num_copy=6, halo=10, slice_step=1)
+    """
+    num_slice = ds_shape[0] if len(ds_shape) == 3 else 1
+    length, width = ds_shape[-2:]
+    z_step = slice_step or num_slice
+    if not slice_step and int(chunk_size / (z_step * width * num_copy)) - 2 * halo < multiple:
+        # one block of all slices is too large, split in slices too
+        z_step = max(int(chunk_size / ((multiple + 2 * halo) * width * num_copy)), 1)
+    r_step = get_row_step(width, num_slice=z_step, chunk_size=chunk_size, num_copy=num_copy,
+                          multiple=multiple, halo=halo)
+
+    block_list = []
+    for z0 in range(0, num_slice, z_step):
+        z1 = min(z0 + z_step, num_slice)
+        for y0 in range(0, length, r_step):
+            y1 = min(y0 + r_step, length)
+            if len(ds_shape) == 3:
+                block_list.append([z0, z1, y0, y1])
+            else:
+                block_list.append([None, None, y0, y1])
+    return block_list
+
+
+def run_tasks(func, task_list, write_func, num_worker=1, suffix=None):
+    """Run func(*task) for all tasks, and write_func(task, result) in the main process in the order of tasks.
+    With num_worker > 1, tasks are computed in parallel processes, with max 2 results per worker in memory,
+    thus func and its arguments have to be picklable, e.g. functions defined in the module level.
+    Parameters: func       : function to compute one task, e.g. to read and process one block
+                task_list  : list of tuple, arguments of func
+                write_func : function to write the result of one task, called as write_func(task, result)
+                num_worker : int, number of processes
+                suffix     : function to return the progress bar suffix of one task, called as suffix(task)
+    Examples:   blockwise.run_tasks(multilook_block, task_list, write_block, num_worker=4)
+    """
+    num_task = len(task_list)
+    num_worker = max(min(num_worker, num_task), 1)
+    prog_bar = ptime.progressBar(maxValue=num_task)
+
+    def update_prog_bar(i, task):
+        if suffix is None:
+            prog_bar.update(i+1, suffix='{}/{}'.format(i+1, num_task))
+        else:
+            prog_bar.update(i+1, suffix=suffix(task))
+
+    if num_worker == 1:
+        for i, task in enumerate(task_list):
+            write_func(task, func(*task))
+            update_prog_bar(i, task)
+    else:
+        print('parallel processing using {} workers ...'.format(num_worker))
+        with futures.ProcessPoolExecutor(max_workers=num_worker) as executor:
+            running = []
+            for i, task in enumerate(task_list):
+                while len(running) >= 2 * num_worker:
+                    task_done, future = running.pop(0)
+                    write_func(task_done, future.result())
+                running.append((task, executor.submit(func, *task)))
+                update_prog_bar(i, task)
+            for task_done, future in running:
+                write_func(task_done, future.result())
+    prog_bar.close()
+    return
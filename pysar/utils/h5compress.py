@@ -0,0 +1,228 @@
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+# Benchmark HDF5 compression filters and pick the best one for a dataset.
+# Recommend import:
+#   from pysar.utils import h5compress
+
+
+import os
+import time
+import h5py
+import numpy as np
+
+
+# compression values accepted by all PySAR HDF5 writers
+# auto_size  - filter with the minimum file size
+# auto_speed - filter with the maximum read speed (disk I/O + decoding)
+# "auto" is NOT accepted, as it means the default value, i.e. no compression, in the template files.
+COMPRESSION_CHOICES = [None, 'lzf', 'gzip', 'auto_size', 'auto_speed']
+
+# environment variable of the default compression of all PySAR HDF5 writers,
+# used if the compression is not specified by the caller, e.g.:
+#   export PYSAR_COMPRESSION=lzf
+COMPRESSION_ENV_NAME = 'PYSAR_COMPRESSION'
+
+# candidate filter combinations in the format of h5py create_dataset() kwargs
+FILTER_LIST = [{'compression': None, 'compression_opts': None, 'shuffle': False},
+               {'compression': 'lzf',  'compression_opts': None, 'shuffle': False},
+               {'compression': 'lzf',  'compression_opts': None, 'shuffle': True},
+               {'compression': 'gzip', 'compression_opts': 1, 'shuffle': False},
+               {'compression': 'gzip', 'compression_opts': 1, 'shuffle': True},
+               {'compression': 'gzip', 'compression_opts': 4, 'shuffle': False},
+               {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+               {'compression': 'gzip', 'compression_opts': 9, 'shuffle': False},
+               {'compression': 'gzip', 'compression_opts': 9, 'shuffle': True}]
+
+# filter of the auto options for datasets without data to benchmark, e.g. empty datasets
+# created by writefile.layout_hdf5() to be written block by block
+AUTO_DEFAULT_FILTER = {'size' : {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True},
+                       'speed': {'compression': 'lzf',  'compression_opts': None, 'shuffle': False}}
+
+# datasets smaller than this are not worth benchmarking / compressing
+MIN_BENCHMARK_SIZE = 64 * 1024
+
+# disk read speed in bytes per second, used to model the read time of auto_speed
+DISK_SPEED = 200e6
+
+
+################################################################
+def filter2str(kwargs):
+    """Convert filter kwargs into a short string, e.g. gzip-4+shuffle"""
+    if not kwargs or not kwargs['compression']:
+        return 'None'
+    fstr = kwargs['compression']
+    if kwargs.get('compression_opts', None) is not None:
+        fstr += '-{}'.format(kwargs['compression_opts'])
+    if kwargs.get('shuffle', False):
+        fstr += '+shuffle'
+    return fstr
+
+
+def sample_data(data, num_sample=3, sample_size=1024*1024):
+    """Read a few evenly distributed blocks from the input 2D/3D matrix
+    Parameters: data : 2D/3D np.ndarray or h5py.Dataset
+                num_sample  : int, number of blocks to sample
+                sample_size : int, approximate number of bytes in each block
+    Returns:    samples : list of np.ndarray
+    """
+    shape = data.shape
+    itemsize = np.dtype(data.dtype).itemsize
+    if len(shape) < 2:
+        return [np.array(data[:])]
+
+    # block in the last two (row/col) dimensions, from the first slice(s) in time
+    length, width = shape[-2:]
+    num_slice = 1
+    if len(shape) == 3:
+        num_slice = min(shape[0], 4)
+    num_row = int(max(1, min(length, sample_size / (itemsize * width * num_slice))))
+
+    samples = []
+    row0_list = np.linspace(0, length - num_row, num_sample, dtype=int)
+    slice0_list = np.linspace(0, 0 if len(shape) == 2 else shape[0] - num_slice, num_sample, dtype=int)
+    for r0, s0 in zip(sorted(set(row0_list)), slice0_list):
+        if len(shape) == 2:
+            samples.append(np.array(data[r0:r0+num_row, :]))
+        else:
+            samples.append(np.array(data[s0:s0+num_slice, r0:r0+num_row, :]))
+    return samples
+
+
+def benchmark_filter(samples, kwargs, num_repeat=2):
+    """Measure the stored size and read/decoding time of one filter on sample blocks
+    Parameters: samples : list of np.ndarray
+                kwargs  : dict, filter options for h5py create_dataset()
+                num_repeat : int, number of read repeats, use the fastest one
+    Returns:    raw_size    : int, number of bytes before compression
+                stored_size : int, number of bytes after compression
+                read_time   : float, time in seconds to read & decode all samples
+    """
+    raw_size = 0
+    stored_size = 0
+    read_time = 0.
+    fname = 'pysar_h5compress_{}.h5'.format(id(samples))
+    with h5py.File(fname, 'w', driver='core', backing_store=False) as f:
+        for i, data in enumerate(samples):
+            ds = f.create_dataset('sample{}'.format(i),
+                                  data=data,
+                                  chunks=True,
+                                  **kwargs)
+            raw_size += data.nbytes
+            stored_size += ds.id.get_storage_size()
+
+            # re-open the dataset for each read to start with an empty chunk cache
+            t_min = np.inf
+            for j in range(num_repeat):
+                ds = f['sample{}'.format(i)]
+                t0 = time.time()
+                ds[()]
+                t_min = min(t_min, time.time() - t0)
+            read_time += t_min
+    return raw_size, stored_size, read_time
+
+
+def benchmark_filters(data, filter_list=FILTER_LIST, num_sample=3, print_msg=True):
+    """Benchmark all candidate filters on sampled blocks of input data
+    Parameters: data : 2D/3D np.ndarray or h5py.Dataset
+                filter_list : list of dict, filter options for h5py create_dataset()
+    Returns:    results : list of dict, with the following keys:
+                    filter, raw_size, stored_size, ratio, read_time, read_speed
+    Examples:   results = h5compress.benchmark_filters(data)
+                results = h5compress.benchmark_filters(h5py.File('timeseries.h5','r')['timeseries'])
+    """
+    samples = sample_data(data, num_sample=num_sample)
+    results = []
+    for kwargs in filter_list:
+        raw_size, stored_size, read_time = benchmark_filter(samples, kwargs)
+        results.append({'filter'     : kwargs,
+                        'raw_size'   : raw_size,
+                        'stored_size': stored_size,
+                        'ratio'      : stored_size / max(raw_size, 1),
+                        'read_time'  : read_time,
+                        'read_speed' : raw_size / max(read_time, 1e-9)})
+
+    if print_msg:
+        print('{:<18} {:>8} {:>14}'.format('filter', 'ratio', 'decode MB/s'))
+        for res in results:
+            print('{:<18} {:>8.3f} {:>14.1f}'.format(filter2str(res['filter']),
+                                                   res['ratio'],
+                                                   res['read_speed'] / 1e6))
+    return results
+
+
+def select_filter(results, goal='size', disk_speed=DISK_SPEED):
+    """Select the best filter from benchmark results for the given goal
+    Parameters: results : list of dict, output of benchmark_filters()
+                goal    : str, size  - minimum stored size, ties broken by read time
+                               speed - minimum read time, including disk I/O at disk_speed
+                disk_speed : float, disk read speed in bytes per second
+    Returns:    kwargs  : dict, filter options for h5py create_dataset()
+    """
+    def read_time_with_io(res):
+        return res['stored_size'] / disk_speed + res['read_time']
+
+    if goal == 'size':
+        best = min(results, key=lambda x: (x['stored_size'], read_time_with_io(x)))
+    elif goal == 'speed':
+        best = min(results, key=lambda x: (read_time_with_io(x), x['stored_size']))
+    else:
+        raise ValueError('un-recognized compression goal: {}'.format(goal))
+    return dict(best['filter'])
+
+
+def check_compression(compression=None):
+    """Compression to use: the input one, or the default one from $PYSAR_COMPRESSION if None"""
+    if compression is None:
+        compression = os.environ.get(COMPRESSION_ENV_NAME, None) or None
+    if compression in [False, 'none', 'no', 'None']:
+        compression = None
+    if compression not in COMPRESSION_CHOICES:
+        raise ValueError('un-recognized compression: {}, available: {}'.format(compression,
+                                                                             COMPRESSION_CHOICES))
+    return compression
+
+
+def get_compression_kwargs(compression=None, data=None, print_msg=True):
+    """Get filter options of h5py create_dataset() for the input compression setting
+    Parameters: compression : str, one of COMPRESSION_CHOICES, None for the default from $PYSAR_COMPRESSION
+                data : 2D/3D np.ndarray or h5py.Dataset, (sample of) the data to be written.
+                       Used by the auto options only, which fall back to AUTO_DEFAULT_FILTER if None.
+    Returns:    kwargs : dict, with compression, compression_opts and shuffle keys
+    Examples:   kwargs = h5compress.get_compression_kwargs('gzip')
+                kwargs = h5compress.get_compression_kwargs('auto_size', data)
+                f.create_dataset('velocity', data=data, chunks=True, **kwargs)
+    """
+    compression = check_compression(compression)
+    if compression is None:
+        return {'compression': None}
+    elif compression in ['lzf', 'gzip']:
+        return {'compression': compression}
+
+    # auto options
+    goal = 'speed' if compression == 'auto_speed' else 'size'
+    if data is None:
+        # filter can not be changed after the dataset is created, thus, not benchmarked on the first block
+        kwargs = dict(AUTO_DEFAULT_FILTER[goal])
+        if print_msg:
+            print('WARNING: no data to benchmark compression filters for {}, use {}'.format(compression,
+                                                                                            filter2str(kwargs)))
+        return kwargs
+
+    if (len(data.shape) < 2
+            or np.dtype(data.dtype).kind not in 'biufc'
+            or np.prod(data.shape) * np.dtype(data.dtype).itemsize < MIN_BENCHMARK_SIZE):
+        return {'compression': None}
+
+    results = benchmark_filters(data, print_msg=False)
+    kwargs = select_filter(results, goal=goal)
+    if print_msg:
+        res = [i for i in results if i['filter'] == kwargs][0]
+        print(('benchmark compression filters for data in {} with goal of {}:'
+               ' use {} with ratio of {:.3f}').format(data.shape,
+                                                      goal,
+                                                      filter2str(kwargs),
+                                                      res['ratio']))
+    return kwargs
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+# Benchmark of the import time of PySAR modules, to keep the startup of command line scripts fast
+# Usage:
+#   python -m pysar.utils.import_time
+#   python -m pysar.utils.import_time pysar.info pysar.dem_error --budget 0.5
+
+
+import sys
+import argparse
+import subprocess
+
+
+# processing scripts, which should start fast and run without matplotlib / basemap
+HEADLESS_MODULES = ['pysar.info',
+                    'pysar.ifgram_inversion',
+                    'pysar.dem_error',
+                    'pysar.correct_timeseries',
+                    'pysar.timeseries2velocity',
+                    'pysar.timeseries_rms',
+                    'pysar.reference_point',
+                    'pysar.reference_date',
+                    'pysar.generate_mask',
+                    'pysar.modify_network',
+                    'pysar.remove_ramp',
+                    'pysar.tropcor_phase_elevation',
+                    'pysar.geocode',
+                    'pysar.pysarApp']
+
+# modules loaded for plotting only
+PLOT_MODULES = ['matplotlib', 'mpl_toolkits', 'pylab']
+
+
+################################################################################
+EXAMPLE = """example:
+  python -m pysar.utils.import_time
+  python -m pysar.utils.import_time pysar.info pysar.dem_error --budget 0.5
+  python -m pysar.utils.import_time pysar.view --allow-plot
+"""
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the import time of PySAR modules',
+                                     formatter_class=argparse.RawTextHelpFormatter,
+                                     epilog=EXAMPLE)
+    parser.add_argument('modules', nargs='*', default=HEADLESS_MODULES,
+                        help='module(s) to import, default: processing scripts of pysarApp')
+    parser.add_argument('--budget', type=float, default=1.0,
+                        help='max import time in seconds of each module, default: 1.0')
+    parser.add_argument('-r', '--repeat', dest='num_repeat', type=int, default=3,
+                        help='number of repeats, the minimum import time is used, default: 3')
+    parser.add_argument('--top', dest='num_top', type=int, default=5,
+                        help='number of slowest imported packages to show, default: 5')
+    parser.add_argument('--allow-plot', dest='allow_plot', action='store_true',
+                        help='do not fail for modules importing matplotlib / basemap')
+    return parser
+
+
+def cmd_line_parse(iargs=None):
+    parser = create_parser()
+    inps = parser.parse_args(args=iargs)
+    return inps
+
+
+################################################################################
+def parse_import_time(msg):
+    """Parse output of python -X importtime
+    Returns: imports : list of tuple (module_name, self_time, cumulative_time, level) with time in seconds
+    """
+    imports = []
+    for line in msg.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        name = fields[2].rstrip()
+        level = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(fields[0]) * 1e-6, int(fields[1]) * 1e-6, level))
+    return imports
+
+
+def measure_import_time(module, num_repeat=3):
+    """Import time of module in a new Python interpreter.
+    Parameters: module     : str, module name, e.g. pysar.dem_error
+                num_repeat : int, number of repeats, the minimum is used
+    Returns:    import_time : float, cumulative import time in seconds, including its dependencies
+                imports     : list of tuple (module_name, self_time, cumulative_time, level)
+    """
+    import_time, imports = None, []
+    for i in range(num_repeat):
+        p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if p.returncode != 0:
+            raise ImportError('failed to import {}:\n{}'.format(module, p.stderr.strip().splitlines()[-1]))
+
+        # modules imported by "import module", i.e. top level entries after the interpreter startup
+        imports_i = parse_import_time(p.stderr)
+        top_names = [name for name, t0, t1, level in imports_i if level == 0]
+        idx = [j for j, name in enumerate(top_names) if module == name or module.startswith(name+'.')]
+        time_i = sum(t1 for (name, t0, t1, level) in imports_i
+                     if level == 0 and top_names.index(name) >= idx[0])
+        if import_time is None or time_i < import_time:
+            import_time, imports = time_i, imports_i
+    return import_time, imports
+
+
+def get_plot_modules(imports):
+    """Plotting modules imported, return the list of their top level package names"""
+    names = [name.split('.')[0] for name, t0, t1, level in imports]
+    return sorted(set(i for i in names if i in PLOT_MODULES))
+
+
+def check_import_time(modules, budget=1.0, num_repeat=3, num_top=5, allow_plot=False):
+    """Check import time of modules against the budget.
+    Returns: failed : list of str, modules over the budget or importing plotting modules
+    """
+    failed = []
+    max_digit = max(len(i) for i in modules)
+    for module in modules:
+        import_time, imports = measure_import_time(module, num_repeat=num_repeat)
+        plot_modules = get_plot_modules(imports)
+        msg = '{m:<{w}} : {t:6.3f} sec'.format(m=module, w=max_digit, t=import_time)
+        status = []
+        if import_time > budget:
+            status.append('over budget of {} sec'.format(budget))
+        if plot_modules and not allow_plot:
+            status.append('import {}'.format(', '.join(plot_modules)))
+        if status:
+            failed.append(module)
+            msg += '  FAILED: {}'.format('; '.join(status))
+        print(msg)
+
+        if status:
+            # slowest packages, excluding the module itself
+            pkgs = [i for i in imports if i[0] != module and i[3] <= 1]
+            for name, t0, t1, level in sorted(pkgs, key=lambda x: x[2], reverse=True)[:num_top]:
+                print('    {:<40} {:6.3f} sec'.format(name, t1))
+    return failed
+
+
+################################################################################
+def main(iargs=None):
+    inps = cmd_line_parse(iargs)
+    failed = check_import_time(inps.modules,
+                               budget=inps.budget,
+                               num_repeat=inps.num_repeat,
+                               num_top=inps.num_top,
+                               allow_plot=inps.allow_plot)
+    if failed:
+        raise SystemExit('{} module(s) failed the import time check: {}'.format(len(failed), failed))
+    print('all modules passed the import time check.')
+    return
+
+
+################################################################################
+if __name__ == '__main__':
+    main()
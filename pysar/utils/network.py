@@ -9,23 +9,17 @@
 
 import os
 import sys
+import hashlib
 import datetime
 import itertools
 
 import h5py
 import numpy as np
-import matplotlib as mpl
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
-import matplotlib.colors as colors
-import matplotlib.lines as mlines
-from matplotlib.tri import Triangulation
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-import scipy.sparse as sparse
-from scipy.sparse.csgraph import minimum_spanning_tree
+# matplotlib and scipy.sparse are imported within functions using them,
+# to speed up the import of this module, which is imported by pysar.utils.utils
 
 from pysar.utils import ptime, readfile
-from pysar.objects import ifgramStack, timeseries, sensor
+from pysar.objects import ifgramStack, timeseries, sensor, closureDatasetName
 
 
 ##################################################################
@@ -216,6 +210,125 @@ def get_date12_list(File, dropIfgram=False):
     return date12_list
 
 
+def get_triangles(date12_list):
+    """Enumerate closure triangles of the network of interferograms, i.e. (ab, bc, ac) with a < b < c,
+    via the adjacency matrix of the date graph, vectorized for all triangles sharing the middle date b.
+    Parameters: date12_list : list of str, in YYYYMMDD_YYYYMMDD or YYMMDD-YYMMDD format,
+                              with master date before slave date
+    Returns:    triangles : 2D np.array of int32 in size of (num_triangle, 3),
+                            index of interferogram ab, bc and ac in date12_list
+    Example:    triangles = get_triangles(ifgramStack('ifgramStack.h5').get_date12_list())
+    """
+    date12_list = [i.replace('-', '_') for i in date12_list]
+    m_dates = ptime.yyyymmdd([i.split('_')[0] for i in date12_list])
+    s_dates = ptime.yyyymmdd([i.split('_')[1] for i in date12_list])
+    date_list = sorted(list(set(m_dates + s_dates)))
+    date_idx = dict((d, i) for i, d in enumerate(date_list))
+    num_date = len(date_list)
+
+    # adjacency matrix with ifgram index as value, -1 for no connection
+    ifg_mat = -1 * np.ones((num_date, num_date), np.int32)
+    ifg_mat[[date_idx[i] for i in m_dates],
+            [date_idx[i] for i in s_dates]] = np.arange(len(date12_list), dtype=np.int32)
+
+    triangles = []
+    for b in range(num_date):
+        a = np.where(ifg_mat[:, b] >= 0)[0]
+        c = np.where(ifg_mat[b, :] >= 0)[0]
+        if a.size == 0 or c.size == 0:
+            continue
+        ac = ifg_mat[np.ix_(a, c)]
+        ai, ci = np.where(ac >= 0)
+        triangles.append(np.vstack((ifg_mat[a[ai], b],
+                                    ifg_mat[b, c[ci]],
+                                    ac[ai, ci])).T)
+
+    if not triangles:
+        return np.zeros((0, 3), np.int32)
+    triangles = np.vstack(triangles)
+    triangles = triangles[np.lexsort((triangles[:, 1], triangles[:, 0]))]
+    return triangles
+
+
+def triangle2closure_matrix(triangles, num_ifgram):
+    """Closure matrix C of triangles, so that closure phase = C * phase = ab + bc - ac
+    Parameters: triangles  : 2D np.array of int in size of (num_triangle, 3), index of ab, bc and ac
+                num_ifgram : int, number of interferograms
+    Returns:    C : 2D scipy.sparse.csr_matrix of float32 in size of (num_triangle, num_ifgram)
+    """
+    from scipy import sparse
+    num_tri = triangles.shape[0]
+    C = sparse.csr_matrix((np.tile(np.array([1, 1, -1], np.float32), num_tri),
+                           (np.repeat(np.arange(num_tri), 3), triangles.flatten())),
+                          shape=(num_tri, num_ifgram))
+    return C
+
+
+def get_closure_matrix(date12_list):
+    """Closure matrix C of the network of interferograms
+    Returns: C         : 2D scipy.sparse.csr_matrix of float32 in size of (num_triangle, num_ifgram)
+             triangles : 2D np.array of int32 in size of (num_triangle, 3)
+    """
+    triangles = get_triangles(date12_list)
+    C = triangle2closure_matrix(triangles, len(date12_list))
+    return C, triangles
+
+
+def read_closure_matrix(stack_file, dropIfgram=True, cache_file=None, print_msg=True):
+    """Closure matrix C of ifgramStack file, with triangles cached in a separate HDF5 file,
+    keyed by the hash of the date12 list, thus, updated after network modification automatically.
+    The input ifgramStack file is not modified.
+    Parameters: stack_file : str, path of ifgramStack file
+                dropIfgram : bool, use kept interferograms only or all interferograms
+                cache_file : str, path of closure triangle cache file,
+                             default: closureTriangle.h5 in the same directory as stack_file
+    Returns:    C         : 2D scipy.sparse.csr_matrix of float32 in size of (num_triangle, num_ifgram)
+                triangles : 2D np.array of int32 in size of (num_triangle, 3)
+    Example:    C = read_closure_matrix('INPUTS/ifgramStack.h5')[0]
+    """
+    date12_list = ifgramStack(stack_file).get_date12_list(dropIfgram=dropIfgram)
+    key = hashlib.md5('\n'.join(date12_list).encode('utf8')).hexdigest()
+    if not cache_file:
+        cache_file = os.path.join(os.path.dirname(stack_file), '{}.h5'.format(closureDatasetName))
+
+    triangles = None
+    if os.path.isfile(cache_file):
+        try:
+            with h5py.File(cache_file, 'r') as f:
+                value = f[closureDatasetName].attrs.get('DATE12_HASH', b'')
+                if isinstance(value, bytes):
+                    value = value.decode('utf8')
+                if value == key:
+                    triangles = f[closureDatasetName][:]
+                    if print_msg:
+                        print('read closure triangles from file: {}'.format(cache_file))
+        except (OSError, KeyError, ValueError):
+            # corrupted or partially written file, re-calculate it
+            print('WARNING: can not read closure triangles from file: {}'.format(cache_file))
+
+    if triangles is None:
+        triangles = get_triangles(date12_list)
+        # write to temporary file and rename, for concurrent runs sharing the same cache file
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        try:
+            with h5py.File(tmp_file, 'w') as f:
+                ds = f.create_dataset(closureDatasetName, data=triangles)
+                ds.attrs['DATE12_HASH'] = key
+            os.replace(tmp_file, cache_file)
+            if print_msg:
+                print('write closure triangles to file: {}'.format(cache_file))
+        except (OSError, ValueError):
+            print('WARNING: can not cache closure triangles in file: {}'.format(cache_file))
+            if os.path.isfile(tmp_file):
+                os.remove(tmp_file)
+
+    C = triangle2closure_matrix(triangles, len(date12_list))
+    if print_msg:
+        print('number of interferograms: {}'.format(len(date12_list)))
+        print('number of triangles     : {}'.format(C.shape[0]))
+    return C, triangles
+
+
 def igram_perp_baseline_list(File):
     """Get perpendicular baseline list from input multi_group hdf5 file"""
     print(('read perp baseline info from '+File))
@@ -363,6 +476,7 @@ def simulate_coherence(date12_list, baseline_file='bl_list.txt', sensor_name='En
         print('')
 
     if display:
+        import matplotlib.pyplot as plt
         print(('critical perp baseline: %.f m' % pbase_c))
         cohs_mat = coherence_matrix(date12_list, cohs)
         plt.figure()
@@ -540,6 +654,8 @@ def threshold_coherence_based_mst(date12_list, coh_list):
     wei_mat[mask] = 1/coh_mat[mask]
 
     # MST path based on weight matrix
+    from scipy import sparse
+    from scipy.sparse.csgraph import minimum_spanning_tree
     wei_mat_csr = sparse.csr_matrix(wei_mat)
     mst_mat_csr = minimum_spanning_tree(wei_mat_csr)
 
@@ -685,6 +801,7 @@ def select_pairs_delaunay(date_list, pbase_list, norm=True):
         tbase_list = [tbase*temp2perp_scale for tbase in tbase_list]
 
     # Generate Delaunay Triangulation
+    from matplotlib.tri import Triangulation
     date12_idx_list = Triangulation(tbase_list, pbase_list).edges.tolist()
     date12_idx_list = [sorted(idx) for idx in sorted(date12_idx_list)]
 
@@ -722,10 +839,12 @@ def select_pairs_mst(date_list, pbase_list):
 
     # 2D distance matrix in temp/perp domain
     weightMat = np.sqrt(np.square(ttMat) + np.square(ppMat))
+    from scipy import sparse
+    from scipy.sparse.csgraph import minimum_spanning_tree
     weightMat = sparse.csr_matrix(weightMat)  # compress sparse row matrix
 
     # MST path based on weight matrix
-    mstMat = sparse.csgraph.minimum_spanning_tree(weightMat)
+    mstMat = minimum_spanning_tree(weightMat)
 
     # Convert MST index matrix into date12 list
     [s_idx_list, m_idx_list] = [date_idx_array.tolist()
@@ -0,0 +1,322 @@
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+# Performance report of processing steps: wall time, CPU time, peak memory and bytes read/written
+# Recommend import:
+#   from pysar.utils import perf
+
+
+import os
+import csv
+import json
+import time
+import threading
+import subprocess
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+REPORT_KEYS = ['step', 'phase', 'wall_time', 'cpu_time', 'peak_rss_MB', 'read_MB', 'write_MB']
+
+# active monitor and the stack of records of the current thread
+_monitor = None
+_local = threading.local()
+
+
+########################################################################################
+def read_proc_io(pid='self'):
+    """Bytes read/written by the process (and its reaped children) via system calls,
+    including data in the page cache, in bytes. Returns (None, None) if not available."""
+    try:
+        with open('/proc/{}/io'.format(pid), 'r') as f:
+            io = dict(line.split(':') for line in f.read().strip().splitlines())
+        return int(io['rchar']), int(io['wchar'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def read_peak_rss():
+    """Peak resident set size of the current process in MB"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1]) / 1024.
+    except (IOError, OSError):
+        pass
+    if resource is not None:
+        return get_maxrss_MB(resource.getrusage(resource.RUSAGE_SELF))
+    return None
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of the current process to the current RSS, Linux only.
+    Returns True if succeed, so that the peak RSS of each step can be measured separately."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def get_maxrss_MB(ru):
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024. * 1024. if os.uname().sysname == 'Darwin' else 1024.
+    return ru.ru_maxrss / scale
+
+
+def get_cpu_time():
+    """CPU time (user + system) of the current process and its reaped children in seconds"""
+    if resource is None:
+        t = os.times()
+        return t.user + t.system + t.children_user + t.children_system
+    ru_self = resource.getrusage(resource.RUSAGE_SELF)
+    ru_child = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru_self.ru_utime + ru_self.ru_stime + ru_child.ru_utime + ru_child.ru_stime
+
+
+def get_usage():
+    rchar, wchar = read_proc_io()
+    return {'wall_time': time.time(),
+            'cpu_time': get_cpu_time(),
+            'rchar': rchar,
+            'wchar': wchar}
+
+
+def diff_usage(start, end, rec):
+    """Update record rec with the difference of two usages"""
+    rec['wall_time'] += end['wall_time'] - start['wall_time']
+    rec['cpu_time'] += end['cpu_time'] - start['cpu_time']
+    for key, name in [('rchar', 'read_MB'), ('wchar', 'write_MB')]:
+        if start[key] is not None and end[key] is not None:
+            rec[name] = (rec[name] or 0.) + (end[key] - start[key]) / 1024. / 1024.
+    return rec
+
+
+def new_record(step, phase=''):
+    return {'step': step, 'phase': phase, 'wall_time': 0., 'cpu_time': 0.,
+            'peak_rss_MB': None, 'read_MB': None, 'write_MB': None}
+
+
+def current_record():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+########################################################################################
+class perfMonitor:
+    """Record performance of processing steps and their sub-phases.
+
+    For each step, record wall time, CPU time, peak RSS and bytes read/written via system calls,
+    i.e. HDF5 and binary files, in MB. Commands run with perf.call() in a child process are measured
+    from the resource usage of the child process, so that steps running in parallel are separated.
+    Sub-phases, e.g. read / compute / write, are recorded within the step with perf.phase(),
+    durations of the same phase within one step are accumulated.
+
+    Example:
+        monitor = perfMonitor()
+        with monitor.step('dem_error'):
+            with perf.phase('read'):
+                data = ts_obj.read()
+            with perf.phase('compute'):
+                ...
+        monitor.write('pysarApp_perf.json')
+        monitor.compare('pysarApp_perf_old.json')
+    """
+
+    def __init__(self, print_msg=True):
+        self.records = []
+        self.print_msg = print_msg
+        self.lock = threading.Lock()
+
+    def activate(self):
+        global _monitor
+        _monitor = self
+        return self
+
+    @contextmanager
+    def step(self, name, in_process=True):
+        """Record one step.
+        Parameters: name       : str, step name
+                    in_process : bool, True to measure usage of the current process,
+                                 False if the step runs in a child process with perf.call(),
+                                 e.g. steps running in parallel.
+        """
+        rec = new_record(name)
+        rec['_phases'] = []
+        rec['_in_process'] = in_process
+        _local.stack = [rec]
+        if in_process:
+            reset_peak_rss()
+            start = get_usage()
+        else:
+            start_time = time.time()
+        try:
+            yield rec
+        finally:
+            if in_process:
+                diff_usage(start, get_usage(), rec)
+                peak_rss = read_peak_rss()
+                if peak_rss is not None:
+                    rec['peak_rss_MB'] = max(peak_rss, rec['peak_rss_MB'] or 0.)
+            else:
+                rec['wall_time'] = time.time() - start_time
+            _local.stack = []
+            phases = rec.pop('_phases')
+            rec.pop('_in_process')
+            with self.lock:
+                self.records += [rec] + phases
+            if self.print_msg:
+                print_record(rec)
+
+    def write(self, out_file):
+        """Write report into JSON file and CSV file with the same base name"""
+        fbase = os.path.splitext(out_file)[0]
+        report = {'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                  'steps': self.records}
+        with open(fbase+'.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(fbase+'.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_KEYS)
+            writer.writeheader()
+            for rec in self.records:
+                writer.writerow({k: round_value(rec[k]) for k in REPORT_KEYS})
+        print('write performance report to file: {}.json/csv'.format(fbase))
+        return fbase+'.json'
+
+    def compare(self, ref_file, threshold=0.2, min_time=1.0):
+        """Compare with the report of a previous run, print steps slower or larger than threshold.
+        Parameters: ref_file  : str, JSON file of the previous report
+                    threshold : float, relative increase considered as regression
+                    min_time  : float, minimum wall time in seconds of steps to check
+        Returns:    regressions : list of tuple (step, phase, key, value_ref, value)
+        """
+        ref_recs = read_report(ref_file)
+        ref_dict = {(i['step'], i['phase']): i for i in ref_recs}
+        print('\n{:<30} {:<10} {:>12} {:>12} {:>12} {:>12}'.format('step', 'phase', 'wall_time', 'ref',
+                                                                 'peak_rss_MB', 'ref'))
+        regressions = []
+        for rec in self.records:
+            ref = ref_dict.get((rec['step'], rec['phase']), None)
+            if ref is None:
+                continue
+            print('{:<30} {:<10} {:>12} {:>12} {:>12} {:>12}'.format(rec['step'], rec['phase'],
+                                                                   round_value(rec['wall_time']),
+                                                                   round_value(ref['wall_time']),
+                                                                   round_value(rec['peak_rss_MB']),
+                                                                   round_value(ref['peak_rss_MB'])))
+            if max(rec['wall_time'], ref['wall_time']) < min_time:
+                continue
+            for key in REPORT_KEYS[2:]:
+                if rec[key] is not None and ref[key] and rec[key] > ref[key] * (1. + threshold):
+                    regressions.append((rec['step'], rec['phase'], key, ref[key], rec[key]))
+
+        if regressions:
+            print('\nWARNING: regression (increase > {:.0f}%) compared with {}:'.format(threshold*100, ref_file))
+            for step, phase, key, v0, v1 in regressions:
+                print('    {:<30} {:<10} {:<12}: {} --> {}'.format(step, phase, key,
+                                                                  round_value(v0), round_value(v1)))
+        else:
+            print('\nno regression found compared with {}'.format(ref_file))
+        return regressions
+
+
+########################################################################################
+@contextmanager
+def phase(name):
+    """Record a sub-phase of the current step, e.g. read, compute or write.
+    Do nothing if no step is being recorded, i.e. running the script standalone.
+    Example:
+        with perf.phase('read'):
+            data = readfile.read(fname)[0]
+    """
+    step_rec = current_record()
+    if step_rec is None or _monitor is None:
+        yield
+        return
+
+    rec = None
+    for i in step_rec['_phases']:
+        if i['phase'] == name:
+            rec = i
+    if rec is None:
+        rec = new_record(step_rec['step'], phase=name)
+        step_rec['_phases'].append(rec)
+    start = get_usage()
+    try:
+        yield
+    finally:
+        diff_usage(start, get_usage(), rec)
+        peak_rss = read_peak_rss()
+        if peak_rss is not None:
+            rec['peak_rss_MB'] = max(peak_rss, rec['peak_rss_MB'] or 0.)
+
+
+def call(cmd, cwd=None):
+    """Run command with shell in a child process and record its resource usage into the current step.
+    Returns: status : int, exit status of the command
+    """
+    p = subprocess.Popen(cmd, shell=True, cwd=cwd)
+    rec = current_record()
+    if rec is None or not hasattr(os, 'wait4'):
+        return p.wait()
+
+    # read I/O counters of the finished child before reaping it
+    rchar = wchar = None
+    try:
+        os.waitid(os.P_PID, p.pid, os.WEXITED | os.WNOWAIT)
+        rchar, wchar = read_proc_io(p.pid)
+    except (AttributeError, OSError):
+        pass
+    pid, status, ru = os.wait4(p.pid, 0)
+    p.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status >> 8
+
+    rec['peak_rss_MB'] = max(get_maxrss_MB(ru), rec['peak_rss_MB'] or 0.)
+    # CPU time and I/O of reaped child are included in the usage of in-process step already
+    if rec['_in_process']:
+        return p.returncode
+    rec['cpu_time'] += ru.ru_utime + ru.ru_stime
+    if rchar is not None:
+        rec['read_MB'] = (rec['read_MB'] or 0.) + rchar / 1024. / 1024.
+        rec['write_MB'] = (rec['write_MB'] or 0.) + wchar / 1024. / 1024.
+    return p.returncode
+
+
+def read_report(fname):
+    """Read records from JSON or CSV report file"""
+    if fname.endswith('.csv'):
+        with open(fname, 'r') as f:
+            recs = list(csv.DictReader(f))
+        for rec in recs:
+            for key in REPORT_KEYS[2:]:
+                rec[key] = float(rec[key]) if rec[key] else None
+        return recs
+    with open(fname, 'r') as f:
+        return json.load(f)['steps']
+
+
+def round_value(value, digit=3):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return round(value, digit)
+    return value
+
+
+def print_record(rec):
+    msg = 'step {:<20}: wall time {:.1f} sec, CPU time {:.1f} sec'.format(rec['step'],
+                                                                         rec['wall_time'],
+                                                                         rec['cpu_time'])
+    if rec['peak_rss_MB'] is not None:
+        msg += ', peak RSS {:.1f} MB'.format(rec['peak_rss_MB'])
+    if rec['read_MB'] is not None:
+        msg += ', read {:.1f} MB, write {:.1f} MB'.format(rec['read_MB'], rec['write_MB'])
+    print(msg)
+    return
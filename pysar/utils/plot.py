@@ -19,7 +19,6 @@ from matplotlib.colors import LinearSegmentedColormap, LightSource
 from matplotlib.offsetbox import AnchoredText
 from matplotlib.patheffects import withStroke
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from mpl_toolkits.basemap import Basemap, cm, pyproj
 
 from pysar.utils import ptime, readfile, network as pnet, utils as ut
 from pysar.objects import timeseriesKeyNames
@@ -44,9 +43,10 @@ max_figsize_height = 8.0       # max figure size in vertical direction in inch
 
 
 ############################################ Class Begein ###############################################
-class BasemapExt(Basemap):
+class BasemapExtMixin:
     """
     Extend Basemap class to add drawscale(), because Basemap.drawmapscale() do not support 'cyl' projection.
+    Use BasemapExt() to create the object, as basemap is imported on demand only.
     """
 
     def draw_scale_bar(self, lat_c, lon_c, distance, ax=None, font_size=12, yoffset=None, color='k'):
@@ -57,6 +57,7 @@ class BasemapExt(Basemap):
                     yoffset     : float, optional, scale bar length at two ends, in degree
         Example:    m.drawscale(33.06, 131.18, 2000)
         """
+        from mpl_toolkits.basemap import pyproj
         gc = pyproj.Geod(a=self.rmajor, b=self.rminor)
         if distance > 1000.0:
             distance = np.rint(distance/1000.0)*1000.0
@@ -163,6 +164,21 @@ class BasemapExt(Basemap):
         return lats, lons, lalo_step
 
 
+basemapExtClass = None
+
+
+def BasemapExt(*args, **kwargs):
+    """Create Basemap object extended with BasemapExtMixin.
+    basemap is imported here at the first call, because it takes seconds to import
+    and is only needed while plotting in geo coordinates.
+    """
+    global basemapExtClass
+    if basemapExtClass is None:
+        from mpl_toolkits.basemap import Basemap
+        basemapExtClass = type('BasemapExt', (BasemapExtMixin, Basemap), {})
+    return basemapExtClass(*args, **kwargs)
+
+
 ############################################ Plot Utilities #############################################
 def discrete_cmap(N, base_cmap=None):
     """Create an N-bin discrete colormap from the specified input map
@@ -841,7 +857,7 @@ def plot_dem_background(ax, geo_box=None, dem_shade=None, dem_contour=None, dem_
 
     if dem_shade is not None:
         # geo coordinates
-        if isinstance(ax, BasemapExt) and geo_box is not None:
+        if isinstance(ax, BasemapExtMixin) and geo_box is not None:
             ax.imshow(dem_shade, interpolation='spline16', origin='upper')
         # radar coordinates
         elif isinstance(ax, plt.Axes):
@@ -849,7 +865,7 @@ def plot_dem_background(ax, geo_box=None, dem_shade=None, dem_contour=None, dem_
 
     if dem_contour is not None and dem_contour_seq is not None:
         # geo coordinates
-        if isinstance(ax, BasemapExt) and geo_box is not None:
+        if isinstance(ax, BasemapExtMixin) and geo_box is not None:
             yy, xx = np.mgrid[geo_box[1]:geo_box[3]:dem_contour.shape[0]*1j,
                               geo_box[0]:geo_box[2]:dem_contour.shape[1]*1j]
             ax.contour(xx, yy, dem_contour, dem_contour_seq,
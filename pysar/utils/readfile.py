@@ -11,6 +11,7 @@ import os
 import sys
 import re
 from datetime import datetime as dt
+from collections import OrderedDict
 import h5py
 import numpy as np
 #from PIL import Image
@@ -432,6 +433,45 @@ def get_2d_dataset_list(fname):
     return datasetList
 
 
+def is_root_hdf5_file(fname):
+    """Whether the input file is HDF5 file with datasets in the root level"""
+    if os.path.splitext(fname)[1].lower() not in ['.h5', '.he5']:
+        return False
+    with h5py.File(fname, 'r') as f:
+        return any(isinstance(f[i], h5py.Dataset) for i in f.keys())
+
+
+# cache of attributes / template content of files, shared by all steps
+# running within the same Python process, e.g. pysarApp.py
+# key: file signature + read options, value: dict
+# with least recently used entries dropped beyond METADATA_CACHE_SIZE
+metadata_cache = OrderedDict()
+METADATA_CACHE_SIZE = 128
+
+
+def get_cached_metadata(cache_key):
+    """Return a copy of the cached dict of cache_key, None if not cached."""
+    if cache_key not in metadata_cache.keys():
+        return None
+    metadata_cache.move_to_end(cache_key)
+    return dict(metadata_cache[cache_key])
+
+
+def set_cached_metadata(cache_key, meta):
+    """Cache a copy of meta dict with cache_key, and drop the least recently used entry if full."""
+    metadata_cache[cache_key] = dict(meta)
+    metadata_cache.move_to_end(cache_key)
+    while len(metadata_cache) > METADATA_CACHE_SIZE:
+        metadata_cache.popitem(last=False)
+
+
+def get_file_signature(fname):
+    """Return (absolute path, modification time in ns, size) of the input file,
+    which changes whenever the file is re-written or modified."""
+    st = os.stat(fname)
+    return (os.path.abspath(fname), st.st_mtime_ns, st.st_size)
+
+
 #########################################################################
 def read_attribute(fname, datasetName=None, standardize=True):
     """Read attributes of input file into a dictionary
@@ -444,6 +484,14 @@ def read_attribute(fname, datasetName=None, standardize=True):
         print('current directory: '+os.getcwd())
         sys.exit(1)
 
+    # use cached attributes of unchanged HDF5 file
+    cache_key = None
+    if ext in ['.h5', '.he5']:
+        cache_key = ('attribute',) + get_file_signature(fname) + (datasetName, standardize)
+        meta = get_cached_metadata(cache_key)
+        if meta is not None:
+            return meta
+
     # HDF5 files
     if ext in ['.h5', '.he5']:
         f = h5py.File(fname, 'r')
@@ -541,6 +589,9 @@ def read_attribute(fname, datasetName=None, standardize=True):
 
     if standardize:
         atr = standardize_metadata(atr, standardMetadataKeys)
+
+    if cache_key is not None:
+        set_cached_metadata(cache_key, atr)
     return atr
 
 
@@ -593,6 +644,14 @@ def read_template(fname, delimiter='=', print_msg=True):
         from pysar.defaults.auto_path import isceAutoPath
         tmpl = read_template(isceAutoPath, print_msg=False)
     """
+    # use cached content of unchanged template file
+    cache_key = None
+    if os.path.isfile(fname):
+        cache_key = ('template',) + get_file_signature(fname) + (delimiter,)
+        meta = get_cached_metadata(cache_key)
+        if meta is not None:
+            return meta
+
     template_dict = {}
     plotAttributeDict = {}
     insidePlotObject = False
@@ -649,6 +708,8 @@ def read_template(fname, delimiter='=', print_msg=True):
     if len(plotAttributes) > 0:
         template_dict["plotAttributes"] = json.dumps(plotAttributes)
 
+    if cache_key is not None:
+        set_cached_metadata(cache_key, template_dict)
     return template_dict
 
 
@@ -0,0 +1,303 @@
+############################################################
+# Program is part of PySAR                                 #
+# Copyright(c) 2018, Zhang Yunjun, Heresh Fattahi          #
+# Author:  Zhang Yunjun, Heresh Fattahi, 2018              #
+############################################################
+# Dependency graph of processing steps with content-hash based change detection
+# Recommend import:
+#   from pysar.utils.scheduler import stepGraph
+
+
+import os
+import json
+import time
+import fnmatch
+import hashlib
+from concurrent import futures
+import h5py
+import numpy as np
+from pysar.utils import perf
+
+
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+# HDF5 files larger than this are identified by their structure and a sample of their content,
+# instead of the hash of the whole file, see get_hdf5_hash()
+HASH_HDF5_MAX_SIZE = 256 * 1024 * 1024
+
+
+########################################################################################
+class stepNode:
+    """Processing step as a node of the dependency graph.
+    Parameters: name : str, unique step name
+                cmd  : str, command line to run
+                inputs  : list of str, files read by the step
+                outputs : list of str, files written by the step, including files modified in place
+                template_keys : list of str, template options used by the step, support wildcards,
+                    e.g. pysar.reference.*
+                error_msg : str, message of the exception raised if the step fails,
+                    None to ignore the failure of the step and skip the steps depending on it
+    """
+
+    def __init__(self, name, cmd, inputs=None, outputs=None, template_keys=None, error_msg=None):
+        self.name = name
+        self.cmd = cmd
+        self.inputs = [os.path.abspath(i) for i in (inputs or []) if i]
+        self.outputs = [os.path.abspath(i) for i in (outputs or []) if i]
+        self.template_keys = list(template_keys or [])
+        self.error_msg = error_msg
+        self.deps = []
+
+
+########################################################################################
+class stepGraph:
+    """Dependency graph of processing steps.
+
+    A step depends on the previously added steps that write any of its inputs (read after write),
+    read any of its outputs (write after read) or write any of its outputs (write after write).
+    A step is re-run only if any of the following changes since its last successful run:
+        1) hash of the command line, the relevant template options and the content of input files
+        2) existence or content of output files
+    Steps ready to run are executed in parallel with num_worker > 1.
+    With perf_file, the wall time, CPU time, peak memory and bytes read/written of each step run
+    are written into a JSON/CSV report, see perf.perfMonitor.
+
+    Example:
+        dag = stepGraph(state_file='pysarApp_state.json', template=template, run_func=run_cmd)
+        dag.add_step('mask', 'generate_mask.py temporalCoherence.h5 -m 0.7 -o maskTempCoh.h5',
+                     inputs=['temporalCoherence.h5'], outputs=['maskTempCoh.h5'],
+                     template_keys=['pysar.networkInversion.minTempCoh'])
+        dag.run()
+    """
+
+    def __init__(self, state_file='pysarApp_state.json', template=None, run_func=None,
+                 num_worker=1, work_dir=None, perf_file=None, print_msg=True):
+        self.state_file = os.path.abspath(state_file)
+        self.template = template or {}
+        self.run_func = run_func
+        self.num_worker = max(1, int(num_worker))
+        self.work_dir = os.path.abspath(work_dir or os.getcwd())
+        self.print_msg = print_msg
+        self.perf_file = perf_file
+        self.monitor = perf.perfMonitor().activate() if perf_file else None
+
+        self.nodes = []
+        self.done = []
+        self.failed = []
+        self.read_state()
+
+    # ---------------------------- state file ---------------------------- #
+    def read_state(self):
+        self.state = {'files': {}, 'steps': {}}
+        if os.path.isfile(self.state_file):
+            try:
+                with open(self.state_file, 'r') as f:
+                    self.state.update(json.load(f))
+            except ValueError:
+                print('WARNING: can not read {}, ignore it.'.format(self.state_file))
+        return self.state
+
+    def write_state(self):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.state_file)
+        return self.state_file
+
+    # ---------------------------- hashing ---------------------------- #
+    @staticmethod
+    def get_hdf5_hash(fname):
+        """Hash of large HDF5 file, from the name, shape, data type and attributes of all groups
+        and datasets, the full content of small datasets and evenly spaced slices of large datasets,
+        reading ~HASH_BLOCK_SIZE bytes per dataset, instead of the whole file of many GB.
+        In-place edits changing only un-sampled part of a large dataset without touching any
+        attribute or small dataset are NOT detected; all PySAR steps update metadata, e.g. REF_Y/X,
+        or small datasets, e.g. dropIfgram, or write new datasets when modifying files in place.
+        """
+        md5 = hashlib.md5()
+
+        def update_hash(name, obj):
+            md5.update(name.encode('utf8'))
+            for key in sorted(obj.attrs.keys()):
+                md5.update('{}={}'.format(key, obj.attrs[key]).encode('utf8'))
+            if not isinstance(obj, h5py.Dataset):
+                return
+            md5.update('{}{}'.format(obj.shape, obj.dtype).encode('utf8'))
+            if obj.nbytes <= HASH_BLOCK_SIZE or len(obj.shape) == 0:
+                md5.update(np.ascontiguousarray(obj[()]).tobytes())
+                return
+            # evenly spaced slices along the 1st axis, strided along the 2nd axis if one slice is too large
+            slice_size = obj.nbytes / obj.shape[0]
+            num_slice = int(max(1, min(obj.shape[0], HASH_BLOCK_SIZE // slice_size)))
+            step = int(np.ceil(slice_size / HASH_BLOCK_SIZE)) if len(obj.shape) > 1 else 1
+            for i in np.unique(np.linspace(0, obj.shape[0]-1, num_slice).astype(int)):
+                data = obj[i, ::step] if step > 1 else obj[i]
+                md5.update(np.ascontiguousarray(data).tobytes())
+
+        with h5py.File(fname, 'r') as f:
+            update_hash('/', f)
+            f.visititems(update_hash)
+        return md5.hexdigest()
+
+    def get_file_hash(self, fname):
+        """Content hash of a file, cached by file path, modification time and size.
+        Large HDF5 files are hashed partially, see get_hdf5_hash().
+        Returns None if file does not exist."""
+        if not os.path.isfile(fname):
+            return None
+        st = os.stat(fname)
+        signature = [st.st_mtime_ns, st.st_size]
+        cache = self.state['files'].get(fname, None)
+        if cache and cache['signature'] == signature:
+            return cache['hash']
+
+        if self.print_msg:
+            print('calculate content hash of file: {}'.format(fname))
+        if st.st_size > HASH_HDF5_MAX_SIZE and h5py.is_hdf5(fname):
+            file_hash = self.get_hdf5_hash(fname)
+        else:
+            md5 = hashlib.md5()
+            with open(fname, 'rb') as f:
+                for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    md5.update(block)
+            file_hash = md5.hexdigest()
+        self.state['files'][fname] = {'signature': signature, 'hash': file_hash}
+        return file_hash
+
+    def get_template_options(self, node):
+        opts = {}
+        for key in sorted(self.template.keys()):
+            if any(fnmatch.fnmatchcase(key, i) for i in node.template_keys):
+                opts[key] = str(self.template[key])
+        return opts
+
+    def get_step_key(self, node):
+        """Hash of command line, relevant template options and content of input files"""
+        content = {'cmd': node.cmd,
+                   'template': self.get_template_options(node),
+                   'inputs': [[i, self.get_file_hash(i)] for i in node.inputs]}
+        return hashlib.md5(json.dumps(content, sort_keys=True).encode('utf8')).hexdigest()
+
+    def need_run(self, node):
+        step_state = self.state['steps'].get(node.name, None)
+        if step_state is None:
+            return True, 'never run before'
+
+        if step_state['key'] != self.get_step_key(node):
+            return True, 'inputs or options changed'
+
+        for fname in node.outputs:
+            out_hash = step_state['outputs'].get(fname, None)
+            if out_hash is None and fname not in step_state['outputs'].keys():
+                return True, 'new output {}'.format(fname)
+            if out_hash != self.get_file_hash(fname):
+                return True, 'output {} missing or changed'.format(fname)
+        return False, 'up to date'
+
+    def record_step(self, node):
+        self.state['steps'][node.name] = {'key': self.get_step_key(node),
+                                          'outputs': {i: self.get_file_hash(i) for i in node.outputs},
+                                          'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    # ---------------------------- graph ---------------------------- #
+    def add_step(self, name, cmd, inputs=None, outputs=None, template_keys=None, error_msg=None):
+        """Add a step to the graph, dependency is resolved based on the previously added steps."""
+        if name in [n.name for n in self.nodes]:
+            raise ValueError('step name already exists: {}'.format(name))
+        node = stepNode(name, cmd,
+                        inputs=inputs,
+                        outputs=outputs,
+                        template_keys=template_keys,
+                        error_msg=error_msg)
+
+        for prev in self.nodes:
+            if (set(node.inputs) & set(prev.outputs)
+                    or set(node.outputs) & set(prev.inputs)
+                    or set(node.outputs) & set(prev.outputs)):
+                node.deps.append(prev)
+        self.nodes.append(node)
+        return node
+
+    def run_node(self, node, parallel=False):
+        """Run the command of one step, return its exit status"""
+        print(node.cmd)
+        in_process = not parallel and self.run_func is not None
+        if self.monitor is None:
+            return self.run_func(node.cmd) if in_process else perf.call(node.cmd, cwd=self.work_dir)
+
+        with self.monitor.step(node.name, in_process=in_process):
+            if in_process:
+                return self.run_func(node.cmd)
+            return perf.call(node.cmd, cwd=self.work_dir)
+
+    def finish_node(self, node, status):
+        if status != 0:
+            if node.error_msg is not None:
+                raise RuntimeError('{}\nstep: {}\ncommand: {}'.format(node.error_msg,
+                                                                    node.name,
+                                                                    node.cmd))
+            print('WARNING: step {} exits with status {}, ignore and continue.'.format(node.name, status))
+            self.state['steps'].pop(node.name, None)
+            self.failed.append(node)
+        else:
+            self.record_step(node)
+            self.write_state()
+            self.done.append(node)
+
+    def skip_node(self, node):
+        """Skip step depending on failed step(s), as its inputs are missing or out of date"""
+        failed_deps = [d.name for d in node.deps if d in self.failed]
+        print('WARNING: skip step {} as its dependency failed: {}'.format(node.name, failed_deps))
+        self.state['steps'].pop(node.name, None)
+        self.failed.append(node)
+
+    def run(self):
+        """Run all added steps not run yet, in the order of dependency"""
+        pending = [n for n in self.nodes if n not in self.done and n not in self.failed]
+        running = {}
+        parallel = self.num_worker > 1
+        with futures.ThreadPoolExecutor(max_workers=self.num_worker) as executor:
+            while pending or running:
+                # steps with failed dependencies, marked as failed too for their own dependents
+                skipped = [n for n in pending if any(d in self.failed for d in n.deps)]
+                while skipped:
+                    for node in skipped:
+                        pending.remove(node)
+                        self.skip_node(node)
+                    skipped = [n for n in pending if any(d in self.failed for d in n.deps)]
+
+                # steps with all dependencies done
+                ready = [n for n in pending if all(d in self.done for d in n.deps)]
+                for node in ready:
+                    if len(running) >= self.num_worker:
+                        break
+                    pending.remove(node)
+                    flag, reason = self.need_run(node)
+                    if not flag:
+                        print('step {:<20}: {}, skip.'.format(node.name, reason))
+                        self.done.append(node)
+                        continue
+                    print('step {:<20}: {}, run.'.format(node.name, reason))
+                    if parallel:
+                        running[executor.submit(self.run_node, node, True)] = node
+                    else:
+                        self.finish_node(node, self.run_node(node))
+
+                # wait for one of the running steps to finish
+                if running:
+                    finished = futures.wait(list(running.keys()),
+                                            return_when=futures.FIRST_COMPLETED)[0]
+                    for future in finished:
+                        node = running.pop(future)
+                        self.finish_node(node, future.result())
+                elif pending and not ready:
+                    raise RuntimeError('un-resolved dependency for steps: {}'.format([n.name for n in pending]))
+
+        # steps later in the graph may modify the input files in place,
+        # update the record of all steps with the final file content.
+        for node in self.done:
+            self.record_step(node)
+        self.write_state()
+        if self.monitor is not None:
+            self.monitor.write(self.perf_file)
+        return
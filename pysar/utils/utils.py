@@ -13,6 +13,7 @@ import glob
 import time
 import datetime
 import errno
+import hashlib
 import h5py
 import numpy as np
 import multiprocessing
@@ -1392,6 +1393,66 @@ def check_file_size(fname_list, mode_width=None, mode_length=None):
     return fname_list_out, mode_width, mode_length
 
 
+def get_file_hash(fname, block_size=2**20):
+    """MD5 hash of file content in hex string"""
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_delay_cache(cache_file, cache_key, file_hash_dict):
+    """Read delay of dates with matched cache key and input file hash from the cache file.
+    Parameters: cache_file     : str, HDF5 file with one dataset per date
+                cache_key      : dict of str, attributes of the cache file, i.e. hash of DEM, incidence angle,
+                                 lookup table and reference pixel, delays are valid only if all of them match.
+                file_hash_dict : dict, hash of the input (weather / GACOS) file of each date,
+                                 e.g. {'20151002': 'a2c0...'}
+    Returns:    delay_dict     : dict, 2D np.array of delay of each cached date
+    """
+    delay_dict = dict()
+    if not os.path.isfile(cache_file):
+        return delay_dict
+
+    with h5py.File(cache_file, 'r') as f:
+        atr = dict(f.attrs)
+        if any(str(atr.get(k, '')) != v for k, v in cache_key.items()):
+            print('cache key changed, ignore cache file: {}'.format(cache_file))
+            return delay_dict
+        for date, file_hash in file_hash_dict.items():
+            if date in f.keys() and f[date].attrs.get('FILE_HASH', '') == file_hash:
+                delay_dict[date] = f[date][:]
+    print('read delay of {} dates from cache file: {}'.format(len(delay_dict), cache_file))
+    return delay_dict
+
+
+def write_delay_cache(cache_file, cache_key, date, file_hash, delay):
+    """Write/update delay of one date into the cache file.
+    The file is re-created if the cache key changed, because the space of deleted datasets
+    is never returned by HDF5; and created with persistent free-space tracking, so that the
+    space of the updated date is re-used in later runs.
+    """
+    mode = 'a'
+    if os.path.isfile(cache_file):
+        with h5py.File(cache_file, 'r') as f:
+            if any(str(f.attrs.get(k, '')) != v for k, v in cache_key.items()):
+                mode = 'w'
+    else:
+        mode = 'w'
+
+    kwargs = {'fs_strategy': 'fsm', 'fs_persist': True} if mode == 'w' else {}
+    with h5py.File(cache_file, mode, **kwargs) as f:
+        if mode == 'w':
+            for k, v in cache_key.items():
+                f.attrs[k] = v
+        if date in f.keys():
+            del f[date]
+        ds = f.create_dataset(date, data=delay, chunks=True)
+        ds.attrs['FILE_HASH'] = file_hash
+    return cache_file
+
+
 def most_common(L):
     """Return the most common item in the list L. From Alex Martelli on Stack Overflow.
     If the "most common" items with the same highest count are > 1, return the earliest-occurring one.
@@ -1481,29 +1542,147 @@ def azimuth_ground_resolution(atr):
 
 #########################################################################
 # Use geomap*.trans file for precious (pixel-level) coord conversion
-def get_lookup_row_col(y, x, lut_y, lut_x, y_factor=10, x_factor=10, geoCoord=False):
-    """Get row/col number in y/x value matrix from input y/x
-    Use overlap mean value between y and x buffer;
-    To support point outside of value pool/matrix, could use np.polyfit to fit a line
-    for y and x value buffer and return the intersection point row/col
+# lookup table and its spatial index, cached by file name, size and modification time,
+# for repeated coordinate conversion, e.g. mouse hovering in tsview.py
+_lookup_cache = dict()
+
+
+def read_lookup_table(lookupFile, datasetNames, print_msg=True):
+    """Read the two datasets of the lookup table, with cache
+    Parameters: lookupFile   : list of 2 str, file of the 1st and 2nd dataset
+                datasetNames : list of 2 str, e.g. ['latitude', 'longitude'] or ['azimuthCoord', 'rangeCoord']
+    Returns:    lut : dict, with data : tuple of 2 np.array in 2D, lookup table value
+                                 tree : scipy.spatial.cKDTree, spatial index of data, created on demand
     """
-    ymin = y - y_factor
-    xmin = x - x_factor
-    if not geoCoord:
-        ymin = max(ymin, 0.5)
-        xmin = max(xmin, 0.5)
-    mask_y = np.multiply(lut_y >= ymin, lut_y <= (y+y_factor))
-    mask_x = np.multiply(lut_x >= xmin, lut_x <= (x+x_factor))
-    row, col = np.nanmean(np.where(np.multiply(mask_y, mask_x)), axis=1)
+    key = tuple((os.path.abspath(fname), os.path.getsize(fname), os.path.getmtime(fname), dsName)
+                for fname, dsName in zip(lookupFile, datasetNames))
+    if key not in _lookup_cache.keys():
+        lut_y = readfile.read(lookupFile[0], datasetName=datasetNames[0], print_msg=print_msg)[0]
+        lut_x = readfile.read(lookupFile[1], datasetName=datasetNames[1], print_msg=print_msg)[0]
+        if len(_lookup_cache) >= 4:
+            _lookup_cache.pop(list(_lookup_cache.keys())[0])
+        _lookup_cache[key] = {'data': (lut_y, lut_x), 'tree': None}
+    return _lookup_cache[key]
+
+
+def interpolate_lookup_table(data, row, col, no_data=None):
+    """Bilinear interpolation of 2D data at (row, col) in float, with weights normalized
+    over the valid neighbours, nan for points outside of data or without valid neighbour.
+    Parameters: data    : 2D np.array
+                row/col : np.array in float
+                no_data : number, value of invalid pixels, besides nan
+    Returns:    value   : np.array in float64
+    """
+    length, width = data.shape
+    row = np.asarray(row, dtype=np.float64)
+    col = np.asarray(col, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        flag = np.multiply(np.multiply(row >= 0, row <= length - 1),
+                           np.multiply(col >= 0, col <= width - 1))
+    r, c = row[flag], col[flag]
+    r0 = np.minimum(np.floor(r).astype(int), max(length - 2, 0))
+    c0 = np.minimum(np.floor(c).astype(int), max(width - 2, 0))
+    r1 = np.minimum(r0 + 1, length - 1)
+    c1 = np.minimum(c0 + 1, width - 1)
+    dr, dc = r - r0, c - c0
+
+    value = np.zeros(r.shape, dtype=np.float64)
+    weight_sum = np.zeros(r.shape, dtype=np.float64)
+    for weight, r_idx, c_idx in [((1 - dr) * (1 - dc), r0, c0), ((1 - dr) * dc, r0, c1),
+                                 (dr * (1 - dc), r1, c0), (dr * dc, r1, c1)]:
+        d = data[r_idx, c_idx]
+        valid = np.multiply(weight > 0., np.isfinite(d))
+        if no_data is not None:
+            valid *= d != no_data
+        value[valid] += weight[valid] * d[valid]
+        weight_sum[valid] += weight[valid]
+
+    out = np.full(row.shape, np.nan, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[flag] = np.where(weight_sum > 0., value / weight_sum, np.nan)
+    return out
+
+
+def search_lookup_table(y, x, lut, max_dist=2.):
+    """Find the row/col of the input values y/x in the lookup table, i.e. the inverse of the lookup table,
+    with the KD-tree of valid pixels and sub-pixel refinement using the local gradient.
+    Parameters: y/x      : 1D np.array, values to search, e.g. lat/lon for lookup table in radar coord
+                lut      : dict, lookup table from read_lookup_table()
+                max_dist : float, max distance in number of pixels to the nearest pixel
+    Returns:    row/col  : 1D np.array in float, nan for points out of the lookup table coverage
+    """
+    from scipy.spatial import cKDTree
+    lut_y, lut_x = lut['data']
+    length, width = lut_y.shape
+
+    # build the spatial index once, in the unit of pixel size
+    if lut['tree'] is None:
+        with np.errstate(invalid='ignore'):
+            flag = np.multiply(np.isfinite(lut_y), np.isfinite(lut_x))
+            flag *= ~np.multiply(lut_y == 0., lut_x == 0.)
+        step = max(1, min(length, width) // 100)
+        scale = []
+        for data in [lut_y, lut_x]:
+            d = data[::step, ::step]
+            m = flag[::step, ::step]
+            d_row = np.abs(np.diff(d, axis=0))[np.multiply(m[1:, :], m[:-1, :])] / step
+            d_col = np.abs(np.diff(d, axis=1))[np.multiply(m[:, 1:], m[:, :-1])] / step
+            d_pix = [np.median(i[i > 0]) for i in [d_row, d_col] if np.any(i > 0)]
+            scale.append(max(d_pix) if d_pix else 1.)
+        idx = np.flatnonzero(flag)
+        lut['idx'] = idx
+        lut['scale'] = scale
+        lut['tree'] = cKDTree(np.hstack((lut_y.flatten()[idx].reshape(-1, 1) / scale[0],
+                                         lut_x.flatten()[idx].reshape(-1, 1) / scale[1])))
+
+    # nearest pixel, batched query
+    y = np.asarray(y, dtype=np.float64).flatten()
+    x = np.asarray(x, dtype=np.float64).flatten()
+    pts = np.hstack((y.reshape(-1, 1) / lut['scale'][0], x.reshape(-1, 1) / lut['scale'][1]))
+    dist, i = lut['tree'].query(pts, k=1, distance_upper_bound=max_dist)
+    found = i < lut['idx'].size
+    row = np.full(y.shape, np.nan)
+    col = np.full(y.shape, np.nan)
+    r0, c0 = np.divmod(lut['idx'][i[found]], width)
+
+    # sub-pixel: solve the local linear system with the gradient of y/x w.r.t. row/col
+    rp, rm = np.minimum(r0 + 1, length - 1), np.maximum(r0 - 1, 0)
+    cp, cm = np.minimum(c0 + 1, width - 1), np.maximum(c0 - 1, 0)
+    dy_dr = (lut_y[rp, c0] - lut_y[rm, c0]) / np.maximum(rp - rm, 1)
+    dy_dc = (lut_y[r0, cp] - lut_y[r0, cm]) / np.maximum(cp - cm, 1)
+    dx_dr = (lut_x[rp, c0] - lut_x[rm, c0]) / np.maximum(rp - rm, 1)
+    dx_dc = (lut_x[r0, cp] - lut_x[r0, cm]) / np.maximum(cp - cm, 1)
+    det = dy_dr * dx_dc - dy_dc * dx_dr
+    res_y = y[found] - lut_y[r0, c0]
+    res_x = x[found] - lut_x[r0, c0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_row = (dx_dc * res_y - dy_dc * res_x) / det
+        d_col = (dy_dr * res_x - dx_dr * res_y) / det
+    # keep the nearest pixel where the gradient is not available, e.g. next to no-data pixels
+    flag = np.multiply(np.isfinite(d_row), np.isfinite(d_col))
+    flag *= np.multiply(np.abs(d_row) <= 1., np.abs(d_col) <= 1.)
+    d_row[~flag] = 0.
+    d_col[~flag] = 0.
+    row[found] = r0 + d_row
+    col[found] = c0 + d_col
     return row, col
 
 
-def glob2radar(lat, lon, lookupFile=None, atr_rdr=dict(), print_msg=True):
+def _round_coord(coord, shape):
+    """Round coordinates to int if all found, and reshape to the input shape"""
+    if np.all(np.isfinite(coord)):
+        coord = np.rint(coord).astype(int)
+    coord = coord.reshape(shape)
+    return coord[()] if coord.ndim == 0 else coord
+
+
+def glob2radar(lat, lon, lookupFile=None, atr_rdr=dict(), print_msg=True, subpixel=False):
     """Convert geo coordinates into radar coordinates.
     Parameters: lat/lon : np.array, float, latitude/longitude
                 lookupFile : string, trans/look up file
                 atr_rdr : dict, attributes of file in radar coord, optional but recommended.
-    Returns:    az/rg : np.array, float, range/azimuth pixel number
+                subpixel : bool, return az/rg in float with sub-pixel precision instead of int
+    Returns:    az/rg : np.array, int, range/azimuth pixel number; nan if not found, in float
                 az/rg_res : float, residul/uncertainty of coordinate conversion
     """
     if lookupFile is None:
@@ -1517,13 +1696,16 @@ def glob2radar(lat, lon, lookupFile=None, atr_rdr=dict(), print_msg=True):
     atr_lut = readfile.read_attribute(lookupFile[0])
     if print_msg:
         print('reading file: '+lookupFile[0])
+    shape = np.shape(lat)
+    lat = np.array(lat, dtype=np.float64).flatten()
+    lon = np.array(lon, dtype=np.float64).flatten()
 
     # For lookup table in geo-coord, read value directly
     if 'Y_FIRST' in atr_lut.keys():
         # Get lat/lon resolution/step in meter
         earth_radius = 6371.0e3
-        lut_x = readfile.read(lookupFile[1], datasetName='rangeCoord', print_msg=False)[0]
-        lut_y = readfile.read(lookupFile[0], datasetName='azimuthCoord', print_msg=False)[0]
+        lut = read_lookup_table(lookupFile, ['azimuthCoord', 'rangeCoord'], print_msg=False)
+        lut_y, lut_x = lut['data']
         lat0 = float(atr_lut['Y_FIRST'])
         lon0 = float(atr_lut['X_FIRST'])
         lat_center = lat0 + float(atr_lut['Y_STEP'])*float(atr_lut['LENGTH'])/2
@@ -1550,44 +1732,29 @@ def glob2radar(lat, lon, lookupFile=None, atr_rdr=dict(), print_msg=True):
             except:
                 pass
 
-        width = int(atr_lut['WIDTH'])
-        row = np.rint((lat - lat0)/lat_step_deg).astype(int)
-        col = np.rint((lon - lon0)/lon_step_deg).astype(int)
-        rg = np.rint(lut_x[row, col]).astype(int) - rg0
-        az = np.rint(lut_y[row, col]).astype(int) - az0
+        row = (lat - lat0)/lat_step_deg
+        col = (lon - lon0)/lon_step_deg
+        if not subpixel:
+            row = np.rint(row)
+            col = np.rint(col)
+        rg = interpolate_lookup_table(lut_x, row, col, no_data=0.) - rg0
+        az = interpolate_lookup_table(lut_y, row, col, no_data=0.) - az0
 
-    # For lookup table in radar-coord, search the buffer and use center pixel
+    # For lookup table in radar-coord, search with the spatial index of lat/lon
     else:
-        lut_x = readfile.read(lookupFile[1], datasetName='longitude', print_msg=print_msg)[0]
-        lut_y = readfile.read(lookupFile[0], datasetName='latitude', print_msg=print_msg)[0]
-        az = np.zeros(lat.shape)
-        rg = np.zeros(lat.shape)
+        lut = read_lookup_table(lookupFile, ['latitude', 'longitude'], print_msg=print_msg)
+        az, rg = search_lookup_table(lat, lon, lut)
         x_factor = 10
         y_factor = 10
-        try:
-            earth_radius = float(atr_rdr['EARTH_RADIUS'])
-        except:
-            earth_radius = 6371.0e3
-        az_step = azimuth_ground_resolution(atr_rdr)
-        rg_step = range_ground_resolution(atr_rdr, print_msg=False)
-        lat0 = np.nanmax(lat)
-        lat1 = np.nanmin(lat)
-        az_step_deg = 180. / np.pi * az_step / earth_radius
-        rg_step_deg = 180. / np.pi * rg_step / (earth_radius*np.cos((lat0+lat1)/2*np.pi/180.))
 
-        if lat.size == 1:
-            az, rg = get_lookup_row_col(lat, lon, lut_y, lut_x,
-                                        y_factor*az_step_deg,
-                                        x_factor*rg_step_deg,
-                                        geoCoord=True)
-        else:
-            for i in range(rg.size):
-                az[i], rg[i] = get_lookup_row_col(lat[i], lon[i], lut_y, lut_x,
-                                                  y_factor*az_step_deg,
-                                                  x_factor*rg_step_deg,
-                                                  geoCoord=True)
-        az = np.rint(az).astype(int)
-        rg = np.rint(rg).astype(int)
+    if not np.all(np.isfinite(az)) and print_msg:
+        print('WARNING: {} point(s) out of the lookup table coverage.'.format(np.sum(~np.isfinite(az))))
+    if not subpixel:
+        az = _round_coord(az, shape)
+        rg = _round_coord(rg, shape)
+    else:
+        az = az.reshape(shape)
+        rg = rg.reshape(shape)
     rg_resid = x_factor
     az_resid = y_factor
     return az, rg, az_resid, rg_resid
@@ -1595,7 +1762,7 @@ def glob2radar(lat, lon, lookupFile=None, atr_rdr=dict(), print_msg=True):
 
 def radar2glob(az, rg, lookupFile=None, atr_rdr=dict(), print_msg=True):
     """Convert radar coordinates into geo coordinates
-    Parameters: rg/az : np.array, int, range/azimuth pixel number
+    Parameters: rg/az : np.array, int or float, range/azimuth pixel number
                 lookupFile : string, trans/look up file
                 atr_rdr : dict, attributes of file in radar coord, optional but recommended.
     Returns:    lon/lat : np.array, float, longitude/latitude of input point (rg,az);
@@ -1613,8 +1780,11 @@ def radar2glob(az, rg, lookupFile=None, atr_rdr=dict(), print_msg=True):
     atr_lut = readfile.read_attribute(lookupFile[0])
     if print_msg:
         print('reading file: '+lookupFile[0])
+    shape = np.shape(az)
+    az = np.array(az, dtype=np.float64).flatten()
+    rg = np.array(rg, dtype=np.float64).flatten()
 
-    # For lookup table in geo-coord, search the buffer and use center pixel
+    # For lookup table in geo-coord, search with the spatial index of azimuth/rangeCoord
     if 'Y_FIRST' in atr_lut.keys():
         if 'SUBSET_XMIN' in atr_rdr.keys():
             rg += int(atr_rdr['SUBSET_XMIN'])
@@ -1622,8 +1792,7 @@ def radar2glob(az, rg, lookupFile=None, atr_rdr=dict(), print_msg=True):
 
         # Get lat/lon resolution/step in meter
         earth_radius = 6371.0e3    # in meter
-        lut_x = readfile.read(lookupFile[1], datasetName='rangeCoord', print_msg=print_msg)[0]
-        lut_y = readfile.read(lookupFile[0], datasetName='azimuthCoord', print_msg=print_msg)[0]
+        lut = read_lookup_table(lookupFile, ['azimuthCoord', 'rangeCoord'], print_msg=print_msg)
         lat0 = float(atr_lut['Y_FIRST'])
         lon0 = float(atr_lut['X_FIRST'])
         lat_center = lat0 + float(atr_lut['Y_STEP'])*float(atr_lut['LENGTH'])/2
@@ -1644,16 +1813,7 @@ def radar2glob(az, rg, lookupFile=None, atr_rdr=dict(), print_msg=True):
             except:
                 pass
 
-        lut_row = np.zeros(rg.shape)
-        lut_col = np.zeros(rg.shape)
-        if rg.size == 1:
-            lut_row, lut_col = get_lookup_row_col(az, rg, lut_y, lut_x,
-                                                  y_factor, x_factor)
-        else:
-            for i in range(rg.size):
-                lut_row[i], lut_col[i] = get_lookup_row_col(az[i], rg[i],
-                                                            lut_y, lut_x,
-                                                            y_factor, x_factor)
+        lut_row, lut_col = search_lookup_table(az, rg, lut)
         lat = lut_row*lat_step_deg + lat0
         lon = lut_col*lon_step_deg + lon0
         lat_resid = abs(y_factor*lat_step_deg)
@@ -1661,10 +1821,10 @@ def radar2glob(az, rg, lookupFile=None, atr_rdr=dict(), print_msg=True):
 
     # For lookup table in radar-coord, read the value directly.
     else:
-        lut_x = readfile.read(lookupFile[1], datasetName='longitude', print_msg=print_msg)[0]
-        lut_y = readfile.read(lookupFile[0], datasetName='latitude', print_msg=print_msg)[0]
-        lat = lut_y[az, rg]
-        lon = lut_x[az, rg]
+        lut = read_lookup_table(lookupFile, ['latitude', 'longitude'], print_msg=print_msg)
+        lut_y, lut_x = lut['data']
+        lat = interpolate_lookup_table(lut_y, az, rg, no_data=0.)
+        lon = interpolate_lookup_table(lut_x, az, rg, no_data=0.)
 
         x_factor = 2
         y_factor = 2
@@ -1682,6 +1842,10 @@ def radar2glob(az, rg, lookupFile=None, atr_rdr=dict(), print_msg=True):
         lat_resid = abs(y_factor * az_step_deg)
         lon_resid = abs(x_factor * rg_step_deg)
 
+    lat = lat.reshape(shape)
+    lon = lon.reshape(shape)
+    if lat.ndim == 0:
+        lat, lon = lat[()], lon[()]
     return lat, lon, lat_resid, lon_resid
 
 
@@ -2081,103 +2245,3 @@ def yymmdd(dates):
             date = date[2:8]
         datesOut.append(date)
     return datesOut
-
-
-def make_triangle(dates12, igram1, igram2, igram3):
-    dates = []
-    dates.append(igram1.split('-')[0])
-    dates.append(igram1.split('-')[1])
-    dates.append(igram2.split('-')[1])
-    datesyy = []
-    for d in dates:
-        datesyy.append(yymmdd2YYYYMMDD(d))
-
-    datesyy.sort()
-    Igramtriangle = []
-    Igramtriangle.append(datesyy[0][2:]+'-'+datesyy[1][2:])
-    Igramtriangle.append(datesyy[0][2:]+'-'+datesyy[2][2:])
-    Igramtriangle.append(datesyy[1][2:]+'-'+datesyy[2][2:])
-
-    IgramtriangleIndexes = [dates12.index(Igramtriangle[0]),
-                            dates12.index(Igramtriangle[1]),
-                            dates12.index(Igramtriangle[2])]
-    return Igramtriangle, IgramtriangleIndexes
-
-
-def get_triangles(h5file):
-    k = list(h5file.keys())
-    igramList = list(h5file[k[0]].keys())
-
-    dates12 = []
-    for igram in igramList:
-        dates12.append(h5file[k[0]][igram].attrs['DATE12'])
-    Triangles = []
-    Triangles_indexes = []
-    for igram1 in dates12:
-        igram1_date1 = igram1.split('-')[0]
-        igram1_date2 = igram1.split('-')[1]
-
-        igram2 = []
-        igram2_date2 = []
-        for d in dates12:
-            if igram1_date2 == d.split('-')[0]:
-                igram2.append(d)
-                igram2_date2.append(d.split('-')[1])
-
-        igram3 = []
-        igram3_date2 = []
-        for d in dates12:
-            if igram1_date1 == d.split('-')[0] and d != igram1:
-                igram3.append(d)
-                igram3_date2.append(d.split('-')[1])
-
-        for date in igram2_date2:
-            if date in igram3_date2:
-                (Igramtriangle,
-                 IgramtriangleIndexes) = make_triangle(dates12, igram1,
-                                                       igram2[igram2_date2.index(date)],
-                                                       igram3[igram3_date2.index(date)])
-                if not Igramtriangle in Triangles:
-                    Triangles.append(Igramtriangle)
-                    Triangles_indexes.append(IgramtriangleIndexes)
-
-    numTriangles = np.shape(Triangles_indexes)[0]
-    curls = np.zeros([numTriangles, 3], dtype=np.int)
-    for i in range(numTriangles):
-        curls[i][:] = Triangles_indexes[i]
-
-    numIgrams = len(igramList)
-    C = np.zeros([numTriangles, numIgrams])
-    for ni in range(numTriangles):
-        C[ni][curls[ni][0]] = 1
-        C[ni][curls[ni][1]] = -1
-        C[ni][curls[ni][2]] = 1
-
-    return curls, Triangles, C
-
-
-def generate_curls(curlfile, h5file, Triangles, curls):
-    ifgram_list = list(h5file['interferograms'].keys())
-    h5curlfile = h5py.File(curlfile, 'w')
-    gg = h5curlfile.create_group('interferograms')
-
-    curl_num = np.shape(curls)[0]
-    prog_bar = ptime.progressBar(maxValue=curl_num)
-    for i in range(curl_num):
-        ifgram1 = ifgram_list[curls[i, 0]]
-        ifgram2 = ifgram_list[curls[i, 1]]
-        ifgram3 = ifgram_list[curls[i, 2]]
-        d1 = h5file['interferograms'][ifgram1].get(ifgram1)[:]
-        d2 = h5file['interferograms'][ifgram2].get(ifgram2)[:]
-        d3 = h5file['interferograms'][ifgram3].get(ifgram3)[:]
-
-        triangle_date = Triangles[i][0]+'_'+Triangles[i][1]+'_'+Triangles[i][2]
-        group = gg.create_group(triangle_date)
-        dset = group.create_dataset(triangle_date, data=d1+d3-d2)
-        for key, value in h5file['interferograms'][ifgram1].attrs.items():
-            group.attrs[key] = value
-        prog_bar.update(i+1)
-
-    h5curlfile.close()
-    prog_bar.close()
-    return curlfile
@@ -8,12 +8,11 @@
 
 
 import numpy as np
-import pyproj
-import random
-import matplotlib.pyplot as plt
 from pysar.utils import ptime
 
 
+EARTH_RADIUS = 6371.0e3   # mean radius in meter, for haversine distance
+
 def get_lat_lon(atr):
     '''Get lat/lon of all pixels'''
     length = int(atr['LENGTH'])
@@ -32,25 +31,27 @@ def get_lat_lon(atr):
 
 
 def sample_data(lat, lon, mask=None, num_sample=500):
-    ''''''
+    '''Randomly select samples within mask
+    Returns: idx_sample : 1D np.array of int, index of samples in the flattened lat/lon
+             lat/lon_sample : 1D np.array of float, lat/lon of samples
+    '''
     # Flatten input data
-    for i in [lat, lon]:
-        if len(i.shape) != 1:
-            i = i.flatten()
-
-    # Check number of samples and number of pixels
-    num_pixel = len(lat)
-    if num_sample > num_pixel:
-        print('Number of samples > number of pixels, fix number of samples to number of pixels.')
-        num_sample = num_pixel
+    lat = np.array(lat).flatten()
+    lon = np.array(lon).flatten()
 
     # Check input mask
+    num_pixel = len(lat)
     if mask is None:
         mask = np.ones((num_pixel))
+    idx = np.where(np.array(mask).flatten() != 0)[0]
+
+    # Check number of samples and number of pixels
+    if num_sample > len(idx):
+        print('Number of samples > number of pixels, fix number of samples to number of pixels.')
+        num_sample = len(idx)
 
     # Random select samples
-    idx = np.arange(num_pixel)
-    idx_sample = random.sample(idx[mask.flatten() == 1.0], int(num_sample))
+    idx_sample = np.sort(np.random.choice(idx, int(num_sample), replace=False))
 
     lat_sample = lat[idx_sample]
     lon_sample = lon[idx_sample]
@@ -60,6 +61,7 @@ def sample_data(lat, lon, mask=None, num_sample=500):
 
 def get_distance(lat, lon, i):
     '''Return the distance of all points in lat/lon from its ith point'''
+    import pyproj
     lat1 = lat[i]*np.ones(lat.shape)
     lon1 = lon[i]*np.ones(lon.shape)
 
@@ -68,44 +70,199 @@ def get_distance(lat, lon, i):
     return dist
 
 
-def structure_function(data, lat, lon, step=5e3, min_pair_num=100e3, print_msg=True):
-    num_sample = len(data)
-    distance = np.zeros((num_sample**2))
-    variance = np.zeros((num_sample**2))
-    if print_msg:
-        prog_bar = ptime.progressBar(maxValue=num_sample)
-    for i in range(num_sample):
-        distance[i*num_sample:(i+1)*num_sample] = get_distance(lat, lon, i)
-        variance[i*num_sample:(i+1)*num_sample] = np.square(data - data[i])
-        if print_msg:
-            prog_bar.update(i+1, every=10)
-    if print_msg:
-        prog_bar.close()
+def haversine_distance(lat0, lon0, lat1, lon1):
+    '''Great-circle distance in meter between points in degrees, with numpy broadcasting'''
+    lat0, lon0, lat1, lon1 = [np.deg2rad(i) for i in [lat0, lon0, lat1, lon1]]
+    a = (np.square(np.sin((lat1 - lat0) / 2.))
+         + np.cos(lat0) * np.cos(lat1) * np.square(np.sin((lon1 - lon0) / 2.)))
+    return 2. * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.)))
 
-    dist, std, stdStd = bin_variance(
-        distance, variance, step=step, min_pair_num=min_pair_num, print_msg=print_msg)
-    return dist, std, stdStd
 
+def lat_lon2xyz(lat, lon):
+    '''Cartesian coordinates in meter of points on the sphere, for KD-tree search'''
+    lat, lon = np.deg2rad(lat), np.deg2rad(lon)
+    return EARTH_RADIUS * np.vstack((np.cos(lat) * np.cos(lon),
+                                     np.cos(lat) * np.sin(lon),
+                                     np.sin(lat))).T
 
-def bin_variance(distance, variance, step=5e3, min_pair_num=100e3, print_msg=True):
-    x_steps = np.arange(0, np.max(distance), step)
-    num_step = len(x_steps)
-    std = np.zeros(x_steps.shape)
-    stdStd = np.zeros(std.shape)
-    p_num = np.zeros(x_steps.shape)
 
-    if print_msg:
-        prog_bar = ptime.progressBar(maxValue=num_step)
-    for i in range(num_step):
-        x = x_steps[i]
-        idx = (distance > max(0, x-step/2.)) * (distance < x+step/2.)
-        p_num[i] = np.sum(idx)
-        std[i] = np.mean(np.sqrt(variance[idx]))
-        stdStd[i] = np.std(np.sqrt(variance[idx]))
+class binnedVariance:
+    """Histogram of pair statistics per distance bin, accumulated pair group by pair group,
+    without keeping the pair arrays in memory.
+    Bin i covers the distance of (i*step - step/2, i*step + step/2].
+
+    Example:
+        stat = binnedVariance(step=5e3, num_epoch=1)
+        stat.add(distance, data_diff)
+        dist, std, stdStd, num_pair = stat.result()
+    """
+    def __init__(self, step=5e3, num_epoch=1):
+        self.step = step
+        self.num_epoch = num_epoch
+        self.num_bin = 0
+        self.count = np.zeros((num_epoch, 0), np.int64)
+        self.sum = np.zeros((num_epoch, 0), np.float64)
+        self.sum_sq = np.zeros((num_epoch, 0), np.float64)
+
+    def add(self, distance, data_diff):
+        """Accumulate a group of pairs
+        Parameters: distance  : 1D np.array in size of (num_pair,), distance in meter
+                    data_diff : 2D np.array in size of (num_epoch, num_pair), data difference of pairs
+                                pairs with NaN are ignored
+        """
+        # same bin edges as np.arange(0, max_dist, step) +/- step/2, excluding zero distance
+        bin_idx = np.ceil(np.asarray(distance, np.float64) / self.step - 0.5).astype(np.int64)
+        flag = distance > 0.
+        bin_idx, data_diff = bin_idx[flag], np.abs(data_diff.reshape(self.num_epoch, -1)[:, flag])
+        if bin_idx.size == 0:
+            return
+        num_bin = max(self.num_bin, int(np.max(bin_idx)) + 1)
+        if num_bin > self.num_bin:
+            pad = ((0, 0), (0, num_bin - self.num_bin))
+            self.count = np.pad(self.count, pad, mode='constant')
+            self.sum = np.pad(self.sum, pad, mode='constant')
+            self.sum_sq = np.pad(self.sum_sq, pad, mode='constant')
+            self.num_bin = num_bin
+
+        # bin index of all epochs at once
+        valid = ~np.isnan(data_diff)
+        data_diff = np.where(valid, data_diff, 0.)
+        idx = (bin_idx.reshape(1, -1) + np.arange(self.num_epoch).reshape(-1, 1) * num_bin).flatten()
+        shape = (self.num_epoch, num_bin)
+        self.count += np.bincount(idx, weights=valid.flatten(), minlength=shape[0]*shape[1]).reshape(shape).astype(np.int64)
+        self.sum += np.bincount(idx, weights=data_diff.flatten(), minlength=shape[0]*shape[1]).reshape(shape)
+        self.sum_sq += np.bincount(idx, weights=np.square(data_diff).flatten(), minlength=shape[0]*shape[1]).reshape(shape)
+
+    def result(self):
+        """Mean and std of the absolute data difference of pairs, per distance bin
+        Returns: dist     : 1D np.array in size of (num_bin,), distance of bin center in meter
+                 std      : 2D np.array in size of (num_epoch, num_bin), mean of |data difference|
+                 stdStd   : 2D np.array in size of (num_epoch, num_bin), std  of |data difference|
+                 num_pair : 2D np.array in size of (num_epoch, num_bin), number of pairs
+        """
+        dist = np.arange(self.num_bin) * self.step
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = self.sum / self.count
+            stdStd = np.sqrt(np.maximum(self.sum_sq / self.count - np.square(std), 0.))
+        return dist, std, stdStd, self.count
+
+
+def structure_function(data, lat, lon, step=5e3, min_pair_num=100e3, max_dist=None, num_pair=None,
+                       chunk_size=10e6, print_msg=True):
+    """Structure function, i.e. the std of data difference as a function of distance,
+    from all / randomly selected pairs of samples, accumulated in tiles of pairs.
+    Parameters: data : 1D np.array in size of (num_sample,), or
+                       2D np.array in size of (num_epoch, num_sample) for all epochs of time-series,
+                       pairs with NaN are ignored
+                lat/lon  : 1D np.array in size of (num_sample,), in degrees
+                step     : float, bin size of distance in meter
+                min_pair_num : int, min number of pairs for the bin to be used, counted as ordered pairs,
+                           i.e. each pair of all / within max_dist counts twice, as (i, j) and (j, i)
+                max_dist : float, max distance in meter, pairs within are searched using KD-tree,
+                           bins with upper edge beyond max_dist are not returned
+                num_pair : int, number of randomly selected pairs, instead of all pairs
+                chunk_size : float, max number of pairs to process per tile
+    Returns:    dist   : 1D np.array, distance in meter
+                std    : 1D / 2D np.array, mean of the absolute data difference
+                stdStd : 1D / 2D np.array, std  of the absolute data difference
+    """
+    lat = np.array(lat, np.float64).flatten()
+    lon = np.array(lon, np.float64).flatten()
+    num_sample = lat.size
+    data = np.array(data, np.float32)
+    is_1d = data.ndim == 1
+    data = data.reshape(-1, num_sample)
+    stat = binnedVariance(step=step, num_epoch=data.shape[0])
+
+    def add_pairs(i, j):
+        dist = haversine_distance(lat[i], lon[i], lat[j], lon[j])
+        if max_dist:
+            flag = dist <= max_dist
+            i, j, dist = i[flag], j[flag], dist[flag]
+        stat.add(dist, data[:, i] - data[:, j])
+
+    if num_pair:
+        # random pairs with replacement
+        num_pair = int(num_pair)
+        tile_size = int(max(chunk_size / data.shape[0], 1))
+        if print_msg:
+            print('calculating structure function from {} random pairs'.format(num_pair))
+            prog_bar = ptime.progressBar(maxValue=num_pair)
+        for p0 in range(0, num_pair, tile_size):
+            n = min(tile_size, num_pair - p0)
+            i = np.random.randint(0, num_sample, size=n)
+            j = np.random.randint(0, num_sample - 1, size=n)
+            j[j >= i] += 1
+            add_pairs(i, j)
+            if print_msg:
+                prog_bar.update(p0+n, every=10)
+
+    elif max_dist:
+        # pairs within max_dist, using KD-tree on cartesian coordinates
+        from scipy.spatial import cKDTree
+        xyz = lat_lon2xyz(lat, lon)
+        tree = cKDTree(xyz)
+        # chord length <= great-circle distance, thus a superset, refined in add_pairs()
+        if print_msg:
+            print('calculating structure function from pairs within {} km'.format(max_dist/1e3))
+            prog_bar = ptime.progressBar(maxValue=num_sample)
+        # tile size from the mean pair density, assuming uniform distribution of samples
+        area = (np.deg2rad(np.ptp(lat)) * np.deg2rad(np.ptp(lon)) * np.cos(np.deg2rad(np.mean(lat)))
+                * EARTH_RADIUS**2)
+        num_neighbor = min(num_sample * np.pi * max_dist**2 / max(area, 1.), num_sample)
+        r_step = int(max(chunk_size / max(num_neighbor * data.shape[0], 1.), 1))
+        for i0 in range(0, num_sample, r_step):
+            i1 = min(i0 + r_step, num_sample)
+            pairs = cKDTree(xyz[i0:i1]).sparse_distance_matrix(tree, max_dist, output_type='ndarray')
+            i = pairs['i'].astype(np.int64) + i0
+            j = pairs['j'].astype(np.int64)
+            flag = j > i
+            add_pairs(i[flag], j[flag])
+            if print_msg:
+                prog_bar.update(i1, every=10)
+
+    else:
+        # all pairs, in tiles of rows of the upper triangle of distance matrix
+        r_step = int(max(chunk_size / (num_sample * data.shape[0]), 1))
         if print_msg:
-            prog_bar.update(i+1, every=10)
+            print('calculating structure function from all {} pairs'.format(num_sample*(num_sample-1)//2))
+            prog_bar = ptime.progressBar(maxValue=num_sample)
+        for i0 in range(0, num_sample, r_step):
+            i1 = min(i0 + r_step, num_sample)
+            i, j = np.meshgrid(np.arange(i0, i1), np.arange(i0, num_sample), indexing='ij')
+            flag = j > i
+            add_pairs(i[flag], j[flag])
+            if print_msg:
+                prog_bar.update(i1, every=10)
+
     if print_msg:
         prog_bar.close()
 
-    max_step_idx = int(max(np.argwhere(p_num > min_pair_num)))
-    return x_steps[0:max_step_idx], std[0:max_step_idx], stdStd[0:max_step_idx]
+    dist, std, stdStd, p_num = stat.result()
+    if not num_pair:
+        # unordered pairs (j > i) to ordered pairs
+        p_num = p_num * 2
+    # bins up to the last one with enough pairs in all epochs
+    idx = np.argwhere(np.min(p_num, axis=0) >= min_pair_num)
+    num_step = int(np.max(idx)) + 1 if idx.size > 0 else 0
+    if max_dist:
+        # bins fully covered by max_dist only, the partially covered ones are biased
+        num_step = min(num_step, int(np.sum(dist + step / 2. <= max_dist)))
+    dist, std, stdStd = dist[:num_step], std[:, :num_step], stdStd[:, :num_step]
+    if is_1d:
+        std, stdStd = std[0], stdStd[0]
+    return dist, std, stdStd
+
+
+def bin_variance(distance, variance, step=5e3, min_pair_num=100e3, print_msg=True):
+    """Bin the variance of pairs by distance
+    Parameters: distance : 1D np.array, distance of pairs in meter
+                variance : 1D np.array, squared data difference of pairs
+    Returns:    dist, std, stdStd : 1D np.array, see structure_function()
+    """
+    stat = binnedVariance(step=step, num_epoch=1)
+    stat.add(np.array(distance).flatten(), np.sqrt(np.array(variance).reshape(1, -1)))
+    dist, std, stdStd, p_num = stat.result()
+    idx = np.argwhere(p_num[0] >= min_pair_num)
+    num_step = int(np.max(idx)) + 1 if idx.size > 0 else 0
+    return dist[:num_step], std[0, :num_step], stdStd[0, :num_step]
@@ -12,8 +12,8 @@ import sys
 import h5py
 import numpy as np
 #from PIL import Image
-from pysar.objects import timeseries
-from pysar.utils import readfile
+from pysar.objects import timeseries, refValueDatasetName
+from pysar.utils import readfile, h5compress
 
 
 def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None):
@@ -26,7 +26,9 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
                 out_file : str, output file name
                 metadata : dict of attributes
                 ref_file : str, reference file to get auxliary info
-                compression : str, compression while writing to HDF5 file, None, "lzf", "gzip"
+                compression : str, compression while writing to HDF5 file, None, "lzf", "gzip",
+                              "auto_size" / "auto_speed" to pick the filter by benchmarking,
+                              None for the default from $PYSAR_COMPRESSION, see h5compress.check_compression()
     Returns:    out_file : str
     Examples:   dsDict = dict()
                 dsDict['velocity'] = np.ones((200,300), dtype=np.float32)
@@ -50,7 +52,8 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
             obj = timeseries(out_file)
             obj.write2hdf5(datasetDict[k],
                            metadata=metadata,
-                           refFile=ref_file)
+                           refFile=ref_file,
+                           compression=compression)
 
         else:
             if os.path.isfile(out_file):
@@ -63,33 +66,39 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
             maxDigit = max([len(i) for i in list(datasetDict.keys())])
             for dsName in datasetDict.keys():
                 data = datasetDict[dsName]
+                kwargs = h5compress.get_compression_kwargs(compression, data)
                 print(('create dataset /{d:<{w}} of {t:<10}'
-                       ' in size of {s}').format(d=dsName,
-                                                 w=maxDigit,
-                                                 t=str(data.dtype),
-                                                 s=data.shape))
+                       ' in size of {s} with compression = {c}').format(d=dsName,
+                                                                        w=maxDigit,
+                                                                        t=str(data.dtype),
+                                                                        s=data.shape,
+                                                                        c=h5compress.filter2str(kwargs)))
                 ds = f.create_dataset(dsName,
                                       data=data,
                                       chunks=True,
-                                      compression=compression)
+                                      **kwargs)
 
             # Write extra/auxliary datasets from ref_file
+            # except for the virtual reference value, which is applied to the input data already
             if ref_file:
                 fr = h5py.File(ref_file, 'r')
                 dsNames = [i for i in fr.keys()
                            if (i not in list(datasetDict.keys())
+                               and i != refValueDatasetName
                                and isinstance(fr[i], h5py.Dataset))]
                 for dsName in dsNames:
                     ds = fr[dsName]
+                    kwargs = h5compress.get_compression_kwargs(compression, ds)
                     print(('create dataset /{d:<{w}} of {t:<10}'
-                           ' in size of {s}').format(d=dsName,
-                                                     w=maxDigit,
-                                                     t=str(ds.dtype),
-                                                     s=ds.shape))
+                           ' in size of {s} with compression = {c}').format(d=dsName,
+                                                                            w=maxDigit,
+                                                                            t=str(ds.dtype),
+                                                                            s=ds.shape,
+                                                                            c=h5compress.filter2str(kwargs)))
                     f.create_dataset(dsName,
                                      data=ds[:],
                                      chunks=True,
-                                     compression=compression)
+                                     **kwargs)
                 fr.close()
 
             # metadata
@@ -133,6 +142,72 @@ def write(datasetDict, out_file, metadata=None, ref_file=None, compression=None)
         return out_file
 
 
+def layout_hdf5(out_file, dsNameDict, metadata, compression=None):
+    """Create HDF5 file with empty datasets, to be filled block by block with write_hdf5_block()
+    Parameters: out_file   : str, output file name
+                dsNameDict : dict of dataset, with key = datasetName and value = (dtype, shape, data),
+                             data is None for empty dataset to be written later, e.g.:
+                    {'date'      : (np.string_,  (80,),         dateList),
+                     'bperp'     : (np.float32,  (80,),         pbase),
+                     'timeseries': (np.float32,  (80,200,300),  None),
+                     ...}
+                metadata : dict of attributes
+                compression : str, None, "lzf", "gzip", "auto_size", "auto_speed",
+                              auto options use h5compress.AUTO_DEFAULT_FILTER for empty datasets
+    Returns:    out_file : str
+    Examples:   dsNameDict = {'date'      : (np.string_, (num_date,), dateList),
+                              'timeseries': (np.float32, (num_date, length, width), None)}
+                layout_hdf5('timeseries_demErr.h5', dsNameDict, metadata=atr)
+                write_hdf5_block('timeseries_demErr.h5', data, 'timeseries', block=[0, num_date, 0, 100, 0, width])
+    """
+    print('create HDF5 file: {} with w mode'.format(out_file))
+    maxDigit = max([len(i) for i in list(dsNameDict.keys())])
+    with h5py.File(out_file, 'w') as f:
+        for dsName, (dsType, dsShape, data) in dsNameDict.items():
+            if data is not None:
+                data = np.array(data, dtype=dsType)
+                kwargs = {}
+                if len(dsShape) > 1:
+                    kwargs = h5compress.get_compression_kwargs(compression, data)
+                ds = f.create_dataset(dsName, data=data, chunks=len(dsShape) > 1 or None, **kwargs)
+            else:
+                kwargs = h5compress.get_compression_kwargs(compression)
+                ds = f.create_dataset(dsName, shape=dsShape, dtype=dsType, chunks=True, **kwargs)
+            print(('create dataset /{d:<{w}} of {t:<10}'
+                   ' in size of {s} with compression = {c}').format(d=dsName,
+                                                                    w=maxDigit,
+                                                                    t=str(ds.dtype),
+                                                                    s=dsShape,
+                                                                    c=h5compress.filter2str(kwargs)))
+
+        # metadata
+        for key, value in metadata.items():
+            f.attrs[key] = str(value)
+    return out_file
+
+
+def write_hdf5_block(out_file, data, datasetName, block=None, print_msg=True):
+    """Write data block into existing HDF5 dataset created by layout_hdf5()
+    Parameters: out_file : str, HDF5 file name
+                data     : 2D/3D np.ndarray
+                datasetName : str, dataset name
+                block    : list of int, [z0, z1, y0, y1, x0, x1] for 3D or [y0, y1, x0, x1] for 2D,
+                           None to write the whole dataset
+    Returns:    out_file : str
+    """
+    with h5py.File(out_file, 'r+') as f:
+        ds = f[datasetName]
+        if block is None:
+            block = []
+            for i in ds.shape:
+                block += [0, i]
+        if print_msg:
+            print('write block {} of /{} to file: {}'.format(block, datasetName, os.path.basename(out_file)))
+        slices = tuple(slice(block[2*i], block[2*i+1]) for i in range(len(ds.shape)))
+        ds[slices] = data.reshape([block[2*i+1] - block[2*i] for i in range(len(ds.shape))])
+    return out_file
+
+
 def write_roipac_rsc(metadata, out_file, sorting=True):
     """Write attribute dict into ROI_PAC .rsc file
     Inputs:
@@ -19,7 +19,6 @@ import scipy.ndimage as ndimage
 import matplotlib.pyplot as plt
 from matplotlib.colors import LightSource
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from mpl_toolkits.basemap import cm, pyproj
 
 from pysar.objects import ifgramDatasetNames, geometryDatasetNames, timeseriesKeyNames, timeseriesDatasetNames
 from pysar.objects import timeseries, ifgramStack, geometry, HDFEOS
@@ -567,6 +566,7 @@ def plot_2d_matrix(ax, data, metadata, inps=None):
 
             # Default Distance - 20% of data width
             if inps.scalebar[0] == 999.0:
+                from mpl_toolkits.basemap import pyproj
                 gc = pyproj.Geod(a=m.rmajor, b=m.rminor)
                 wid_dist = gc.inv(inps.geo_box[0], inps.geo_box[3],
                                   inps.geo_box[2], inps.geo_box[3])[2]